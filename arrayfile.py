@@ -0,0 +1,172 @@
+"""@package arrayfile
+
+@brief Read and write collections of NumPy arrays in a simple binary
+        container that can be memory mapped.  Arrays read from a container
+        are read-only views of the mapped file, so loading is independent
+        of the size of the arrays and the pages are shared between all
+        processes that map the same file.
+
+        File layout:
+            8 bytes   magic string ARRAY_FILE_MAGIC
+            4 bytes   little endian unsigned length of the JSON header
+            n bytes   JSON header describing the arrays and user metadata
+            ...       array data, each array aligned to ARRAY_FILE_ALIGNMENT bytes
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor
+      the names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import os
+import mmap
+import json
+import struct
+import tempfile
+
+import numpy as np
+
+## Constants
+ARRAY_FILE_MAGIC = 'RHWARRAY'
+ARRAY_FILE_VERSION = 1
+ARRAY_FILE_ALIGNMENT = 64
+_HEADER_LENGTH = struct.Struct('<I')
+
+
+def _dtypeToDescr(dtype):
+    if dtype.names:
+        return [ [name, dtype.fields[name][0].str] for name in dtype.names ]
+    return dtype.str
+
+def _descrToDtype(descr):
+    if isinstance(descr, list):
+        return np.dtype([ (str(name), str(typestr)) for (name, typestr) in descr ])
+    return np.dtype(str(descr))
+
+def _align(offset):
+    return (offset + ARRAY_FILE_ALIGNMENT - 1) // ARRAY_FILE_ALIGNMENT * ARRAY_FILE_ALIGNMENT
+
+
+def writeArrays(path, arrays, metadata=None):
+    """ @brief Write a collection of arrays to a container file.  The file is
+        written to a temporary file in the same directory and renamed into
+        place, so readers never see a partially written container.
+
+        @param path String representing the path of the container file to write
+        @param arrays Dict mapping array name to numpy.ndarray
+        @param metadata Dict of JSON serializable values to store with the arrays
+    """
+    names = sorted(arrays.keys())
+    arrays = dict( (name, np.ascontiguousarray(arrays[name])) for name in names )
+
+    # Offsets are relative to the start of the data section, which follows the header
+    descriptions = []
+    offset = 0
+    for name in names:
+        a = arrays[name]
+        descriptions.append({'name': name, 'dtype': _dtypeToDescr(a.dtype),
+                             'shape': list(a.shape), 'offset': offset})
+        offset = _align(offset + a.nbytes)
+    header = json.dumps({'version': ARRAY_FILE_VERSION, 'metadata': metadata or {},
+                         'arrays': descriptions})
+    dataStart = _align(len(ARRAY_FILE_MAGIC) + _HEADER_LENGTH.size + len(header))
+
+    outdir = os.path.dirname(os.path.abspath(path))
+    (fd, tmpPath) = tempfile.mkstemp(prefix='.tmp-', dir=outdir)
+    try:
+        f = os.fdopen(fd, 'wb')
+        f.write(ARRAY_FILE_MAGIC)
+        f.write(_HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        for (name, description) in zip(names, descriptions):
+            f.seek(dataStart + description['offset'])
+            arrays[name].tofile(f)
+        f.truncate(dataStart + offset)
+        f.close()
+        os.chmod(tmpPath, 0644)
+        os.rename(tmpPath, path)
+    except:
+        os.unlink(tmpPath)
+        raise
+
+
+def readArrayMetadata(path):
+    """ @brief Read the metadata stored in a container file without mapping its arrays
+
+        @param path String representing the path of the container file
+
+        @return Dict of metadata
+    """
+    f = open(path, 'rb')
+    try:
+        header = _readHeader(f, path)
+    finally:
+        f.close()
+    return header['metadata']
+
+def _readHeader(f, path):
+    magic = f.read(len(ARRAY_FILE_MAGIC))
+    if magic != ARRAY_FILE_MAGIC:
+        raise IOError("%s is not an array container file" % (path,) )
+    (headerLength,) = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+    header = json.loads(f.read(headerLength))
+    if header['version'] != ARRAY_FILE_VERSION:
+        raise IOError("Unsupported array container version %s in %s" % (header['version'], path) )
+    header['dataStart'] = _align(len(ARRAY_FILE_MAGIC) + _HEADER_LENGTH.size + headerLength)
+    return header
+
+
+def readArrays(path):
+    """ @brief Memory map the arrays of a container file
+
+        @param path String representing the path of the container file
+
+        @return Tuple (arrays, metadata) where arrays is a dict mapping array name
+        to a read-only numpy.ndarray backed by the mapped file
+    """
+    f = open(path, 'rb')
+    try:
+        header = _readHeader(f, path)
+        size = os.fstat(f.fileno()).st_size
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+    arrays = {}
+    for description in header['arrays']:
+        dtype = _descrToDtype(description['dtype'])
+        shape = tuple(description['shape'])
+        count = int(np.prod(shape)) if shape else 1
+        start = header['dataStart'] + description['offset']
+        if start + count * dtype.itemsize > size:
+            raise IOError("Array container %s is truncated" % (path,) )
+        if count:
+            a = np.frombuffer(mapped, dtype=dtype, count=count, offset=start)
+        else:
+            a = np.empty(0, dtype=dtype)
+            a.flags.writeable = False
+        arrays[str(description['name'])] = a.reshape(shape)
+    return (arrays, header['metadata'])
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+"""@package BenchmarkFlowtable.py
+
+@brief Benchmark RHESSys flow table readers on either an existing flow
+       table or a synthetic flow table.  Benchmarks:
+       readers -- Compare the dict based flowtableio.readFlowtable with the
+                  columnar flowtablearray.readFlowtableColumnar
+       parallel -- Scaling of flowtablearray.readFlowtableColumnar with the
+                   number of worker processes.  A synthetic flow table of
+                   1100000 patches has about 10 million lines.
+       memory -- Bytes used per receiver by flowtableio.FlowTableEntryReceiver,
+                 by the dict based receiver class it replaced, and by the
+                 receiver arrays of flowtablearray.ColumnarFlowtable
+       writers -- Compare flowtableio.writeFlowtable of the dict returned by
+                  readFlowtable, flowtableio.writeFlowtableRecords and
+                  flowtablearray.writeFlowtableColumnar
+       compression -- Read throughput of flowtableio.iterFlowtable and
+                      flowtablearray.readFlowtableColumnar on the flow table
+                      uncompressed and compressed with each supported
+                      compression
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel
+      Hill nor the names of its contributors may be used to endorse or
+      promote products derived from this software without specific
+      prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage
+@code
+BenchmarkFlowtable.py [-b readers|parallel|writers|memory|compression] [-f <flow table>] [-n <number of synthetic patches>] [-w <worker counts>]
+@endcode
+"""
+import os
+import errno
+import sys
+import time
+import random
+import tempfile
+import argparse
+import gzip
+import shutil
+
+import numpy as np
+
+import flowtableio
+import flowtablearray
+
+NUM_RECEIVERS = 8
+ROAD_FRACTION = 0.01
+
+def generateSyntheticFlowtable(flowtablePath, numPatches, numReceivers=NUM_RECEIVERS,
+                               roadFraction=ROAD_FRACTION, seed=0):
+    """ @brief Write a synthetic flow table laid out on a square grid of patches,
+        each draining to up to numReceivers of its neighbors
+
+        @param flowtablePath String representing the path of the flow table to write
+        @param numPatches Number of patch entries to write
+        @param numReceivers Maximum number of receivers of each entry
+        @param roadFraction Fraction of entries that are roads
+        @param seed Seed for the random number generator
+    """
+    rand = random.Random(seed)
+    width = int(numPatches ** 0.5) + 1
+    neighbors = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)][:numReceivers]
+    hillSize = 10000
+    f = open(flowtablePath, 'w')
+    f.write("%8d" % (numPatches,) )
+    for p in xrange(numPatches):
+        row, col = divmod(p, width)
+        hill = p // hillSize + 1
+        recvs = [ (r * width + c) for (r, c) in [(row + dr, col + dc) for (dr, dc) in neighbors] \
+                  if 0 <= r and 0 <= c < width and r * width + c < numPatches ]
+        isRoad = rand.random() < roadFraction
+        landType = flowtableio.LAND_TYPE_ROAD if isRoad else 1
+        f.write("\n %6d %6d %6d %6.1f %6.1f %6.1f %10f %d %4d %f %4d" % \
+                (p + 1, hill, hill, col * 5.0, row * 5.0, 100.0 - row * 0.01, \
+                 rand.random() * 1000, 1, landType, rand.random(), len(recvs)) )
+        gammas = [rand.random() for r in recvs]
+        total = sum(gammas) or 1.0
+        for r, g in zip(recvs, gammas):
+            rhill = r // hillSize + 1
+            f.write("\n%16d %6d %6d %8.8f  " % (r + 1, rhill, rhill, g / total) )
+        if isRoad:
+            f.write("\n%16d %6d %6d %lf" % (p + 1, hill, hill, 5.0) )
+    f.close()
+
+def _sizeOfFlowtableDict(flowtable):
+    """ @brief Approximate the number of bytes used by a flow table dict """
+    size = sys.getsizeof(flowtable)
+    for key, items in flowtable.iteritems():
+        size += sys.getsizeof(key) + sys.getsizeof(items)
+        for item in items:
+            size += sys.getsizeof(item)
+            if hasattr(item, '__dict__'):
+                size += sys.getsizeof(item.__dict__)
+    return size
+
+class _DictFlowTableEntryReceiver:
+    """ @brief Receiver class used by flowtableio before receivers were slotted """
+    def __init__(self, patchID, zoneID, hillID, gamma):
+        self.patchID = int(patchID)
+        self.zoneID = int(zoneID)
+        self.hillID = int(hillID)
+        self.gamma = float(gamma)
+
+def _sizeOfReceiver(receiver):
+    """ @brief Number of bytes used by a receiver object, its attribute storage
+        and the attribute values
+    """
+    size = sys.getsizeof(receiver)
+    if hasattr(receiver, '__dict__'):
+        size += sys.getsizeof(receiver.__dict__)
+    for name in ('patchID', 'zoneID', 'hillID', 'gamma'):
+        size += sys.getsizeof(getattr(receiver, name))
+    return size
+
+def _time(function, *args):
+    start = time.time()
+    result = function(*args)
+    return (result, time.time() - start)
+
+def benchmarkReaders(flowtablePath):
+    (columnar, columnarTime) = _time(flowtablearray.readFlowtableColumnar, flowtablePath)
+    sys.stdout.write("readFlowtableColumnar: %8.3f s, %12d bytes\n" % \
+                     (columnarTime, columnar.nbytes) )
+    del columnar
+    (flowDict, dictTime) = _time(flowtableio.readFlowtable, flowtablePath)
+    sys.stdout.write("readFlowtable:         %8.3f s, %12d bytes\n" % \
+                     (dictTime, _sizeOfFlowtableDict(flowDict)) )
+    del flowDict
+
+def benchmarkParallelReader(flowtablePath, workerCounts):
+    serial = None
+    for numWorkers in workerCounts:
+        (table, elapsed) = _time(flowtablearray.readFlowtableColumnar, flowtablePath, numWorkers)
+        if serial is None:
+            serial = (table, elapsed)
+            identical = True
+        else:
+            serialArrays = serial[0].toArrays()
+            arrays = table.toArrays()
+            identical = all(np.array_equal(serialArrays[name], arrays[name]) for name in arrays)
+        sys.stdout.write("readFlowtableColumnar, %2d workers: %8.3f s, speedup %5.2f, identical: %s\n" % \
+                         (numWorkers, elapsed, serial[1] / elapsed, identical) )
+
+def benchmarkWriters(flowtablePath):
+    (fd, outPath) = tempfile.mkstemp(suffix='.flow')
+    os.close(fd)
+    try:
+        flowDict = flowtableio.readFlowtable(flowtablePath)
+        (result, elapsed) = _time(flowtableio.writeFlowtable, flowDict, outPath)
+        sys.stdout.write("writeFlowtable:         %8.3f s\n" % (elapsed,) )
+        del flowDict
+        (result, elapsed) = _time(flowtableio.writeFlowtableRecords,
+                                  flowtableio.iterFlowtable(flowtablePath), outPath)
+        sys.stdout.write("writeFlowtableRecords:  %8.3f s (including reading)\n" % (elapsed,) )
+        columnar = flowtablearray.readFlowtableColumnar(flowtablePath)
+        (result, elapsed) = _time(flowtablearray.writeFlowtableColumnar, columnar, outPath)
+        sys.stdout.write("writeFlowtableColumnar: %8.3f s\n" % (elapsed,) )
+    finally:
+        os.unlink(outPath)
+
+def benchmarkMemory(flowtablePath):
+    slotted = [ r for record in flowtableio.iterFlowtable(flowtablePath) for r in record.receivers ]
+    numReceivers = len(slotted)
+    if not numReceivers:
+        sys.stdout.write("Flow table has no receivers\n")
+        return
+    slottedSize = sum(_sizeOfReceiver(r) for r in slotted)
+    dictSize = sum(_sizeOfReceiver(_DictFlowTableEntryReceiver(r.patchID, r.zoneID, r.hillID, r.gamma)) \
+                   for r in slotted)
+    del slotted
+    columnar = flowtablearray.readFlowtableColumnar(flowtablePath)
+    sys.stdout.write("%d receivers\n" % (numReceivers,) )
+    sys.stdout.write("dict receivers:     %8.1f bytes per receiver\n" % (float(dictSize) / numReceivers,) )
+    sys.stdout.write("slotted receivers:  %8.1f bytes per receiver\n" % (float(slottedSize) / numReceivers,) )
+    sys.stdout.write("columnar receivers: %8.1f bytes per receiver\n" % \
+                     (float(columnar.receivers.nbytes) / numReceivers,) )
+
+def _consume(iterator):
+    n = 0
+    for item in iterator:
+        n += 1
+    return n
+
+def benchmarkCompression(flowtablePath):
+    size = os.path.getsize(flowtablePath)
+    suffixes = ['.gz', '.bz2']
+    if flowtableio.lzma is not None:
+        suffixes.append('.xz')
+    tmpDir = tempfile.mkdtemp()
+    try:
+        paths = [('none', flowtablePath)]
+        table = flowtablearray.readFlowtableColumnar(flowtablePath)
+        for suffix in suffixes:
+            path = os.path.join(tmpDir, 'flowtable.flow' + suffix)
+            (result, elapsed) = _time(flowtablearray.writeFlowtableColumnar, table, path)
+            sys.stdout.write("write %-5s %8.3f s, %12d bytes (%5.1f%%)\n" % \
+                             (suffix[1:], elapsed, os.path.getsize(path),
+                              100.0 * os.path.getsize(path) / size) )
+            paths.append( (suffix[1:], path) )
+        del table
+        for (compression, path) in paths:
+            (result, elapsed) = _time(_consume, flowtableio.iterFlowtable(path))
+            sys.stdout.write("iterFlowtable,         %-5s %8.3f s, %7.1f MB/s uncompressed\n" % \
+                             (compression, elapsed, size / elapsed / 1e6) )
+            (result, elapsed) = _time(flowtablearray.readFlowtableColumnar, path)
+            sys.stdout.write("readFlowtableColumnar, %-5s %8.3f s, %7.1f MB/s uncompressed\n" % \
+                             (compression, elapsed, size / elapsed / 1e6) )
+    finally:
+        shutil.rmtree(tmpDir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark RHESSys flow table readers')
+    parser.add_argument('-f', '--flowtable', dest='flowtable', required=False,
+                        help='The path to the flow table to read, optionally gzipped (e.g. tests/data/world5m_dr5.flow.gz); if not specified a synthetic flow table will be used')
+    parser.add_argument('-n', '--numPatches', dest='numPatches', required=False, type=int, default=100000,
+                        help='The number of patches in the synthetic flow table')
+    parser.add_argument('-b', '--benchmark', dest='benchmark', required=False, default='readers',
+                        choices=['readers', 'parallel', 'writers', 'memory', 'compression'],
+                        help='The benchmark to run')
+    parser.add_argument('-w', '--workers', dest='workers', required=False, default='1,2,4,8',
+                        help='Comma separated list of worker counts for the parallel benchmark')
+    args = parser.parse_args()
+
+    flowtablePath = args.flowtable
+    isTemporary = True
+    if flowtablePath and not os.access(flowtablePath, os.R_OK):
+        raise IOError(errno.EACCES, "Unable to read flow table %s" % (flowtablePath,) )
+    if not flowtablePath:
+        (fd, flowtablePath) = tempfile.mkstemp(suffix='.flow')
+        os.close(fd)
+        generateSyntheticFlowtable(flowtablePath, args.numPatches)
+    elif flowtablePath.endswith('.gz'):
+        (fd, tmpPath) = tempfile.mkstemp(suffix='.flow')
+        fOut = os.fdopen(fd, 'wb')
+        fIn = gzip.open(flowtablePath, 'rb')
+        shutil.copyfileobj(fIn, fOut)
+        fIn.close()
+        fOut.close()
+        flowtablePath = tmpPath
+    else:
+        isTemporary = False
+
+    try:
+        if args.benchmark == 'readers':
+            benchmarkReaders(flowtablePath)
+        elif args.benchmark == 'parallel':
+            benchmarkParallelReader(flowtablePath, [int(w) for w in args.workers.split(',')])
+        elif args.benchmark == 'writers':
+            benchmarkWriters(flowtablePath)
+        elif args.benchmark == 'memory':
+            benchmarkMemory(flowtablePath)
+        elif args.benchmark == 'compression':
+            benchmarkCompression(flowtablePath)
+    finally:
+        if isTemporary:
+            os.unlink(flowtablePath)
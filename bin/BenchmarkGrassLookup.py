@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""@package BenchmarkGrassLookup.py
+
+@brief Benchmark looking up the raster cells of patches in GRASS maps with
+       GrassDataLookup.getCoordinatesForFQPatchIDs, scanning the maps and
+       using the patch cell index, against the original cell by cell scan,
+       checking that all find the same coordinates.  The patches are sampled
+       from a flow table.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel
+      Hill nor the names of its contributors may be used to endorse or
+      promote products derived from this software without specific
+      prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage
+@code
+BenchmarkGrassLookup.py -g <GRASSData> -l <location> -m <mapset> -p <patchmap> -z <zonemap> -i <hillslope> -f <flow table> [-n <number of patches>] [--skip-legacy] [--native]
+@endcode
+
+@note Must have GRASS installed and have GISBASE environmental variable set, unless --native is given.
+"""
+import os
+import errno
+import sys
+import time
+import random
+import argparse
+from ctypes import byref
+from collections import OrderedDict
+
+import rhessystypes
+import flowtableio
+from grassdatalookup import GrassDataLookup
+from grassdatalookup import GRASSConfig
+
+def legacyGetCoordinatesForFQPatchIDs(lookup, fqPatchIDs, patchMap, zoneMap, hillslopeMap):
+    """ @brief The original scan of getCoordinatesForFQPatchIDs, comparing every
+        requested patch with every cell through ctypes
+    """
+    coords = {}
+    gis = lookup.grass_lowlevel
+    gis.G_gisinit('')
+    window = gis.Cell_head()
+    gis.G_get_window(byref(window))
+    numRows = gis.G_window_rows()
+    numCols = gis.G_window_cols()
+    maps = [lookup._openRasterMap(m) for m in (patchMap, zoneMap, hillslopeMap)]
+    (patchRast, zoneRast, hillRast) = [rast for (fd, rast, dataType) in maps]
+    for row in range(numRows):
+        for (fd, rast, dataType) in maps:
+            gis.G_get_raster_row(fd, rast, row, dataType)
+        for col in range(numCols):
+            for fqPatchID in fqPatchIDs:
+                if patchRast[col] == fqPatchID.patchID and \
+                    zoneRast[col] == fqPatchID.zoneID and \
+                    hillRast[col] == fqPatchID.hillID:
+                    easting = gis.G_col_to_easting(col + 0.5, byref(window))
+                    northing = gis.G_row_to_northing(row + 0.5, byref(window))
+                    coords.setdefault(fqPatchID, []).append(rhessystypes.getCoordinatePair(easting, northing))
+    for (fd, rast, dataType) in maps:
+        lookup._closeRasterMap(fd, rast)
+    returnCoords = OrderedDict()
+    for fqPatchID in fqPatchIDs:
+        returnCoords[fqPatchID] = coords[fqPatchID]
+    return returnCoords
+
+def _time(function, *args):
+    start = time.time()
+    result = function(*args)
+    return (result, time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark looking up patch coordinates in GRASS maps')
+    parser.add_argument('-g', '--grassdbase', dest='grassdbase', required=True,
+                        help='The path to the GRASS database')
+    parser.add_argument('-l', '--location', dest='location', required=True,
+                        help='The location of GRASS mapset')
+    parser.add_argument('-m', '--mapset', dest='mapset', required=True,
+                        help='The GRASS mapset')
+    parser.add_argument('-p', '--patchmap', dest='patchmap', required=True,
+                        help='The name of the GRASS raster to use for the patch map')
+    parser.add_argument('-z', '--zonemap', dest='zonemap', required=True,
+                        help='The name of the GRASS raster to use for the zone map')
+    parser.add_argument('-i', '--hillmap', dest='hillmap', required=True,
+                        help='The name of the GRASS raster to use for the hill map')
+    parser.add_argument('-f', '--flowtable', dest='flowtable', required=True,
+                        help='The path to the flow table to sample patches from')
+    parser.add_argument('-n', '--numPatches', dest='numPatches', required=False, type=int, default=9,
+                        help='The number of patches to look up, e.g. a patch and its receivers')
+    parser.add_argument('--skip-legacy', dest='skipLegacy', required=False, action='store_true',
+                        help='Do not run the original scan, which can take minutes on large maps')
+    parser.add_argument('--native', dest='native', required=False, action='store_true',
+                        help='Read the maps with grassraster rather than the GRASS library; implies --skip-legacy')
+    args = parser.parse_args()
+
+    if not os.access(args.grassdbase, os.R_OK):
+        raise IOError(errno.EACCES, "Unable to read grassdbase path %s" % (args.grassdbase,) )
+    if not os.access(args.flowtable, os.R_OK):
+        raise IOError(errno.EACCES, "Unable to read flow table %s" % (args.flowtable,) )
+
+    grassConfig = GRASSConfig(gisbase=os.environ.get('GISBASE'), dbase=os.path.abspath(args.grassdbase),
+                              location=args.location, mapset=args.mapset)
+    lookup = GrassDataLookup(grass_config=grassConfig, use_native_reader=args.native)
+    keys = [rhessystypes.FQPatchID(r.entry.patchID, r.entry.zoneID, r.entry.hillID) \
+            for r in flowtableio.iterFlowtable(args.flowtable)]
+    fqPatchIDs = random.sample(keys, min(args.numPatches, len(keys)))
+
+    (coords, elapsed) = _time(lookup.getCoordinatesForFQPatchIDs, fqPatchIDs,
+                              args.patchmap, args.zonemap, args.hillmap, False)
+    sys.stdout.write("%d patches, %d cells\n" % (len(coords), sum(len(c) for c in coords.itervalues())) )
+    sys.stdout.write("getCoordinatesForFQPatchIDs, scan:  %8.3f s\n" % (elapsed,) )
+    (index, indexElapsed) = _time(lookup.getPatchCellIndex, args.patchmap, args.zonemap, args.hillmap)
+    sys.stdout.write("getPatchCellIndex, load or build:   %8.3f s, %d patches, %d bytes\n" % \
+                     (indexElapsed, len(index), index.nbytes) )
+    (indexedCoords, indexedElapsed) = _time(lookup.getCoordinatesForFQPatchIDs, fqPatchIDs,
+                                            args.patchmap, args.zonemap, args.hillmap)
+    sys.stdout.write("getCoordinatesForFQPatchIDs, index: %8.3f s, speedup %.1f, identical: %s\n" % \
+                     (indexedElapsed, elapsed / indexedElapsed, indexedCoords == coords) )
+    if not args.skipLegacy and not args.native:
+        (legacyCoords, legacyElapsed) = _time(legacyGetCoordinatesForFQPatchIDs, lookup, fqPatchIDs,
+                                              args.patchmap, args.zonemap, args.hillmap)
+        sys.stdout.write("original scan:                      %8.3f s, speedup %.1f, identical: %s\n" % \
+                         (legacyElapsed, legacyElapsed / elapsed, legacyCoords == coords) )
+    stats = lookup.rowCache.getStats()
+    sys.stdout.write("row cache: %d hits, %d misses, %d evictions, %d rows, %d bytes\n" % \
+                     (stats.hits, stats.misses, stats.evictions, stats.numRows, stats.numBytes) )
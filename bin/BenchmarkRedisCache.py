@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""@package BenchmarkRedisCache.py
+
+@brief Benchmark loading a RHESSys flow table into the Redis flow table
+       cache.  Compares the original loader, one rpush and one hset round
+       trip per patch with pickled keys and JSON values, with the
+       pipelined flowtablecache.bulkLoadFlowtable.  Reports load
+       throughput and the Redis memory used by each.  The benchmark
+       flow tables are removed from Redis afterwards.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel
+      Hill nor the names of its contributors may be used to endorse or
+      promote products derived from this software without specific
+      prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage
+@code
+BenchmarkRedisCache.py -f <flow table> [-H <host>] [-p <port>] [-d <db>] [-b <batch size>]
+@endcode
+"""
+import os
+import errno
+import sys
+import time
+import cPickle
+import argparse
+
+import redis
+
+import flowtableio
+import flowtablearray
+import flowtablecache
+
+LEGACY_NAME = 'benchmark-legacy.flow'
+BULK_NAME = 'benchmark-bulk.flow'
+
+def loadLegacy(redisClient, name, table):
+    """ @brief Load a flow table the way FlowtableDriver originally did """
+    for fqpatchid, entry in table.iteritems():
+        key = cPickle.dumps(fqpatchid)
+        redisClient.rpush(name, key)
+        redisClient.hset(name + ".hash", key, flowtableio.dumpReceiversJSON(entry))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark loading a flow table into the Redis cache')
+    parser.add_argument('-f', '--flowtable', dest='flowtable', required=True,
+                        help='The path to the flow table to load')
+    parser.add_argument('-H', '--host', dest='host', required=False, default='localhost',
+                        help='The Redis host')
+    parser.add_argument('-p', '--port', dest='port', required=False, type=int, default=6379,
+                        help='The Redis port')
+    parser.add_argument('-d', '--db', dest='db', required=False, type=int, default=15,
+                        help='The Redis database')
+    parser.add_argument('-b', '--batchSize', dest='batchSize', required=False, type=int,
+                        default=flowtablecache.DEFAULT_BATCH_SIZE,
+                        help='The number of patches per pipelined round trip')
+    args = parser.parse_args()
+
+    if not os.access(args.flowtable, os.R_OK):
+        raise IOError(errno.EACCES, "Unable to read flow table %s" % (args.flowtable,) )
+
+    redisClient = redis.Redis(host=args.host, port=args.port, db=args.db)
+    table = flowtablearray.readFlowtableColumnar(args.flowtable)
+    try:
+        memoryBefore = flowtablecache.getRedisMemory(redisClient)
+        start = time.time()
+        loadLegacy(redisClient, LEGACY_NAME, table)
+        elapsed = time.time() - start
+        memoryAfter = flowtablecache.getRedisMemory(redisClient)
+        sys.stdout.write("legacy loader: %8.3f s, %10.0f patches/s, %12d bytes of Redis memory\n" % \
+                         (elapsed, len(table) / elapsed, memoryAfter - memoryBefore) )
+        redisClient.delete(LEGACY_NAME, LEGACY_NAME + ".hash")
+
+        stats = flowtablecache.bulkLoadFlowtable(redisClient, BULK_NAME, table, args.batchSize)
+        sys.stdout.write("bulk loader:   %8.3f s, %10.0f patches/s, %12d bytes of Redis memory\n" % \
+                         (stats.seconds, stats.numPatches / stats.seconds,
+                          stats.memoryAfter - stats.memoryBefore) )
+    finally:
+        redisClient.delete(LEGACY_NAME, LEGACY_NAME + ".hash")
+        flowtablecache.clearFlowtable(redisClient, BULK_NAME)
@@ -50,8 +50,7 @@ import errno
 from osgeo import osr
 
 import rhessystypes
-from grassdatalookup import getSpatialReferenceForGRASSDataset
-from grassdatalookup import getFQPatchIDForCoordinates
+from grassdatalookup import GrassDataLookup
 from grassdatalookup import GRASSConfig
 
 SEP = ','
@@ -89,7 +88,7 @@ else:
                         help='The name of the GRASS raster to use for the patch map')
     parser.add_argument('-z', '--zonemap', dest='zonemap', required=True,
                         help='The name of the GRASS raster to use for the zone map')
-    parser.add_argument('-h', '--hillmap', dest='hillmap', required=True,
+    parser.add_argument('-i', '--hillmap', dest='hillmap', required=True,
                         help='The name of the GRASS raster to use for the hill map')
     parser.add_argument('-c', '--coordinates', dest='coordinates', required=True,
                         help='The path to comma separated file containing easting,northing coordinates in UTM18N NAD83 spatial reference system.  Will skip the first line in the file.')
@@ -108,12 +107,13 @@ grassdbase = os.path.abspath(args.grassdbase)
 
 grassConfig = GRASSConfig(gisbase=gisbase, dbase=grassdbase, location=args.location, mapset=args.mapset)
 
-t_srs = getSpatialReferenceForGRASSDataset(grassConfig)
+grassDataLookup = GrassDataLookup(grass_config=grassConfig)
+t_srs = grassDataLookup.getSpatialReferenceForGRASSDataset()
 s_srs = osr.SpatialReference()
 s_srs.ImportFromEPSG(4326)
 crx = osr.CoordinateTransformation(s_srs, t_srs)
 
-sys.stdout.write("lat%slon%seasting%snorthing%spatchID%szoneID%shillID\n" % (SEP, SEP, SEP, SEP, SEP, SEP) )
+points = []
 f = open(args.coordinates, 'r')
 f.next() # skip first line
 for line in f:
@@ -124,12 +124,17 @@ for line in f:
     # Transform coordinates from WGS84 to the coordinate system of the
     # GRASS mapset
     (x, y, z) = crx.TransformPoint( lon, lat )
+    points.append( (lat, lon, rhessystypes.getCoordinatePair(x, y)) )
+f.close()
 
-    # Lookup patchID for transformed coordinates
-    coord = rhessystypes.getCoordinatePair(x, y)
-    id = getFQPatchIDForCoordinates(coord, grassConfig,
-                                    args.patchmap, args.zonemap, args.hillmap)
-    
-    sys.stdout.write("%f%s%f%s%f%s%f%s%d%s%d%s%d\n" % (lat, SEP, lon, SEP, coord.easting, SEP, coord.northing, SEP, id.patchID, SEP, id.zoneID, SEP, id.hillID) )
-
+# Lookup patchIDs for all transformed coordinates at once
+ids = grassDataLookup.getFQPatchIDsForCoordinates([coord for (lat, lon, coord) in points],
+                                                  args.patchmap, args.zonemap, args.hillmap)
 
+sys.stdout.write("lat%slon%seasting%snorthing%spatchID%szoneID%shillID\n" % (SEP, SEP, SEP, SEP, SEP, SEP) )
+for ((lat, lon, coord), id) in zip(points, ids):
+    if id is None:
+        # Outside the region or on a NULL cell
+        sys.stdout.write("%f%s%f%s%f%s%f%s%s%s%s\n" % (lat, SEP, lon, SEP, coord.easting, SEP, coord.northing, SEP, SEP, SEP) )
+        continue
+    sys.stdout.write("%f%s%f%s%f%s%f%s%d%s%d%s%d\n" % (lat, SEP, lon, SEP, coord.easting, SEP, coord.northing, SEP, id.patchID, SEP, id.zoneID, SEP, id.hillID) )
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""@package MergeFlowtables.py
+
+@brief Merge RHESSys flow tables, e.g. of sub-catchments, into one flow
+       table, optionally rewiring receivers across the boundaries between
+       them through a boundary mapping file (see flowtablemerge).  The
+       inputs are streamed, so memory use does not grow with their number.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel
+      Hill nor the names of its contributors may be used to endorse or
+      promote products derived from this software without specific
+      prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage
+@code
+MergeFlowtables.py -o <output flow table> [-m <boundary map>] [--keep-first] [--concatenate] <flow table> [<flow table> ...]
+@endcode
+"""
+import os
+import errno
+import sys
+import argparse
+
+import flowtablemerge
+
+parser = argparse.ArgumentParser(description='Merge RHESSys flow tables')
+parser.add_argument('flowtables', nargs='+',
+                    help='The paths of the flow tables to merge, optionally compressed')
+parser.add_argument('-o', '--output', dest='output', required=True,
+                    help='The path of the flow table to write; compressed if it ends with .gz, .bz2 or .xz')
+parser.add_argument('-m', '--boundary-map', dest='boundaryMap', required=False,
+                    help='The path of a file mapping receiver IDs in the inputs to IDs in the merged flow table')
+parser.add_argument('--keep-first', dest='keepFirst', required=False, action='store_true',
+                    help='Keep the first occurrence of patches found in more than one flow table, rather than failing')
+parser.add_argument('--concatenate', dest='concatenate', required=False, action='store_true',
+                    help='Concatenate the flow tables rather than merging their entries by decreasing elevation')
+args = parser.parse_args()
+
+for flowtable in args.flowtables:
+    if not os.access(flowtable, os.R_OK):
+        raise IOError(errno.EACCES, "Unable to read flow table %s" % (flowtable,) )
+boundaryMap = None
+if args.boundaryMap:
+    if not os.access(args.boundaryMap, os.R_OK):
+        raise IOError(errno.EACCES, "Unable to read boundary map %s" % (args.boundaryMap,) )
+    boundaryMap = flowtablemerge.readBoundaryMap(args.boundaryMap)
+
+onCollision = flowtablemerge.COLLISION_KEEP_FIRST if args.keepFirst else flowtablemerge.COLLISION_ERROR
+stats = flowtablemerge.mergeFlowtables(args.flowtables, args.output, boundaryMap, onCollision,
+                                       not args.concatenate)
+if stats.numCollisions:
+    sys.stdout.write("Kept the first of %d patches found in more than one flow table, skipping %d entries\n" % \
+                     (stats.numCollisions, stats.numSkipped) )
+if boundaryMap:
+    sys.stdout.write("Rewired %d receivers across boundaries\n" % (stats.numRewired,) )
+sys.stdout.write("Wrote %d patches to %s\n" % (stats.numPatches, args.output) )
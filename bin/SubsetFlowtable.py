@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""@package SubsetFlowtable.py
+
+@brief Extract the entries of a RHESSys flow table covering a set of
+       hillslopes, a set of zones, or a bounding box, as a flow table of
+       its own.  Receivers outside the subset are dropped, with the gammas
+       of the remaining receivers scaled to the same sum, or kept.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel
+      Hill nor the names of its contributors may be used to endorse or
+      promote products derived from this software without specific
+      prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage
+@code
+SubsetFlowtable.py -f <flow table> -o <output flow table> [--hills <IDs>] [--zones <IDs>] [--bbox <xmin,ymin,xmax,ymax>] [-r drop|keep] [--stream]
+@endcode
+"""
+import os
+import errno
+import sys
+import argparse
+
+import flowtablearray
+import flowtablesubset
+
+def _parseIDs(value):
+    return [int(v) for v in value.split(',')] if value else None
+
+parser = argparse.ArgumentParser(description='Extract part of a RHESSys flow table')
+parser.add_argument('-f', '--flowtable', dest='flowtable', required=True,
+                    help='The path to the flow table to read, optionally compressed')
+parser.add_argument('-o', '--output', dest='output', required=True,
+                    help='The path of the flow table to write; compressed if it ends with .gz, .bz2 or .xz')
+parser.add_argument('--hills', dest='hills', required=False,
+                    help='Comma separated list of the hillslope IDs to extract')
+parser.add_argument('--zones', dest='zones', required=False,
+                    help='Comma separated list of the zone IDs to extract')
+parser.add_argument('--bbox', dest='bbox', required=False,
+                    help='Bounding box xmin,ymin,xmax,ymax of the entry coordinates to extract')
+parser.add_argument('-r', '--receivers', dest='receivers', required=False,
+                    default=flowtablesubset.RECEIVER_POLICY_DROP, choices=flowtablesubset.RECEIVER_POLICIES,
+                    help='Whether to drop receivers outside the subset, renormalizing gammas, or keep them')
+parser.add_argument('--stream', dest='stream', required=False, action='store_true',
+                    help='Stream the flow table rather than loading it, to use less memory')
+args = parser.parse_args()
+
+if not os.access(args.flowtable, os.R_OK):
+    raise IOError(errno.EACCES, "Unable to read flow table %s" % (args.flowtable,) )
+bbox = None
+if args.bbox:
+    bbox = tuple(float(v) for v in args.bbox.split(','))
+    if len(bbox) != 4:
+        sys.exit("Bounding box must be given as xmin,ymin,xmax,ymax")
+if not (args.hills or args.zones or bbox):
+    sys.exit("At least one of --hills, --zones and --bbox must be given")
+
+if args.stream:
+    numPatches = flowtablesubset.subsetFlowtable(args.flowtable, args.output, _parseIDs(args.hills),
+                                                 _parseIDs(args.zones), bbox, args.receivers)
+else:
+    # Loading through the sidecar makes repeated extractions from the same flow table fast
+    table = flowtablearray.loadFlowtable(args.flowtable)
+    subset = flowtablesubset.subsetColumnar(table, _parseIDs(args.hills), _parseIDs(args.zones), bbox,
+                                            args.receivers)
+    flowtablearray.writeFlowtableColumnar(subset, args.output)
+    numPatches = len(subset)
+sys.stdout.write("Wrote %d patches to %s\n" % (numPatches, args.output) )
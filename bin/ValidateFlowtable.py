@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""@package ValidateFlowtable.py
+
+@brief Check the integrity of a RHESSys flow table and print a report of
+       the problems found.  Exits with status 1 if the flow table is invalid.
+       See flowtablevalidator for the checks performed.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel
+      Hill nor the names of its contributors may be used to endorse or
+      promote products derived from this software without specific
+      prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage
+@code
+ValidateFlowtable.py -f <flow table> [-t <gamma tolerance>] [-l <max problems per check>] [-w <workers>]
+@endcode
+"""
+import os
+import errno
+import sys
+import argparse
+
+import flowtablearray
+import flowtablevalidator
+
+parser = argparse.ArgumentParser(description='Check the integrity of a RHESSys flow table')
+parser.add_argument('-f', '--flowtable', dest='flowtable', required=True,
+                    help='The path to the flow table to check')
+parser.add_argument('-t', '--tolerance', dest='tolerance', required=False, type=float,
+                    default=flowtablevalidator.GAMMA_TOLERANCE,
+                    help='Largest allowed difference between 1 and the sum of the receiver gammas of an entry')
+parser.add_argument('-l', '--limit', dest='limit', required=False, type=int, default=20,
+                    help='The maximum number of problems to print per check')
+parser.add_argument('-w', '--workers', dest='workers', required=False, type=int, default=1,
+                    help='The number of processes to read the flow table with')
+args = parser.parse_args()
+
+if not os.access(args.flowtable, os.R_OK):
+    raise IOError(errno.EACCES, "Unable to read flow table %s" % (args.flowtable,) )
+
+table = flowtablearray.readFlowtableColumnar(args.flowtable, numWorkers=args.workers)
+report = flowtablevalidator.validateFlowtable(table, gammaTolerance=args.tolerance)
+sys.stdout.write("%s\n" % (report,) )
+for problem in report.getProblems(limit=args.limit):
+    key = problem.key
+    sys.stdout.write("%s: patch %d zone %d hill %d: %s\n" % \
+                     (problem.check, key.patchID, key.zoneID, key.hillID, problem.message) )
+sys.exit(0 if report.isValid() else 1)
@@ -3,6 +3,7 @@ from osgeo import gdal, ogr, osr
 from django.conf import settings
 from django.contrib.gis.geos import Polygon
 import importlib
+import logging
 import os
 import sh
 import redis
@@ -10,18 +11,29 @@ import cPickle
 
 import tempfile
 from RHESSysWeb.grassdatalookup import GrassDataLookup
+from RHESSysWeb.grassdatalookup import GRASSConfig
 from RHESSysWeb import flowtableio
+from RHESSysWeb import flowtablearray
+from RHESSysWeb import flowtablecache
+from RHESSysWeb import flowtableoverlay
+from RHESSysWeb import flowtablelru
 from RHESSysWeb.rhessystypes import FQPatchID
+from RHESSysWeb.rhessystypes import getCoordinatePair
 from RHESSysWeb.flowtableio import FlowTableEntryReceiver
 
+log = logging.getLogger(__name__)
+
 flowtable = redis.Redis(db=15)
+flowtablelru.getCache().setMaxBytes(getattr(settings, 'FLOWTABLE_CACHE_BYTES', flowtablelru.DEFAULT_MAX_BYTES))
 
 class FlowtableDriver(drivers.Driver):
     def __init__(self, resource):
         super(FlowtableDriver, self).__init__(data_resource=resource)
         self.env = self.resource.parent.grassenvironment
         self.ensure_grass()
-        self._grassdatalookup = GrassDataLookup(self.g, self.grass_lowlevel)
+        grassConfig = GRASSConfig(gisbase=settings.GISBASE, dbase=self.env.database,
+                                  location=self.env.location, mapset=self.env.map_set)
+        self._grassdatalookup = GrassDataLookup(self.g, grass_config=grassConfig, use_native_reader=True)
 
     def ensure_grass(self):
         if 'GISRC' not in os.environ:
@@ -100,47 +112,60 @@ class FlowtableDriver(drivers.Driver):
 
         ### everything below here is specific to rhessys and the hackathon ###
 
-        _, _, _, patch = self.g.read_command("r.what", **{
-            "input" : 'patch_5m',
-            "null" : "None", "east_north" :
-            "{easting},{northing}".format(easting=easting, northing=northing)
-        }).strip().split('|')
-
-        _, _, _, hillslope = self.g.read_command("r.what", **{
-            "input" : 'hillslope',
-            "null" : "None", "east_north" :
-            "{easting},{northing}".format(easting=easting, northing=northing)
-        }).strip().split('|')
-
-        _, _, _, zone = self.g.read_command("r.what", **{
-            "input" : 'hillslope',
-            "null" : "None", "east_north" :
-            "{easting},{northing}".format(easting=easting, northing=northing)
-        }).strip().split('|')
-
-        patch = int(patch)
-        hillslope = int(hillslope)
-        zone = int(zone)
-
-        return patch, hillslope, zone
+        fqPatchID, = self._grassdatalookup.getFQPatchIDsForCoordinates(
+            [getCoordinatePair(easting, northing)], 'patch_5m', 'hillslope', 'hillslope')
+        if fqPatchID is None:
+            raise ValueError("No patch at {easting},{northing}".format(easting=easting, northing=northing))
+
+        return fqPatchID.patchID, fqPatchID.hillID, fqPatchID.zoneID
+
+    def get_local_flowtable(self):
+        # The process-wide LRU cache only rereads the flow table file when it has changed
+        return flowtablelru.getFlowtable(os.path.join(settings.MEDIA_ROOT, self.env.flow_table.name))
+
+    def ensure_flowtable_cached(self):
+        # setup redis if necessary; only one worker loads the flow table, the others wait for it
+        name = self.env.flow_table.name
+        stats = flowtablecache.ensureFlowtableCached(flowtable, name, self.get_local_flowtable)
+        if stats:
+            log.info("cached flow table %s: %d patches in %.1f s, redis memory %d -> %d bytes",
+                name, stats.numPatches, stats.seconds, stats.memoryBefore, stats.memoryAfter)
+
+    def get_donors(self, fqpatch_id):
+        """ Patches draining into fqpatch_id, as a list of flowtableio.FlowTableDonor """
+        try:
+            self.ensure_flowtable_cached()
+            return flowtablecache.getCachedDonors(flowtable, self.env.flow_table.name, fqpatch_id)
+        except redis.ConnectionError:
+            log.warning("redis unavailable, reading donors from flow table %s", self.env.flow_table.name)
+            return self.get_local_flowtable().getDonorsForKey(fqpatch_id)
+
+    def get_items(self, fqpatch_id, edits_owner=None):
+        """ Flow table items of fqpatch_id as returned by flowtableio.readFlowtable, None if
+            the flow table has no such patch
+        """
+        try:
+            self.ensure_flowtable_cached()
+            items = flowtablecache.getCachedItems(flowtable, self.env.flow_table.name, fqpatch_id)
+            # Show the receivers as edited by the requesting user (see views._edits_owner)
+            if edits_owner:
+                items = flowtableoverlay.overlayItems(flowtable, self.env.flow_table.name, edits_owner,
+                                                      fqpatch_id, items)
+            return items
+        except redis.ConnectionError:
+            # Edits are stored in redis, so only the flow table itself can be shown
+            log.warning("redis unavailable, reading items from flow table %s", self.env.flow_table.name)
+            table = self.get_local_flowtable()
+            index = table.getIndexForKey(fqpatch_id)
+            return table.getItems(index) if index >= 0 else None
 
     def get_data_for_point(self, wherex, wherey, srs, fuzziness=0, **kwargs):
         patch, hillslope, zone = self.get_fqpatch(srs, wherex, wherey)
         fqpatch_id = FQPatchID(patchID=patch, hillID=hillslope, zoneID=zone)
         r_srs = self.get_real_srs(srs)
 
-        # setup redis if necessary
-        if not flowtable.llen(self.env.flow_table.name):
-            flow_table = flowtableio.readFlowtable(os.path.join(settings.MEDIA_ROOT, self.env.flow_table.name))
-            for fqpatchid, entry in flow_table.items():
-                key = cPickle.dumps(fqpatchid)
-                value = flowtableio.dumpReceivers(entry)
-                flowtable.rpush(self.env.flow_table.name, key)
-                flowtable.hset(self.env.flow_table.name + ".hash", key, value)
-
         # total_gamma = flowtableio.getEntryForFlowtableKey(fqpatch_id, self.flow_table).totalGamma
-        hkey = cPickle.dumps(fqpatch_id)
-        flowtable_entry = flowtableio.loadReceivers(flowtable.hget(self.env.flow_table.name + ".hash", hkey))
+        flowtable_entry = self.get_items(fqpatch_id, kwargs.get('edits_owner'))
         total_gamma = flowtable_entry[0].totalGamma
 
         receivers = [fqpatch_id] + flowtable_entry[1:]
@@ -12,6 +12,8 @@ from collections import namedtuple
 
 import tempfile
 
+from RHESSysWeb import grassraster
+
 GRASSEnv = namedtuple('GRASSEnv', ['database', 'location', 'map_set', 'default_raster'], verbose=False)
 
 class GrassMixin(object):
@@ -91,24 +93,15 @@ class GrassMixin(object):
         r_srs = self.get_real_srs(srs)
         xrc = osr.CoordinateTransformation(self.proj, r_srs)
         crx = osr.CoordinateTransformation(r_srs, self.proj)
-        self.ensure_grass()
 
         easting, northing, _ = crx.TransformPoint(wherex, wherey)
 
-        rasters = self.g.list_strings('rast')
-        def best_type(k):
-            try:
-                return int(k)
-            except:
-                try:
-                    return float(k)
-                except:
-                    return k
+        # Read the rasters directly rather than through r.what; NULL is '*' as in r.what
+        values = grassraster.getValuesForCoordinates(os.path.join(self.env.database, self.env.location),
+                                                     self.env.map_set, easting, northing)
 
         c = []
-        c.append(dict(zip(rasters, [
-            best_type(k) for k in self.g.read_command('r.what', input=rasters, east_north='{e},{n}'.format(e=easting, n=northing)).strip().split('|')
-        ])))
+        c.append(dict( (k, '*' if v is None else v) for (k, v) in values.items() ))
 
         return c
 
@@ -245,24 +238,15 @@ class Grass(drivers.Driver):
         r_srs = self.get_real_srs(srs)
         xrc = osr.CoordinateTransformation(self.proj, r_srs)
         crx = osr.CoordinateTransformation(r_srs, self.proj)
-        self.ensure_grass()
 
         easting, northing, _ = crx.TransformPoint(wherex, wherey)
 
-        rasters = self.g.list_strings('rast')
-        def best_type(k):
-            try:
-                return int(k)
-            except:
-                try:
-                    return float(k)
-                except:
-                    return k
+        # Read the rasters directly rather than through r.what; NULL is '*' as in r.what
+        values = grassraster.getValuesForCoordinates(os.path.join(self.env.database, self.env.location),
+                                                     self.env.map_set, easting, northing)
 
         c = []
-        c.append(dict(zip(rasters, [
-            best_type(k) for k in self.g.read_command('r.what', input=rasters, east_north='{e},{n}'.format(e=easting, n=northing)).strip().split('|')
-        ])))
+        c.append(dict( (k, '*' if v is None else v) for (k, v) in values.items() ))
 
         return c
 
@@ -0,0 +1,396 @@
+"""@package flowgraph
+
+@brief Flow network algorithms over RHESSys flow tables: topological
+        ordering of patches (upstream first), cycle detection,
+        recomputation of accumulated (contributing) area, and tracing
+        of the dominant downstream path of a patch to its outlet.
+
+        Patches are the nodes of the graph; each receiver of a patch is
+        an edge weighted by its gamma.  Receivers that are not entries
+        of the flow table, and receivers that are the patch itself, are
+        not edges.  All algorithms process the graph one topological
+        level at a time with NumPy, so the work is linear in the size
+        of the flow table.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor
+      the names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+from collections import namedtuple
+
+import numpy as np
+
+import rhessystypes
+from flowtableio import FlowTableEntry
+from flowtableio import FlowTableEntryReceiver
+import flowtablearray
+from flowtablearray import getKeyRadix
+from flowtablearray import packKeys
+
+## Constants
+ACCUM_AREA_TOLERANCE = 1e-3
+
+## Type definitions
+AccumAreaMismatch = namedtuple('AccumAreaMismatch', ['key', 'stored', 'computed'], verbose=False)
+
+
+def _gatherRows(offsets, nodes):
+    """ @brief Gather the CSR rows of a set of nodes
+
+        @param offsets CSR offsets array
+        @param nodes Array of node indexes
+
+        @return Array of the positions offsets[n]:offsets[n+1] of each node n, in order
+    """
+    starts = offsets[nodes]
+    counts = offsets[nodes + 1] - starts
+    blockOffsets = np.cumsum(counts) - counts
+    return np.repeat(starts - blockOffsets, counts) + np.arange(int(counts.sum()))
+
+def _buildCSR(numNodes, sources, *columns):
+    """ @brief Sort edge columns by source node into CSR layout
+
+        @return Tuple (offsets, sortedColumns) where sortedColumns is a list
+    """
+    order = np.argsort(sources, kind='mergesort')
+    offsets = np.zeros(numNodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=numNodes), out=offsets[1:])
+    return (offsets, [c[order] for c in columns])
+
+def _peel(numNodes, offsets, targets, active):
+    """ @brief Repeatedly remove nodes with no incoming edges from active nodes
+        (Kahn's algorithm, one level at a time)
+
+        @param numNodes Number of nodes in the graph
+        @param offsets CSR offsets of the edges, by source node
+        @param targets Target node of each edge, in CSR order
+        @param active Boolean array of the nodes to consider
+
+        @return Tuple (order, levelOffsets, remaining): the removed nodes in order of
+        removal, the offsets into order of each level, and a boolean array of the
+        active nodes that could not be removed because they are in or downstream
+        of a cycle
+    """
+    edgeActive = np.repeat(active, np.diff(offsets)) & active[targets]
+    indegree = np.bincount(targets[edgeActive], minlength=numNodes)
+    frontier = np.flatnonzero(active & (indegree == 0))
+    levels = []
+    numRemoved = 0
+    while len(frontier):
+        levels.append(frontier)
+        numRemoved += len(frontier)
+        edges = _gatherRows(offsets, frontier)
+        edges = edges[edgeActive[edges]]
+        (nodes, counts) = np.unique(targets[edges], return_counts=True)
+        indegree[nodes] -= counts
+        frontier = nodes[indegree[nodes] == 0]
+
+    order = np.concatenate(levels) if levels else np.empty(0, dtype=np.int64)
+    levelOffsets = np.zeros(len(levels) + 1, dtype=np.int64)
+    np.cumsum([len(l) for l in levels], out=levelOffsets[1:])
+    remaining = active.copy()
+    remaining[order] = False
+    return (order, levelOffsets, remaining)
+
+
+def _getOutlets(dominant):
+    """ @brief Follow the dominant receivers of every node to its outlet, doubling
+        the number of steps at each pass (pointer jumping) so that the number of
+        passes grows with the logarithm of the longest path
+
+        @param dominant Array of the dominant receiver of each node, -1 for outlets
+
+        @return Array of the outlet of each node, -1 for nodes whose dominant
+        receivers lead into a cycle
+    """
+    numNodes = len(dominant)
+    isOutlet = dominant < 0
+    ahead = np.where(isOutlet, np.arange(numNodes), dominant)
+    for i in xrange(max(numNodes, 1).bit_length()):
+        jumped = ahead[ahead]
+        if np.array_equal(jumped, ahead):
+            break
+        ahead = jumped
+    # Nodes leading into a cycle end up on the cycle, never on an outlet
+    return np.where(isOutlet[ahead], ahead, -1)
+
+
+class FlowGraph(object):
+    def __init__(self, patchIDs, zoneIDs, hillIDs, area, accumArea,
+                 edgeSources, receiverIDs, edgeGammas):
+        """ @brief Build a FlowGraph from node and receiver arrays.  Use
+            buildFlowGraph to build a FlowGraph from a flow table.
+
+            @param patchIDs Array of the patch ID of each node
+            @param zoneIDs Array of the zone ID of each node
+            @param hillIDs Array of the hillslope ID of each node
+            @param area Array of the area of each node
+            @param accumArea Array of the accumulated area stored for each node
+            @param edgeSources Array of the node of each receiver
+            @param receiverIDs Tuple (patchIDs, zoneIDs, hillIDs) of arrays of the IDs
+            of each receiver
+            @param edgeGammas Array of the gamma of each receiver
+        """
+        self.patchIDs = np.asarray(patchIDs, dtype=np.int64)
+        self.zoneIDs = np.asarray(zoneIDs, dtype=np.int64)
+        self.hillIDs = np.asarray(hillIDs, dtype=np.int64)
+        self.area = np.asarray(area, dtype=np.float64)
+        self.accumArea = np.asarray(accumArea, dtype=np.float64)
+        numNodes = len(self.patchIDs)
+
+        self._radix = getKeyRadix(self.zoneIDs, self.hillIDs)
+        keys = packKeys(self.patchIDs, self.zoneIDs, self.hillIDs, self._radix)
+        self._sortOrder = np.argsort(keys, kind='mergesort')
+        self._sortedKeys = keys[self._sortOrder]
+
+        # Receivers outside the flow table, and patches receiving from themselves, are not edges
+        edgeSources = np.asarray(edgeSources, dtype=np.int64)
+        edgeTargets = self.getIndexesForIDs(*receiverIDs)
+        edgeGammas = np.asarray(edgeGammas, dtype=np.float64)
+        isEdge = (edgeTargets >= 0) & (edgeSources != edgeTargets)
+        (self.edgeOffsets, (self.edgeTargets, self.edgeGammas)) = \
+            _buildCSR(numNodes, edgeSources[isEdge], edgeTargets[isEdge], edgeGammas[isEdge])
+        self._numEdges = np.diff(self.edgeOffsets)
+
+        self._levels = None
+        self._cycleNodes = None
+        self._accumulatedArea = None
+        self._dominantReceivers = None
+        self._outlets = None
+
+    def __len__(self):
+        return len(self.patchIDs)
+
+    def getIndexesForIDs(self, patchIDs, zoneIDs, hillIDs):
+        """ @brief Get the node indexes of arrays of patch IDs
+
+            @return Array of node indexes, -1 for patches not in the graph
+        """
+        keys = packKeys(patchIDs, zoneIDs, hillIDs, self._radix)
+        pos = np.searchsorted(self._sortedKeys, keys, side='right') - 1
+        found = (pos >= 0) & (keys >= 0)
+        found[found] = self._sortedKeys[pos[found]] == keys[found]
+        indexes = np.full(len(keys), -1, dtype=np.int64)
+        indexes[found] = self._sortOrder[pos[found]]
+        return indexes
+
+    def getIndexForKey(self, key):
+        """ @brief Get the node index of a flow table key
+
+            @param key rhessystypes.FQPatchID
+
+            @return Node index, -1 if the graph has no such patch
+        """
+        return int(self.getIndexesForIDs([key.patchID], [key.zoneID], [key.hillID])[0])
+
+    def getKey(self, index):
+        """ @brief Get the rhessystypes.FQPatchID of a node """
+        return rhessystypes.FQPatchID(patchID=int(self.patchIDs[index]), zoneID=int(self.zoneIDs[index]),
+                                      hillID=int(self.hillIDs[index]))
+
+    def _getIndex(self, keyOrIndex):
+        if isinstance(keyOrIndex, rhessystypes.FQPatchID):
+            index = self.getIndexForKey(keyOrIndex)
+            if index < 0:
+                raise KeyError(keyOrIndex)
+            return index
+        return int(keyOrIndex)
+
+    def _getLevels(self):
+        if self._levels is None:
+            numNodes = len(self)
+            (order, levelOffsets, remaining) = _peel(numNodes, self.edgeOffsets, self.edgeTargets,
+                                                     np.ones(numNodes, dtype=bool))
+            self._levels = (order, levelOffsets)
+            if remaining.any():
+                # Drop the nodes downstream of cycles by peeling the reversed graph
+                sources = np.repeat(np.arange(numNodes), self._numEdges)
+                (reverseOffsets, (reverseTargets,)) = _buildCSR(numNodes, self.edgeTargets, sources)
+                remaining = _peel(numNodes, reverseOffsets, reverseTargets, remaining)[2]
+            self._cycleNodes = np.flatnonzero(remaining)
+        return self._levels
+
+    def hasCycles(self):
+        """ @brief Determine whether the flow network contains cycles """
+        return len(self.getCycleNodes()) > 0
+
+    def getCycleNodes(self):
+        """ @brief Get the nodes that are on cycles of the flow network, or on paths
+            between cycles
+
+            @return Array of node indexes
+        """
+        self._getLevels()
+        return self._cycleNodes
+
+    def getTopologicalOrder(self):
+        """ @brief Get the nodes in topological order: every patch precedes the
+            patches it drains into.
+
+            @return Array of node indexes
+
+            @raise Exception if the flow network contains cycles
+        """
+        (order, levelOffsets) = self._getLevels()
+        if len(order) != len(self):
+            raise Exception("Flow network contains cycles, %d patches in or downstream of cycles" % \
+                            (len(self) - len(order),) )
+        return order
+
+    def getAccumulatedArea(self):
+        """ @brief Compute the accumulated (contributing) area of each patch: its own
+            area plus the accumulated area of each of its donors weighted by the gamma
+            of the donor's receiver.
+
+            @return Array of accumulated area; NaN for patches in or downstream of cycles
+        """
+        if self._accumulatedArea is None:
+            (order, levelOffsets) = self._getLevels()
+            accum = np.full(len(self), np.nan)
+            accum[order] = self.area[order]
+            for l in xrange(len(levelOffsets) - 1):
+                nodes = order[levelOffsets[l]:levelOffsets[l+1]]
+                edges = _gatherRows(self.edgeOffsets, nodes)
+                if len(edges):
+                    sources = np.repeat(nodes, self._numEdges[nodes])
+                    np.add.at(accum, self.edgeTargets[edges], self.edgeGammas[edges] * accum[sources])
+            self._accumulatedArea = accum
+        return self._accumulatedArea
+
+    def getAccumulatedAreaMismatches(self, tolerance=ACCUM_AREA_TOLERANCE, scale=1.0):
+        """ @brief Compare the computed accumulated area of each patch with the
+            accumArea stored in the flow table
+
+            @param tolerance Relative difference above which areas are considered different
+            @param scale Factor converting computed area to the units of accumArea
+
+            @return List of AccumAreaMismatch, in node order
+        """
+        computed = self.getAccumulatedArea() * scale
+        stored = self.accumArea
+        with np.errstate(invalid='ignore'):
+            differs = ~(np.abs(computed - stored) <= tolerance * np.maximum(np.abs(stored), 1.0))
+        return [ AccumAreaMismatch(self.getKey(i), float(stored[i]), float(computed[i])) \
+                 for i in np.flatnonzero(differs) ]
+
+    def _getDownstream(self):
+        """ @brief Compute the dominant (largest gamma) receiver of each node, and
+            the outlet reached by following dominant receivers.  Only cycles of dominant
+            receivers matter here, other receivers of the patches on a path are ignored.
+        """
+        if self._dominantReceivers is None:
+            numNodes = len(self)
+            counts = self._numEdges
+            hasEdges = counts > 0
+            sources = np.repeat(np.arange(numNodes), counts)
+            maxGammas = np.zeros(numNodes)
+            if hasEdges.any():
+                maxGammas[hasEdges] = np.maximum.reduceat(self.edgeGammas, self.edgeOffsets[:-1][hasEdges])
+            # Ties go to the receiver listed first
+            candidates = np.flatnonzero(self.edgeGammas == maxGammas[sources])
+            isFirst = np.ones(len(candidates), dtype=bool)
+            isFirst[1:] = sources[candidates[1:]] != sources[candidates[:-1]]
+            firstEdges = candidates[isFirst]
+            dominant = np.full(numNodes, -1, dtype=np.int64)
+            dominant[sources[firstEdges]] = self.edgeTargets[firstEdges]
+
+            self._dominantReceivers = dominant
+            self._outlets = _getOutlets(dominant)
+        return (self._dominantReceivers, self._outlets)
+
+    def getOutlet(self, keyOrIndex):
+        """ @brief Get the outlet reached by following the dominant receivers of a patch
+
+            @param keyOrIndex rhessystypes.FQPatchID or node index
+
+            @return Node index of the outlet, -1 if the dominant receivers of the patch lead
+            into a cycle
+        """
+        return int(self._getDownstream()[1][self._getIndex(keyOrIndex)])
+
+    def getDownstreamPath(self, keyOrIndex):
+        """ @brief Trace the downstream path of a patch to its outlet, following the
+            receiver with the largest gamma at each step.  Dominant receivers and
+            outlets are computed once for the whole graph.
+
+            @param keyOrIndex rhessystypes.FQPatchID or node index
+
+            @return List of rhessystypes.FQPatchID from the patch to its outlet
+
+            @raise Exception if the path enters a cycle
+        """
+        (dominant, outlets) = self._getDownstream()
+        index = self._getIndex(keyOrIndex)
+        if outlets[index] < 0:
+            raise Exception("Downstream path of patch %s enters a cycle" % (self.getKey(index),) )
+        path = [index]
+        while dominant[index] >= 0:
+            index = dominant[index]
+            path.append(index)
+        return [self.getKey(i) for i in path]
+
+
+def buildFlowGraph(flowtable):
+    """ @brief Build the FlowGraph of a flow table
+
+        @param flowtable Dict returned by flowtableio.readFlowtable, or a
+        flowtablearray.ColumnarFlowtable
+
+        @return FlowGraph whose nodes are the entries of the flow table, in table order
+    """
+    if isinstance(flowtable, flowtablearray.ColumnarFlowtable):
+        rows = flowtable.getWriteOrder()
+        entries = flowtable.entries[rows]
+        (receiverRows, numReceivers) = flowtable.getReceiverRows(rows)
+        receivers = flowtable.receivers[receiverRows]
+        return FlowGraph(entries['patchID'], entries['zoneID'], entries['hillID'],
+                         entries['area'], entries['accumArea'],
+                         np.repeat(np.arange(len(rows)), numReceivers),
+                         (receivers['patchID'], receivers['zoneID'], receivers['hillID']),
+                         receivers['gamma'])
+
+    ids = []
+    area = []
+    accumArea = []
+    sources = []
+    receiverIDs = []
+    gammas = []
+    for (i, items) in enumerate(flowtable.itervalues()):
+        for item in items:
+            if isinstance(item, FlowTableEntryReceiver):
+                sources.append(i)
+                receiverIDs.append( (item.patchID, item.zoneID, item.hillID) )
+                gammas.append(item.gamma)
+            elif isinstance(item, FlowTableEntry):
+                ids.append( (item.patchID, item.zoneID, item.hillID) )
+                area.append(item.area)
+                accumArea.append(item.accumArea)
+    ids = np.array(ids, dtype=np.int64).reshape(-1, 3)
+    receiverIDs = np.array(receiverIDs, dtype=np.int64).reshape(-1, 3)
+    return FlowGraph(ids[:,0], ids[:,1], ids[:,2], area, accumArea,
+                     sources, (receiverIDs[:,0], receiverIDs[:,1], receiverIDs[:,2]), gammas)
@@ -0,0 +1,1008 @@
+"""@package flowtablearray
+
+@brief Columnar (NumPy) representation of RHESSys flow tables.
+        Patch entries are stored in a structured array, one row per
+        entry.  Receivers are stored in compressed sparse row (CSR)
+        layout: the receivers of entry i are
+        receivers[receiverOffsets[i]:receiverOffsets[i+1]].  Road
+        records are stored in a separate structured array indexed by
+        roadIndex (-1 for entries without a road record).
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor
+      the names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import os
+import hashlib
+import itertools
+import multiprocessing
+from collections import OrderedDict
+from collections import deque
+
+import numpy as np
+
+import rhessystypes
+import arrayfile
+from flowtableio import FLOW_ENTRY_NUM_TOKENS
+from flowtableio import FLOW_ENTRY_ITEM_NUM_TOKENS
+from flowtableio import FlowTableEntry
+from flowtableio import FlowTableEntryReceiver
+from flowtableio import FlowTableEntryRoad
+from flowtableio import FlowTableDonor
+from flowtableio import FLOW_TABLE_HEADER_FORMAT
+from flowtableio import FLOW_ENTRY_FORMAT
+from flowtableio import FLOW_ENTRY_RECEIVER_FORMAT
+from flowtableio import FLOW_ENTRY_ROAD_FORMAT
+from flowtableio import openFlowtable
+from flowtableio import writeFlowtable
+from flowtableio import getFlowtableCompression
+
+## Type definitions
+ENTRY_DTYPE = np.dtype([('patchID', np.int32), ('zoneID', np.int32), ('hillID', np.int32),
+                        ('x', np.float64), ('y', np.float64), ('z', np.float64),
+                        ('accumArea', np.float64), ('area', np.int64),
+                        ('landType', np.int32), ('totalGamma', np.float64),
+                        ('numAdjacent', np.int32)])
+RECEIVER_DTYPE = np.dtype([('patchID', np.int32), ('zoneID', np.int32), ('hillID', np.int32),
+                           ('gamma', np.float64)])
+DONOR_DTYPE = RECEIVER_DTYPE
+ROAD_DTYPE = np.dtype([('streamPatchID', np.int32), ('streamZoneID', np.int32),
+                       ('streamHillID', np.int32), ('roadWidth', np.float64)])
+
+## Constants
+SIDECAR_SUFFIX = '.cache'
+SIDECAR_FORMAT = 'rhessysweb.flowtable'
+SIDECAR_FORMAT_VERSION = 2
+SIDECAR_CURRENT = 'current'
+SIDECAR_TOUCHED = 'touched'
+SIDECAR_STALE = 'stale'
+_HASH_BLOCK_SIZE = 1024 * 1024
+_ITER_BLOCK_SIZE = 65536
+_WHITESPACE = np.array([ord(c) for c in ' \t\n\r\x0b\x0c'], dtype=np.uint8)
+_NEWLINE = ord('\n')
+_INTEGER_CHARS = np.array([ord(c) for c in '0123456789+-'], dtype=np.uint8)
+_ENTRY_INTEGER_COLUMNS = np.array([i for (i, name) in enumerate(ENTRY_DTYPE.names) \
+                                   if ENTRY_DTYPE[name].kind == 'i'], dtype=np.int64)
+_ITEM_INTEGER_COLUMNS = np.array([i for (i, name) in enumerate(RECEIVER_DTYPE.names) \
+                                  if RECEIVER_DTYPE[name].kind == 'i'], dtype=np.int64)
+_CHUNK_SIZE = 64 * 1024 * 1024
+_TOO_FEW_RECEIVERS = "Error in flow table at line %d, only %d of %d adjacent recievers read"
+
+
+def getKeyRadix(zoneIDs, hillIDs):
+    """ @brief Compute the mixed radix used to pack fully qualified patch IDs
+        into a single 64-bit integer.
+
+        @param zoneIDs Array of zone IDs
+        @param hillIDs Array of hillslope IDs
+
+        @return Tuple (zoneRadix, hillRadix)
+    """
+    zoneRadix = int(zoneIDs.max()) + 1 if len(zoneIDs) else 1
+    hillRadix = int(hillIDs.max()) + 1 if len(hillIDs) else 1
+    return (zoneRadix, hillRadix)
+
+
+def packKeys(patchIDs, zoneIDs, hillIDs, radix):
+    """ @brief Pack fully qualified patch IDs into 64-bit integer keys.
+        Keys packed with the same radix sort in (patchID, zoneID, hillID) order.
+
+        @param patchIDs Array of patch IDs
+        @param zoneIDs Array of zone IDs
+        @param hillIDs Array of hillslope IDs
+        @param radix Tuple (zoneRadix, hillRadix) as returned by getKeyRadix
+
+        @return Array of numpy.int64 keys; IDs that cannot be represented by
+        radix (e.g. a zoneID larger than any in the table) yield -1
+    """
+    zoneRadix, hillRadix = radix
+    patchIDs = np.asarray(patchIDs, dtype=np.int64)
+    zoneIDs = np.asarray(zoneIDs, dtype=np.int64)
+    hillIDs = np.asarray(hillIDs, dtype=np.int64)
+    if len(patchIDs) and int(patchIDs.max()) + 1 > (2**63 - 1) // (zoneRadix * hillRadix):
+        raise ValueError("Patch IDs too large to pack with zone radix %d and hill radix %d" % \
+                         (zoneRadix, hillRadix) )
+    keys = (patchIDs * zoneRadix + zoneIDs) * hillRadix + hillIDs
+    invalid = (zoneIDs < 0) | (zoneIDs >= zoneRadix) | (hillIDs < 0) | (hillIDs >= hillRadix) | \
+        (patchIDs < 0)
+    keys[invalid] = -1
+    return keys
+
+
+class ColumnarFlowtable(object):
+    def __init__(self, entries, receiverOffsets, receivers, roadIndex, roads,
+                 donorOffsets=None, donors=None):
+        """ @brief Build a ColumnarFlowtable from its component arrays
+
+            @param entries Structured array of dtype ENTRY_DTYPE, one row per flow table entry
+            @param receiverOffsets Integer array of length len(entries) + 1; the receivers
+            of entry i are receivers[receiverOffsets[i]:receiverOffsets[i+1]]
+            @param receivers Structured array of dtype RECEIVER_DTYPE
+            @param roadIndex Integer array of length len(entries) holding the index into
+            roads of each entry's road record, -1 if the entry has none
+            @param roads Structured array of dtype ROAD_DTYPE
+            @param donorOffsets Integer array of length len(entries) + 1; the donors
+            of entry i are donors[donorOffsets[i]:donorOffsets[i+1]].  If None, the
+            donor index is built when first needed (see buildDonorIndex).
+            @param donors Structured array of dtype DONOR_DTYPE
+        """
+        self.entries = entries
+        self.receiverOffsets = receiverOffsets
+        self.receivers = receivers
+        self.roadIndex = roadIndex
+        self.roads = roads
+        self.donorOffsets = donorOffsets
+        self.donors = donors
+
+        self._radix = None
+        self._sortedKeys = None
+        self._sortOrder = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def nbytes(self):
+        """ @brief Number of bytes used by the arrays of this flow table, including
+            its donor index once built
+        """
+        return sum(a.nbytes for a in (self.entries, self.receiverOffsets, self.receivers, self.roadIndex,
+                                      self.roads, self.donorOffsets, self.donors) if a is not None)
+
+    def setReadOnly(self):
+        """ @brief Make the arrays of this flow table read-only, e.g. before sharing it """
+        for a in (self.entries, self.receiverOffsets, self.receivers, self.roadIndex, self.roads,
+                  self.donorOffsets, self.donors):
+            if a is not None:
+                a.flags.writeable = False
+
+    @property
+    def radix(self):
+        """ @brief Radix used to pack the keys of this flow table (see packKeys) """
+        if self._radix is None:
+            self._radix = getKeyRadix(self.entries['zoneID'], self.entries['hillID'])
+        return self._radix
+
+    def packedKeys(self):
+        """ @brief Get the packed (see packKeys) key of each entry, in table order """
+        return packKeys(self.entries['patchID'], self.entries['zoneID'], self.entries['hillID'],
+                        self.radix)
+
+    def _buildKeyIndex(self):
+        keys = self.packedKeys()
+        self._sortOrder = np.argsort(keys, kind='mergesort')
+        self._sortedKeys = keys[self._sortOrder]
+
+    def getIndexesForKeys(self, fqPatchIDs):
+        """ @brief Get the row indexes of a list of flow table keys
+
+            @param fqPatchIDs List of rhessystypes.FQPatchID
+
+            @return Array of row indexes, -1 for keys not in the table.  As with
+            readFlowtable, the last entry wins if a key occurs more than once.
+        """
+        ids = np.array([(k.patchID, k.zoneID, k.hillID) for k in fqPatchIDs],
+                       dtype=np.int64).reshape(-1, 3)
+        return self.getIndexesForIDs(ids[:,0], ids[:,1], ids[:,2])
+
+    def getIndexesForIDs(self, patchIDs, zoneIDs, hillIDs):
+        """ @brief Get the row indexes of arrays of patch, zone and hillslope IDs
+
+            @return Array of row indexes, -1 for IDs not in the table
+        """
+        if self._sortedKeys is None:
+            self._buildKeyIndex()
+        keys = packKeys(patchIDs, zoneIDs, hillIDs, self.radix)
+        pos = np.searchsorted(self._sortedKeys, keys, side='right') - 1
+        found = (pos >= 0) & (keys >= 0)
+        found[found] = self._sortedKeys[pos[found]] == keys[found]
+        indexes = np.full(len(keys), -1, dtype=np.int64)
+        indexes[found] = self._sortOrder[pos[found]]
+        return indexes
+
+    def getIndexForKey(self, key):
+        """ @brief Get the row index of a flow table key
+
+            @param key rhessystypes.FQPatchID
+
+            @return Row index, -1 if the table has no such key
+        """
+        return int(self.getIndexesForKeys([key])[0])
+
+    def getKey(self, index):
+        """ @brief Get the rhessystypes.FQPatchID of the entry at a row index """
+        e = self.entries[index]
+        return rhessystypes.FQPatchID(patchID=int(e['patchID']), zoneID=int(e['zoneID']),
+                                      hillID=int(e['hillID']))
+
+    def getEntry(self, index):
+        """ @brief Get the FlowTableEntry at a row index """
+        return FlowTableEntry(*self.entries[index].tolist())
+
+    def getReceivers(self, index):
+        """ @brief Get the list of FlowTableEntryReceiver objects of the entry at a row index """
+        start = self.receiverOffsets[index]
+        end = self.receiverOffsets[index + 1]
+        return [FlowTableEntryReceiver(*r) for r in self.receivers[start:end].tolist()]
+
+    def getRoad(self, index):
+        """ @brief Get the FlowTableEntryRoad of the entry at a row index, None if the
+            entry has no road record
+        """
+        roadIdx = self.roadIndex[index]
+        if roadIdx < 0:
+            return None
+        return FlowTableEntryRoad(*self.roads[roadIdx].tolist())
+
+    def getItems(self, index):
+        """ @brief Get the items of the entry at a row index in the form used by
+            readFlowtable: the FlowTableEntry, its FlowTableEntryReceiver objects,
+            followed by possibly one FlowTableEntryRoad
+        """
+        items = [self.getEntry(index)]
+        items.extend(self.getReceivers(index))
+        road = self.getRoad(index)
+        if road is not None:
+            items.append(road)
+        return items
+
+    def keys(self):
+        """ @brief Get the list of rhessystypes.FQPatchID keys, in table order """
+        ids = zip(self.entries['patchID'].tolist(), self.entries['zoneID'].tolist(),
+                  self.entries['hillID'].tolist())
+        return list(OrderedDict.fromkeys(rhessystypes.FQPatchID(*i) for i in ids))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        return self.getIndexForKey(key) >= 0
+
+    def __getitem__(self, key):
+        index = self.getIndexForKey(key)
+        if index < 0:
+            raise KeyError(key)
+        return self.getItems(index)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def iteritems(self):
+        """ @brief Iterate over (rhessystypes.FQPatchID, items) pairs in table order,
+            where items is the list returned by getItems
+        """
+        for blockStart in xrange(0, len(self.entries), _ITER_BLOCK_SIZE):
+            blockEnd = min(blockStart + _ITER_BLOCK_SIZE, len(self.entries))
+            entries = self.entries[blockStart:blockEnd].tolist()
+            offsets = self.receiverOffsets[blockStart:blockEnd+1]
+            receivers = self.receivers[offsets[0]:offsets[-1]].tolist()
+            offsets = (offsets - offsets[0]).tolist()
+            roadIndex = self.roadIndex[blockStart:blockEnd].tolist()
+            for i, e in enumerate(entries):
+                items = [FlowTableEntry(*e)]
+                items.extend([FlowTableEntryReceiver(*r) for r in receivers[offsets[i]:offsets[i+1]]])
+                if roadIndex[i] >= 0:
+                    items.append(FlowTableEntryRoad(*self.roads[roadIndex[i]].tolist()))
+                yield (rhessystypes.FQPatchID(patchID=e[0], zoneID=e[1], hillID=e[2]), items)
+
+    def getWriteOrder(self):
+        """ @brief Get the row indexes written by writeFlowtable, in the order they
+            are written.  As with the dict returned by readFlowtable, a key that
+            occurs more than once is written at the position of its first occurrence
+            with the items of its last occurrence.
+
+            @return Array of row indexes
+        """
+        keys = self.packedKeys()
+        (uniqueKeys, firstIndex) = np.unique(keys, return_index=True)
+        if len(uniqueKeys) == len(keys):
+            return np.arange(len(keys), dtype=np.int64)
+        lastIndex = len(keys) - 1 - np.unique(keys[::-1], return_index=True)[1]
+        return lastIndex[np.argsort(firstIndex, kind='mergesort')]
+
+    def getReceiverRows(self, rows):
+        """ @return Tuple (receiverRows, numReceivers): the rows of the receivers of
+            the entries at rows, in order, and the number of receivers of each entry
+        """
+        starts = self.receiverOffsets[rows]
+        numReceivers = self.receiverOffsets[rows + 1] - starts
+        # Row of each receiver: its entry's first receiver plus its position within the entry
+        blockOffsets = np.cumsum(numReceivers) - numReceivers
+        receiverRows = np.repeat(starts - blockOffsets, numReceivers) + \
+            np.arange(int(numReceivers.sum()))
+        return (receiverRows, numReceivers)
+
+    def buildDonorIndex(self):
+        """ @brief Build the upstream (donor) index of this flow table, the reverse
+            of its receivers.  The donors of each entry are the entries (as written
+            by writeFlowtable) that list it as a receiver, in table order, each with
+            the gamma of that receiver.  Receivers that are not entries of the table
+            are not indexed.
+        """
+        rows = self.getWriteOrder()
+        (receiverRows, numReceivers) = self.getReceiverRows(rows)
+        receivers = self.receivers[receiverRows]
+        donorRows = np.repeat(rows, numReceivers)
+        targets = self.getIndexesForIDs(receivers['patchID'], receivers['zoneID'],
+                                         receivers['hillID'])
+        found = targets >= 0
+        targets = targets[found]
+        order = np.argsort(targets, kind='mergesort')
+
+        donorEntries = self.entries[donorRows[found][order]]
+        donors = np.empty(len(order), dtype=DONOR_DTYPE)
+        for name in ('patchID', 'zoneID', 'hillID'):
+            donors[name] = donorEntries[name]
+        donors['gamma'] = receivers['gamma'][found][order]
+        donorOffsets = np.zeros(len(self.entries) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(targets, minlength=len(self.entries)), out=donorOffsets[1:])
+
+        self.donorOffsets = donorOffsets
+        self.donors = donors
+
+    def getDonors(self, index):
+        """ @brief Get the list of FlowTableDonor objects of the entry at a row index """
+        if self.donorOffsets is None:
+            self.buildDonorIndex()
+        start = self.donorOffsets[index]
+        end = self.donorOffsets[index + 1]
+        return [FlowTableDonor(*d) for d in self.donors[start:end].tolist()]
+
+    def getDonorsForKey(self, key):
+        """ @brief Get the list of FlowTableDonor objects of a flow table key, empty
+            if the key is not in the table
+        """
+        index = self.getIndexForKey(key)
+        if index < 0:
+            return []
+        return self.getDonors(index)
+
+    def getDonorArrays(self):
+        """ @brief Get the dict of donor index arrays, as accepted by the constructor """
+        if self.donorOffsets is None:
+            self.buildDonorIndex()
+        return dict(donorOffsets=self.donorOffsets, donors=self.donors)
+
+    def iterFormattedBlocks(self):
+        """ @brief Format this flow table as it is written by writeFlowtable.  Entries
+            are formatted a block at a time, each with a single string format
+            operation covering the entry, its receivers and its road record.
+
+            @return Iterator over strings which, concatenated, form the flow table,
+            starting with the header
+        """
+        order = self.getWriteOrder()
+        yield FLOW_TABLE_HEADER_FORMAT % (len(order),)
+        formats = {}
+        for blockStart in xrange(0, len(order), _ITER_BLOCK_SIZE):
+            rows = order[blockStart:blockStart + _ITER_BLOCK_SIZE]
+            (receiverRows, numReceivers) = self.getReceiverRows(rows)
+            counts = numReceivers.tolist()
+            receivers = self.receivers[receiverRows]
+            receiverValues = np.column_stack([receivers[name].astype(object) for name in \
+                                              RECEIVER_DTYPE.names]).ravel().tolist()
+            entries = self.entries[rows].tolist()
+            roadIndex = self.roadIndex[rows].tolist()
+            lines = []
+            r = 0
+            for (i, entry) in enumerate(entries):
+                numValues = counts[i] * 4
+                hasRoad = roadIndex[i] >= 0
+                fmt = formats.get((counts[i], hasRoad))
+                if fmt is None:
+                    fmt = FLOW_ENTRY_FORMAT + FLOW_ENTRY_RECEIVER_FORMAT * counts[i] + \
+                        (FLOW_ENTRY_ROAD_FORMAT if hasRoad else '')
+                    formats[(counts[i], hasRoad)] = fmt
+                values = entry + tuple(receiverValues[r:r+numValues])
+                if hasRoad:
+                    values += self.roads[roadIndex[i]].tolist()
+                lines.append(fmt % values)
+                r += numValues
+            yield ''.join(lines)
+
+    def toArrays(self):
+        """ @brief Get the dict of arrays that make up this flow table, as accepted
+            by the constructor
+        """
+        return dict(entries=self.entries, receiverOffsets=self.receiverOffsets,
+                    receivers=self.receivers, roadIndex=self.roadIndex, roads=self.roads)
+
+    def toFlowtableDict(self):
+        """ @brief Convert to the collections.OrderedDict representation returned
+            by readFlowtable
+        """
+        flowDict = OrderedDict()
+        for (key, items) in self.iteritems():
+            flowDict[key] = items
+        return flowDict
+
+
+class _ChunkError(Exception):
+    """ @brief Error in the structure of a chunk of a flow table.  Line numbers
+        are indexes of lines within the chunk; see _raiseForChunkError.
+    """
+    def __init__(self, message, lineIndexes, values):
+        """ @param message Message format; line numbers precede other values
+            @param lineIndexes Tuple of line indexes within the chunk
+            @param values Tuple of remaining values for message
+        """
+        super(_ChunkError, self).__init__(message, lineIndexes, values)
+
+def _raiseForChunkError(error, firstLineNumber):
+    """ @brief Raise the Exception for the args of a _ChunkError
+
+        @param error Tuple of args of the _ChunkError
+        @param firstLineNumber Line number, in the flow table file, of the first
+        line of the chunk
+    """
+    (message, lineIndexes, values) = error
+    lineNumbers = tuple(l + firstLineNumber for l in lineIndexes)
+    raise Exception(message % (lineNumbers + tuple(values)))
+
+def _emptyFlowtableArrays():
+    return dict(entries=np.empty(0, dtype=ENTRY_DTYPE),
+                receiverOffsets=np.zeros(1, dtype=np.int64),
+                receivers=np.empty(0, dtype=RECEIVER_DTYPE),
+                roadIndex=np.empty(0, dtype=np.int64),
+                roads=np.empty(0, dtype=ROAD_DTYPE))
+
+
+def _parseFlowtableLines(content):
+    """ @brief Parse flow table lines into column arrays.  Lines are classified
+        by their number of tokens exactly as readFlowtable does; all tokens are
+        converted to numbers in a single pass.
+
+        @param content String containing whole lines of the flow table, excluding the header
+
+        @return Tuple (arrays, lastEntryShort) where arrays is a dict of the arrays
+        needed to build a ColumnarFlowtable, and lastEntryShort is None unless the
+        last entry has fewer receivers than numAdjacent, in which case it is the tuple
+        (index of the line of the entry, number of receivers read, numAdjacent)
+
+        @raise _ChunkError if the structure of the flow table is invalid
+    """
+    buf = np.frombuffer(content, dtype=np.uint8)
+    if len(buf) == 0:
+        return (_emptyFlowtableArrays(), None)
+
+    # Locate the start of each token and the line it is on
+    isSpace = np.in1d(buf, _WHITESPACE)
+    isTokenStart = ~isSpace
+    isTokenStart[1:] &= isSpace[:-1]
+    nonIntegerBytes = np.flatnonzero(~(isSpace | np.in1d(buf, _INTEGER_CHARS)))
+    del isSpace
+    tokenStarts = np.flatnonzero(isTokenStart)
+    del isTokenStart
+    newlines = np.flatnonzero(buf == _NEWLINE)
+    tokenLines = np.searchsorted(newlines, tokenStarts)
+    numLines = len(newlines) + 1
+    tokensPerLine = np.bincount(tokenLines, minlength=numLines)
+    lineFirstToken = np.zeros(numLines, dtype=np.int64)
+    np.cumsum(tokensPerLine[:-1], out=lineFirstToken[1:])
+
+    values = np.fromstring(content, dtype=np.float64, sep=' ')
+    if len(values) != len(tokenStarts):
+        badLine = tokenLines[len(values)] if len(values) < len(tokenLines) else numLines - 1
+        raise _ChunkError("Error in flow table at line %d, unable to parse value", \
+                          (badLine,), () )
+
+    entryLines = np.flatnonzero(tokensPerLine == FLOW_ENTRY_NUM_TOKENS)
+    itemLines = np.flatnonzero(tokensPerLine == FLOW_ENTRY_ITEM_NUM_TOKENS)
+    numEntries = len(entryLines)
+
+    # Items before the first entry are ignored, as they are by readFlowtable
+    itemGroups = np.searchsorted(entryLines, itemLines, side='right') - 1
+    itemLines = itemLines[itemGroups >= 0]
+    itemGroups = itemGroups[itemGroups >= 0]
+
+    # Integer columns are parsed with int() by readFlowtable, which rejects values
+    # such as 12.0 or 1e3 that would otherwise be truncated here
+    nonIntegerTokens = np.unique(np.searchsorted(tokenStarts, nonIntegerBytes, side='right') - 1)
+    integerTokens = np.concatenate(( (lineFirstToken[entryLines][:,None] + _ENTRY_INTEGER_COLUMNS).ravel(),
+                                     (lineFirstToken[itemLines][:,None] + _ITEM_INTEGER_COLUMNS).ravel() ))
+    badTokens = integerTokens[np.in1d(integerTokens, nonIntegerTokens)]
+    if len(badTokens):
+        raise _ChunkError("Error in flow table at line %d, unable to parse value", \
+                          (tokenLines[badTokens.min()],), () )
+
+    entryValues = values[lineFirstToken[entryLines][:,None] + np.arange(FLOW_ENTRY_NUM_TOKENS)]
+    entries = np.empty(numEntries, dtype=ENTRY_DTYPE)
+    for i, name in enumerate(ENTRY_DTYPE.names):
+        entries[name] = entryValues[:,i]
+    del entryValues
+    numAdj = entries['numAdjacent'].astype(np.int64)
+
+    itemsPerEntry = np.bincount(itemGroups, minlength=numEntries)
+    firstItemOfEntry = np.zeros(numEntries, dtype=np.int64)
+    np.cumsum(itemsPerEntry[:-1], out=firstItemOfEntry[1:])
+    itemRank = np.arange(len(itemLines)) - firstItemOfEntry[itemGroups]
+    isReceiver = itemRank < numAdj[itemGroups]
+
+    # Check for errors in flow table structure
+    receiversPerEntry = np.minimum(itemsPerEntry, numAdj)
+    short = np.flatnonzero(itemsPerEntry < numAdj)
+    if len(short) and short[0] < numEntries - 1:
+        i = short[0]
+        raise _ChunkError(_TOO_FEW_RECEIVERS, (entryLines[i + 1],), (itemsPerEntry[i], numAdj[i]) )
+    lastEntryShort = None
+    if len(short):
+        i = short[0]
+        lastEntryShort = (entryLines[i], itemsPerEntry[i], numAdj[i])
+    multipleRoads = np.flatnonzero(itemsPerEntry - receiversPerEntry > 1)
+    if len(multipleRoads):
+        i = multipleRoads[0]
+        secondRoad = itemLines[firstItemOfEntry[i] + receiversPerEntry[i] + 1]
+        raise _ChunkError("Error in flow table at line %d, already read road record for entry at line %d", \
+                          (secondRoad, entryLines[i]), () )
+
+    itemValues = values[lineFirstToken[itemLines][:,None] + np.arange(FLOW_ENTRY_ITEM_NUM_TOKENS)]
+    receiverValues = itemValues[isReceiver]
+    receivers = np.empty(len(receiverValues), dtype=RECEIVER_DTYPE)
+    for i, name in enumerate(RECEIVER_DTYPE.names):
+        receivers[name] = receiverValues[:,i]
+    roadValues = itemValues[~isReceiver]
+    roads = np.empty(len(roadValues), dtype=ROAD_DTYPE)
+    for i, name in enumerate(ROAD_DTYPE.names):
+        roads[name] = roadValues[:,i]
+
+    receiverOffsets = np.zeros(numEntries + 1, dtype=np.int64)
+    np.cumsum(receiversPerEntry, out=receiverOffsets[1:])
+    roadIndex = np.full(numEntries, -1, dtype=np.int64)
+    roadIndex[itemGroups[~isReceiver]] = np.arange(len(roads))
+
+    arrays = dict(entries=entries, receiverOffsets=receiverOffsets, receivers=receivers,
+                  roadIndex=roadIndex, roads=roads)
+    return (arrays, lastEntryShort)
+
+
+def _findChunkBoundaries(flowtable, numChunks):
+    """ @brief Split a flow table into chunks that each start with an entry line
+
+        @param flowtable String representing the path of the flow table
+        @param numChunks Desired number of chunks
+
+        @return List of byte offsets such that chunk i spans
+        [boundaries[i], boundaries[i+1]); the first chunk starts after the header line
+    """
+    flow = open(flowtable, 'rb')
+    try:
+        flow.readline()
+        dataStart = flow.tell()
+        end = os.fstat(flow.fileno()).st_size
+        boundaries = [dataStart]
+        for i in xrange(1, numChunks):
+            pos = dataStart + (end - dataStart) * i // numChunks
+            if pos <= boundaries[-1]:
+                continue
+            # Skip the (possibly partial) line we landed in, then find the next entry
+            flow.seek(pos - 1)
+            flow.readline()
+            lineStart = flow.tell()
+            line = flow.readline()
+            while line and len(line.split()) != FLOW_ENTRY_NUM_TOKENS:
+                lineStart = flow.tell()
+                line = flow.readline()
+            if not line:
+                break
+            if lineStart > boundaries[-1]:
+                boundaries.append(lineStart)
+        boundaries.append(end)
+    finally:
+        flow.close()
+    return boundaries
+
+
+def _splitAtLastEntry(block):
+    """ @brief Find the start of the last entry line of a block of whole flow table lines
+
+        @return Offset of the start of the last entry line, 0 if no line but the
+        first is an entry line
+    """
+    end = len(block)
+    while end > 0:
+        start = block.rfind('\n', 0, end - 1) + 1
+        if start == 0:
+            break
+        if len(block[start:end].split()) == FLOW_ENTRY_NUM_TOKENS:
+            return start
+        end = start
+    return 0
+
+def _iterFlowtableStreamChunks(flow, chunkSize=_CHUNK_SIZE):
+    """ @brief Split a flow table read from a stream, e.g. while it is decompressed,
+        into chunks that each start with an entry line
+
+        @param flow File object positioned at the start of the flow table
+        @param chunkSize Number of bytes to read at a time
+
+        @return Iterator over strings of whole lines; the first chunk starts after
+        the header line
+    """
+    flow.readline()
+    pending = ''
+    while True:
+        block = flow.read(chunkSize)
+        if not block:
+            break
+        block = pending + block + flow.readline()
+        split = _splitAtLastEntry(block)
+        if split == 0:
+            pending = block
+            continue
+        pending = block[split:]
+        yield block[:split]
+    if pending:
+        yield pending
+
+
+def _parseFlowtableContent(content):
+    """ @brief Parse one chunk of a flow table
+
+        @param content String containing the whole lines of the chunk
+
+        @return Tuple (arrays, lastEntryShort, numNewlines, error) where error is
+        None, or the args of the _ChunkError raised while parsing the chunk
+    """
+    try:
+        (arrays, lastEntryShort) = _parseFlowtableLines(content)
+    except _ChunkError as e:
+        return (None, None, content.count('\n'), e.args)
+    return (arrays, lastEntryShort, content.count('\n'), None)
+
+def _parseFlowtableChunk(args):
+    """ @brief Read and parse one chunk of a flow table
+
+        @param args Tuple (flowtable path, start offset, end offset)
+
+        @return Tuple as returned by _parseFlowtableContent
+    """
+    (flowtable, start, end) = args
+    flow = open(flowtable, 'rb')
+    try:
+        flow.seek(start)
+        content = flow.read(end - start)
+    finally:
+        flow.close()
+    return _parseFlowtableContent(content)
+
+
+def _collectFlowtableChunks(results):
+    """ @brief Check the parsed chunks of a flow table, in order
+
+        @param results Iterable of tuples returned by _parseFlowtableContent
+
+        @return List of the arrays of the chunks
+    """
+    chunks = []
+    firstLineNumber = 2
+    short = None
+    for (arrays, lastEntryShort, numNewlines, error) in results:
+        if short:
+            # Report the error at the next entry, as readFlowtable does
+            raise Exception(_TOO_FEW_RECEIVERS % (firstLineNumber, short[1], short[2]))
+        if error:
+            _raiseForChunkError(error, firstLineNumber)
+        if lastEntryShort:
+            (lineIndex, numRead, numAdj) = lastEntryShort
+            short = (firstLineNumber + lineIndex, numRead, numAdj)
+        chunks.append(arrays)
+        firstLineNumber += numNewlines
+    if short:
+        raise Exception(_TOO_FEW_RECEIVERS % short)
+    return chunks
+
+
+def _concatenateFlowtableArrays(chunks):
+    """ @brief Concatenate the arrays of consecutive flow table chunks """
+    if len(chunks) == 1:
+        return chunks[0]
+    entries = np.concatenate([c['entries'] for c in chunks])
+    receivers = np.concatenate([c['receivers'] for c in chunks])
+    roads = np.concatenate([c['roads'] for c in chunks])
+
+    receiverOffsets = [np.zeros(1, dtype=np.int64)]
+    roadIndex = []
+    receiverBase = 0
+    roadBase = 0
+    for c in chunks:
+        receiverOffsets.append(c['receiverOffsets'][1:] + receiverBase)
+        ri = c['roadIndex'].copy()
+        ri[ri >= 0] += roadBase
+        roadIndex.append(ri)
+        receiverBase += len(c['receivers'])
+        roadBase += len(c['roads'])
+    return dict(entries=entries, receiverOffsets=np.concatenate(receiverOffsets),
+                receivers=receivers, roadIndex=np.concatenate(roadIndex), roads=roads)
+
+
+def flowtableDictToColumnar(flowtableDict):
+    """ @brief Convert the collections.OrderedDict representation returned by
+        readFlowtable to a ColumnarFlowtable
+
+        @param flowtableDict Flow table as returned by readFlowtable
+
+        @return ColumnarFlowtable holding the same entries, receivers and road records
+    """
+    entries = []
+    receivers = []
+    roads = []
+    numReceivers = []
+    roadIndex = []
+    for items in flowtableDict.itervalues():
+        numEntryReceivers = 0
+        entryRoad = -1
+        for item in items:
+            if isinstance(item, FlowTableEntryReceiver):
+                receivers.append( (item.patchID, item.zoneID, item.hillID, item.gamma) )
+                numEntryReceivers += 1
+            elif isinstance(item, FlowTableEntry):
+                entries.append(tuple(item))
+            elif isinstance(item, FlowTableEntryRoad):
+                entryRoad = len(roads)
+                roads.append(tuple(item))
+        numReceivers.append(numEntryReceivers)
+        roadIndex.append(entryRoad)
+    receiverOffsets = np.zeros(len(entries) + 1, dtype=np.int64)
+    np.cumsum(numReceivers, out=receiverOffsets[1:])
+    return ColumnarFlowtable(entries=np.array(entries, dtype=ENTRY_DTYPE),
+                             receiverOffsets=receiverOffsets,
+                             receivers=np.array(receivers, dtype=RECEIVER_DTYPE),
+                             roadIndex=np.array(roadIndex, dtype=np.int64),
+                             roads=np.array(roads, dtype=ROAD_DTYPE))
+
+
+def _imapBounded(pool, function, tasks, maxPending):
+    """ @brief Like pool.imap, but consume tasks only as results are taken, so that
+        at most maxPending chunks of a streamed flow table are in memory at once
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(function, (task,)))
+        if len(pending) >= maxPending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def readFlowtableColumnar(flowtable, numWorkers=1):
+    """ @brief Read a RHESSys flow table into a ColumnarFlowtable.  The columnar
+        table holds the same information as the dict returned by readFlowtable
+        in a fraction of the memory, and writes back identically with
+        writeFlowtable.
+
+        The flow table is split into chunks at entry lines.  With numWorkers > 1,
+        chunks are parsed in a pool of worker processes; the result is identical
+        to that of the serial reader.  Compressed flow tables and file objects are
+        read as a stream, and split into chunks as they are decompressed.
+
+        @param flowtable String representing the absolute path of the file
+        containing the RHESSys flowtable, possibly compressed (see
+        flowtableio.openFlowtable), or a file object open for reading
+        @param numWorkers Number of processes to parse the flow table with
+
+        @return ColumnarFlowtable representing the flow table
+    """
+    flow = None
+    if isinstance(flowtable, basestring) and getFlowtableCompression(flowtable) is None:
+        size = os.path.getsize(flowtable)
+        numChunks = max(numWorkers, (size + _CHUNK_SIZE - 1) // _CHUNK_SIZE, 1)
+        boundaries = _findChunkBoundaries(flowtable, numChunks)
+        tasks = [ (flowtable, boundaries[i], boundaries[i+1]) for i in xrange(len(boundaries) - 1) ]
+        parse = _parseFlowtableChunk
+        numProcesses = min(numWorkers, len(tasks))
+    else:
+        if isinstance(flowtable, basestring):
+            flow = openFlowtable(flowtable, 'r')
+            tasks = _iterFlowtableStreamChunks(flow)
+        else:
+            tasks = _iterFlowtableStreamChunks(flowtable)
+        parse = _parseFlowtableContent
+        numProcesses = numWorkers
+
+    try:
+        if numProcesses > 1:
+            pool = multiprocessing.Pool(processes=numProcesses)
+            try:
+                chunks = _collectFlowtableChunks(_imapBounded(pool, parse, tasks, 2 * numProcesses))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            chunks = _collectFlowtableChunks(itertools.imap(parse, tasks))
+    finally:
+        if flow is not None:
+            flow.close()
+
+    if not chunks:
+        return ColumnarFlowtable(**_emptyFlowtableArrays())
+    return ColumnarFlowtable(**_concatenateFlowtableArrays(chunks))
+
+
+def writeFlowtableColumnar(table, flowtableOutfile):
+    """ @brief Write a ColumnarFlowtable as a RHESSys flow table.  The blocks returned
+        by its iterFormattedBlocks method are written by flowtableio.writeFlowtable, so
+        the output is identical to that of writeFlowtable for the same flow table.
+
+        @param table ColumnarFlowtable
+        @param flowtableOutfile String representing the absolute path of the flow table to be written,
+        compressed according to its suffix (see flowtableio.openFlowtable), or a file object
+        open for writing
+    """
+    writeFlowtable(table, flowtableOutfile)
+
+
+def getSidecarPath(flowtable):
+    """ @brief Get the path of the binary sidecar cache of a flow table
+
+        @param flowtable String representing the path of the flow table
+
+        @return String representing the path of the sidecar
+    """
+    return flowtable + SIDECAR_SUFFIX
+
+
+def _hashFile(path):
+    h = hashlib.sha1()
+    f = open(path, 'rb')
+    try:
+        block = f.read(_HASH_BLOCK_SIZE)
+        while block:
+            h.update(block)
+            block = f.read(_HASH_BLOCK_SIZE)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+
+def getSourceIdentity(flowtable, withHash=True):
+    """ @brief Get the identity of a flow table file used to key its sidecar cache
+
+        @param flowtable String representing the path of the flow table
+        @param withHash True if the SHA-1 of the flow table should be computed
+
+        @return Dict with keys size, mtime and (if withHash) sha1
+    """
+    st = os.stat(flowtable)
+    identity = {'size': st.st_size, 'mtime': st.st_mtime}
+    if withHash:
+        identity['sha1'] = _hashFile(flowtable)
+    return identity
+
+
+def writeFlowtableSidecar(table, flowtable, sidecar=None, source=None):
+    """ @brief Write the binary sidecar cache of a flow table, including its
+        donor index
+
+        @param table ColumnarFlowtable read from flowtable
+        @param flowtable String representing the path of the flow table
+        @param sidecar String representing the path of the sidecar to write;
+        if None, getSidecarPath(flowtable) is used
+        @param source Identity of flowtable, as returned by getSourceIdentity, at the
+        time table was read; if None, the current identity of flowtable is used
+    """
+    if sidecar is None:
+        sidecar = getSidecarPath(flowtable)
+    if source is None:
+        source = getSourceIdentity(flowtable)
+    metadata = {'format': SIDECAR_FORMAT, 'formatVersion': SIDECAR_FORMAT_VERSION,
+                'source': source}
+    arrays = table.toArrays()
+    arrays.update(table.getDonorArrays())
+    arrayfile.writeArrays(sidecar, arrays, metadata)
+
+
+def readFlowtableSidecar(sidecar):
+    """ @brief Memory map the binary sidecar cache of a flow table.  The arrays of
+        the returned table are read-only views of the sidecar file.
+
+        @param sidecar String representing the path of the sidecar
+
+        @return ColumnarFlowtable
+    """
+    (arrays, metadata) = arrayfile.readArrays(sidecar)
+    if metadata.get('format') != SIDECAR_FORMAT:
+        raise IOError("%s is not a flow table sidecar" % (sidecar,) )
+    return ColumnarFlowtable(**arrays)
+
+
+def _getSidecarState(flowtable, sidecar):
+    """ @return SIDECAR_CURRENT if the size and modification time of the flow table
+        match its sidecar, SIDECAR_TOUCHED if only the modification time differs but
+        the contents are unchanged, otherwise SIDECAR_STALE
+    """
+    try:
+        metadata = arrayfile.readArrayMetadata(sidecar)
+    except (IOError, OSError, ValueError):
+        return SIDECAR_STALE
+    if metadata.get('format') != SIDECAR_FORMAT or \
+            metadata.get('formatVersion') != SIDECAR_FORMAT_VERSION:
+        return SIDECAR_STALE
+
+    source = metadata['source']
+    current = getSourceIdentity(flowtable, withHash=False)
+    if current['size'] != source['size']:
+        return SIDECAR_STALE
+    if current['mtime'] == source['mtime']:
+        return SIDECAR_CURRENT
+    if _hashFile(flowtable) == source['sha1']:
+        return SIDECAR_TOUCHED
+    return SIDECAR_STALE
+
+
+def isSidecarCurrent(flowtable, sidecar=None):
+    """ @brief Determine whether the sidecar cache of a flow table matches the
+        flow table.  The sidecar matches if the size and modification time of the
+        flow table are unchanged; if only the modification time changed, the
+        SHA-1 of the flow table is compared.
+
+        @param flowtable String representing the path of the flow table
+        @param sidecar String representing the path of the sidecar;
+        if None, getSidecarPath(flowtable) is used
+
+        @return True if the sidecar exists and matches the flow table
+    """
+    if sidecar is None:
+        sidecar = getSidecarPath(flowtable)
+    return _getSidecarState(flowtable, sidecar) != SIDECAR_STALE
+
+
+def loadFlowtable(flowtable, useSidecar=True):
+    """ @brief Load a flow table as a ColumnarFlowtable, using its binary sidecar
+        cache when it is current.  If the sidecar is missing or stale, the flow
+        table is parsed and the sidecar (re)written; failure to write the sidecar,
+        e.g. because the directory is read-only, is not an error.
+
+        @param flowtable String representing the path of the flow table
+        @param useSidecar False to always parse the flow table
+
+        @return ColumnarFlowtable
+    """
+    if not useSidecar:
+        return readFlowtableColumnar(flowtable)
+
+    sidecar = getSidecarPath(flowtable)
+    state = _getSidecarState(flowtable, sidecar)
+    table = None
+    if state != SIDECAR_STALE:
+        try:
+            table = readFlowtableSidecar(sidecar)
+        except (IOError, OSError, ValueError):
+            state = SIDECAR_STALE
+    if state == SIDECAR_CURRENT:
+        return table
+
+    if state == SIDECAR_STALE:
+        source = getSourceIdentity(flowtable)
+        table = readFlowtableColumnar(flowtable)
+    else:
+        # Contents unchanged, record the new modification time
+        source = None
+    try:
+        writeFlowtableSidecar(table, flowtable, sidecar, source)
+    except (IOError, OSError):
+        pass
+    return table
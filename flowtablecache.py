@@ -0,0 +1,477 @@
+"""@package flowtablecache
+
+@brief Redis cache of RHESSys flow tables shared by the web application
+        processes.  Patches are stored under fixed-width binary keys
+        (see packKey) and their flow table items under the compact binary
+        encoding of flowtableio.encodeCacheValue.  Flow tables are loaded with
+        pipelined, batched commands.
+
+        Redis keys used for a flow table named name:
+        name            List of the packed keys of the patches, in table order
+        name.hash       Hash mapping packed key to encoded flow table items
+        name.donors     Hash mapping packed key to encoded donors, for patches
+                        that have donors
+        name.format     CACHE_FORMAT of the cached flow table, set once the
+                        flow table is completely loaded
+        name.load       Identifier of the load of the cached flow table, new
+                        for every load (see getCacheLoadID)
+        name.lock       Lock held by the process loading the flow table
+        name.progress   Hash describing the progress of the load in progress
+
+        Loading is single-flight (see ensureFlowtableCached): one process
+        takes the lock and loads the flow table while other processes wait
+        for the format marker.  The loader refreshes the expiry of the lock
+        after every batch, so the lock of a crashed loader expires and
+        another process takes over.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor
+      the names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import os
+import time
+import uuid
+import socket
+import struct
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+import rhessystypes
+from flowtableio import FlowTableEntry
+from flowtableio import FlowTableEntryReceiver
+from flowtableio import FlowTableEntryRoad
+from flowtableio import FlowTableRecord
+from flowtableio import buildDonorIndex
+from flowtableio import CACHE_ENTRY_STRUCT
+from flowtableio import CACHE_RECORD_SIZE
+from flowtableio import packCacheValueHeader
+from flowtableio import RECORD_LIST_HEADER
+from flowtableio import packRecordList
+from flowtableio import unpackRecordList
+from flowtableio import dumpDonors
+from flowtableio import loadDonors
+from flowtableio import encodeCacheValue
+from flowtableio import encodeCacheRecord
+from flowtableio import decodeCacheRecord
+from flowtableio import decodeCacheValue
+import flowtablearray
+
+## Constants
+CACHE_FORMAT = 'rhessysweb.flowtable.cache.1'
+DEFAULT_BATCH_SIZE = 10000
+LOCK_TIMEOUT = 60
+WAIT_TIMEOUT = 3600
+POLL_INTERVAL = 0.5
+
+KEY_STRUCT = struct.Struct('>iii')
+
+_ENTRY_WIRE_DTYPE = flowtablearray.ENTRY_DTYPE.newbyteorder('<')
+_RECORD_WIRE_DTYPE = flowtablearray.RECEIVER_DTYPE.newbyteorder('<')
+_ROAD_WIRE_DTYPE = flowtablearray.ROAD_DTYPE.newbyteorder('<')
+
+# Delete or extend the lock only if it is still held by the caller
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+_EXTEND_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+## Type definitions
+CacheLoadStats = namedtuple('CacheLoadStats', ['numPatches', 'seconds', 'memoryBefore', 'memoryAfter'],
+                            verbose=False)
+LoadProgress = namedtuple('LoadProgress', ['owner', 'started', 'numLoaded', 'numPatches'], verbose=False)
+
+def getCacheKeys(name):
+    """ @brief Get the Redis keys holding a cached flow table
+
+        @param name Name of the flow table
+
+        @return Tuple (list, hash, donors, format, load) of Redis key names
+    """
+    return (name, name + '.hash', name + '.donors', name + '.format', name + '.load')
+
+def _getLockKeys(name):
+    return (name + '.lock', name + '.progress')
+
+def packKey(key):
+    """ @brief Pack a rhessystypes.FQPatchID into a 12 byte Redis key """
+    return KEY_STRUCT.pack(key.patchID, key.zoneID, key.hillID)
+
+def unpackKey(data):
+    """ @brief Unpack a Redis key packed by packKey into a rhessystypes.FQPatchID """
+    return rhessystypes.FQPatchID(*KEY_STRUCT.unpack(data))
+
+
+def encodeReceivers(receivers):
+    """ @brief Encode a list of FlowTableEntryReceiver objects for the cache """
+    return packRecordList(receivers)
+
+def decodeReceivers(data):
+    """ @brief Decode a list of FlowTableEntryReceiver objects encoded by encodeReceivers """
+    return unpackRecordList(data, FlowTableEntryReceiver)
+
+
+def _iterColumnarBatches(table, batchSize, rows=None):
+    """ @brief Encode the keys and values of a ColumnarFlowtable a batch of entries
+        at a time, directly from its arrays
+
+        @param rows Array of row indexes returned by table.getWriteOrder, None to get it
+
+        @return Iterator over (keys, values, donorKeys, donorValues) lists
+    """
+    if rows is None:
+        rows = table.getWriteOrder()
+    donorArrays = table.getDonorArrays()
+    for batchStart in xrange(0, len(rows), batchSize):
+        batchRows = rows[batchStart:batchStart + batchSize]
+        entries = table.entries[batchRows]
+        keyBytes = np.empty(len(batchRows), dtype=[('patchID', '>i4'), ('zoneID', '>i4'),
+                                                   ('hillID', '>i4')])
+        for name in ('patchID', 'zoneID', 'hillID'):
+            keyBytes[name] = entries[name]
+        keyBytes = keyBytes.tostring()
+        entryBytes = entries.astype(_ENTRY_WIRE_DTYPE).tostring()
+        (receiverRows, numReceivers) = table.getReceiverRows(batchRows)
+        receiverBytes = table.receivers[receiverRows].astype(_RECORD_WIRE_DTYPE).tostring()
+        roadIndex = table.roadIndex[batchRows]
+        roadBytes = table.roads[roadIndex[roadIndex >= 0]].astype(_ROAD_WIRE_DTYPE).tostring()
+        donorOffsets = donorArrays['donorOffsets']
+        numDonors = (donorOffsets[batchRows + 1] - donorOffsets[batchRows]).tolist()
+        donorStarts = donorOffsets[batchRows].tolist()
+        donorBytes = donorArrays['donors']
+
+        keys = []
+        values = []
+        donorKeys = []
+        donorValues = []
+        receiverOffset = 0
+        roadOffset = 0
+        numReceivers = numReceivers.tolist()
+        hasRoad = (roadIndex >= 0).tolist()
+        for i in xrange(len(batchRows)):
+            key = keyBytes[i*KEY_STRUCT.size:(i+1)*KEY_STRUCT.size]
+            receiverEnd = receiverOffset + numReceivers[i] * CACHE_RECORD_SIZE
+            parts = [packCacheValueHeader(numReceivers[i], hasRoad[i]),
+                     entryBytes[i*CACHE_ENTRY_STRUCT.size:(i+1)*CACHE_ENTRY_STRUCT.size],
+                     receiverBytes[receiverOffset:receiverEnd]]
+            receiverOffset = receiverEnd
+            if hasRoad[i]:
+                parts.append(roadBytes[roadOffset:roadOffset + CACHE_RECORD_SIZE])
+                roadOffset += CACHE_RECORD_SIZE
+            keys.append(key)
+            values.append(''.join(parts))
+            if numDonors[i]:
+                donors = donorBytes[donorStarts[i]:donorStarts[i] + numDonors[i]]
+                donorKeys.append(key)
+                donorValues.append(RECORD_LIST_HEADER.pack(numDonors[i]) + \
+                                   donors.astype(_RECORD_WIRE_DTYPE).tostring())
+        yield (keys, values, donorKeys, donorValues)
+
+def _iterDictBatches(flowtableDict, batchSize):
+    """ @brief Encode the keys and values of a flow table dict a batch of entries at a time
+
+        @return Iterator over (keys, values, donorKeys, donorValues) lists
+    """
+    donorIndex = buildDonorIndex(flowtableDict)
+    keys = []
+    values = []
+    donorKeys = []
+    donorValues = []
+    for (fqPatchID, items) in flowtableDict.iteritems():
+        key = packKey(fqPatchID)
+        keys.append(key)
+        values.append(encodeCacheValue(items))
+        donors = donorIndex.get(fqPatchID)
+        if donors:
+            donorKeys.append(key)
+            donorValues.append(dumpDonors(donors))
+        if len(keys) >= batchSize:
+            yield (keys, values, donorKeys, donorValues)
+            keys = []
+            values = []
+            donorKeys = []
+            donorValues = []
+    if keys:
+        yield (keys, values, donorKeys, donorValues)
+
+
+def getRedisMemory(redisClient):
+    """ @brief Get the number of bytes of memory used by a Redis server """
+    return int(redisClient.info()['used_memory'])
+
+def isFlowtableCached(redisClient, name):
+    """ @brief Determine whether a flow table is cached in the current format """
+    return redisClient.get(getCacheKeys(name)[3]) == CACHE_FORMAT
+
+def getCacheLoadID(redisClient, name):
+    """ @brief Get the identifier of the load of a cached flow table.  Reloading
+        the flow table, even from the same file, changes the identifier, so that
+        data derived from the cached flow table can tell that it is stale.
+
+        @return String, None if the flow table is not cached
+    """
+    return redisClient.get(getCacheKeys(name)[4])
+
+def clearFlowtable(redisClient, name):
+    """ @brief Remove a flow table from the cache """
+    redisClient.delete(*getCacheKeys(name))
+
+def bulkLoadFlowtable(redisClient, name, flowtable, batchSize=DEFAULT_BATCH_SIZE, progress=None):
+    """ @brief Load a flow table into the cache, replacing any cached flow table
+        of the same name.  Keys and values are encoded a batch at a time and sent
+        in one pipelined round trip per batch.
+
+        @param redisClient redis.Redis client
+        @param name Name of the flow table
+        @param flowtable flowtablearray.ColumnarFlowtable, or dict returned by
+        flowtableio.readFlowtable
+        @param batchSize Number of patches sent per round trip
+        @param progress Function called with (numLoaded, numPatches) before the first
+        batch and after each batch, numPatches being the number of distinct patches
+
+        @return CacheLoadStats
+    """
+    (listKey, hashKey, donorsKey, formatKey, loadKey) = getCacheKeys(name)
+    memoryBefore = getRedisMemory(redisClient)
+    start = time.time()
+    clearFlowtable(redisClient, name)
+
+    if isinstance(flowtable, flowtablearray.ColumnarFlowtable):
+        # A patch that occurs more than once in the table is loaded once
+        rows = flowtable.getWriteOrder()
+        totalPatches = len(rows)
+        batches = _iterColumnarBatches(flowtable, batchSize, rows)
+    else:
+        totalPatches = len(flowtable)
+        batches = _iterDictBatches(flowtable, batchSize)
+    if progress:
+        progress(0, totalPatches)
+    numPatches = 0
+    for (keys, values, donorKeys, donorValues) in batches:
+        pipe = redisClient.pipeline(transaction=False)
+        pipe.rpush(listKey, *keys)
+        pipe.hmset(hashKey, dict(zip(keys, values)))
+        if donorKeys:
+            pipe.hmset(donorsKey, dict(zip(donorKeys, donorValues)))
+        pipe.execute()
+        numPatches += len(keys)
+        if progress:
+            progress(numPatches, totalPatches)
+    # Mark the flow table as cached only once it is complete
+    redisClient.set(loadKey, uuid.uuid4().hex)
+    redisClient.set(formatKey, CACHE_FORMAT)
+
+    seconds = time.time() - start
+    return CacheLoadStats(numPatches, seconds, memoryBefore, getRedisMemory(redisClient))
+
+
+def _acquireLock(redisClient, name, token, lockTimeout):
+    (lockKey, progressKey) = _getLockKeys(name)
+    if not redisClient.set(lockKey, token, px=int(lockTimeout * 1000), nx=True):
+        return False
+    redisClient.delete(progressKey)
+    redisClient.hmset(progressKey, {'owner': token, 'started': time.time(), 'numLoaded': 0,
+                                    'numPatches': -1})
+    return True
+
+def _extendLock(redisClient, name, token, lockTimeout):
+    lockKey = _getLockKeys(name)[0]
+    return bool(redisClient.eval(_EXTEND_LOCK_SCRIPT, 1, lockKey, token, int(lockTimeout * 1000)))
+
+def _callWithLockRenewed(redisClient, name, token, lockTimeout, function):
+    """ @brief Call a function, renewing the lock from a heartbeat thread while it runs,
+        so that a slow read or load is not mistaken for a dead loader
+
+        @return Value returned by function
+
+        @raise Exception if the lock was lost while function ran
+    """
+    done = threading.Event()
+    lost = []
+    def heartbeat():
+        while not done.wait(lockTimeout / 3.0):
+            if not _extendLock(redisClient, name, token, lockTimeout):
+                lost.append(True)
+                return
+    thread = threading.Thread(target=heartbeat, name="flowtablecache-lock-%s" % (name,) )
+    thread.daemon = True
+    thread.start()
+    try:
+        result = function()
+    finally:
+        done.set()
+        thread.join()
+    if lost:
+        raise Exception("Lost lock while loading flow table %s" % (name,) )
+    return result
+
+def _releaseLock(redisClient, name, token):
+    (lockKey, progressKey) = _getLockKeys(name)
+    if redisClient.eval(_RELEASE_LOCK_SCRIPT, 1, lockKey, token):
+        redisClient.delete(progressKey)
+
+def getLoadProgress(redisClient, name):
+    """ @brief Get the progress of loading a flow table into the cache
+
+        @param redisClient redis.Redis client
+        @param name Name of the flow table
+
+        @return LoadProgress, None if the flow table is not being loaded.  numPatches
+        is -1 until the loader has read the flow table.
+    """
+    (lockKey, progressKey) = _getLockKeys(name)
+    if redisClient.get(lockKey) is None:
+        return None
+    progress = redisClient.hgetall(progressKey)
+    if not progress:
+        return None
+    return LoadProgress(progress.get('owner'), float(progress.get('started', 0)),
+                        int(progress.get('numLoaded', 0)), int(progress.get('numPatches', -1)))
+
+def ensureFlowtableCached(redisClient, name, readFlowtable, lockTimeout=LOCK_TIMEOUT,
+                          waitTimeout=WAIT_TIMEOUT, pollInterval=POLL_INTERVAL):
+    """ @brief Make sure a flow table is cached, loading it if need be.  Only one
+        process loads a flow table at a time: other processes calling this function
+        wait until the load completes.  The loading process renews its lock while it
+        reads and loads the flow table; if it dies, its lock expires after lockTimeout
+        seconds and a waiting process takes over.
+
+        @param redisClient redis.Redis client
+        @param name Name of the flow table
+        @param readFlowtable Function, called without arguments, returning the flow
+        table to load, e.g. a flowtablearray.ColumnarFlowtable
+        @param lockTimeout Seconds without progress after which a loader is presumed dead
+        @param waitTimeout Seconds to wait for another process to load the flow table
+        @param pollInterval Seconds between checks for the flow table being loaded
+
+        @return CacheLoadStats if this process loaded the flow table, None if it was
+        already cached or loaded by another process
+
+        @raise Exception if the flow table is not loaded within waitTimeout seconds
+    """
+    token = "%s:%d:%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+    deadline = time.time() + waitTimeout
+    while not isFlowtableCached(redisClient, name):
+        if _acquireLock(redisClient, name, token, lockTimeout):
+            try:
+                # Another process may have finished loading since we last checked
+                if isFlowtableCached(redisClient, name):
+                    return None
+                def progress(numLoaded, numPatches):
+                    if not _extendLock(redisClient, name, token, lockTimeout):
+                        raise Exception("Lost lock while loading flow table %s" % (name,) )
+                    redisClient.hmset(_getLockKeys(name)[1], {'numLoaded': numLoaded,
+                                                              'numPatches': numPatches})
+                load = lambda: bulkLoadFlowtable(redisClient, name, readFlowtable(), progress=progress)
+                return _callWithLockRenewed(redisClient, name, token, lockTimeout, load)
+            finally:
+                _releaseLock(redisClient, name, token)
+        if time.time() > deadline:
+            raise Exception("Timed out waiting for flow table %s to be cached" % (name,) )
+        time.sleep(pollInterval)
+    return None
+
+
+def getCachedItems(redisClient, name, key):
+    """ @brief Get the flow table items of a patch from the cache
+
+        @param redisClient redis.Redis client
+        @param name Name of the flow table
+        @param key rhessystypes.FQPatchID
+
+        @return List of items as returned by decodeCacheValue, None if the patch
+        is not cached
+    """
+    value = redisClient.hget(getCacheKeys(name)[1], packKey(key))
+    if value is None:
+        return None
+    return decodeCacheValue(value)
+
+def getCachedDonors(redisClient, name, key):
+    """ @brief Get the donors of a patch from the cache
+
+        @param redisClient redis.Redis client
+        @param name Name of the flow table
+        @param key rhessystypes.FQPatchID
+
+        @return List of FlowTableDonor objects
+    """
+    value = redisClient.hget(getCacheKeys(name)[2], packKey(key))
+    if value is None:
+        return []
+    return loadDonors(value)
+
+def getCachedNumPatches(redisClient, name):
+    """ @brief Get the number of patches of a cached flow table """
+    return redisClient.llen(getCacheKeys(name)[0])
+
+def getUncachedKeys(redisClient, name, keys):
+    """ @brief Find the patches that are not in a cached flow table
+
+        @param redisClient redis.Redis client
+        @param name Name of the flow table
+        @param keys Sequence of rhessystypes.FQPatchID
+
+        @return List of the keys that are not cached
+    """
+    keys = list(keys)
+    if not keys:
+        return []
+    cached = redisClient.hmget(getCacheKeys(name)[1], [packKey(k) for k in keys])
+    return [k for (k, value) in zip(keys, cached) if value is None]
+
+def iterCachedRecords(redisClient, name, batchSize=DEFAULT_BATCH_SIZE):
+    """ @brief Stream the entries of a cached flow table in table order, fetching
+        a batch of entries per HMGET
+
+        @param redisClient redis.Redis client
+        @param name Name of the flow table
+        @param batchSize Number of entries fetched per round trip
+
+        @return Iterator over FlowTableRecord
+    """
+    (listKey, hashKey) = getCacheKeys(name)[:2]
+    numPatches = redisClient.llen(listKey)
+    for batchStart in xrange(0, numPatches, batchSize):
+        keys = redisClient.lrange(listKey, batchStart, batchStart + batchSize - 1)
+        if not keys:
+            break
+        for (key, value) in zip(keys, redisClient.hmget(hashKey, keys)):
+            if value is None:
+                raise Exception("Cached flow table %s has no entry for patch %s" % \
+                                (name, unpackKey(key)) )
+            yield decodeCacheRecord(value)
@@ -7,6 +7,15 @@
         FlowTableEntryReceive objects. To test run with the flow table
         distributed with this file
 
+        Consumers that only need a single pass over the flow table should
+        use iterFlowtable, which yields one FlowTableRecord at a time.
+
+        Flow tables may be compressed with gzip, bzip2 or (if the lzma
+        module is available) xz: compressed flow tables are recognized by
+        their contents when read and by their suffix (see
+        COMPRESSION_SUFFIXES) when written, and are decompressed and
+        compressed as they are streamed (see openFlowtable).
+
 This software is provided free of charge under the New BSD License. Please see
 the following license information:
 
@@ -40,17 +49,52 @@ OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 """
 import os, sys, errno
+import io
+import gzip
+import bz2
 from collections import namedtuple
 from collections import OrderedDict
 import argparse
 import cPickle
+import json
+import struct
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 
 import rhessystypes
 
 ## Constants
+LAND_TYPE_LAND = 0
 LAND_TYPE_ROAD = 2
 FLOW_ENTRY_NUM_TOKENS = 11
 FLOW_ENTRY_ITEM_NUM_TOKENS = 4
+FLOW_TABLE_HEADER_FORMAT = "%8d"
+FLOW_TABLE_HEADER_WIDTH = 8
+FLOW_ENTRY_FORMAT = "\n %6d %6d %6d %6.1f %6.1f %6.1f %10f %d %4d %f %4d"
+FLOW_ENTRY_RECEIVER_FORMAT = "\n%16d %6d %6d %8.8f  "
+FLOW_ENTRY_ROAD_FORMAT = "\n%16d %6d %6d %lf"
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+WRITE_BLOCK_NUM_ENTRIES = 4096
+READ_BUFFER_SIZE = 4 * 1024 * 1024
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_BZIP2 = 'bzip2'
+COMPRESSION_XZ = 'xz'
+COMPRESSION_SUFFIXES = {'.gz': COMPRESSION_GZIP, '.bz2': COMPRESSION_BZIP2, '.xz': COMPRESSION_XZ}
+COMPRESSION_LEVEL = 6
+_COMPRESSION_MAGIC = [('\x1f\x8b', COMPRESSION_GZIP), ('BZh', COMPRESSION_BZIP2),
+                      ('\xfd7zXZ\x00', COMPRESSION_XZ)]
+CACHE_VALUE_VERSION = 1
+CACHE_ENTRY_STRUCT = struct.Struct('<iiiddddqidi')
+_HAS_ROAD = 0x01
+_VALUE_HEADER = struct.Struct('<BBI')
+_RECORD_FORMAT = 'iiid'
+CACHE_RECORD_SIZE = struct.calcsize('<' + _RECORD_FORMAT)
+RECORD_LIST_HEADER = struct.Struct('<I')
 
 ## Type definitions
 FlowTableEntry = namedtuple('FlowTableEntry', ['patchID', 'zoneID', 'hillID', 'x', 'y', 'z', 'accumArea', 'area', 'landType', 'totalGamma', 'numAdjacent'], verbose=False)
@@ -73,7 +117,13 @@ def getFlowTableEntryFromArray(values):
                           numAdjacent=int(values[10]) )
 
 
-class FlowTableEntryReceiver:
+class FlowTableEntryReceiver(object):
+    """ @brief Receiver of a flow table entry.  Receivers are mutable (e.g. gamma
+        is edited in place), and are by far the most numerous objects in a flow
+        table, so attributes are stored in slots rather than a per-instance dict.
+    """
+    __slots__ = ('patchID', 'zoneID', 'hillID', 'gamma')
+
     def __init__(self, patchID, zoneID, hillID, gamma):
         """ @brief Build a FlowTableEntryReceiver
             @param patchID String representing the patch ID, will be cast to an int
@@ -86,11 +136,147 @@ class FlowTableEntryReceiver:
         self.zoneID = int(zoneID)
         self.hillID = int(hillID)
         self.gamma = float(gamma)
+
+    def __reduce__(self):
+        return (FlowTableEntryReceiver, (self.patchID, self.zoneID, self.hillID, self.gamma))
+
+    def __repr__(self):
+        return "FlowTableEntryReceiver(patchID=%r, zoneID=%r, hillID=%r, gamma=%r)" % \
+            (self.patchID, self.zoneID, self.hillID, self.gamma)
    
-FlowTableEntryRoad = namedtuple('FlowTableEntryReceiver', ['streamPatchID', 'streamZoneID', 'streamHillID', 'roadWidth'], verbose=False) 
+FlowTableEntryRoad = namedtuple('FlowTableEntryRoad', ['streamPatchID', 'streamZoneID', 'streamHillID', 'roadWidth'], verbose=False) 
+
+FlowTableRecord = namedtuple('FlowTableRecord', ['entry', 'receivers', 'road'], verbose=False)
+
+FlowTableDonor = namedtuple('FlowTableDonor', ['patchID', 'zoneID', 'hillID', 'gamma'], verbose=False)
+
+_recordStructs = {}
+
+def _getRecordStruct(numRecords):
+    s = _recordStructs.get(numRecords)
+    if s is None:
+        s = struct.Struct('<' + _RECORD_FORMAT * numRecords)
+        _recordStructs[numRecords] = s
+    return s
+
+def packRecords(values, numRecords):
+    """ @brief Pack receivers, roads or donors as consecutive CACHE_RECORD_SIZE byte records
+
+        @param values Sequence of the patchID, zoneID, hillID and gamma (or road width)
+        of each record, one after another
+        @param numRecords Number of records
+
+        @return String
+    """
+    return _getRecordStruct(numRecords).pack(*values)
+
+def unpackRecords(data, numRecords, offset=0):
+    """ @brief Unpack records packed by packRecords
+
+        @return Tuple of the values of the records, one after another
+    """
+    return _getRecordStruct(numRecords).unpack_from(data, offset)
+
+def packCacheValueHeader(numReceivers, hasRoad):
+    """ @brief Pack the header of a value encoded by encodeCacheValue, for encoders
+        that pack the entry and records of a value themselves
+    """
+    return _VALUE_HEADER.pack(CACHE_VALUE_VERSION, _HAS_ROAD if hasRoad else 0, numReceivers)
+
+def encodeCacheValue(items):
+    """ @brief Encode the items of a flow table entry in a compact binary encoding:
+        a header holding CACHE_VALUE_VERSION, then the entry and its receivers and
+        road as little endian structs.  This is the encoding of the flow table
+        cache (see flowtablecache).
+
+        @param items List containing a FlowTableEntry, its FlowTableEntryReceiver
+        objects, and possibly one FlowTableEntryRoad, as stored in the dict returned
+        by readFlowtable
+
+        @return String encoding the items
+    """
+    entry = None
+    receivers = []
+    road = None
+    for item in items:
+        if isinstance(item, FlowTableEntryReceiver):
+            receivers.extend( (item.patchID, item.zoneID, item.hillID, item.gamma) )
+        elif isinstance(item, FlowTableEntry):
+            entry = item
+        elif isinstance(item, FlowTableEntryRoad):
+            road = item
+    if entry is None:
+        raise ValueError("Flow table items to encode have no FlowTableEntry")
+    numReceivers = len(receivers) // 4
+    parts = [packCacheValueHeader(numReceivers, road is not None),
+             CACHE_ENTRY_STRUCT.pack(*entry),
+             packRecords(receivers, numReceivers)]
+    if road is not None:
+        parts.append(packRecords(road, 1))
+    return ''.join(parts)
+
+def encodeCacheRecord(record):
+    """ @brief Encode a FlowTableRecord as encodeCacheValue encodes the corresponding items """
+    items = [record.entry] + list(record.receivers)
+    if record.road is not None:
+        items.append(record.road)
+    return encodeCacheValue(items)
+
+def decodeCacheRecord(data):
+    """ @brief Decode a flow table entry encoded by encodeCacheValue
+
+        @param data String returned by encodeCacheValue
+
+        @return FlowTableRecord
+
+        @raise ValueError if the encoding is of an unsupported version
+    """
+    (version, flags, numReceivers) = _VALUE_HEADER.unpack_from(data)
+    if version != CACHE_VALUE_VERSION:
+        raise ValueError("Unsupported flow table cache value version %d" % (version,) )
+    offset = _VALUE_HEADER.size
+    entry = FlowTableEntry(*CACHE_ENTRY_STRUCT.unpack_from(data, offset))
+    offset += CACHE_ENTRY_STRUCT.size
+    values = unpackRecords(data, numReceivers, offset)
+    receivers = [FlowTableEntryReceiver(*values[i:i+4]) for i in xrange(0, len(values), 4)]
+    road = None
+    if flags & _HAS_ROAD:
+        offset += numReceivers * CACHE_RECORD_SIZE
+        road = FlowTableEntryRoad(*unpackRecords(data, 1, offset))
+    return FlowTableRecord(entry, receivers, road)
+
+def decodeCacheValue(data):
+    """ @brief Decode the items of a flow table entry encoded by encodeCacheValue
+
+        @param data String returned by encodeCacheValue
+
+        @return List containing a FlowTableEntry, its FlowTableEntryReceiver
+        objects, and possibly one FlowTableEntryRoad
+    """
+    record = decodeCacheRecord(data)
+    items = [record.entry] + record.receivers
+    if record.road is not None:
+        items.append(record.road)
+    return items
 
-import json
 def dumpReceivers(thing):
+    """ @brief Encode the items of a flow table entry, as encodeCacheValue does
+
+        @param thing List containing a FlowTableEntry, its FlowTableEntryReceiver
+        objects, and possibly one FlowTableEntryRoad
+
+        @return String encoding the items, to be decoded by loadReceivers
+    """
+    return encodeCacheValue(thing)
+
+def dumpReceiversJSON(thing):
+    """ @brief Encode the items of a flow table entry as JSON, the encoding used
+        before dumpReceivers switched to encodeCacheValue.  loadReceivers reads both.
+
+        @param thing List of FlowTableEntry, FlowTableEntryReceiver and FlowTableEntryRoad objects
+
+        @return String encoding the items as a JSON array of objects
+    """
     x = []
     for t in thing:
             if hasattr(t, "roadWidth"):
@@ -122,9 +308,8 @@ def dumpReceivers(thing):
                     'numAdjacent' : t.numAdjacent
                 })
     return json.dumps(x)
-        
 
-def loadReceivers(thing):
+def _loadReceiversJSON(thing):
     val = json.loads(thing)
     x = []
     for t in val:
@@ -136,6 +321,58 @@ def loadReceivers(thing):
                 x.append(FlowTableEntry(**t))
     return x
 
+def loadReceivers(thing):
+    """ @brief Decode the items of a flow table entry encoded by dumpReceivers.
+        Items stored as JSON, by dumpReceiversJSON or before dumpReceivers
+        used the binary encoding, are still read.
+
+        @param thing String returned by dumpReceivers or dumpReceiversJSON
+
+        @return List of FlowTableEntry, FlowTableEntryReceiver and FlowTableEntryRoad objects
+    """
+    if thing[:1] == '[':
+        return _loadReceiversJSON(thing)
+    return decodeCacheValue(thing)
+
+def packRecordList(records):
+    """ @brief Encode a list of records with patchID, zoneID, hillID and gamma
+        fields, e.g. FlowTableDonor or FlowTableEntryReceiver objects, preceded
+        by their number
+
+        @return String encoding the records, to be decoded by unpackRecordList
+    """
+    values = []
+    for r in records:
+        values.extend( (r.patchID, r.zoneID, r.hillID, r.gamma) )
+    return RECORD_LIST_HEADER.pack(len(records)) + packRecords(values, len(records))
+
+def unpackRecordList(data, recordType):
+    """ @brief Decode a list of records encoded by packRecordList
+
+        @param data String returned by packRecordList
+        @param recordType Type of the records, e.g. FlowTableDonor
+    """
+    (numRecords,) = RECORD_LIST_HEADER.unpack_from(data)
+    values = unpackRecords(data, numRecords, RECORD_LIST_HEADER.size)
+    return [recordType(*values[i:i+4]) for i in xrange(0, len(values), 4)]
+
+def dumpDonors(donors):
+    """ @brief Encode the donors of a flow table entry, as they are stored in the
+        donors hash of a cached flow table (see flowtablecache.getCachedDonors)
+
+        @param donors List of FlowTableDonor objects
+
+        @return String encoding the donors, to be decoded by loadDonors
+    """
+    return packRecordList(donors)
+
+def loadDonors(thing):
+    """ @brief Decode the donors of a flow table entry encoded by dumpDonors
+
+        @return List of FlowTableDonor objects
+    """
+    return unpackRecordList(thing, FlowTableDonor)
+
 def getFlowTableEntryRoadFromArray(values):
     """ @brief Build a FlowTableEntryRoad from an array
         @param values Array of strings representing tokenized flow table entry
@@ -149,39 +386,324 @@ def getFlowTableEntryRoadFromArray(values):
                                roadWidth=float(values[3]) )
 
 ## Function definitions
+def _formatReceiver(item):
+    return FLOW_ENTRY_RECEIVER_FORMAT % (item.patchID, item.zoneID, item.hillID, item.gamma)
+
+def _formatEntry(item):
+    # FlowTableEntry fields are in the order they are written
+    return FLOW_ENTRY_FORMAT % item
+
+def _formatRoad(item):
+    return FLOW_ENTRY_ROAD_FORMAT % item
+
+_ITEM_FORMATTERS = OrderedDict([ (FlowTableEntryReceiver, _formatReceiver),
+                                 (FlowTableEntry, _formatEntry),
+                                 (FlowTableEntryRoad, _formatRoad) ])
+
+def formatFlowtableItems(items):
+    """ @brief Format the items of one flow table entry as they are written to a
+        flow table, including the newline preceding each line.
+
+        @param items List containing a FlowTableEntry, its FlowTableEntryReceiver
+        objects, and possibly one FlowTableEntryRoad, as stored in the dict returned
+        by readFlowtable
+        @return String representing the items
+    """
+    lines = []
+    for item in items:
+        formatter = _ITEM_FORMATTERS.get(item.__class__)
+        if formatter is None:
+            # Subclasses of the flow table types
+            for (itemType, f) in _ITEM_FORMATTERS.iteritems():
+                if isinstance(item, itemType):
+                    formatter = f
+                    break
+            else:
+                continue
+        lines.append(formatter(item))
+    return ''.join(lines)
+
+def formatFlowtableRecord(record):
+    """ @brief Format a FlowTableRecord as it is written to a flow table, including
+        the newline preceding each line.
+
+        @param record FlowTableRecord
+        @return String representing the record
+    """
+    lines = [_formatEntry(record.entry)]
+    lines.extend([_formatReceiver(r) for r in record.receivers])
+    if record.road is not None:
+        lines.append(_formatRoad(record.road))
+    return ''.join(lines)
+
+def getFlowtableCompression(flowtable):
+    """ @brief Determine how a flow table file is compressed from its first bytes
+
+        @param flowtable String representing the path of the flow table
+
+        @return One of COMPRESSION_GZIP, COMPRESSION_BZIP2, COMPRESSION_XZ, None if
+        the flow table is not compressed
+    """
+    f = open(flowtable, 'rb')
+    try:
+        magic = f.read(6)
+    finally:
+        f.close()
+    for (prefix, compression) in _COMPRESSION_MAGIC:
+        if magic.startswith(prefix):
+            return compression
+    return None
+
+def _getLZMA():
+    if lzma is None:
+        raise IOError("Reading or writing xz compressed flow tables requires the lzma module")
+    return lzma
+
+def openFlowtable(flowtable, mode='r'):
+    """ @brief Open a flow table file for streaming, decompressing or compressing
+        it as it is read or written, with buffers of READ_BUFFER_SIZE or
+        WRITE_BUFFER_SIZE bytes.
+
+        @param flowtable String representing the path of the flow table.  When
+        reading, its compression is determined from its contents; when writing,
+        from its suffix (see COMPRESSION_SUFFIXES).
+        @param mode 'r' to read or 'w' to write
+
+        @return File object
+    """
+    if mode.startswith('r'):
+        compression = getFlowtableCompression(flowtable)
+        if compression == COMPRESSION_GZIP:
+            return io.BufferedReader(gzip.GzipFile(flowtable, 'rb'), READ_BUFFER_SIZE)
+        elif compression == COMPRESSION_BZIP2:
+            return bz2.BZ2File(flowtable, 'r', READ_BUFFER_SIZE)
+        elif compression == COMPRESSION_XZ:
+            return io.BufferedReader(_getLZMA().LZMAFile(flowtable, 'rb'), READ_BUFFER_SIZE)
+        return open(flowtable, 'rb', READ_BUFFER_SIZE)
+
+    compression = COMPRESSION_SUFFIXES.get(os.path.splitext(flowtable)[1])
+    if compression == COMPRESSION_GZIP:
+        return io.BufferedWriter(gzip.GzipFile(flowtable, 'wb', COMPRESSION_LEVEL), WRITE_BUFFER_SIZE)
+    elif compression == COMPRESSION_BZIP2:
+        return bz2.BZ2File(flowtable, 'w', WRITE_BUFFER_SIZE, COMPRESSION_LEVEL)
+    elif compression == COMPRESSION_XZ:
+        return io.BufferedWriter(_getLZMA().LZMAFile(flowtable, 'wb', preset=COMPRESSION_LEVEL),
+                                 WRITE_BUFFER_SIZE)
+    return open(flowtable, 'wb', WRITE_BUFFER_SIZE)
+
+def _isFileObject(flowtable):
+    return not isinstance(flowtable, basestring)
+
+def _openFlowtableForReading(flowtable):
+    """ @return Tuple (file object, True if the file object should be closed when done) """
+    if _isFileObject(flowtable):
+        return (flowtable, False)
+    return (openFlowtable(flowtable, 'r'), True)
+
+def _openFlowtableForWriting(flowtableOutfile):
+    """ @return Tuple (file object, True if the file object should be closed when done) """
+    if _isFileObject(flowtableOutfile):
+        return (flowtableOutfile, False)
+    flowtableOutdir = os.path.split(flowtableOutfile)[0] or os.curdir
+    if not os.access(flowtableOutdir, os.W_OK):
+        raise IOError("Unable to write to output directory %s\n" % (flowtableOutdir,) )
+    return (openFlowtable(flowtableOutfile, 'w'), True)
+
+def _joinBlocks(blocks):
+    """ @brief Join formatted strings into strings of WRITE_BLOCK_NUM_ENTRIES strings each """
+    buf = []
+    for block in blocks:
+        buf.append(block)
+        if len(buf) >= WRITE_BLOCK_NUM_ENTRIES:
+            yield ''.join(buf)
+            del buf[:]
+    if buf:
+        yield ''.join(buf)
+
+def _writeBlocks(flowFile, blocks):
+    """ @brief Write formatted strings to a flow table, joining them into large writes """
+    for block in _joinBlocks(blocks):
+        flowFile.write(block)
+
 def writeFlowtable(flowtableDict, flowtableOutfile):
     """ @brief Write a RHESSys flow table from a representation stored in collections.OrderedDict
         returned by readFlowtable.
         
-        @param flowtableDict Flow table as returned by readFlowtable
-        @param flowtableOutfile String representing the absolute path of the flow table to be written
+        @param flowtableDict Flow table as returned by readFlowtable.  Flow tables
+        that provide their own formatting (e.g. flowtablearray.ColumnarFlowtable) are
+        written from the blocks returned by their iterFormattedBlocks method.
+        @param flowtableOutfile String representing the absolute path of the flow table to be written,
+        compressed according to its suffix (see openFlowtable), or a file object open for writing
     """
-    flowtableOutdir = os.path.split(flowtableOutfile)[0]
-    if not os.access(flowtableOutdir, os.W_OK):
-        raise IOError("Unable to write to output directory %s\n" % (flowtableOutdir,) )
-    flowFile = open(flowtableOutfile, 'w')
-    
-    keys = flowtableDict.keys()
-    numKeys = len(keys)
-    
-    flowFile.write("%8d" % (numKeys,) )
-    for key in keys:
-        items = flowtableDict[key]
-        for item in items:
-            if isinstance(item, FlowTableEntryReceiver):
-                flowFile.write("\n%16d %6d %6d %8.8f  " % \
-                               (item.patchID, item.zoneID, item.hillID, item.gamma) )
-            elif isinstance(item, FlowTableEntry):
-                flowFile.write("\n %6d %6d %6d %6.1f %6.1f %6.1f %10f %d %4d %f %4d" % \
-                               (item.patchID, item.zoneID, item.hillID, item.x, item.y, \
-                                item.z, item.accumArea, item.area, item.landType, \
-                                item.totalGamma, item.numAdjacent) )
-            elif isinstance(item, FlowTableEntryRoad):
-                flowFile.write("\n%16d %6d %6d %lf" % \
-                               (item.streamPatchID, item.streamZoneID, item.streamHillID, \
-                               item.roadWidth) )
-    
-    flowFile.close()
+    (flowFile, closeFile) = _openFlowtableForWriting(flowtableOutfile)
+    try:
+        if hasattr(flowtableDict, 'iterFormattedBlocks'):
+            for block in flowtableDict.iterFormattedBlocks():
+                flowFile.write(block)
+        else:
+            keys = flowtableDict.keys()
+            flowFile.write(FLOW_TABLE_HEADER_FORMAT % (len(keys),) )
+            _writeBlocks(flowFile, (formatFlowtableItems(flowtableDict[key]) for key in keys))
+    finally:
+        if closeFile:
+            flowFile.close()
+
+def writeFlowtableRecords(records, flowtableOutfile, numPatches=None):
+    """ @brief Write a RHESSys flow table from a sequence of FlowTableRecord objects,
+        e.g. as yielded by iterFlowtable, without holding the flow table in memory.
+
+        @param records Iterable of FlowTableRecord
+        @param flowtableOutfile String representing the absolute path of the flow table to be written,
+        compressed according to its suffix (see openFlowtable), or a file object open for writing
+        @param numPatches Number of records; if None, the records are counted as they are
+        written and the header is filled in afterwards, which requires an uncompressed,
+        seekable output file
+        
+        @return Number of records written
+    """
+    if numPatches is None and (_isFileObject(flowtableOutfile) or \
+                               os.path.splitext(flowtableOutfile)[1] in COMPRESSION_SUFFIXES):
+        raise IOError("The number of patches must be given to write flow table %s" % (flowtableOutfile,) )
+    (flowFile, closeFile) = _openFlowtableForWriting(flowtableOutfile)
+    try:
+        if numPatches is None:
+            flowFile.write(' ' * FLOW_TABLE_HEADER_WIDTH)
+        else:
+            flowFile.write(FLOW_TABLE_HEADER_FORMAT % (numPatches,) )
+        counter = [0]
+        def formatted():
+            for record in records:
+                counter[0] += 1
+                yield formatFlowtableRecord(record)
+        _writeBlocks(flowFile, formatted())
+        numWritten = counter[0]
+        if numPatches is None:
+            header = FLOW_TABLE_HEADER_FORMAT % (numWritten,)
+            if len(header) > FLOW_TABLE_HEADER_WIDTH:
+                raise IOError("Too many patches (%d) to write flow table header" % (numWritten,) )
+            flowFile.seek(0)
+            flowFile.write(header)
+        elif numWritten != numPatches:
+            raise IOError("Expected %d flow table records but wrote %d" % (numPatches, numWritten) )
+    finally:
+        if closeFile:
+            flowFile.close()
+    return numWritten
+
+def iterFlowtableBlocks(records, numPatches):
+    """ @brief Format a RHESSys flow table from a sequence of FlowTableRecord objects
+        as a sequence of strings, e.g. to stream a flow table to a client without
+        writing it to a file.
+
+        @param records Iterable of FlowTableRecord
+        @param numPatches Number of records, written to the header
+
+        @return Iterator over strings, the header followed by blocks of
+        WRITE_BLOCK_NUM_ENTRIES formatted records
+    """
+    yield FLOW_TABLE_HEADER_FORMAT % (numPatches,)
+    for block in _joinBlocks(formatFlowtableRecord(record) for record in records):
+        yield block
+
+def readFlowtableNumPatches(flowtable):
+    """ @brief Read the number of patches from the header of a RHESSys flow table
+
+        @param flowtable String representing the absolute path of the file
+        containing the RHESSys flowtable, possibly compressed
+
+        @return Number of patches
+    """
+    flow = openFlowtable(flowtable, 'r')
+    try:
+        return int(flow.readline())
+    finally:
+        flow.close()
+
+def iterFlowtable(flowtable):
+    """ @brief Iterate over the entries of a RHESSys flow table one at a time,
+        without reading the whole table into memory.
+
+        @param flowtable String representing the absolute path of the file
+        containing the RHESSys flowtable, possibly compressed (see openFlowtable),
+        or a file object open for reading positioned at the start of the flow table
+
+        @return Generator yielding one FlowTableRecord per flow table entry, in
+        the order they appear in the flow table.  The road member of each record
+        is None if the entry has no road record.
+
+        @raise Exception if the structure of the flow table is invalid; the message
+        gives the line number, in the flow table file, at which the error was found
+    """
+    (flow, closeFile) = _openFlowtableForReading(flowtable)
+    try:
+        # Skip number of patches
+        flow.readline()
+
+        # State variables
+        numLines = 1
+        entryLine = -1
+        entry = None
+        receivers = None
+        road = None
+
+        for line in flow:
+            numLines += 1
+            values = line.split()
+            lv = len(values)
+            if lv == FLOW_ENTRY_NUM_TOKENS:
+                if entry is not None:
+                    # Check for error in flow table structure
+                    if len(receivers) < entry.numAdjacent:
+                        raise Exception("Error in flow table at line %d, only %d of %d adjacent recievers read" % \
+                                        (numLines, len(receivers), entry.numAdjacent))
+                    yield FlowTableRecord(entry=entry, receivers=receivers, road=road)
+                entry = getFlowTableEntryFromArray(values)
+                entryLine = numLines
+                receivers = []
+                road = None
+            elif lv == FLOW_ENTRY_ITEM_NUM_TOKENS and entry is not None:
+                # Check for error in flow table structure
+                if road is not None:
+                    raise Exception("Error in flow table at line %d, already read road record for entry at line %d" % \
+                                    (numLines, entryLine))
+                # See if we need to read the stream patch to which the road drains
+                if len(receivers) == entry.numAdjacent:
+                    road = getFlowTableEntryRoadFromArray(values)
+                else:
+                    receivers.append(FlowTableEntryReceiver(values[0], values[1], values[2], values[3]))
+
+        if entry is not None:
+            if len(receivers) < entry.numAdjacent:
+                raise Exception("Error in flow table at line %d, only %d of %d adjacent recievers read" % \
+                                (entryLine, len(receivers), entry.numAdjacent))
+            yield FlowTableRecord(entry=entry, receivers=receivers, road=road)
+    finally:
+        if closeFile:
+            flow.close()
+
+def iterFlowtableKeys(flowtable):
+    """ @brief Iterate over the keys of the entries of a RHESSys flow table,
+        scanning only the entry lines.  Receiver and road records are skipped
+        without being parsed, and the structure of the table is not checked.
+
+        @param flowtable String representing the absolute path of the file
+        containing the RHESSys flowtable, possibly compressed (see openFlowtable),
+        or a file object open for reading positioned at the start of the flow table
+
+        @return Generator yielding one rhessystypes.FQPatchID per flow table entry,
+        in the order they appear in the flow table
+    """
+    (flow, closeFile) = _openFlowtableForReading(flowtable)
+    try:
+        # Skip number of patches
+        flow.readline()
+        for line in flow:
+            values = line.split()
+            if len(values) == FLOW_ENTRY_NUM_TOKENS:
+                yield rhessystypes.FQPatchID(patchID=int(values[0]), zoneID=int(values[1]), hillID=int(values[2]))
+    finally:
+        if closeFile:
+            flow.close()
 
 def readFlowtable(flowtable):
     """ @brief Read a RHESSys flow table into a dict where the keys are 
@@ -190,55 +712,21 @@ def readFlowtable(flowtable):
         FlowTableEntryRoad object.
     
         @param flowtable String representing the absolute path of the file
-        containing the RHESSys flowtable
+        containing the RHESSys flowtable, possibly compressed (see openFlowtable),
+        or a file object open for reading
 
         @return The dict representing the flow table
     """
-    #flowDict = dict()
     flowDict = OrderedDict()
-    flow = open(flowtable, 'r')
-
-    numPatches = flow.readline().lstrip()
-
-    # State variables
-    readReceivers = False
-    numRead = -1
-    numAdj = -1
-    numLines = 0
-    currEntry = None
-
-    for line in flow:
-        numLines += 1
-        line = line.strip()
-        values = line.split()
-        lv = len(values)
-        if lv == FLOW_ENTRY_NUM_TOKENS:
-            # Check for error in flow table structure
-            if readReceivers and numRead < numAdj:
-                raise Exception("Error in flow table at line %d, only %d of %d adjacent recievers read" % (numLines, numRead, numAdj))
-
-            # FlowDict uses a FlowTableKey as reference, adds newEntry and items as entries
-            newEntry = getFlowTableEntryFromArray(values)
-            newKey = rhessystypes.FQPatchID(patchID=newEntry.patchID, zoneID=newEntry.zoneID, hillID=newEntry.hillID)
-            flowDict[newKey] = [newEntry]
-            readReceivers = True
-            numRead = 0
-            numAdj = int(newEntry.numAdjacent)
-            currEntry = newKey
-        elif lv == FLOW_ENTRY_ITEM_NUM_TOKENS and readReceivers:
-            # Check for error in flow table structure
-            if numRead > numAdj:
-                raise Exception("Error in flow table at line %d, already read %d of %d adjacent" % (numLines, numRead, numAdj))
-            # See if we need to read the stream patch to which the road drains
-            if numRead == numAdj:
-                item = getFlowTableEntryRoadFromArray(values)
-            else:
-                item = FlowTableEntryReceiver(values[0], values[1], values[2], values[3])
-                numRead += 1
-            # Write item to flow table entry
-            flowDict[currEntry].append(item)
- 
-    flow.close()   
+    for record in iterFlowtable(flowtable):
+        entry = record.entry
+        newKey = rhessystypes.FQPatchID(patchID=entry.patchID, zoneID=entry.zoneID, hillID=entry.hillID)
+        items = [entry]
+        items.extend(record.receivers)
+        if record.road is not None:
+            items.append(record.road)
+        flowDict[newKey] = items
+
     return flowDict
 
 def getEntryForFlowtableKey(key, flowtable):
@@ -279,4 +767,40 @@ def getReceiversForFlowtableEntry(key, flowtable):
     
     return recvs
 
+def buildDonorIndex(flowtable):
+    """ @brief Build the upstream (donor) index of a flow table in one pass over
+        its entries.  The flow table records only the receivers of each patch;
+        the donor index records, for each patch, the patches that drain into it.
+    
+        @param flowtable Dict returned by readFlowtable
+    
+        @return Dict mapping rhessystypes.FQPatchID to the list of FlowTableDonor
+        objects of the patches draining into it, in flow table order.  Each donor
+        holds the gamma of the corresponding receiver.
+    """
+    donorIndex = dict()
+    for (key, items) in flowtable.iteritems():
+        for item in items:
+            if isinstance(item, FlowTableEntryReceiver):
+                receiverKey = rhessystypes.FQPatchID(patchID=item.patchID, zoneID=item.zoneID,
+                                                     hillID=item.hillID)
+                donor = FlowTableDonor(key.patchID, key.zoneID, key.hillID, item.gamma)
+                donors = donorIndex.get(receiverKey)
+                if donors is None:
+                    donorIndex[receiverKey] = [donor]
+                else:
+                    donors.append(donor)
+    return donorIndex
 
+def getDonorsForFlowtableEntry(key, donorIndex):
+    """ @brief Get list of donors (patches draining into a patch) for a given flow table key
+    
+        @param key rhessysweb.types.FQPatchID
+        @param donorIndex Dict returned by buildDonorIndex, or a flow table providing
+        its own donor index (e.g. flowtablearray.ColumnarFlowtable)
+    
+        @return List of FlowTableDonor objects, empty if no patch drains into key
+    """
+    if hasattr(donorIndex, 'getDonorsForKey'):
+        return donorIndex.getDonorsForKey(key)
+    return list(donorIndex.get(key, ()))
@@ -0,0 +1,255 @@
+"""@package flowtablejournal
+
+@brief Edit journals for RHESSys flow tables.  A journal records
+        replacements of the receiver lists of individual patches, and is
+        applied by streaming the original flow table and splicing in the
+        edited patches, so saving an edited flow table costs one
+        sequential pass over it regardless of its size.
+
+        Journals are replayed in order: when a patch is edited more than
+        once, the last edit wins.  Journals from several sessions compose
+        by concatenation (see composeJournals).
+
+        Journal file format: one JSON object per line.  The first line
+        is a header {"format": JOURNAL_FORMAT, "version": JOURNAL_VERSION};
+        each following line is an edit
+        {"patch": [patchID, zoneID, hillID],
+         "receivers": [[patchID, zoneID, hillID, gamma], ...]}
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor
+      the names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import os
+import json
+from collections import namedtuple
+from collections import OrderedDict
+
+import rhessystypes
+from flowtableio import FlowTableEntryReceiver
+from flowtableio import FlowTableRecord
+from flowtableio import iterFlowtable
+from flowtableio import writeFlowtableRecords
+from flowtableio import readFlowtableNumPatches
+from flowtableio import COMPRESSION_SUFFIXES
+
+## Constants
+JOURNAL_FORMAT = 'rhessysweb.flowtable.journal'
+JOURNAL_VERSION = 1
+
+## Type definitions
+JournalEdit = namedtuple('JournalEdit', ['key', 'receivers'], verbose=False)
+
+
+class FlowtableJournal(object):
+    def __init__(self, edits=None):
+        """ @brief Build a FlowtableJournal
+
+            @param edits List of JournalEdit, in the order they were made
+        """
+        self.edits = list(edits) if edits else []
+
+    def __len__(self):
+        return len(self.edits)
+
+    def setReceivers(self, key, receivers):
+        """ @brief Record the replacement of the receivers of a patch
+
+            @param key rhessystypes.FQPatchID of the patch
+            @param receivers List of FlowTableEntryReceiver objects
+        """
+        key = rhessystypes.FQPatchID(patchID=int(key.patchID), zoneID=int(key.zoneID),
+                                     hillID=int(key.hillID))
+        receivers = [FlowTableEntryReceiver(r.patchID, r.zoneID, r.hillID, r.gamma) for r in receivers]
+        self.edits.append(JournalEdit(key, receivers))
+
+    def getReplacements(self):
+        """ @brief Replay the journal
+
+            @return collections.OrderedDict mapping rhessystypes.FQPatchID to the
+            final list of FlowTableEntryReceiver objects of each edited patch, in
+            order of first edit
+        """
+        replacements = OrderedDict()
+        for edit in self.edits:
+            replacements[edit.key] = edit.receivers
+        return replacements
+
+    def compact(self):
+        """ @brief Get an equivalent journal with one edit per patch """
+        return FlowtableJournal([JournalEdit(k, r) for (k, r) in self.getReplacements().iteritems()])
+
+
+def composeJournals(journals):
+    """ @brief Compose journals, e.g. from several sessions, into one.  Edits of
+        later journals take precedence over edits of earlier journals.
+
+        @param journals List of FlowtableJournal, in the order they are to be applied
+
+        @return FlowtableJournal
+    """
+    edits = []
+    for journal in journals:
+        edits.extend(journal.edits)
+    return FlowtableJournal(edits)
+
+
+def _encodeEdit(edit):
+    key = edit.key
+    return json.dumps({'patch': [key.patchID, key.zoneID, key.hillID],
+                       'receivers': [[r.patchID, r.zoneID, r.hillID, r.gamma] for r in edit.receivers]},
+                      sort_keys=True)
+
+def _writeJournalHeader(journalFile):
+    journalFile.write(json.dumps({'format': JOURNAL_FORMAT, 'version': JOURNAL_VERSION},
+                                 sort_keys=True))
+    journalFile.write('\n')
+
+def writeJournal(journal, path):
+    """ @brief Write a journal to a file, replacing the file if it exists
+
+        @param journal FlowtableJournal
+        @param path String representing the path of the journal file
+    """
+    journalFile = open(path, 'w')
+    try:
+        _writeJournalHeader(journalFile)
+        for edit in journal.edits:
+            journalFile.write(_encodeEdit(edit))
+            journalFile.write('\n')
+    finally:
+        journalFile.close()
+
+def appendJournalEdit(path, key, receivers):
+    """ @brief Append one edit to a journal file, creating the file if need be
+
+        @param path String representing the path of the journal file
+        @param key rhessystypes.FQPatchID of the patch
+        @param receivers List of FlowTableEntryReceiver objects
+    """
+    journal = FlowtableJournal()
+    journal.setReceivers(key, receivers)
+    journalFile = open(path, 'a')
+    try:
+        if journalFile.tell() == 0:
+            _writeJournalHeader(journalFile)
+        journalFile.write(_encodeEdit(journal.edits[0]))
+        journalFile.write('\n')
+    finally:
+        journalFile.close()
+
+def readJournal(path):
+    """ @brief Read a journal file
+
+        @param path String representing the path of the journal file
+
+        @return FlowtableJournal
+    """
+    journal = FlowtableJournal()
+    journalFile = open(path, 'r')
+    try:
+        header = json.loads(journalFile.readline() or 'null')
+        if not isinstance(header, dict) or header.get('format') != JOURNAL_FORMAT:
+            raise Exception("%s is not a flow table journal" % (path,) )
+        if header.get('version') != JOURNAL_VERSION:
+            raise Exception("Unsupported flow table journal version %s in %s" % (header.get('version'), path) )
+        for (lineNumber, line) in enumerate(journalFile, 2):
+            if not line.strip():
+                continue
+            try:
+                edit = json.loads(line)
+                key = rhessystypes.FQPatchID(*edit['patch'])
+                receivers = [FlowTableEntryReceiver(*r) for r in edit['receivers']]
+            except (ValueError, KeyError, TypeError):
+                raise Exception("Error in flow table journal %s at line %d" % (path, lineNumber) )
+            journal.edits.append(JournalEdit(key, receivers))
+    finally:
+        journalFile.close()
+    return journal
+
+
+def iterJournaledFlowtable(flowtable, journal):
+    """ @brief Stream the records of a flow table with the edits of a journal applied.
+        The numAdjacent of each edited entry is set to its number of receivers; its
+        road record, if any, is kept.
+
+        @param flowtable String representing the absolute path of the file
+        containing the RHESSys flowtable, or an iterable of FlowTableRecord,
+        e.g. as returned by flowtablecache.iterCachedRecords
+        @param journal FlowtableJournal
+
+        @return Iterator over FlowTableRecord
+
+        @raise Exception, once the flow table is exhausted, if the journal edits
+        patches that are not in the flow table
+    """
+    replacements = journal.getReplacements()
+    applied = set()
+    records = iterFlowtable(flowtable) if isinstance(flowtable, basestring) else flowtable
+    for record in records:
+        entry = record.entry
+        if replacements:
+            key = rhessystypes.FQPatchID(patchID=entry.patchID, zoneID=entry.zoneID, hillID=entry.hillID)
+            receivers = replacements.get(key)
+            if receivers is not None:
+                applied.add(key)
+                record = FlowTableRecord(entry._replace(numAdjacent=len(receivers)), receivers,
+                                         record.road)
+        yield record
+    missing = [k for k in replacements if k not in applied]
+    if missing:
+        source = flowtable if isinstance(flowtable, basestring) else "records"
+        raise Exception("Flow table journal edits %d patches not in flow table %s, e.g. %s" % \
+                        (len(missing), source, missing[0]) )
+
+def applyJournal(flowtable, journal, flowtableOutfile):
+    """ @brief Write a flow table with the edits of a journal applied, in one
+        sequential pass over the original flow table
+
+        @param flowtable String representing the absolute path of the file
+        containing the RHESSys flowtable, possibly compressed
+        @param journal FlowtableJournal, e.g. as returned by readJournal or composeJournals
+        @param flowtableOutfile String representing the absolute path of the flow table to be
+        written, compressed according to its suffix (see flowtableio.openFlowtable)
+
+        @return Number of flow table entries written
+
+        @raise Exception if the journal edits patches that are not in the flow
+        table, in which case flowtableOutfile is removed
+    """
+    # Compressed flow tables cannot be rewound to fill in the header afterwards
+    numPatches = None
+    if os.path.splitext(flowtableOutfile)[1] in COMPRESSION_SUFFIXES:
+        numPatches = readFlowtableNumPatches(flowtable)
+    try:
+        return writeFlowtableRecords(iterJournaledFlowtable(flowtable, journal), flowtableOutfile,
+                                     numPatches)
+    except:
+        if os.path.exists(flowtableOutfile):
+            os.unlink(flowtableOutfile)
+        raise
@@ -0,0 +1,164 @@
+"""@package flowtablelru
+
+@brief Process-wide cache of loaded flow tables, so that repeated requests
+        against the same flow table file do not load it again.  Flow tables
+        are keyed by the identity of their file (path, size and
+        modification time), so a changed file is loaded afresh, and are
+        evicted least recently used first to stay within a memory budget.
+        Cached flow tables are shared between callers and their arrays are
+        read-only.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor
+      the names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import os
+import threading
+from collections import namedtuple
+from collections import OrderedDict
+
+import flowtablearray
+
+## Constants
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+## Type definitions
+FlowtableCacheStats = namedtuple('FlowtableCacheStats', ['hits', 'misses', 'evictions', 'numTables',
+                                                         'numBytes', 'maxBytes'], verbose=False)
+
+
+class FlowtableLRUCache(object):
+    def __init__(self, maxBytes=DEFAULT_MAX_BYTES, loadFunction=None):
+        """ @brief Build a FlowtableLRUCache
+
+            @param maxBytes Number of bytes of flow table arrays the cache may hold
+            @param loadFunction Function called with the path of a flow table to
+            load it, flowtablearray.loadFlowtable by default
+        """
+        self.maxBytes = maxBytes
+        self.loadFunction = loadFunction or flowtablearray.loadFlowtable
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.numBytes = 0
+
+    def __len__(self):
+        return len(self._tables)
+
+    def _getIdentity(self, path):
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        return (path, st.st_size, st.st_mtime)
+
+    def getFlowtable(self, path):
+        """ @brief Get a flow table, loading it if it is not cached or its file has changed
+
+            @param path String representing the path of the flow table
+
+            @return ColumnarFlowtable with read-only arrays, shared with other callers
+        """
+        identity = self._getIdentity(path)
+        with self._lock:
+            cached = self._tables.pop(identity, None)
+            if cached is not None:
+                # The donor index of a cached table is built when first needed
+                (table, size) = cached
+                if table.nbytes != size:
+                    self.numBytes += table.nbytes - size
+                    size = table.nbytes
+                self._tables[identity] = (table, size)
+                self.hits += 1
+                return table
+            self.misses += 1
+
+        table = self.loadFunction(path)
+        table.setReadOnly()
+        size = table.nbytes
+        with self._lock:
+            if identity in self._tables:
+                # Loaded concurrently by another thread, share its copy
+                return self._tables[identity][0]
+            # Older versions of the same file can no longer be requested
+            for stale in [k for k in self._tables if k[0] == identity[0]]:
+                self._evict(stale)
+            if size <= self.maxBytes:
+                while self.numBytes + size > self.maxBytes:
+                    self._evict(next(iter(self._tables)))
+                self._tables[identity] = (table, size)
+                self.numBytes += size
+        return table
+
+    def _evict(self, identity):
+        (table, size) = self._tables.pop(identity)
+        self.numBytes -= size
+        self.evictions += 1
+
+    def setMaxBytes(self, maxBytes):
+        """ @brief Change the memory budget, evicting flow tables as needed """
+        with self._lock:
+            self.maxBytes = maxBytes
+            while self._tables and self.numBytes > self.maxBytes:
+                self._evict(next(iter(self._tables)))
+
+    def invalidate(self, path):
+        """ @brief Remove all versions of a flow table from the cache """
+        path = os.path.realpath(path)
+        with self._lock:
+            for identity in [k for k in self._tables if k[0] == path]:
+                self._evict(identity)
+
+    def clear(self):
+        """ @brief Remove all flow tables from the cache """
+        with self._lock:
+            for identity in list(self._tables):
+                self._evict(identity)
+
+    def getStats(self):
+        """ @brief Get the counters of this cache
+
+            @return FlowtableCacheStats
+        """
+        with self._lock:
+            return FlowtableCacheStats(self.hits, self.misses, self.evictions, len(self._tables),
+                                       self.numBytes, self.maxBytes)
+
+
+## Process-wide cache
+_cache = FlowtableLRUCache()
+
+def getFlowtable(path):
+    """ @brief Get a flow table from the process-wide cache, see FlowtableLRUCache.getFlowtable """
+    return _cache.getFlowtable(path)
+
+def getCache():
+    """ @brief Get the process-wide FlowtableLRUCache, e.g. to configure its memory
+        budget with setMaxBytes or to read its counters with getStats
+    """
+    return _cache
@@ -0,0 +1,346 @@
+"""@package flowtablemerge
+
+@brief Merge RHESSys flow tables, e.g. of sub-catchments generated in
+        parallel, into one flow table.  The inputs are streamed together
+        with a k-way merge.  RHESSys flow tables list their entries by
+        decreasing elevation, and the merge preserves that order; an input
+        that is not so ordered is sorted externally first, in sorted runs of
+        at most SORT_RUN_NUM_ENTRIES entries written to temporary files, so
+        that one entry per input (or per run of an unsorted input) is held
+        in memory while the merged flow table is written.  Inputs can also
+        simply be concatenated.
+
+        Entries with the same patch, zone and hillslope IDs in more than one
+        input (or more than once in an input) are collisions, found in a
+        first pass that reads only the entry lines of each input and keeps
+        the IDs of its entries in a NumPy array, 12 bytes per entry.
+        Receivers that cross the boundary between inputs are rewired
+        through a boundary mapping from the IDs used in an input to the IDs
+        of the patch in the merged flow table.
+
+        Boundary mapping file format: one mapping per line,
+        srcPatchID srcZoneID srcHillID dstPatchID dstZoneID dstHillID
+        Blank lines and lines starting with # are ignored.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor
+      the names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import heapq
+import tempfile
+import cPickle
+from collections import namedtuple
+from collections import OrderedDict
+
+import numpy as np
+
+import rhessystypes
+from flowtableio import FlowTableEntryReceiver
+from flowtableio import FlowTableRecord
+from flowtableio import FLOW_ENTRY_NUM_TOKENS
+from flowtableio import openFlowtable
+from flowtableio import iterFlowtable
+from flowtableio import writeFlowtableRecords
+
+## Constants
+COLLISION_ERROR = 'error'
+COLLISION_KEEP_FIRST = 'first'
+COLLISION_POLICIES = (COLLISION_ERROR, COLLISION_KEEP_FIRST)
+SORT_RUN_NUM_ENTRIES = 100000
+
+## Type definitions
+FlowtableCollision = namedtuple('FlowtableCollision', ['key', 'inputs', 'positions'], verbose=False)
+MergeStats = namedtuple('MergeStats', ['numPatches', 'numCollisions', 'numSkipped', 'numRewired'],
+                        verbose=False)
+
+
+def readBoundaryMap(path):
+    """ @brief Read a boundary mapping file
+
+        @param path String representing the path of the boundary mapping file
+
+        @return Dict mapping rhessystypes.FQPatchID in an input to rhessystypes.FQPatchID
+        in the merged flow table
+
+        @raise Exception if a line does not hold six integers
+    """
+    boundaryMap = {}
+    f = open(path, 'r')
+    try:
+        for (lineNumber, line) in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            values = line.split()
+            if len(values) != 6:
+                raise Exception("Error in boundary map %s at line %d, expected 6 IDs but found %d" % \
+                                (path, lineNumber, len(values)) )
+            ids = [int(v) for v in values]
+            boundaryMap[rhessystypes.FQPatchID(*ids[:3])] = rhessystypes.FQPatchID(*ids[3:])
+    finally:
+        f.close()
+    return boundaryMap
+
+
+def _readEntryIDs(flowtable):
+    """ @brief Scan the entry lines of a flow table, skipping its receiver and road
+        records without parsing them
+
+        @return Tuple (ids, isSorted) where ids is an array of the patch, zone and
+        hillslope IDs of the entries of the flow table, of shape (number of entries, 3),
+        and isSorted is True if the entries are sorted by decreasing elevation
+    """
+    state = {'isSorted': True, 'z': float('inf')}
+    def iterIDs(flow):
+        for line in flow:
+            values = line.split()
+            if len(values) == FLOW_ENTRY_NUM_TOKENS:
+                z = float(values[5])
+                if z > state['z']:
+                    state['isSorted'] = False
+                state['z'] = z
+                yield int(values[0])
+                yield int(values[1])
+                yield int(values[2])
+
+    flow = openFlowtable(flowtable, 'r')
+    try:
+        # Skip number of patches
+        flow.readline()
+        ids = np.fromiter(iterIDs(flow), dtype=np.int32)
+    finally:
+        flow.close()
+    return (ids.reshape(-1, 3), state['isSorted'])
+
+def findCollisions(flowtables, ids=None):
+    """ @brief Find the entries that occur more than once in a set of flow tables.
+        The flow tables are read one at a time, keeping only the IDs of their entries.
+
+        @param flowtables List of paths of flow tables, possibly compressed
+        @param ids List of the arrays of IDs of the entries of each flow table, as
+        returned by _readEntryIDs, if already read
+
+        @return Tuple (collisions, numEntries) where collisions is a list of
+        FlowtableCollision, each holding the rhessystypes.FQPatchID, the indexes
+        into flowtables of the inputs in which it occurs (once per occurrence) and
+        the position of each occurrence in its input, in input and position order;
+        numEntries is the total number of entries in the flow tables
+    """
+    if ids is None:
+        ids = [_readEntryIDs(f)[0] for f in flowtables]
+    if not ids:
+        return ([], 0)
+    inputs = np.repeat(np.arange(len(ids)), [len(i) for i in ids])
+    positions = np.concatenate([np.arange(len(i)) for i in ids])
+    ids = np.concatenate(ids)
+    if not len(ids):
+        return ([], 0)
+    (patchIDs, zoneIDs, hillIDs) = (ids[:,0], ids[:,1], ids[:,2])
+
+    order = np.lexsort((hillIDs, zoneIDs, patchIDs))  # stable, so occurrences stay in input order
+    isRepeat = np.ones(len(order) - 1, dtype=bool)
+    for column in (patchIDs, zoneIDs, hillIDs):
+        sortedIDs = column[order]
+        isRepeat &= sortedIDs[1:] == sortedIDs[:-1]
+    collided = np.zeros(len(order), dtype=bool)
+    collided[1:] |= isRepeat
+    collided[:-1] |= isRepeat
+    collisions = OrderedDict()
+    for row in order[collided].tolist():
+        key = rhessystypes.FQPatchID(int(patchIDs[row]), int(zoneIDs[row]), int(hillIDs[row]))
+        collisions.setdefault(key, []).append( (int(inputs[row]), int(positions[row])) )
+    return ([FlowtableCollision(k, [i for (i, p) in v], [p for (i, p) in v]) \
+             for (k, v) in collisions.iteritems()], len(order))
+
+
+def rewireRecord(record, boundaryMap):
+    """ @brief Rewire the receivers and road stream patch of a flow table entry
+        through a boundary mapping.  Receivers mapped to the same patch are
+        combined, their gammas summed.
+
+        @param record FlowTableRecord
+        @param boundaryMap Dict mapping rhessystypes.FQPatchID to rhessystypes.FQPatchID
+
+        @return Tuple (record, number of receivers and road records rewired)
+    """
+    numRewired = 0
+    receivers = OrderedDict()
+    for r in record.receivers:
+        key = rhessystypes.FQPatchID(r.patchID, r.zoneID, r.hillID)
+        mapped = boundaryMap.get(key)
+        if mapped is not None:
+            key = mapped
+            numRewired += 1
+        if key in receivers:
+            receivers[key] += r.gamma
+        else:
+            receivers[key] = r.gamma
+    road = record.road
+    if road is not None:
+        mapped = boundaryMap.get(rhessystypes.FQPatchID(road.streamPatchID, road.streamZoneID,
+                                                        road.streamHillID))
+        if mapped is not None:
+            road = road._replace(streamPatchID=mapped.patchID, streamZoneID=mapped.zoneID,
+                                 streamHillID=mapped.hillID)
+            numRewired += 1
+    if not numRewired:
+        return (record, 0)
+    receivers = [FlowTableEntryReceiver(k.patchID, k.zoneID, k.hillID, g) for (k, g) in receivers.iteritems()]
+    entry = record.entry._replace(numAdjacent=len(receivers))
+    return (FlowTableRecord(entry, receivers, road), numRewired)
+
+
+def _writeSortedRun(decorated):
+    """ @brief Sort decorated records and write them to a temporary file
+
+        @return File object of the temporary file, positioned at its start
+    """
+    decorated.sort(key=lambda d: d[:3])
+    run = tempfile.TemporaryFile()
+    pickler = cPickle.Pickler(run, cPickle.HIGHEST_PROTOCOL)
+    for d in decorated:
+        pickler.dump(d)
+        # Records are written once, do not keep them in the memo
+        pickler.clear_memo()
+    run.seek(0)
+    return run
+
+def _iterRun(run):
+    unpickler = cPickle.Unpickler(run)
+    while True:
+        try:
+            yield unpickler.load()
+        except EOFError:
+            return
+
+def _iterDecorated(index, flowtable, isSorted):
+    """ @brief Decorate the records of an input for merging by decreasing elevation,
+        breaking ties by input and position in the input.  An input that is not
+        sorted by decreasing elevation is sorted externally: runs of
+        SORT_RUN_NUM_ENTRIES records are sorted and written to temporary files,
+        which are then merged.
+    """
+    records = ( (-record.entry.z, index, position, record) \
+                for (position, record) in enumerate(iterFlowtable(flowtable)) )
+    if isSorted:
+        for decorated in records:
+            yield decorated
+        return
+    runs = []
+    try:
+        run = []
+        for decorated in records:
+            run.append(decorated)
+            if len(run) >= SORT_RUN_NUM_ENTRIES:
+                runs.append(_writeSortedRun(run))
+                run = []
+        if run:
+            runs.append(_writeSortedRun(run))
+        del run
+        for decorated in heapq.merge(*[_iterRun(r) for r in runs]):
+            yield decorated
+    finally:
+        for r in runs:
+            r.close()
+
+def iterMergedFlowtables(flowtables, byElevation=True, sortedInputs=None):
+    """ @brief Stream the entries of several flow tables as one
+
+        @param flowtables List of paths of flow tables, possibly compressed
+        @param byElevation True to merge the entries by decreasing elevation, False
+        to concatenate the flow tables
+        @param sortedInputs List telling for each flow table whether its entries are
+        sorted by decreasing elevation; if None, the entries are scanned to find out
+
+        @return Iterator over tuples (index into flowtables of the input, position of
+        the entry in the input, FlowTableRecord)
+    """
+    if not byElevation:
+        return ( (index, position, record) for (index, flowtable) in enumerate(flowtables) \
+                 for (position, record) in enumerate(iterFlowtable(flowtable)) )
+    if sortedInputs is None:
+        sortedInputs = [_readEntryIDs(f)[1] for f in flowtables]
+    merged = heapq.merge(*[_iterDecorated(i, f, isSorted) \
+                           for (i, (f, isSorted)) in enumerate(zip(flowtables, sortedInputs))])
+    return ( (index, position, record) for (z, index, position, record) in merged )
+
+def mergeFlowtables(flowtables, flowtableOutfile, boundaryMap=None, onCollision=COLLISION_ERROR,
+                    byElevation=True):
+    """ @brief Merge several flow tables into one
+
+        @param flowtables List of paths of flow tables, possibly compressed
+        @param flowtableOutfile String representing the path of the flow table to be written,
+        compressed according to its suffix
+        @param boundaryMap Dict mapping rhessystypes.FQPatchID of receivers (and road stream
+        patches) in the inputs to rhessystypes.FQPatchID in the merged flow table, e.g. as
+        returned by readBoundaryMap
+        @param onCollision COLLISION_ERROR to refuse to merge flow tables that have entries
+        in common, COLLISION_KEEP_FIRST to keep the occurrence of such entries in the first
+        input, in the order of flowtables, that has them (the first one in that input)
+        @param byElevation True to merge the entries by decreasing elevation, False to
+        concatenate the flow tables
+
+        @return MergeStats
+
+        @raise Exception if onCollision is COLLISION_ERROR and there are collisions; the
+        message describes the first of them.  Nothing is written in that case.
+    """
+    if onCollision not in COLLISION_POLICIES:
+        raise Exception("Unknown collision policy %s, expected one of %s" % \
+                        (onCollision, ', '.join(COLLISION_POLICIES)) )
+    ids = []
+    sortedInputs = []
+    for f in flowtables:
+        (inputIDs, isSorted) = _readEntryIDs(f)
+        ids.append(inputIDs)
+        sortedInputs.append(isSorted)
+    (collisions, numEntries) = findCollisions(flowtables, ids)
+    del ids
+    if collisions and onCollision == COLLISION_ERROR:
+        c = collisions[0]
+        raise Exception("%d patches occur more than once in the flow tables to merge, e.g. patch %d zone %d hill %d in %s" % \
+                        (len(collisions), c.key.patchID, c.key.zoneID, c.key.hillID,
+                         ', '.join(flowtables[i] for i in c.inputs)) )
+    # Occurrences are in input order, the first is kept
+    skipped = set()
+    for c in collisions:
+        skipped.update(zip(c.inputs[1:], c.positions[1:]))
+    numSkipped = len(skipped)
+    counts = {'rewired': 0}
+
+    def records():
+        for (index, position, record) in iterMergedFlowtables(flowtables, byElevation, sortedInputs):
+            if skipped and (index, position) in skipped:
+                continue
+            if boundaryMap:
+                (record, numRewired) = rewireRecord(record, boundaryMap)
+                counts['rewired'] += numRewired
+            yield record
+
+    numPatches = writeFlowtableRecords(records(), flowtableOutfile, numEntries - numSkipped)
+    return MergeStats(numPatches, len(collisions), numSkipped, counts['rewired'])
@@ -0,0 +1,197 @@
+"""@package flowtableoverlay
+
+@brief Server-side store of the receiver edits each user makes to a
+        flow table, kept in Redis beside the flow table cache rather than
+        in the Django session.  Each (flow table, owner) pair has its own
+        hash mapping the packed key of an edited patch (see
+        flowtablecache.packKey) to its encoded receivers (see
+        flowtablecache.encodeReceivers), so reading or writing the edit of
+        one patch is O(1) and merging the edits with the flow table is
+        O(number of edits).
+
+        Redis keys used for a flow table named name:
+        name.edits.owner    Hash of the edits made by owner, expiring
+                            OVERLAY_TIMEOUT seconds after the last edit
+
+        Redis keys used for an owner:
+        edits.owner         Set of the names of the flow tables edited by
+                            owner, so that its edits can be handed over to
+                            another owner (see moveEdits)
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor
+      the names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+from flowtableio import FlowTableEntryRoad
+from flowtablejournal import FlowtableJournal
+from flowtablecache import packKey
+from flowtablecache import unpackKey
+from flowtablecache import encodeReceivers
+from flowtablecache import decodeReceivers
+
+## Constants
+OVERLAY_TIMEOUT = 14 * 24 * 3600
+
+
+def getOverlayKey(name, owner):
+    """ @brief Get the Redis key holding the edits of an owner
+
+        @param name Name of the flow table
+        @param owner String identifying the owner of the edits, e.g. a user or session
+
+        @return String representing the Redis key
+    """
+    return "%s.edits.%s" % (name, owner)
+
+def getOwnerKey(owner):
+    """ @brief Get the Redis key holding the names of the flow tables edited by an owner """
+    return "edits.%s" % (owner,)
+
+def setEditedReceivers(redisClient, name, owner, key, receivers):
+    """ @brief Record the replacement of the receivers of a patch, replacing any
+        earlier edit of the patch
+
+        @param redisClient redis.Redis client
+        @param name Name of the flow table
+        @param owner String identifying the owner of the edits
+        @param key rhessystypes.FQPatchID of the patch
+        @param receivers List of FlowTableEntryReceiver objects
+    """
+    overlayKey = getOverlayKey(name, owner)
+    ownerKey = getOwnerKey(owner)
+    pipe = redisClient.pipeline(transaction=False)
+    pipe.hset(overlayKey, packKey(key), encodeReceivers(receivers))
+    pipe.expire(overlayKey, OVERLAY_TIMEOUT)
+    pipe.sadd(ownerKey, name)
+    pipe.expire(ownerKey, OVERLAY_TIMEOUT)
+    pipe.execute()
+
+def getEditedReceivers(redisClient, name, owner, key):
+    """ @brief Get the edited receivers of a patch
+
+        @param redisClient redis.Redis client
+        @param name Name of the flow table
+        @param owner String identifying the owner of the edits
+        @param key rhessystypes.FQPatchID of the patch
+
+        @return List of FlowTableEntryReceiver objects, None if the patch has not been edited
+    """
+    value = redisClient.hget(getOverlayKey(name, owner), packKey(key))
+    if value is None:
+        return None
+    return decodeReceivers(value)
+
+def getEdits(redisClient, name, owner):
+    """ @brief Get all the edits of an owner
+
+        @param redisClient redis.Redis client
+        @param name Name of the flow table
+        @param owner String identifying the owner of the edits
+
+        @return Dict mapping rhessystypes.FQPatchID to list of FlowTableEntryReceiver objects
+    """
+    edits = redisClient.hgetall(getOverlayKey(name, owner))
+    return dict( (unpackKey(k), decodeReceivers(v)) for (k, v) in edits.iteritems() )
+
+def getNumEdits(redisClient, name, owner):
+    """ @brief Get the number of patches edited by an owner """
+    return redisClient.hlen(getOverlayKey(name, owner))
+
+def clearEdits(redisClient, name, owner):
+    """ @brief Discard all the edits of an owner """
+    pipe = redisClient.pipeline(transaction=False)
+    pipe.delete(getOverlayKey(name, owner))
+    pipe.srem(getOwnerKey(owner), name)
+    pipe.execute()
+
+def moveEdits(redisClient, fromOwner, toOwner):
+    """ @brief Hand the edits of an owner over to another owner, e.g. the edits made
+        in an anonymous session to the user who logs in.  Where both owners edited
+        the same patch, the edit of fromOwner wins.
+
+        @param redisClient redis.Redis client
+        @param fromOwner String identifying the owner whose edits are moved
+        @param toOwner String identifying the owner receiving the edits
+
+        @return Number of flow tables whose edits were moved
+    """
+    fromOwnerKey = getOwnerKey(fromOwner)
+    toOwnerKey = getOwnerKey(toOwner)
+    numMoved = 0
+    for name in redisClient.smembers(fromOwnerKey):
+        edits = redisClient.hgetall(getOverlayKey(name, fromOwner))
+        if not edits:
+            continue
+        overlayKey = getOverlayKey(name, toOwner)
+        pipe = redisClient.pipeline(transaction=False)
+        pipe.hmset(overlayKey, edits)
+        pipe.expire(overlayKey, OVERLAY_TIMEOUT)
+        pipe.sadd(toOwnerKey, name)
+        pipe.expire(toOwnerKey, OVERLAY_TIMEOUT)
+        pipe.delete(getOverlayKey(name, fromOwner))
+        pipe.execute()
+        numMoved += 1
+    redisClient.delete(fromOwnerKey)
+    return numMoved
+
+def getOverlayJournal(redisClient, name, owner):
+    """ @brief Get the edits of an owner as a journal, e.g. for
+        flowtablejournal.applyJournal or flowtablejournal.iterJournaledFlowtable
+
+        @param redisClient redis.Redis client
+        @param name Name of the flow table
+        @param owner String identifying the owner of the edits
+
+        @return flowtablejournal.FlowtableJournal with one edit per patch, in key order
+    """
+    edits = getEdits(redisClient, name, owner)
+    journal = FlowtableJournal()
+    for key in sorted(edits.keys()):
+        journal.setReceivers(key, edits[key])
+    return journal
+
+def overlayItems(redisClient, name, owner, key, items):
+    """ @brief Merge the edit of a patch, if any, into its flow table items
+
+        @param redisClient redis.Redis client
+        @param name Name of the flow table
+        @param owner String identifying the owner of the edits
+        @param key rhessystypes.FQPatchID of the patch
+        @param items List containing a FlowTableEntry, its FlowTableEntryReceiver
+        objects, and possibly one FlowTableEntryRoad, e.g. as returned by
+        flowtablecache.getCachedItems
+
+        @return List of items with the edited receivers in place of the original
+        ones, and the numAdjacent of the entry updated to match
+    """
+    receivers = getEditedReceivers(redisClient, name, owner, key)
+    if receivers is None:
+        return items
+    entry = items[0]
+    road = [item for item in items if isinstance(item, FlowTableEntryRoad)]
+    return [entry._replace(numAdjacent=len(receivers))] + receivers + road
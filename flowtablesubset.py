@@ -0,0 +1,388 @@
+"""@package flowtablesubset
+
+@brief Extract the part of a RHESSys flow table covering a set of
+        hillslopes, a set of zones, or a bounding box of entry coordinates.
+        Criteria that are given together must all be met.  Receivers of
+        selected entries that are not themselves selected entries of the
+        flow table, and road records whose stream patch is not, are handled
+        according to a receiver policy:
+        RECEIVER_POLICY_DROP    Remove them and scale the gammas of the
+                                remaining receivers so that their sum is
+                                unchanged.  An entry whose road record is
+                                removed becomes a land patch
+                                (LAND_TYPE_LAND).
+        RECEIVER_POLICY_KEEP    Keep them, so that the sub-table still
+                                drains out of the subset
+
+        subsetColumnar extracts from a loaded ColumnarFlowtable, e.g. one
+        returned by flowtablearray.loadFlowtable, which is the fastest way to
+        make repeated extractions.  subsetFlowtable streams the flow table
+        instead: selections with RECEIVER_POLICY_KEEP take one pass, while
+        RECEIVER_POLICY_DROP takes a first pass to find the selected patches.
+        Both apply the same rule: a receiver or stream patch is kept under
+        RECEIVER_POLICY_DROP only if it is a selected entry.  Both write a
+        patch that occurs more than once in the flow table once, at the
+        position of its first occurrence with the items of its last, as
+        readFlowtable does; subsetFlowtable buffers only the records of
+        patches it has already seen, and in a single pass merges them into
+        the flow table it wrote afterwards.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor
+      the names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import os
+import itertools
+import tempfile
+
+import numpy as np
+
+import rhessystypes
+from flowtableio import FlowTableEntryReceiver
+from flowtableio import FlowTableRecord
+from flowtableio import LAND_TYPE_LAND
+from flowtableio import COMPRESSION_SUFFIXES
+from flowtableio import iterFlowtable
+from flowtableio import writeFlowtableRecords
+from flowtablearray import ColumnarFlowtable
+
+## Constants
+RECEIVER_POLICY_DROP = 'drop'
+RECEIVER_POLICY_KEEP = 'keep'
+RECEIVER_POLICIES = (RECEIVER_POLICY_DROP, RECEIVER_POLICY_KEEP)
+
+
+def _checkSelection(hillIDs, zoneIDs, bbox, receiverPolicy):
+    if hillIDs is None and zoneIDs is None and bbox is None:
+        raise Exception("No hillslopes, zones or bounding box given to select flow table entries")
+    if receiverPolicy not in RECEIVER_POLICIES:
+        raise Exception("Unknown receiver policy %s, expected one of %s" % \
+                        (receiverPolicy, ', '.join(RECEIVER_POLICIES)) )
+
+def selectEntries(patchIDs, zoneIDs, hillIDs, x, y, selectHillIDs=None, selectZoneIDs=None, bbox=None):
+    """ @brief Select flow table entries from arrays of their columns
+
+        @param patchIDs Array of patch IDs
+        @param zoneIDs Array of zone IDs
+        @param hillIDs Array of hillslope IDs
+        @param x Array of x coordinates
+        @param y Array of y coordinates
+        @param selectHillIDs Sequence of hillslope IDs to select, None for all
+        @param selectZoneIDs Sequence of zone IDs to select, None for all
+        @param bbox Tuple (xmin, ymin, xmax, ymax) of the coordinates to select,
+        inclusive, None for all
+
+        @return Boolean array, True for selected entries
+    """
+    mask = np.ones(len(patchIDs), dtype=bool)
+    if selectHillIDs is not None:
+        mask &= np.in1d(hillIDs, np.asarray(list(selectHillIDs), dtype=np.int64))
+    if selectZoneIDs is not None:
+        mask &= np.in1d(zoneIDs, np.asarray(list(selectZoneIDs), dtype=np.int64))
+    if bbox is not None:
+        (xmin, ymin, xmax, ymax) = bbox
+        mask &= (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+    return mask
+
+def _isEntrySelected(entry, hillIDs, zoneIDs, bbox):
+    if hillIDs is not None and entry.hillID not in hillIDs:
+        return False
+    if zoneIDs is not None and entry.zoneID not in zoneIDs:
+        return False
+    if bbox is not None:
+        (xmin, ymin, xmax, ymax) = bbox
+        if not (xmin <= entry.x <= xmax and ymin <= entry.y <= ymax):
+            return False
+    return True
+
+def _renormalize(receivers, keptReceivers):
+    """ @brief Scale the gammas of the kept receivers so that they sum to the sum
+        of the gammas of all the receivers
+    """
+    kept = sum(r.gamma for r in keptReceivers)
+    if kept <= 0.0:
+        return keptReceivers
+    scale = sum(r.gamma for r in receivers) / kept
+    return [FlowTableEntryReceiver(r.patchID, r.zoneID, r.hillID, r.gamma * scale) for r in keptReceivers]
+
+
+def subsetColumnar(table, hillIDs=None, zoneIDs=None, bbox=None, receiverPolicy=RECEIVER_POLICY_DROP):
+    """ @brief Extract a sub-table from a ColumnarFlowtable
+
+        @param table ColumnarFlowtable
+        @param hillIDs Sequence of hillslope IDs to select, None for all
+        @param zoneIDs Sequence of zone IDs to select, None for all
+        @param bbox Tuple (xmin, ymin, xmax, ymax) of the entry coordinates to select,
+        inclusive, None for all
+        @param receiverPolicy RECEIVER_POLICY_DROP or RECEIVER_POLICY_KEEP
+
+        @return ColumnarFlowtable holding the selected entries, in table order.  As
+        with writeFlowtable, a key that occurs more than once is taken once.
+
+        @raise Exception if no selection criteria or an unknown receiver policy is given
+    """
+    _checkSelection(hillIDs, zoneIDs, bbox, receiverPolicy)
+    entries = table.entries
+    mask = selectEntries(entries['patchID'], entries['zoneID'], entries['hillID'],
+                         entries['x'], entries['y'], hillIDs, zoneIDs, bbox)
+    rows = table.getWriteOrder()
+    rows = rows[mask[rows]]
+    (receiverRows, numReceivers) = table.getReceiverRows(rows)
+    receivers = table.receivers[receiverRows]
+
+    if receiverPolicy == RECEIVER_POLICY_DROP:
+        owners = np.repeat(np.arange(len(rows)), numReceivers)
+        indexes = table.getIndexesForIDs(receivers['patchID'], receivers['zoneID'], receivers['hillID'])
+        keep = indexes >= 0
+        keep[keep] = mask[indexes[keep]]
+        total = np.bincount(owners, weights=receivers['gamma'], minlength=len(rows))
+        kept = np.bincount(owners[keep], weights=receivers['gamma'][keep], minlength=len(rows))
+        scale = np.ones(len(rows))
+        positive = kept > 0.0
+        scale[positive] = total[positive] / kept[positive]
+        receivers = receivers[keep]
+        owners = owners[keep]
+        receivers['gamma'] *= scale[owners]
+        numReceivers = np.bincount(owners, minlength=len(rows))
+
+    subEntries = entries[rows]
+    subEntries['numAdjacent'] = numReceivers
+    receiverOffsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(numReceivers, out=receiverOffsets[1:])
+    roadIndex = table.roadIndex[rows]
+    hasRoad = roadIndex >= 0
+    if receiverPolicy == RECEIVER_POLICY_DROP:
+        roads = table.roads[roadIndex[hasRoad]]
+        streams = table.getIndexesForIDs(roads['streamPatchID'], roads['streamZoneID'], roads['streamHillID'])
+        keep = streams >= 0
+        keep[keep] = mask[streams[keep]]
+        dropped = np.flatnonzero(hasRoad)[~keep]
+        subEntries['landType'][dropped] = LAND_TYPE_LAND
+        hasRoad[dropped] = False
+    roads = table.roads[roadIndex[hasRoad]]
+    subRoadIndex = np.full(len(rows), -1, dtype=np.int64)
+    subRoadIndex[hasRoad] = np.arange(len(roads))
+    return ColumnarFlowtable(entries=subEntries, receiverOffsets=receiverOffsets,
+                             receivers=receivers, roadIndex=subRoadIndex, roads=roads)
+
+
+def iterFlowtableSubset(records, hillIDs=None, zoneIDs=None, bbox=None,
+                        receiverPolicy=RECEIVER_POLICY_DROP, selectedKeys=None):
+    """ @brief Stream the selected entries of a flow table
+
+        @param records Iterable of FlowTableRecord, e.g. returned by flowtableio.iterFlowtable.
+        Records are taken as they come: a patch that occurs more than once is
+        yielded once per occurrence selected.
+        @param hillIDs Sequence of hillslope IDs to select, None for all
+        @param zoneIDs Sequence of zone IDs to select, None for all
+        @param bbox Tuple (xmin, ymin, xmax, ymax) of the entry coordinates to select,
+        inclusive, None for all
+        @param receiverPolicy RECEIVER_POLICY_DROP or RECEIVER_POLICY_KEEP
+        @param selectedKeys Set of the rhessystypes.FQPatchID of the selected entries.
+        Needed to drop receivers and road records, since whether a receiver or stream
+        patch is a selected entry cannot be told from its IDs alone.
+
+        @return Iterator over FlowTableRecord
+
+        @raise Exception if no selection criteria or an unknown receiver policy is
+        given, or if selectedKeys is needed but not given
+    """
+    _checkSelection(hillIDs, zoneIDs, bbox, receiverPolicy)
+    hillIDs = set(hillIDs) if hillIDs is not None else None
+    zoneIDs = set(zoneIDs) if zoneIDs is not None else None
+    drop = receiverPolicy == RECEIVER_POLICY_DROP
+    if drop and selectedKeys is None:
+        raise Exception("The selected keys are needed to drop receivers")
+
+    for record in records:
+        entry = record.entry
+        if not _isEntrySelected(entry, hillIDs, zoneIDs, bbox):
+            continue
+        if drop:
+            kept = [r for r in record.receivers if \
+                    rhessystypes.FQPatchID(r.patchID, r.zoneID, r.hillID) in selectedKeys]
+            road = record.road
+            if road is not None and rhessystypes.FQPatchID(road.streamPatchID, road.streamZoneID,
+                                                           road.streamHillID) not in selectedKeys:
+                (road, entry) = (None, entry._replace(landType=LAND_TYPE_LAND))
+            receiversDropped = len(kept) < len(record.receivers)
+            if receiversDropped:
+                kept = _renormalize(record.receivers, kept)
+            if receiversDropped or road is not record.road:
+                record = FlowTableRecord(entry._replace(numAdjacent=len(kept)), kept, road)
+        yield record
+
+def _getKey(entry):
+    return rhessystypes.FQPatchID(entry.patchID, entry.zoneID, entry.hillID)
+
+def _findSelectedKeys(flowtable, hills, zones, bbox):
+    """ @brief Find the selected patches of a flow table in one pass, buffering
+        only the records of patches that were already seen
+
+        @return Tuple (selectedKeys, lastRecords): the set of rhessystypes.FQPatchID
+        of the selected patches, and a dict mapping the rhessystypes.FQPatchID of
+        each patch that occurs more than once to the FlowTableRecord of its last
+        occurrence
+    """
+    seen = set()
+    selectedKeys = set()
+    lastRecords = {}
+    for record in iterFlowtable(flowtable):
+        key = _getKey(record.entry)
+        if key in seen:
+            lastRecords[key] = record
+            continue
+        seen.add(key)
+        if _isEntrySelected(record.entry, hills, zones, bbox):
+            selectedKeys.add(key)
+    del seen
+    # A patch that occurs more than once is selected according to its last occurrence
+    for (key, record) in lastRecords.iteritems():
+        if _isEntrySelected(record.entry, hills, zones, bbox):
+            selectedKeys.add(key)
+        else:
+            selectedKeys.discard(key)
+    return (selectedKeys, lastRecords)
+
+def _iterUniqueRecords(records, lastRecords):
+    """ @brief Yield each patch of a stream of records once, at its first position,
+        with the record of its last occurrence
+
+        @param records Iterable of FlowTableRecord
+        @param lastRecords Dict returned by _findSelectedKeys
+    """
+    if not lastRecords:
+        for record in records:
+            yield record
+        return
+    written = set()
+    for record in records:
+        key = _getKey(record.entry)
+        if key in lastRecords:
+            if key in written:
+                continue
+            written.add(key)
+            record = lastRecords[key]
+        yield record
+
+def subsetFlowtable(flowtable, flowtableOutfile, hillIDs=None, zoneIDs=None, bbox=None,
+                    receiverPolicy=RECEIVER_POLICY_DROP):
+    """ @brief Write the selected entries of a flow table, streaming the flow table
+        rather than loading it
+
+        @param flowtable String representing the absolute path of the file
+        containing the RHESSys flowtable, possibly compressed
+        @param flowtableOutfile String representing the absolute path of the flow table
+        to be written, compressed according to its suffix
+        @param hillIDs Sequence of hillslope IDs to select, None for all
+        @param zoneIDs Sequence of zone IDs to select, None for all
+        @param bbox Tuple (xmin, ymin, xmax, ymax) of the entry coordinates to select,
+        inclusive, None for all
+        @param receiverPolicy RECEIVER_POLICY_DROP or RECEIVER_POLICY_KEEP
+
+        @return Number of flow table entries written
+    """
+    _checkSelection(hillIDs, zoneIDs, bbox, receiverPolicy)
+    hills = set(hillIDs) if hillIDs is not None else None
+    zones = set(zoneIDs) if zoneIDs is not None else None
+    # A first pass finds the selected patches when receivers and road records are
+    # dropped, or when the header cannot be filled in afterwards
+    if receiverPolicy == RECEIVER_POLICY_DROP or \
+            os.path.splitext(flowtableOutfile)[1] in COMPRESSION_SUFFIXES:
+        (selectedKeys, lastRecords) = _findSelectedKeys(flowtable, hills, zones, bbox)
+        records = iterFlowtableSubset(_iterUniqueRecords(iterFlowtable(flowtable), lastRecords), hillIDs,
+                                      zoneIDs, bbox, receiverPolicy, selectedKeys)
+        return writeFlowtableRecords(records, flowtableOutfile, len(selectedKeys))
+
+    # Otherwise the first occurrence of each selected patch is written as it is
+    # read, and the records of patches that were already seen are buffered and
+    # merged into the written flow table afterwards
+    firstPositions = {}
+    writtenPositions = []
+    lastRecords = {}
+    def iterFirstRecords():
+        for (position, record) in enumerate(iterFlowtable(flowtable)):
+            key = _getKey(record.entry)
+            if key in firstPositions:
+                lastRecords[key] = record
+                continue
+            firstPositions[key] = position
+            if _isEntrySelected(record.entry, hills, zones, bbox):
+                writtenPositions.append(position)
+                yield record
+    numWritten = writeFlowtableRecords(iterFirstRecords(), flowtableOutfile)
+    if not lastRecords:
+        return numWritten
+    changes = {}
+    for (key, record) in lastRecords.iteritems():
+        changes[firstPositions[key]] = record if _isEntrySelected(record.entry, hills, zones, bbox) else None
+    return _mergeChanges(flowtableOutfile, writtenPositions, changes)
+
+def _iterMergedRecords(records, positions, changes):
+    """ @brief Merge the changed records of patches that occur more than once into
+        the records written for their first occurrences
+
+        @param records Iterable of the FlowTableRecord written
+        @param positions Sequence of the position in the input of each record written
+        @param changes Dict mapping the input position of the first occurrence of a
+        patch to the FlowTableRecord of its last occurrence, or to None if the patch
+        is not selected
+    """
+    changed = sorted(changes.iteritems())
+    i = 0
+    for (position, record) in itertools.izip(positions, records):
+        while i < len(changed) and changed[i][0] < position:
+            if changed[i][1] is not None:
+                yield changed[i][1]
+            i += 1
+        if i < len(changed) and changed[i][0] == position:
+            record = changed[i][1]
+            i += 1
+            if record is None:
+                continue
+        yield record
+    for (position, record) in changed[i:]:
+        if record is not None:
+            yield record
+
+def _mergeChanges(flowtableOutfile, positions, changes):
+    """ @brief Rewrite an uncompressed flow table written by subsetFlowtable with
+        the records of patches that occur more than once
+
+        @return Number of flow table entries written
+    """
+    (fd, tmpPath) = tempfile.mkstemp(prefix='.subset', dir=os.path.dirname(os.path.abspath(flowtableOutfile)))
+    os.close(fd)
+    try:
+        numWritten = writeFlowtableRecords(_iterMergedRecords(iterFlowtable(flowtableOutfile), positions, changes),
+                                           tmpPath)
+        os.rename(tmpPath, flowtableOutfile)
+    except:
+        os.unlink(tmpPath)
+        raise
+    return numWritten
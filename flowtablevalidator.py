@@ -0,0 +1,221 @@
+"""@package flowtablevalidator
+
+@brief Check the integrity of RHESSys flow tables before they are handed
+        to RHESSys.  All checks operate on the columnar representation of
+        the flow table (flowtablearray.ColumnarFlowtable) with batched
+        array operations; flow table dicts returned by
+        flowtableio.readFlowtable are converted first.
+
+        Checks:
+        CHECK_DUPLICATE_KEY -- A patch has more than one entry
+        CHECK_NUM_ADJACENT -- The number of receivers of an entry differs
+                              from its numAdjacent
+        CHECK_GAMMA_SUM -- The gammas of the receivers of an entry do not
+                           sum to 1.  RHESSys multiplies each receiver's
+                           gamma by the entry's totalGamma, so receiver
+                           gammas are fractions of totalGamma.
+        CHECK_NEGATIVE_GAMMA -- A receiver has a negative gamma
+        CHECK_MISSING_RECEIVER -- A receiver is not an entry of the flow table
+        CHECK_SELF_RECEIVER -- A patch is its own receiver
+        CHECK_ROAD_LAND_TYPE -- An entry with land type LAND_TYPE_ROAD has no
+                                road record, or an entry with a road record
+                                has another land type
+        CHECK_MISSING_STREAM -- The stream patch of a road record is not an
+                                entry of the flow table
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor
+      the names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+from collections import namedtuple
+from collections import OrderedDict
+
+import numpy as np
+
+from flowtableio import LAND_TYPE_ROAD
+import flowtablearray
+
+## Constants
+CHECK_DUPLICATE_KEY = 'duplicateKey'
+CHECK_NUM_ADJACENT = 'numAdjacent'
+CHECK_GAMMA_SUM = 'gammaSum'
+CHECK_NEGATIVE_GAMMA = 'negativeGamma'
+CHECK_MISSING_RECEIVER = 'missingReceiver'
+CHECK_SELF_RECEIVER = 'selfReceiver'
+CHECK_ROAD_LAND_TYPE = 'roadLandType'
+CHECK_MISSING_STREAM = 'missingStream'
+GAMMA_TOLERANCE = 1e-6
+
+_CHECK_MESSAGES = OrderedDict([
+    (CHECK_DUPLICATE_KEY, "patch has more than one entry"),
+    (CHECK_NUM_ADJACENT, "numAdjacent is %(numAdjacent)d but entry has %(numReceivers)d receivers"),
+    (CHECK_GAMMA_SUM, "receiver gammas sum to %(gammaSum)f"),
+    (CHECK_NEGATIVE_GAMMA, "receiver %(receiver)s has negative gamma %(gamma)f"),
+    (CHECK_MISSING_RECEIVER, "receiver %(receiver)s is not an entry of the flow table"),
+    (CHECK_SELF_RECEIVER, "patch is its own receiver"),
+    (CHECK_ROAD_LAND_TYPE, "land type is %(landType)d but entry %(hasRoad)s road record"),
+    (CHECK_MISSING_STREAM, "stream patch %(stream)s of road record is not an entry of the flow table") ])
+
+## Type definitions
+FlowtableProblem = namedtuple('FlowtableProblem', ['check', 'key', 'message'], verbose=False)
+
+
+class FlowtableValidationReport(object):
+    def __init__(self, table, entryRows, receiverRows, gammaTolerance):
+        """ @brief Build a FlowtableValidationReport.  Use validateFlowtable to
+            validate a flow table.
+
+            @param table flowtablearray.ColumnarFlowtable that was validated
+            @param entryRows Dict mapping check to the array of rows of the entries failing it
+            @param receiverRows Dict mapping receiver level checks to the array of
+            rows of the receivers failing it, aligned with entryRows
+            @param gammaTolerance Tolerance used for CHECK_GAMMA_SUM
+        """
+        self.table = table
+        self.entryRows = entryRows
+        self.receiverRows = receiverRows
+        self.gammaTolerance = gammaTolerance
+
+    def isValid(self):
+        """ @brief Determine whether the flow table passed all checks """
+        return not any(len(rows) for rows in self.entryRows.itervalues())
+
+    def getCounts(self):
+        """ @brief Get the number of problems found by each check
+
+            @return collections.OrderedDict mapping check to number of problems
+        """
+        return OrderedDict( (check, len(self.entryRows[check])) for check in _CHECK_MESSAGES )
+
+    def getProblems(self, check=None, limit=None):
+        """ @brief Describe the problems found
+
+            @param check Check to describe problems of; if None, all checks
+            @param limit Maximum number of problems to describe per check
+
+            @return List of FlowtableProblem, ordered by check then by table order
+        """
+        checks = _CHECK_MESSAGES.keys() if check is None else [check]
+        problems = []
+        for c in checks:
+            rows = self.entryRows[c][:limit]
+            receiverRows = self.receiverRows.get(c)
+            for (i, row) in enumerate(rows.tolist()):
+                values = self._getMessageValues(c, row, None if receiverRows is None else receiverRows[i])
+                problems.append(FlowtableProblem(c, self.table.getKey(row), _CHECK_MESSAGES[c] % values))
+        return problems
+
+    def _getMessageValues(self, check, row, receiverRow):
+        table = self.table
+        entry = table.entries[row]
+        values = {}
+        if check == CHECK_NUM_ADJACENT:
+            values['numAdjacent'] = entry['numAdjacent']
+            values['numReceivers'] = table.receiverOffsets[row + 1] - table.receiverOffsets[row]
+        elif check == CHECK_GAMMA_SUM:
+            start = table.receiverOffsets[row]
+            values['gammaSum'] = table.receivers['gamma'][start:table.receiverOffsets[row + 1]].sum()
+        elif check == CHECK_ROAD_LAND_TYPE:
+            values['landType'] = entry['landType']
+            values['hasRoad'] = 'has a' if table.roadIndex[row] >= 0 else 'has no'
+        elif check == CHECK_MISSING_STREAM:
+            road = table.roads[table.roadIndex[row]]
+            values['stream'] = (int(road['streamPatchID']), int(road['streamZoneID']),
+                                int(road['streamHillID']))
+        elif receiverRow is not None:
+            receiver = table.receivers[receiverRow]
+            values['receiver'] = (int(receiver['patchID']), int(receiver['zoneID']),
+                                  int(receiver['hillID']))
+            values['gamma'] = receiver['gamma']
+        return values
+
+    def __str__(self):
+        counts = self.getCounts()
+        lines = ["Flow table of %d entries: %s" % \
+                 (len(self.table), 'valid' if self.isValid() else 'INVALID')]
+        for (check, count) in counts.iteritems():
+            lines.append("%-16s %d" % (check, count))
+        return '\n'.join(lines)
+
+
+def validateFlowtable(flowtable, gammaTolerance=GAMMA_TOLERANCE):
+    """ @brief Check the integrity of a flow table
+
+        @param flowtable Dict returned by flowtableio.readFlowtable, or a
+        flowtablearray.ColumnarFlowtable.  Duplicate keys can only be detected
+        in a ColumnarFlowtable, since a dict holds one entry per key.
+        @param gammaTolerance Largest allowed difference between 1 and the sum of
+        the receiver gammas of an entry
+
+        @return FlowtableValidationReport
+    """
+    if isinstance(flowtable, flowtablearray.ColumnarFlowtable):
+        table = flowtable
+    else:
+        table = flowtablearray.flowtableDictToColumnar(flowtable)
+    entries = table.entries
+    receivers = table.receivers
+    numEntries = len(entries)
+    numReceivers = np.diff(table.receiverOffsets)
+    receiverEntryRows = np.repeat(np.arange(numEntries), numReceivers)
+    entryRows = {}
+    receiverRows = {}
+
+    keys = table.packedKeys()
+    (uniqueKeys, inverse, counts) = np.unique(keys, return_inverse=True, return_counts=True)
+    entryRows[CHECK_DUPLICATE_KEY] = np.flatnonzero(counts[inverse] > 1)
+
+    entryRows[CHECK_NUM_ADJACENT] = np.flatnonzero(numReceivers != entries['numAdjacent'])
+
+    gammaSums = np.bincount(receiverEntryRows, weights=receivers['gamma'], minlength=numEntries)
+    entryRows[CHECK_GAMMA_SUM] = np.flatnonzero((numReceivers > 0) & \
+                                                (np.abs(gammaSums - 1.0) > gammaTolerance))
+
+    def receiverCheck(check, failing):
+        rows = np.flatnonzero(failing)
+        receiverRows[check] = rows
+        entryRows[check] = receiverEntryRows[rows]
+
+    receiverCheck(CHECK_NEGATIVE_GAMMA, receivers['gamma'] < 0)
+    receiverIndexes = table.getIndexesForIDs(receivers['patchID'], receivers['zoneID'],
+                                             receivers['hillID'])
+    receiverCheck(CHECK_MISSING_RECEIVER, receiverIndexes < 0)
+    donorEntries = entries[receiverEntryRows]
+    receiverCheck(CHECK_SELF_RECEIVER, (receivers['patchID'] == donorEntries['patchID']) & \
+                                       (receivers['zoneID'] == donorEntries['zoneID']) & \
+                                       (receivers['hillID'] == donorEntries['hillID']))
+
+    hasRoad = table.roadIndex >= 0
+    entryRows[CHECK_ROAD_LAND_TYPE] = np.flatnonzero(hasRoad != (entries['landType'] == LAND_TYPE_ROAD))
+    roadEntryRows = np.flatnonzero(hasRoad)
+    roads = table.roads[table.roadIndex[roadEntryRows]]
+    streamIndexes = table.getIndexesForIDs(roads['streamPatchID'], roads['streamZoneID'],
+                                           roads['streamHillID'])
+    entryRows[CHECK_MISSING_STREAM] = roadEntryRows[streamIndexes < 0]
+
+    return FlowtableValidationReport(table, entryRows, receiverRows, gammaTolerance)
@@ -0,0 +1,288 @@
+"""@package flowtableversions
+
+@brief Copy-on-write versions of a flow table cached by flowtablecache.
+        A version stores only the patches changed in it and points at its
+        parent; version BASE_VERSION is the cached flow table itself.
+        Creating a version is O(1) and freezes its parent, so the parent
+        is an immutable snapshot from then on.  Each version records its
+        chain of ancestors, so a patch is looked up in all the versions
+        from the version to the base in one pipelined round trip after
+        reading the chain, the first version holding the patch winning.
+        Chains are kept short by compactVersion, which flattens the changes
+        of a chain into one version whose parent is the base.  Each version
+        records the load of the cached flow table it was made from (see
+        flowtablecache.getCacheLoadID); versions of a flow table that has
+        since been reloaded or removed are refused rather than applied to
+        a different base.
+
+        Redis keys used for a flow table named name:
+        name.versions               Counter used to number versions
+        name.version.N              Hash of the metadata of version N: its
+                                    parent, chain of ancestors, load of the
+                                    base, and whether it is frozen
+        name.version.N.patches      Hash mapping packed key to the flow table
+                                    items (see flowtableio.encodeCacheValue)
+                                    of the patches changed in version N
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor
+      the names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import time
+
+from flowtablejournal import FlowtableJournal
+from flowtablecache import getCacheKeys
+from flowtablecache import isFlowtableCached
+from flowtablecache import getCacheLoadID
+from flowtablecache import iterCachedRecords
+from flowtablecache import packKey
+from flowtablecache import unpackKey
+from flowtableio import encodeCacheRecord
+from flowtableio import decodeCacheRecord
+
+## Constants
+BASE_VERSION = 0
+MAX_CHAIN_LENGTH = 8
+
+
+def _getVersionKeys(name, version):
+    return ("%s.version.%d" % (name, version), "%s.version.%d.patches" % (name, version))
+
+def _getChain(redisClient, name, version):
+    """ @brief Get the versions to search for a patch of a version, the version first,
+        not including the base
+    """
+    if version == BASE_VERSION:
+        return []
+    pipe = redisClient.pipeline(transaction=False)
+    pipe.hmget(_getVersionKeys(name, version)[0], ['chain', 'base'])
+    pipe.get(getCacheKeys(name)[4])
+    ((chain, base), loadID) = pipe.execute()
+    if chain is None:
+        raise Exception("Flow table %s has no version %d" % (name, version) )
+    if loadID is None or base != loadID:
+        raise Exception("Version %d of flow table %s was made from a flow table that has since been " \
+                        "reloaded or removed" % (version, name) )
+    return [int(v) for v in chain.split(',')]
+
+def createVersion(redisClient, name, parent=BASE_VERSION):
+    """ @brief Create a version of a flow table.  The parent version is frozen:
+        further changes are made in the new version.
+
+        @param redisClient redis.Redis client
+        @param name Name of the cached flow table
+        @param parent Version the new version is derived from
+
+        @return Number of the new version
+
+        @raise Exception if the flow table is not cached, if parent does not exist or
+        was made from a previous load of the flow table, or if the chain of versions
+        would be longer than MAX_CHAIN_LENGTH, in which case parent should be
+        compacted first (see compactVersion)
+    """
+    loadID = getCacheLoadID(redisClient, name)
+    if loadID is None or not isFlowtableCached(redisClient, name):
+        raise Exception("Flow table %s is not cached" % (name,) )
+    chain = _getChain(redisClient, name, parent)
+    if len(chain) >= MAX_CHAIN_LENGTH:
+        raise Exception("Version %d of flow table %s is %d versions deep, compact it first" % \
+                        (parent, name, len(chain)) )
+    version = int(redisClient.incr(name + '.versions'))
+    if parent != BASE_VERSION:
+        redisClient.hset(_getVersionKeys(name, parent)[0], 'frozen', 1)
+    redisClient.hmset(_getVersionKeys(name, version)[0],
+                      {'parent': parent, 'chain': ','.join(str(v) for v in [version] + chain),
+                       'base': loadID, 'frozen': 0, 'created': time.time()})
+    return version
+
+def getParentVersion(redisClient, name, version):
+    """ @brief Get the parent of a version, None for the base """
+    chain = _getChain(redisClient, name, version)
+    if not chain:
+        return None
+    return chain[1] if len(chain) > 1 else BASE_VERSION
+
+def isVersionFrozen(redisClient, name, version):
+    """ @brief Determine whether a version can no longer be changed """
+    if version == BASE_VERSION:
+        return True
+    return redisClient.hget(_getVersionKeys(name, version)[0], 'frozen') == '1'
+
+def getVersionRecords(redisClient, name, version, keys):
+    """ @brief Look up patches in a version of a flow table
+
+        @param redisClient redis.Redis client
+        @param name Name of the cached flow table
+        @param version Number of the version
+        @param keys Sequence of rhessystypes.FQPatchID
+
+        @return List of FlowTableRecord, None for patches not in the flow table
+    """
+    packedKeys = [packKey(k) for k in keys]
+    if not packedKeys:
+        return []
+    chain = _getChain(redisClient, name, version)
+    pipe = redisClient.pipeline(transaction=False)
+    for v in chain:
+        pipe.hmget(_getVersionKeys(name, v)[1], packedKeys)
+    pipe.hmget(getCacheKeys(name)[1], packedKeys)
+    found = pipe.execute()
+    records = []
+    for i in xrange(len(packedKeys)):
+        value = None
+        for values in found:
+            if values[i] is not None:
+                value = values[i]
+                break
+        records.append(decodeCacheRecord(value) if value is not None else None)
+    return records
+
+def getVersionRecord(redisClient, name, version, key):
+    """ @brief Look up a patch in a version of a flow table
+
+        @return FlowTableRecord, None if the patch is not in the flow table
+    """
+    return getVersionRecords(redisClient, name, version, [key])[0]
+
+def setVersionRecord(redisClient, name, version, record):
+    """ @brief Change a patch in a version of a flow table
+
+        @param redisClient redis.Redis client
+        @param name Name of the cached flow table
+        @param version Number of the version, which must not be frozen
+        @param record FlowTableRecord of the patch, which must be in the flow table
+
+        @raise Exception if the version is frozen or stale, or the patch is not in the
+        flow table
+    """
+    _getChain(redisClient, name, version)
+    if isVersionFrozen(redisClient, name, version):
+        raise Exception("Version %d of flow table %s is frozen" % (version, name) )
+    entry = record.entry
+    key = packKey(entry)
+    if not redisClient.hexists(getCacheKeys(name)[1], key):
+        raise Exception("Patch %s is not in flow table %s" % (unpackKey(key), name) )
+    redisClient.hset(_getVersionKeys(name, version)[1], key, encodeCacheRecord(record))
+
+def setVersionReceivers(redisClient, name, version, key, receivers):
+    """ @brief Replace the receivers of a patch in a version of a flow table.  The
+        numAdjacent of the entry is set to the number of receivers; its road record,
+        if any, is kept.
+
+        @param redisClient redis.Redis client
+        @param name Name of the cached flow table
+        @param version Number of the version, which must not be frozen
+        @param key rhessystypes.FQPatchID of the patch
+        @param receivers List of FlowTableEntryReceiver objects
+
+        @raise Exception if the version is frozen or the patch is not in the flow table
+    """
+    record = getVersionRecord(redisClient, name, version, key)
+    if record is None:
+        raise Exception("Patch %s is not in flow table %s" % (key, name) )
+    setVersionRecord(redisClient, name, version,
+                     record._replace(entry=record.entry._replace(numAdjacent=len(receivers)),
+                                     receivers=list(receivers)))
+
+def getVersionChanges(redisClient, name, version):
+    """ @brief Get the patches of a version that differ from the base, i.e. the
+        changes made in the version and its ancestors
+
+        @param redisClient redis.Redis client
+        @param name Name of the cached flow table
+        @param version Number of the version
+
+        @return Dict mapping rhessystypes.FQPatchID to FlowTableRecord
+    """
+    changes = {}
+    # Apply the oldest changes first so that later versions override them
+    for v in reversed(_getChain(redisClient, name, version)):
+        changes.update(redisClient.hgetall(_getVersionKeys(name, v)[1]))
+    return dict( (unpackKey(k), decodeCacheRecord(value)) for (k, value) in changes.iteritems() )
+
+def getVersionJournal(redisClient, name, version):
+    """ @brief Get the receiver changes of a version as a journal, e.g. for
+        flowtablejournal.applyJournal
+
+        @return flowtablejournal.FlowtableJournal with one edit per changed patch, in key order
+    """
+    changes = getVersionChanges(redisClient, name, version)
+    journal = FlowtableJournal()
+    for key in sorted(changes.keys()):
+        journal.setReceivers(key, changes[key].receivers)
+    return journal
+
+def iterVersionRecords(redisClient, name, version, batchSize=None):
+    """ @brief Stream the entries of a version of a flow table in table order
+
+        @param redisClient redis.Redis client
+        @param name Name of the cached flow table
+        @param version Number of the version
+        @param batchSize Number of entries fetched per round trip, see
+        flowtablecache.iterCachedRecords
+
+        @return Iterator over FlowTableRecord
+    """
+    changes = dict( (packKey(k), record) for (k, record) in \
+                    getVersionChanges(redisClient, name, version).iteritems() )
+    args = (batchSize,) if batchSize else ()
+    for record in iterCachedRecords(redisClient, name, *args):
+        if changes:
+            record = changes.get(packKey(record.entry), record)
+        yield record
+
+def compactVersion(redisClient, name, version):
+    """ @brief Flatten a version into a new version whose parent is the base, so that
+        lookups search at most one version.  The version itself is frozen.
+
+        @param redisClient redis.Redis client
+        @param name Name of the cached flow table
+        @param version Number of the version
+
+        @return Number of the new version
+    """
+    changes = {}
+    for v in reversed(_getChain(redisClient, name, version)):
+        changes.update(redisClient.hgetall(_getVersionKeys(name, v)[1]))
+    compacted = createVersion(redisClient, name, BASE_VERSION)
+    if version != BASE_VERSION:
+        redisClient.hset(_getVersionKeys(name, version)[0], 'frozen', 1)
+    if changes:
+        redisClient.hmset(_getVersionKeys(name, compacted)[1], changes)
+    return compacted
+
+def deleteVersions(redisClient, name):
+    """ @brief Remove all the versions of a flow table, e.g. the stale versions
+        left by a reload of the flow table
+    """
+    numVersions = int(redisClient.get(name + '.versions') or 0)
+    keys = [name + '.versions']
+    for version in xrange(1, numVersions + 1):
+        keys.extend(_getVersionKeys(name, version))
+    for start in xrange(0, len(keys), 1000):
+        redisClient.delete(*keys[start:start + 1000])
@@ -40,14 +40,34 @@ from collections import OrderedDict
 from ctypes import *
 import importlib
 
+import numpy as np
 from osgeo import osr
 
 import rhessystypes
+import flowtablearray
+import patchcellindex
+import rasterrowcache
+import grassraster
 
 GRASSConfig = namedtuple('GRASSConfig', ['gisbase', 'dbase', 'location', 'mapset'], verbose=False)
 
+## Constants
+_CELL_NULL = -2147483648
+# Key of the identity of the MASK in the sources of a patch cell index, not a valid map name
+_MASK_SOURCE = "@" + grassraster.MASK_NAME
+
+def _getIntegerValues(row):
+    """ @brief Get the cell values of a raster row as 64-bit integers.  Cells of
+        floating point maps whose values are not integers, including NULL cells,
+        become -1, which matches no patch.
+    """
+    if row.dtype.kind == 'f':
+        row = np.where(row == np.floor(row), row, -1)
+    return row.astype(np.int64)
+
 class GrassDataLookup(object): 
-    def __init__(self, grass_scripting=None, grass_lib=None, grass_config=None):
+    def __init__(self, grass_scripting=None, grass_lib=None, grass_config=None, row_cache=None,
+                 use_native_reader=False):
         """ @brief Constructor for GrassDataLookup
         
             @param grass_scripting Previously imported grass.script (GRASS scripting API), 
@@ -55,20 +75,36 @@ class GrassDataLookup(object):
             @param grass_lib Previously imported grass.lib.gis (low-level GRASS API); if None
             grass.lib.gis will be imported
             @param grass_config GRASSConfig instance 
+            @param row_cache rasterrowcache.RasterRowCache through which raster rows are
+            read; if None, the process-wide cache is used
+            @param use_native_reader True to read rasters and the region from the files of
+            the mapset of grass_config with grassraster, without the GRASS library; the
+            GRASS scripting API is then only set up when it is needed
         """
         self.grass_config = grass_config
+        self.useNativeReader = use_native_reader
         
-        if not grass_scripting:
+        if use_native_reader:
+            self.g = grass_scripting
+        elif not grass_scripting:
             self.g = self._setupGrassScriptingEnvironment()
         else:
             self.g = grass_scripting
             
-        if not grass_lib:
+        if use_native_reader:
+            self.grass_lowlevel = grass_lib
+        elif not grass_lib:
             self.grass_lowlevel = self._setupGrassEnvironment()
 
         else:
             self.grass_lowlevel = grass_lib 
         
+        self._patchCellIndexes = {}
+        if row_cache is None:
+            self.rowCache = rasterrowcache.getCache()
+        else:
+            self.rowCache = row_cache
+        
     
     def getSpatialReferenceForGRASSDataset(self):
         """ @brief Return the spatial reference for a GRASS mapset 
@@ -81,11 +117,13 @@ class GrassDataLookup(object):
         """
         
         s_srs = osr.SpatialReference()
+        if not self.g:
+            self.g = self._setupGrassScriptingEnvironment()
         proj = self.g.read_command('g.proj', flags='j')
         s_srs.ImportFromProj4( proj )
         return s_srs
     
-    def getCoordinatesForFQPatchIDs(self, fqPatchIDs, patchMap, zoneMap, hillslopeMap):
+    def getCoordinatesForFQPatchIDs(self, fqPatchIDs, patchMap, zoneMap, hillslopeMap, useIndex=True):
         """ @brief Get the geographic coordinates for a list of patches identified by
             their fully qualified patch ID. The fully qualified patch ID is the combination 
             of the patchID, zoneID, and hillslopeID.
@@ -97,106 +135,111 @@ class GrassDataLookup(object):
             @param patchMap String representing the name of the patch map
             @param zoneMap String representing the name of the zone map 
             @param hillslopeMap String representing the name of the hillslope map
+            @param useIndex True to look the patches up in the patch cell index of the maps
+            (see getPatchCellIndex), False to scan the maps
             
             @return Dict mapping rhessystypes.FQPatchID to the list of rhessysweb.types.CoordinatePair 
             objects representing the raster pixels that make up each patch in the input list 
             
+            @raise KeyError if a patch has no cells in the maps
         """
-        coords = {}
-        
         # Set up GRASS environment
-        self.grass_lowlevel.G_gisinit('')
+        if not self.useNativeReader:
+            self.grass_lowlevel.G_gisinit('')
+        
+        if useIndex:
+            index = self.getPatchCellIndex(patchMap, zoneMap, hillslopeMap)
+            indexes = index.getIndexesForKeys(fqPatchIDs).tolist()
+            returnCoords = OrderedDict()
+            for (fqPatchID, i) in zip(fqPatchIDs, indexes):
+                if i < 0:
+                    raise KeyError(fqPatchID)
+                returnCoords[fqPatchID] = index.getCoordinates(i)
+            return returnCoords
         
         # Get the window so we can conver row,col to easting,northing
-        window = self.grass_lowlevel.Cell_head()
-        self.grass_lowlevel.G_get_window(byref(window))
-        numRows = self.grass_lowlevel.G_window_rows()
-        numCols = self.grass_lowlevel.G_window_cols()
+        (window, numRows, numCols) = self._getWindow()
         
-        # Open patch map
-        patch = self.grass_lowlevel.G_find_cell2(patchMap, '')
-        patch = c_char_p(patch).value
-        patchType = self.grass_lowlevel.G_raster_map_type(patchMap, patch)
-        if patchType == 0: 
-            ptype = POINTER(c_int) 
-        elif patchType == 1: 
-            ptype = POINTER(c_float) 
-        elif patchType == 2: 
-            ptype = POINTER(c_double) 
-        patchFd = self.grass_lowlevel.G_open_cell_old(patchMap, patch) 
-        patchRast = self.grass_lowlevel.G_allocate_raster_buf(patchType)     
-        patchRast = cast(c_void_p(patchRast), ptype) 
-        
-        # Open zone map
-        zone = self.grass_lowlevel.G_find_cell2(zoneMap, '')
-        zone = c_char_p(zone).value
-        zoneType = self.grass_lowlevel.G_raster_map_type(zoneMap, zone)
-        if zoneType == 0: 
-            ptype = POINTER(c_int) 
-        elif zoneType == 1: 
-            ptype = POINTER(c_float) 
-        elif zoneType == 2: 
-            ptype = POINTER(c_double) 
-        zoneFd = self.grass_lowlevel.G_open_cell_old(zoneMap, zone) 
-        zoneRast = self.grass_lowlevel.G_allocate_raster_buf(zoneType)     
-        zoneRast = cast(c_void_p(zoneRast), ptype) 
-        
-        # Open hill map
-        hill = self.grass_lowlevel.G_find_cell2(hillslopeMap, '')
-        hill = c_char_p(hill).value
-        hillType = self.grass_lowlevel.G_raster_map_type(hillslopeMap, hill)
-        if hillType == 0: 
-            ptype = POINTER(c_int) 
-        elif hillType == 1: 
-            ptype = POINTER(c_float) 
-        elif hillType == 2: 
-            ptype = POINTER(c_double) 
-        hillFd = self.grass_lowlevel.G_open_cell_old(hillslopeMap, hill) 
-        hillRast = self.grass_lowlevel.G_allocate_raster_buf(hillType)     
-        hillRast = cast(c_void_p(hillRast), ptype) 
+        # Pack the requested patches into sorted keys, so that each row is matched
+        # against all of them at once
+        if not len(fqPatchIDs):
+            return OrderedDict()
+        ids = np.array([(f.patchID, f.zoneID, f.hillID) for f in fqPatchIDs], dtype=np.int64)
+        radix = flowtablearray.getKeyRadix(ids[:,1], ids[:,2])
+        (sortedKeys, requested) = np.unique(flowtablearray.packKeys(ids[:,0], ids[:,1], ids[:,2], radix),
+                                            return_inverse=True)
+        coords = [[] for k in sortedKeys]
 #        print( "getCoordinatesForFQPatchIDs: patchIDs: %s" % (fqPatchIDs,) )
-         
-        for row in range(numRows):
-            # Get current row for each dataset
-            self.grass_lowlevel.G_get_raster_row(patchFd, patchRast, row, patchType)
-            self.grass_lowlevel.G_get_raster_row(zoneFd, zoneRast, row, zoneType)
-            self.grass_lowlevel.G_get_raster_row(hillFd, hillRast, row, hillType)
-        
-            for col in range(numCols):
-                for fqPatchID in fqPatchIDs:
-                    if patchRast[col] == fqPatchID.patchID and \
-                        zoneRast[col] == fqPatchID.zoneID and \
-                        hillRast[col] == fqPatchID.hillID:
-                        # Match found, get its coordinates
-                        easting = self.grass_lowlevel.G_col_to_easting(col + 0.5, byref(window))
-                        northing = self.grass_lowlevel.G_row_to_northing(row + 0.5, byref(window))
-                        try:
-                            coordList = coords[fqPatchID]
-                        except KeyError:
-                            coordList = []
-                            coords[fqPatchID] = coordList
-                        coordList.append(rhessystypes.getCoordinatePair(easting, northing))
-#                        print( "row: %d, col: %d; patch: %d, %d, %d; coordList: %s" % \
-#                               (row, col, fqPatchID.patchID, fqPatchID.zoneID, fqPatchID.hillID, coordList) )
-        
-        # Clean up
-        self.grass_lowlevel.G_close_cell(patchFd)
-        self.grass_lowlevel.G_free(patchRast)
-        self.grass_lowlevel.G_close_cell(zoneFd)
-        self.grass_lowlevel.G_free(zoneRast)
-        self.grass_lowlevel.G_close_cell(hillFd)
-        self.grass_lowlevel.G_free(hillRast)
+        
+        for (row, (patchRow, zoneRow, hillRow)) in enumerate(self._iterMapRows(patchMap, zoneMap, hillslopeMap,
+                                                                                window)):
+            rowKeys = flowtablearray.packKeys(patchRow, zoneRow, hillRow, radix)
+            positions = np.minimum(np.searchsorted(sortedKeys, rowKeys), len(sortedKeys) - 1)
+            cols = np.flatnonzero( (sortedKeys[positions] == rowKeys) & (rowKeys >= 0) )
+            if not len(cols):
+                continue
+            # Match found, get its coordinates as G_col_to_easting and G_row_to_northing would
+            northing = window['north'] - (row + 0.5) * window['nsRes']
+            eastings = window['west'] + (cols + 0.5) * window['ewRes']
+            for (easting, position) in zip(eastings.tolist(), positions[cols].tolist()):
+                coords[position].append(rhessystypes.getCoordinatePair(easting, northing))
         
 #        os.environ['GIS_LOCK'] = ''
 #        os.unlink(os.environ['GISRC'])
         
         returnCoords = OrderedDict()
-        for fqPatchID in fqPatchIDs:
-            returnCoords[fqPatchID] = coords[fqPatchID]
+        for (fqPatchID, position) in zip(fqPatchIDs, requested.tolist()):
+            if not coords[position]:
+                raise KeyError(fqPatchID)
+            returnCoords[fqPatchID] = coords[position]
         
         return returnCoords
     
     
+    def getPatchCellIndex(self, patchMap, zoneMap, hillslopeMap):
+        """ @brief Get the patch cell index of a set of maps.  The index is kept in memory
+            and in the support files of the patch map (see patchcellindex.getPatchCellIndexPath),
+            and built by scanning the maps if it is missing or stale, i.e. if the region or
+            any of the maps changed.  Failure to write the index, e.g. because the mapset is
+            read-only, is not an error.
+        
+            @param patchMap String representing the name of the patch map
+            @param zoneMap String representing the name of the zone map 
+            @param hillslopeMap String representing the name of the hillslope map
+            
+            @return patchcellindex.PatchCellIndex
+        """
+        (window, numRows, numCols) = self._getWindow()
+        sources = {}
+        for mapName in (patchMap, zoneMap, hillslopeMap):
+            sources[mapName] = patchcellindex.getRasterIdentity(*self._findRaster(mapName))
+        # The index is built from the rows as masked by the current mapset
+        sources[_MASK_SOURCE] = self._getMaskIdentity()
+        
+        indexKey = (patchMap, zoneMap, hillslopeMap)
+        index = self._patchCellIndexes.get(indexKey)
+        if index is not None and patchcellindex.isPatchCellIndexCurrent(index, window, sources):
+            return index
+        
+        (patchMapset, patchName) = self._findRaster(patchMap)
+        path = patchcellindex.getPatchCellIndexPath(patchMapset, patchName, zoneMap, hillslopeMap)
+        try:
+            index = patchcellindex.readPatchCellIndex(path)
+        except (IOError, OSError, ValueError):
+            index = None
+        if index is None or not patchcellindex.isPatchCellIndexCurrent(index, window, sources):
+            # The identity of the maps is taken before the scan, so that changes made
+            # during the scan leave the index stale
+            rows = self._iterMapRows(patchMap, zoneMap, hillslopeMap, window)
+            index = patchcellindex.buildPatchCellIndex(rows, window, sources)
+            try:
+                patchcellindex.writePatchCellIndex(index, path)
+            except (IOError, OSError):
+                pass
+        self._patchCellIndexes[indexKey] = index
+        return index
+    
+    
     def _getCentroidCoordinatesForPatches(self, coordDict):
         """ @brief return a list of patch centroid coordinates for each list of patch sub-cell coordinates 
             stored in a dictionary.
@@ -235,42 +278,103 @@ class GrassDataLookup(object):
             @param zoneMap String representing the name of the zone map 
             @param hillslopeMap String representing the name of the hillslope map
             
-            @return FQPatchID
+            @return FQPatchID, None if the coordinate is outside the current region or
+            on a NULL cell
         """
         patchID = None
         zoneID = None
         hillID = None
         
+        # Get number of rows
+        (region, numRows, numCols) = self._getWindow()
+        
         # Translate coordinates to row, col
-        window = self.grass_lowlevel.Cell_head()
-        self.grass_lowlevel.G_get_window(byref(window))
-        row = int( self.grass_lowlevel.G_northing_to_row(coordinate.northing, byref(window)) )
-        col = int( self.grass_lowlevel.G_easting_to_col(coordinate.easting, byref(window)) )
+        if self.useNativeReader:
+            row = int( np.floor( (region['north'] - coordinate.northing) / region['nsRes'] ) )
+            col = int( np.floor( (coordinate.easting - region['west']) / region['ewRes'] ) )
+        else:
+            window = self.grass_lowlevel.Cell_head()
+            self.grass_lowlevel.G_get_window(byref(window))
+            row = int( np.floor( self.grass_lowlevel.G_northing_to_row(coordinate.northing, byref(window)) ) )
+            col = int( np.floor( self.grass_lowlevel.G_easting_to_col(coordinate.easting, byref(window)) ) )
         #print("row: %d, col: %d\n" % (row, col) )
-        
-        # Get number of rows
-        numRows = self.grass_lowlevel.G_window_rows()
-        numCols = self.grass_lowlevel.G_window_cols()
         #print("num rows: %d, num cols: %d\n" % (numRows, numCols) )
         
         # Get patch ID
-        patchID = self._getValueForCell(patchMap, row, col)
+        patchID = self._getValueForCell(patchMap, row, col, region)
         #print("PatchID: %d\n" % (patchID,) )
         
         # Get zone ID
-        zoneID = self._getValueForCell(zoneMap, row, col)
+        zoneID = self._getValueForCell(zoneMap, row, col, region)
         #print("ZoneID: %d\n" % (zoneID,) )
         
         # Get hillslope ID
-        hillID = self._getValueForCell(hillslopeMap, row, col)
+        hillID = self._getValueForCell(hillslopeMap, row, col, region)
         #print("HillID: %d\n" % (hillID,) )
         
 #        os.environ['GIS_LOCK'] = ''
 #        os.unlink(os.environ['GISRC'])
         
+        if patchID is None or zoneID is None or hillID is None:
+            return None
         return rhessystypes.FQPatchID(patchID=int(patchID), zoneID=int(zoneID), hillID=int(hillID))
     
     
+    def getFQPatchIDsForCoordinates(self, coordinates, patchMap, zoneMap, hillslopeMap):
+        """ @brief Get the fully qualified IDs of the patches located at many coordinate
+            pairs.  Each map is opened once, and the points are sorted by row so that
+            each row holding a point is read once.
+        
+            @param coordinates Sequence of rhessystypes.CoordinatePair
+            @param patchMap String representing the name of the patch map
+            @param zoneMap String representing the name of the zone map 
+            @param hillslopeMap String representing the name of the hillslope map
+            
+            @return List of rhessystypes.FQPatchID, in the order of coordinates; None for
+            coordinates outside the current region or on NULL cells
+        """
+        (window, numRows, numCols) = self._getWindow()
+        eastings = np.array([c.easting for c in coordinates], dtype=np.float64)
+        northings = np.array([c.northing for c in coordinates], dtype=np.float64)
+        rows = np.floor( (window['north'] - northings) / window['nsRes'] )
+        cols = np.floor( (eastings - window['west']) / window['ewRes'] )
+        inside = np.flatnonzero( (rows >= 0) & (rows < numRows) & (cols >= 0) & (cols < numCols) )
+        rows = rows[inside].astype(np.int64)
+        cols = cols[inside].astype(np.int64)
+        
+        # Visit the points row by row
+        order = np.argsort(rows, kind='mergesort')
+        rows = rows[order]
+        points = inside[order]
+        cols = cols[order]
+        rowStarts = np.flatnonzero( np.append(True, rows[1:] != rows[:-1]) ) if len(rows) else rows
+        rowEnds = np.append(rowStarts[1:], len(rows))
+        
+        values = np.empty( (3, len(coordinates)), dtype=np.float64 )
+        values.fill(np.nan)
+        maps = [_CachedRasterMap(self, m, window) for m in (patchMap, zoneMap, hillslopeMap)]
+        try:
+            for (start, end) in zip(rowStarts.tolist(), rowEnds.tolist()):
+                row = int(rows[start])
+                for (i, m) in enumerate(maps):
+                    rowValues = m.getRow(row)[cols[start:end]]
+                    cellValues = rowValues.astype(np.float64)
+                    if rowValues.dtype.kind == 'i':
+                        cellValues[rowValues == _CELL_NULL] = np.nan
+                    values[i, points[start:end]] = cellValues
+        finally:
+            for m in maps:
+                m.close()
+        
+        fqPatchIDs = [None] * len(coordinates)
+        found = np.flatnonzero( ~np.isnan(values).any(axis=0) )
+        ids = values[:, found].astype(np.int64)
+        for (point, patchID, zoneID, hillID) in zip(found.tolist(), ids[0].tolist(), ids[1].tolist(),
+                                                    ids[2].tolist()):
+            fqPatchIDs[point] = rhessystypes.FQPatchID(patchID=patchID, zoneID=zoneID, hillID=hillID)
+        return fqPatchIDs
+    
+    
     def _setupGrassScriptingEnvironment(self):
         """ @brief Set up GRASS environment for using GRASS scripting API from 
             Python (e.g. grass.script)
@@ -307,7 +411,82 @@ class GrassDataLookup(object):
         grassRcFile.write(grassRcContent)
         return grassRcFile.name
     
-    def _getValueForCell(self, input, row, col):
+    def _getWindow(self):
+        """ @brief Get the current region
+        
+            @return Tuple (dict with keys north, west, nsRes, ewRes, rows and cols,
+            number of rows, number of columns)
+        """
+        if self.useNativeReader:
+            window = grassraster.readRegion(self._getCurrentMapsetPath())
+            return (window, window['rows'], window['cols'])
+        window = self.grass_lowlevel.Cell_head()
+        self.grass_lowlevel.G_get_window(byref(window))
+        numRows = self.grass_lowlevel.G_window_rows()
+        numCols = self.grass_lowlevel.G_window_cols()
+        return ({'north': window.north, 'west': window.west, 'nsRes': window.ns_res,
+                 'ewRes': window.ew_res, 'rows': numRows, 'cols': numCols}, numRows, numCols)
+    
+    def _getCurrentMapsetPath(self):
+        if self.useNativeReader:
+            return os.path.join(self.grass_config.dbase, self.grass_config.location,
+                                self.grass_config.mapset)
+        location = c_char_p(self.grass_lowlevel.G_location_path()).value
+        return os.path.join(location, c_char_p(self.grass_lowlevel.G_mapset()).value)
+    
+    def _getMaskIdentity(self):
+        """ @brief Get the identity of the MASK of the current mapset, see
+            patchcellindex.getRasterIdentity.  The identity is empty if there is no MASK.
+        """
+        return patchcellindex.getRasterIdentity(self._getCurrentMapsetPath(), grassraster.MASK_NAME)
+    
+    def _findRaster(self, input):
+        """ @brief Find a raster map in the mapsets of the search path
+        
+            @return Tuple (path of the mapset of the map, name of the map without mapset)
+        """
+        if self.useNativeReader:
+            found = grassraster.findRaster(os.path.join(self.grass_config.dbase, self.grass_config.location),
+                                          self.grass_config.mapset, input)
+            if found is None:
+                raise IOError("Raster map %s not found" % (input,) )
+            return found
+        return (self._getMapsetPath(input), input.partition('@')[0])
+    
+    def _getMapsetPath(self, input):
+        if self.useNativeReader:
+            return self._findRaster(input)[0]
+        mapset = self.grass_lowlevel.G_find_cell2(input, '')
+        mapset = c_char_p(mapset).value
+        location = self.grass_lowlevel.G_location_path()
+        location = c_char_p(location).value
+        return os.path.join(location, mapset)
+    
+    def _iterMapRows(self, patchMap, zoneMap, hillslopeMap, window):
+        """ @brief Read the rows of the patch, zone and hillslope maps.  The rows are
+            read directly rather than through the row cache, which a scan of whole maps
+            would only fill with rows that evict those of point lookups.
+        
+            @param window Dict describing the current region, see _getWindow
+        
+            @return Iterator over tuples (patchRow, zoneRow, hillRow) of arrays of
+            numpy.int64, see _getIntegerValues
+        """
+        maps = [_CachedRasterMap(self, m, window) for m in (patchMap, zoneMap, hillslopeMap)]
+        try:
+            for row in xrange(window['rows']):
+                yield tuple(_getIntegerValues(m.readRow(row)) for m in maps)
+        finally:
+            for m in maps:
+                m.close()
+    
+    def _openRasterMap(self, input):
+        """ @brief Open a raster map and allocate a buffer for its rows
+        
+            @param input String representing the name of the map
+            
+            @return Tuple (file descriptor, ctypes pointer to the row buffer, GRASS data type)
+        """
         mapset = self.grass_lowlevel.G_find_cell2(input, '')
         mapset = c_char_p(mapset).value
         data_type = self.grass_lowlevel.G_raster_map_type(input, mapset)
@@ -320,9 +499,91 @@ class GrassDataLookup(object):
         infd = self.grass_lowlevel.G_open_cell_old(input, mapset) 
         inrast = self.grass_lowlevel.G_allocate_raster_buf(data_type)     
         inrast = cast(c_void_p(inrast), ptype) 
-        self.grass_lowlevel.G_get_raster_row(infd, inrast, row, data_type)
-        value = inrast[col]
+        return (infd, inrast, data_type)
+    
+    def _closeRasterMap(self, infd, inrast):
         self.grass_lowlevel.G_close_cell(infd)
         self.grass_lowlevel.G_free(inrast)
+    
+    def _getValueForCell(self, input, row, col, window):
+        """ @brief Get the value of a cell of a map
+        
+            @param window Dict describing the current region, see _getWindow
+            
+            @return Value of the cell, None if the cell is outside the region or NULL
+        """
+        if row < 0 or row >= window['rows'] or col < 0 or col >= window['cols']:
+            return None
+        m = _CachedRasterMap(self, input, window)
+        try:
+            value = m.getRow(row)[col]
+        finally:
+            m.close()
         
-        return value
+        if value.dtype.kind == 'f':
+            return None if np.isnan(value) else value
+        return None if value == _CELL_NULL else value
+
+
+class _CachedRasterMap(object):
+    def __init__(self, lookup, input, window):
+        """ @brief Rows of a raster map read through the row cache of a GrassDataLookup.
+            The map is only opened when a row is not cached.
+        
+            @param lookup GrassDataLookup
+            @param input String representing the name of the map
+            @param window Dict describing the current region, see GrassDataLookup._getWindow
+        """
+        self.lookup = lookup
+        self.input = input
+        (self.mapset, self.name) = lookup._findRaster(input)
+        self.window = window
+        # GRASS applies the mask of the current mapset to the rows it reads
+        identity = patchcellindex.getRasterIdentity(self.mapset, self.name)
+        self.maskMapset = lookup._getCurrentMapsetPath()
+        for (path, stat) in lookup._getMaskIdentity().items():
+            identity['MASK:' + path] = stat
+        self.version = rasterrowcache.getRasterVersion(window, identity)
+        self.numCols = window['cols']
+        self._map = None
+        self._buffer = None
+        self._raster = None
+        self._mask = None
+    
+    def getRow(self, row):
+        """ @brief Get a row of the map
+        
+            @return Read-only numpy.ndarray of the cell values of the row
+        """
+        return self.lookup.rowCache.getRow(self.input, self.mapset, row, self.version, self._readRow)
+    
+    def readRow(self, row):
+        """ @brief Read a row of the map, bypassing the row cache
+        
+            @return numpy.ndarray of the cell values of the row
+        """
+        return self._readRow(row)
+    
+    def _readRow(self, row):
+        if self.lookup.useNativeReader:
+            if self._raster is None:
+                self._raster = grassraster.GrassRaster(self.mapset, self.name)
+                self._mask = grassraster.openMask(self.maskMapset)
+            return self._raster.getRow(row, self.window, self._mask)
+        if self._map is None:
+            self._map = self.lookup._openRasterMap(self.input)
+            # The row buffer is wrapped as an array
+            self._buffer = np.ctypeslib.as_array(self._map[1], shape=(self.numCols,))
+        (infd, inrast, data_type) = self._map
+        self.lookup.grass_lowlevel.G_get_raster_row(infd, inrast, row, data_type)
+        return self._buffer.copy()
+    
+    def close(self):
+        for raster in (self._raster, self._mask):
+            if raster is not None:
+                raster.close()
+        self._raster = self._mask = None
+        if self._map is not None:
+            self.lookup._closeRasterMap(self._map[0], self._map[1])
+            self._map = None
+            self._buffer = None
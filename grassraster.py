@@ -0,0 +1,646 @@
+"""@package grassraster
+
+@brief Read GRASS 6 raster maps with NumPy, without the GRASS library.  The
+        cell header, the integer (cell) and floating point (fcell) data files,
+        uncompressed or with run length or zlib compressed rows, and the null
+        bitmaps are read directly from the mapset, so raster access needs
+        neither a GRASS installation nor G_gisinit, and can be used from
+        several threads.  Rows are returned as GRASS returns them from
+        G_get_raster_row: integer maps as numpy.int32 with NULL cells set to
+        CELL_NULL, floating point maps as numpy.float32 or numpy.float64 with
+        NULL cells set to NaN, resampled to a region by nearest neighbor.
+        Reclass maps are read through the map they reclassify.
+
+        Regions are dicts with the keys north, west, nsRes, ewRes, rows and
+        cols, as returned by readRegion and grassdatalookup.GrassDataLookup.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor
+      the names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import os
+import re
+import zlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+## Constants
+CELL_NULL = -2147483648
+COMPRESSION_NONE = 0
+COMPRESSION_RLE = 1
+COMPRESSION_ZLIB = 2
+MASK_NAME = 'MASK'
+_ZLIB_COMPRESSED_NO = '0'
+_ZLIB_COMPRESSED_YES = '1'
+_PRE3_COMPRESSED_MAGIC = '\xfb\xff\xfb'
+_HEADER_KEYS = {'proj': 'proj', 'zone': 'zone', 'north': 'north', 'south': 'south', 'east': 'east',
+                'west': 'west', 'rows': 'rows', 'cols': 'cols', 'e-w resol': 'ewRes',
+                'n-s resol': 'nsRes', 'format': 'format', 'compressed': 'compressed'}
+_INTEGER_HEADER_KEYS = ('proj', 'zone', 'rows', 'cols', 'format', 'compressed')
+_RECLASS = 'reclass'
+_RECLASS_NULL = '*'
+_DMS = re.compile(r'^(\d+)(?::(\d+)(?::(\d+(?:\.\d*)?))?)?([NSEW]?)$')
+
+
+## Type definitions
+class UnsupportedRasterError(IOError):
+    """ @brief Error raised for raster maps stored in a format that cannot be read
+        without the GRASS library
+    """
+    pass
+
+
+def _scanValue(value):
+    """ @brief Parse a coordinate or resolution of a cell header, either a number
+        or, in latitude-longitude locations, degrees:minutes:seconds with an
+        optional hemisphere
+    """
+    try:
+        return float(value)
+    except ValueError:
+        match = _DMS.match(value.upper())
+        if not match:
+            raise ValueError("Invalid coordinate %s" % (value,) )
+        (degrees, minutes, seconds, hemisphere) = match.groups()
+        value = float(degrees) + float(minutes or 0) / 60.0 + float(seconds or 0) / 3600.0
+        if hemisphere in ('S', 'W'):
+            value = -value
+        return value
+
+def readCellHeader(path):
+    """ @brief Read a GRASS cell header, i.e. the cellhd file of a raster map or the
+        WIND file of a mapset
+    
+        @param path String representing the path of the header
+        
+        @return Dict with the keys proj, zone, north, south, east, west, rows, cols,
+        nsRes, ewRes, format and compressed; format and compressed are None if they
+        are not in the header
+        
+        @raise IOError if the header cannot be read
+        @raise UnsupportedRasterError if it is the header of a reclass map, see readReclass
+    """
+    header = dict.fromkeys(_HEADER_KEYS.values())
+    f = open(path, 'r')
+    try:
+        lines = f.read().splitlines()
+    finally:
+        f.close()
+    if lines and lines[0].strip() == _RECLASS:
+        raise UnsupportedRasterError("Cell header %s is the header of a reclass map" % (path,) )
+    for line in lines:
+        (key, sep, value) = line.partition(':')
+        key = _HEADER_KEYS.get(key.strip().lower())
+        if not sep or key is None:
+            continue
+        value = value.strip()
+        if key in _INTEGER_HEADER_KEYS:
+            header[key] = int(value)
+        else:
+            header[key] = _scanValue(value)
+    for key in ('north', 'south', 'east', 'west'):
+        if header[key] is None:
+            raise IOError("Cell header %s has no %s" % (path, key) )
+    # As in G_adjust_Cell_head, the resolution follows from the bounds and the number
+    # of cells, or the number of cells from the bounds and the resolution
+    for (cells, res, extent) in (('rows', 'nsRes', header['north'] - header['south']),
+                                 ('cols', 'ewRes', header['east'] - header['west'])):
+        if header[cells] is None:
+            if not header[res]:
+                raise IOError("Cell header %s has neither %s nor a resolution" % (path, cells) )
+            header[cells] = int(extent / header[res] + 0.5)
+        header[res] = extent / header[cells]
+    return header
+
+def readReclass(path):
+    """ @brief Read the cell header of a reclass map, as G_get_reclass does
+    
+        @param path String representing the path of the cellhd file of the map
+        
+        @return Tuple (name of the reclassified map, its mapset, first category,
+        numpy.int32 array of the new values of the categories from the first one on,
+        CELL_NULL for categories reclassified to NULL), or None if the map is not a
+        reclass map
+        
+        @raise IOError if the header cannot be read or is invalid
+    """
+    f = open(path, 'r')
+    try:
+        lines = f.read().splitlines()
+    finally:
+        f.close()
+    if not lines or lines[0].strip() != _RECLASS:
+        return None
+    fields = {}
+    i = 1
+    while i < len(lines) and len(fields) < 2:
+        (key, sep, value) = lines[i].partition(':')
+        if sep and key.strip() in ('name', 'mapset'):
+            fields[key.strip()] = value.strip()
+        i += 1
+    if len(fields) < 2:
+        raise IOError("Reclass header %s has no name or mapset" % (path,) )
+    
+    first = 0
+    try:
+        if i < len(lines) and lines[i].startswith('#'):
+            first = int(lines[i][1:].split()[0])
+            i += 1
+        table = [CELL_NULL if line.startswith(_RECLASS_NULL) else int(line.split()[0]) \
+                 for line in lines[i:] if line.strip()]
+    except (ValueError, IndexError):
+        raise IOError("Invalid category in reclass header %s" % (path,) )
+    return (fields['name'], fields['mapset'], first, np.array(table, dtype=np.int32))
+
+def getRegionForHeader(header):
+    """ @brief Get the region of the cells of a cell header
+    
+        @param header Dict, see readCellHeader
+        
+        @return Dict with the keys north, west, nsRes, ewRes, rows and cols
+    """
+    return {'north': header['north'], 'west': header['west'], 'nsRes': header['nsRes'],
+            'ewRes': header['ewRes'], 'rows': header['rows'], 'cols': header['cols']}
+
+def readRegion(mapsetPath):
+    """ @brief Read the current region of a mapset, i.e. its WIND file
+    
+        @param mapsetPath String representing the path of the mapset
+        
+        @return Dict with the keys north, west, nsRes, ewRes, rows and cols
+    """
+    return getRegionForHeader(readCellHeader(os.path.join(mapsetPath, 'WIND')))
+
+
+def getMapsetSearchPath(locationPath, mapset):
+    """ @brief Get the mapsets searched for maps that are not qualified with a mapset,
+        i.e. those listed in the SEARCH_PATH file of the mapset, or the mapset and
+        PERMANENT if it has none
+    
+        @param locationPath String representing the path of the location
+        @param mapset String representing the name of the current mapset
+        
+        @return List of mapset names
+    """
+    try:
+        f = open(os.path.join(locationPath, mapset, 'SEARCH_PATH'), 'r')
+    except IOError:
+        return [mapset] if mapset == 'PERMANENT' else [mapset, 'PERMANENT']
+    try:
+        mapsets = [line.strip() for line in f if line.strip()]
+    finally:
+        f.close()
+    return mapsets or [mapset]
+
+def findRaster(locationPath, mapset, mapName):
+    """ @brief Find a raster map the way G_find_cell2 does
+    
+        @param locationPath String representing the path of the location
+        @param mapset String representing the name of the current mapset
+        @param mapName String representing the name of the map, optionally qualified
+        with a mapset as name@mapset
+        
+        @return Tuple (path of the mapset of the map, name of the map), or None if there
+        is no such map
+    """
+    (name, sep, mapsetName) = mapName.partition('@')
+    if sep:
+        mapsets = [mapsetName]
+    else:
+        mapsets = getMapsetSearchPath(locationPath, mapset)
+    for m in mapsets:
+        mapsetPath = os.path.join(locationPath, m)
+        if os.path.isfile(os.path.join(mapsetPath, 'cellhd', name)):
+            return (mapsetPath, name)
+    return None
+
+def listRasters(locationPath, mapset):
+    """ @brief List the raster maps of the mapsets in the search path of a mapset
+    
+        @param locationPath String representing the path of the location
+        @param mapset String representing the name of the current mapset
+        
+        @return List of strings name@mapset, sorted by name within each mapset
+    """
+    rasters = []
+    for m in getMapsetSearchPath(locationPath, mapset):
+        try:
+            names = os.listdir(os.path.join(locationPath, m, 'cellhd'))
+        except OSError:
+            continue
+        rasters.extend("%s@%s" % (name, m) for name in sorted(names) if not name.startswith('.'))
+    return rasters
+
+
+def _decodeCells(data, nbytes, cols):
+    """ @brief Decode the big endian cells of a row of an integer map.  Cells of 4
+        bytes store the sign in their most significant bit.
+    """
+    if nbytes == 0:
+        return np.zeros(cols, dtype=np.int32)
+    if nbytes > 4:
+        raise IOError("Unsupported cell size of %d bytes" % (nbytes,) )
+    cells = np.frombuffer(data, dtype=np.uint8, count=nbytes * cols).reshape(cols, nbytes)
+    if nbytes < 4:
+        padded = np.zeros( (cols, 4), dtype=np.uint8 )
+        padded[:, 4 - nbytes:] = cells
+        return padded.view('>u4').ravel().astype(np.int32)
+    values = cells.copy().view('>u4').ravel()
+    magnitudes = (values & 0x7fffffff).astype(np.int32)
+    return np.where(values & 0x80000000, -magnitudes, magnitudes)
+
+def _expandRuns(data, nbytes, cols):
+    """ @brief Expand a run length compressed row, stored as pairs of a repeat count
+        byte and a cell
+    """
+    pairs = np.frombuffer(data, dtype=np.uint8)
+    pairs = pairs[:len(pairs) // (nbytes + 1) * (nbytes + 1)].reshape(-1, nbytes + 1)
+    cells = np.repeat(pairs[:, 1:], pairs[:, 0], axis=0)
+    if len(cells) != cols:
+        raise IOError("Run length compressed row has %d cells instead of %d" % (len(cells), cols) )
+    return cells.tostring()
+
+
+class GrassRaster(object):
+    def __init__(self, mapsetPath, mapName):
+        """ @brief Open a GRASS 6 raster map
+        
+            @param mapsetPath String representing the path of the mapset of the map
+            @param mapName String representing the name of the map
+            
+            @raise IOError if the map cannot be read
+            @raise UnsupportedRasterError if the format of the map is not supported
+        """
+        self.mapsetPath = mapsetPath
+        self.mapName = mapName
+        # The cells of a reclass map are those of the map it reclassifies, looked up
+        # in its table
+        self._reclass = readReclass(os.path.join(mapsetPath, 'cellhd', mapName))
+        if self._reclass is not None:
+            mapsetPath = os.path.join(os.path.dirname(mapsetPath), self._reclass[1])
+            mapName = self._reclass[0]
+        self.header = readCellHeader(os.path.join(mapsetPath, 'cellhd', mapName))
+        self.rows = self.header['rows']
+        self.cols = self.header['cols']
+        
+        fcellPath = os.path.join(mapsetPath, 'fcell', mapName)
+        if os.path.exists(fcellPath):
+            if self._reclass is not None:
+                raise UnsupportedRasterError("Reclass map %s of floating point map %s is not supported" % \
+                                             (self.mapName, mapName) )
+            self.dtype = self._readFloatingPointType()
+            self.isFloatingPoint = True
+            self._cellBytes = self.dtype.itemsize
+            self._fileDtype = self.dtype.newbyteorder('>')
+            self._null = np.nan
+            dataPath = fcellPath
+        else:
+            self.dtype = np.dtype(np.int32)
+            self.isFloatingPoint = False
+            self._cellBytes = (self.header['format'] or 0) + 1
+            self._null = CELL_NULL
+            dataPath = os.path.join(mapsetPath, 'cell', mapName)
+        
+        self._lock = threading.Lock()
+        self._file = open(dataPath, 'rb')
+        try:
+            self.compressed = self.header['compressed']
+            if self.compressed is None:
+                # Headers without a compression flag predate GRASS 3
+                if self._file.read(len(_PRE3_COMPRESSED_MAGIC)) == _PRE3_COMPRESSED_MAGIC:
+                    raise UnsupportedRasterError("Pre GRASS 3.0 compressed map %s is not supported" % \
+                                                 (mapName,) )
+                self.compressed = COMPRESSION_NONE
+            if self.compressed > COMPRESSION_ZLIB:
+                raise UnsupportedRasterError("Compression %d of map %s is not supported" % \
+                                             (self.compressed, mapName) )
+            self._rowOffsets = self._readRowOffsets() if self.compressed else None
+            
+            # GRASS 7 may store the null bitmap compressed, in nullcmpr instead of null
+            if os.path.exists(os.path.join(mapsetPath, 'cell_misc', mapName, 'nullcmpr')):
+                raise UnsupportedRasterError("Compressed null file of map %s is not supported" % (mapName,) )
+            nullPath = os.path.join(mapsetPath, 'cell_misc', mapName, 'null')
+            self._nullFile = open(nullPath, 'rb') if os.path.exists(nullPath) else None
+        except:
+            self._file.close()
+            raise
+        self._nullBytes = (self.cols + 7) // 8
+        self._regionMappings = {}
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def close(self):
+        self._file.close()
+        if self._nullFile is not None:
+            self._nullFile.close()
+    
+    def _readFloatingPointType(self):
+        formatPath = os.path.join(self.mapsetPath, 'cell_misc', self.mapName, 'f_format')
+        f = open(formatPath, 'r')
+        try:
+            fields = dict( (key.strip().lower(), value.strip().lower()) for (key, sep, value) in
+                           (line.partition(':') for line in f) if sep )
+        finally:
+            f.close()
+        if fields.get('byte_order', 'xdr') != 'xdr':
+            raise UnsupportedRasterError("Unsupported byte order %s in %s" % (fields['byte_order'], formatPath) )
+        if fields.get('type') == 'double':
+            return np.dtype(np.float64)
+        return np.dtype(np.float32)
+    
+    def _readRowOffsets(self):
+        """ @brief Read the offsets of the compressed rows, stored after the number of
+            bytes of each offset as big endian integers, one per row and one for the
+            end of the last row
+        """
+        self._file.seek(0)
+        nbytes = ord(self._file.read(1) or '\0')
+        data = self._file.read( (self.rows + 1) * nbytes )
+        if nbytes == 0 or len(data) != (self.rows + 1) * nbytes:
+            raise IOError("Invalid row offsets in map %s" % (self.mapName,) )
+        digits = np.frombuffer(data, dtype=np.uint8).reshape(self.rows + 1, nbytes).astype(np.int64)
+        offsets = np.zeros(self.rows + 1, dtype=np.int64)
+        for i in xrange(nbytes):
+            offsets = (offsets << 8) + digits[:, i]
+        return offsets
+    
+    def _readRowData(self, row):
+        """ @brief Read the data of a row, decompressed to cellBytes bytes per cell
+        
+            @return Tuple (data, bytes per cell)
+        """
+        size = self.cols * self._cellBytes
+        if not self.compressed:
+            self._file.seek(row * size)
+            return (self._file.read(size), self._cellBytes)
+        
+        start = int(self._rowOffsets[row])
+        self._file.seek(start)
+        data = self._file.read(int(self._rowOffsets[row + 1]) - start)
+        if self.isFloatingPoint:
+            if data[:1] == _ZLIB_COMPRESSED_YES:
+                return (zlib.decompress(data[1:]), self._cellBytes)
+            elif data[:1] == _ZLIB_COMPRESSED_NO:
+                return (data[1:], self._cellBytes)
+            raise IOError("Invalid compressed row %d in map %s" % (row, self.mapName) )
+        
+        # Compressed rows of integer maps start with their number of bytes per cell,
+        # and are stored as is if compressing them does not make them smaller
+        nbytes = ord(data[0])
+        data = data[1:]
+        if len(data) < nbytes * self.cols:
+            if self.compressed == COMPRESSION_ZLIB:
+                data = zlib.decompress(data)
+            else:
+                data = _expandRuns(data, nbytes, self.cols)
+        return (data, nbytes)
+    
+    def _readNullRow(self, row):
+        """ @return Array of bool, True for NULL cells, or None if the map has no null file """
+        if self._nullFile is None:
+            return None
+        self._nullFile.seek(row * self._nullBytes)
+        data = self._nullFile.read(self._nullBytes)
+        if len(data) != self._nullBytes:
+            return None
+        return np.unpackbits(np.frombuffer(data, dtype=np.uint8))[:self.cols].astype(bool)
+    
+    def readRow(self, row):
+        """ @brief Read a row of the map, in the region of its cell header
+        
+            @param row Integer representing the row
+            
+            @return numpy.ndarray of the cells of the row
+        """
+        if row < 0 or row >= self.rows:
+            raise IndexError("Row %d is outside map %s" % (row, self.mapName) )
+        with self._lock:
+            (data, nbytes) = self._readRowData(row)
+            nulls = self._readNullRow(row)
+        if len(data) < nbytes * self.cols:
+            raise IOError("Row %d of map %s is truncated" % (row, self.mapName) )
+        
+        if self.isFloatingPoint:
+            values = np.frombuffer(data, dtype=self._fileDtype, count=self.cols).astype(self.dtype)
+            if nulls is not None:
+                values[nulls] = np.nan
+        else:
+            values = _decodeCells(data, nbytes, self.cols)
+            if nulls is None:
+                # Integer maps without a null file use zero for NULL
+                nulls = (values == 0)
+            values[nulls] = CELL_NULL
+            if self._reclass is not None:
+                values = self._reclassify(values)
+        return values
+    
+    def _reclassify(self, values):
+        """ @brief Look up the cells of the reclassified map in the table of a reclass
+            map; categories outside the table become NULL, as in G_get_c_raster_row
+        """
+        (first, table) = self._reclass[2:]
+        categories = values.astype(np.int64) - first
+        inTable = (values != CELL_NULL) & (categories >= 0) & (categories < len(table))
+        reclassified = np.empty_like(values)
+        reclassified.fill(CELL_NULL)
+        reclassified[inTable] = table[categories[inTable]]
+        return reclassified
+    
+    def getNulls(self, values):
+        """ @brief Find the NULL cells in values read from this map
+        
+            @return Array of bool, True for NULL cells
+        """
+        if self.isFloatingPoint:
+            return np.isnan(values)
+        return values == CELL_NULL
+    
+    def _getRegionMapping(self, region):
+        """ @brief Map the rows and columns of a region to those of the map, as
+            G__create_window_mapping does
+        
+            @return Tuple (array of map rows, array of map columns), -1 outside the map
+        """
+        key = tuple(sorted(region.items()))
+        mapping = self._regionMappings.get(key)
+        if mapping is not None:
+            return mapping
+        header = self.header
+        
+        steps = np.empty(region['cols'], dtype=np.float64)
+        steps.fill(region['ewRes'] / header['ewRes'])
+        if len(steps):
+            steps[0] = (region['west'] - header['west'] + region['ewRes'] / 2.0) / header['ewRes']
+        cols = np.floor(np.add.accumulate(steps)).astype(np.int64)
+        cols[(cols < 0) | (cols >= self.cols)] = -1
+        
+        rows = np.floor(np.arange(region['rows']) * (region['nsRes'] / header['nsRes']) + \
+                        (header['north'] - region['north'] + region['nsRes'] / 2.0) / header['nsRes'])
+        rows = rows.astype(np.int64)
+        rows[(rows < 0) | (rows >= self.rows)] = -1
+        
+        if len(cols) == self.cols and np.array_equal(cols, np.arange(self.cols)):
+            cols = None
+        mapping = (rows, cols)
+        self._regionMappings[key] = mapping
+        return mapping
+    
+    def getRow(self, row, region=None, mask=None):
+        """ @brief Read a row of a region, resampled from the map by nearest neighbor.
+            Cells outside the map are NULL.
+        
+            @param row Integer representing the row in the region
+            @param region Dict describing the region, the region of the cell header of
+            the map if None
+            @param mask GrassRaster of the mask, see openMask; cells where the mask is
+            NULL or zero become NULL
+            
+            @return numpy.ndarray of the cells of the row
+        """
+        if region is None:
+            region = getRegionForHeader(self.header)
+        (rows, cols) = self._getRegionMapping(region)
+        values = self._resampleRow(int(rows[row]), cols, region['cols'])
+        if mask is not None:
+            maskValues = mask.getRow(row, region)
+            values[(maskValues == 0) | mask.getNulls(maskValues)] = self._null
+        return values
+    
+    def _resampleRow(self, mapRow, cols, numCols):
+        if mapRow < 0:
+            values = np.empty(numCols, dtype=self.dtype)
+            values.fill(self._null)
+            return values
+        values = self.readRow(mapRow)
+        if cols is None:
+            return values
+        # Column -1 takes the NULL appended to the row
+        return np.append(values, np.array([self._null], dtype=self.dtype))[cols]
+    
+    def iterRows(self, region=None, mask=None):
+        """ @brief Iterate over the rows of a region, see getRow
+        
+            @return Iterator over numpy.ndarray
+        """
+        if region is None:
+            region = getRegionForHeader(self.header)
+        if mask is not None:
+            for row in xrange(region['rows']):
+                yield self.getRow(row, region, mask)
+            return
+        (rows, cols) = self._getRegionMapping(region)
+        # Rows of a region finer than the map repeat map rows
+        (lastRow, values) = (None, None)
+        for mapRow in rows.tolist():
+            if mapRow != lastRow or mapRow < 0:
+                values = self._resampleRow(mapRow, cols, region['cols'])
+                lastRow = mapRow
+            yield values.copy()
+    
+    def readArray(self, region=None, mask=None):
+        """ @brief Read all rows of a region, see getRow
+        
+            @return 2 dimensional numpy.ndarray
+        """
+        if region is None:
+            region = getRegionForHeader(self.header)
+        array = np.empty( (region['rows'], region['cols']), dtype=self.dtype )
+        for (row, values) in enumerate(self.iterRows(region, mask)):
+            array[row] = values
+        return array
+
+
+def openMask(mapsetPath):
+    """ @brief Open the mask of a mapset, i.e. its raster map MASK, which GRASS
+        applies to the maps it reads
+    
+        @param mapsetPath String representing the path of the mapset
+        
+        @return GrassRaster, or None if the mapset has no mask
+    """
+    if not os.path.isfile(os.path.join(mapsetPath, 'cellhd', MASK_NAME)):
+        return None
+    return GrassRaster(mapsetPath, MASK_NAME)
+
+
+def getValuesForCoordinates(locationPath, mapset, easting, northing, rasters=None):
+    """ @brief Get the values of raster maps at a coordinate pair in the current region
+        of a mapset, as r.what does
+    
+        @param locationPath String representing the path of the location
+        @param mapset String representing the name of the current mapset
+        @param easting Float
+        @param northing Float
+        @param rasters List of map names, all maps in the search path of the mapset
+        (see listRasters) if None
+        
+        @return OrderedDict mapping map name to its value, an int or a float, or None
+        for NULL cells, coordinates outside the region and maps whose format is not
+        supported (see UnsupportedRasterError), so that one such map does not fail
+        the lookup of the others
+    """
+    mapsetPath = os.path.join(locationPath, mapset)
+    region = readRegion(mapsetPath)
+    if rasters is None:
+        rasters = listRasters(locationPath, mapset)
+    row = int(np.floor( (region['north'] - northing) / region['nsRes'] ))
+    col = int(np.floor( (easting - region['west']) / region['ewRes'] ))
+    inside = (0 <= row < region['rows']) and (0 <= col < region['cols'])
+    
+    values = OrderedDict()
+    mask = openMask(mapsetPath) if inside else None
+    try:
+        for mapName in rasters:
+            values[mapName] = None
+            if not inside:
+                continue
+            found = findRaster(locationPath, mapset, mapName)
+            if found is None:
+                raise IOError("Raster map %s not found" % (mapName,) )
+            try:
+                raster = GrassRaster(*found)
+            except UnsupportedRasterError:
+                continue
+            try:
+                value = raster.getRow(row, region, mask)[col]
+            finally:
+                raster.close()
+            if raster.isFloatingPoint and not np.isnan(value):
+                values[mapName] = float(value)
+            elif not raster.isFloatingPoint and value != CELL_NULL:
+                values[mapName] = int(value)
+    finally:
+        if mask is not None:
+            mask.close()
+    return values
@@ -6,3 +6,6 @@ import sys
 
 os.environ['GISBASE'] = GISBASE = '/usr/lib/grass64'
 sys.path.append(os.path.join(GISBASE, 'etc','python')) 
+
+# Memory budget of the in-process cache of loaded flow tables (see flowtablelru)
+FLOWTABLE_CACHE_BYTES = 1024 * 1024 * 1024
@@ -0,0 +1,262 @@
+"""@package patchcellindex
+
+@brief Index of the raster cells of RHESSys patches, so that the cells of a
+        patch are found in time proportional to the size of the patch rather
+        than by scanning the patch, zone and hillslope maps.  The index is
+        built in one scan of the three maps, recording the cells of each
+        fully qualified patch ID as runs of consecutive columns in a row, and
+        is stored in an arrayfile container that is memory mapped when read.
+
+        The index records the region (window) it was built for and the size
+        and modification time of the files of the three maps; it is stale as
+        soon as any of them changes.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor
+      the names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import os
+
+import numpy as np
+
+import rhessystypes
+import arrayfile
+import flowtablearray
+
+## Constants
+PATCH_INDEX_FORMAT = 'rhessysweb.patchcells'
+PATCH_INDEX_FORMAT_VERSION = 1
+PATCH_INDEX_NAME = 'rhessysweb_patchcells'
+RASTER_ELEMENTS = ('cellhd', 'cell', 'fcell')
+SPAN_DTYPE = np.dtype([('row', np.int32), ('colStart', np.int32), ('colEnd', np.int32)])
+
+
+def getPatchCellIndexPath(mapsetPath, patchMap, zoneMap, hillslopeMap):
+    """ @brief Get the path of the patch cell index of a set of maps, kept with the
+        support files of the patch map
+
+        @param mapsetPath String representing the path of the mapset of the patch map
+        @param patchMap String representing the name of the patch map
+        @param zoneMap String representing the name of the zone map
+        @param hillslopeMap String representing the name of the hillslope map
+
+        @return String representing the path of the index
+    """
+    return os.path.join(mapsetPath, 'cell_misc', patchMap,
+                        "%s.%s.%s" % (PATCH_INDEX_NAME, zoneMap, hillslopeMap) )
+
+def getRasterIdentity(mapsetPath, mapName):
+    """ @brief Get the identity of the files of a GRASS raster map
+
+        @param mapsetPath String representing the path of the mapset of the map
+        @param mapName String representing the name of the map
+
+        @return Dict mapping the path of each file of the map, relative to the mapset,
+        to a list [size, mtime]
+    """
+    identity = {}
+    paths = [os.path.join(element, mapName) for element in RASTER_ELEMENTS]
+    paths.append(os.path.join('cell_misc', mapName, 'null'))
+    for path in paths:
+        try:
+            st = os.stat(os.path.join(mapsetPath, path))
+        except OSError:
+            continue
+        identity[path] = [st.st_size, st.st_mtime]
+    return identity
+
+
+class PatchCellIndex(object):
+    """ @brief Cells of the patches of a raster, as spans of columns [colStart, colEnd)
+        in a row.  The spans of a patch are those from spanOffsets[i] to
+        spanOffsets[i+1], in row and column order, where i is the index of the
+        packed key of the patch in the sorted keys.
+    """
+    def __init__(self, keys, spanOffsets, spans, radix, window, sources=None):
+        """ @brief Build a PatchCellIndex
+
+            @param keys Sorted array of numpy.int64 keys of the patches, packed with radix
+            @param spanOffsets Array of len(keys) + 1 offsets into spans
+            @param spans Array of SPAN_DTYPE
+            @param radix Tuple (zoneRadix, hillRadix) as returned by flowtablearray.getKeyRadix
+            @param window Dict with keys north, west, nsRes, ewRes, rows and cols describing
+            the region the index was built for
+            @param sources Dict mapping map name to identity as returned by getRasterIdentity
+        """
+        self.keys = keys
+        self.spanOffsets = spanOffsets
+        self.spans = spans
+        self.radix = tuple(radix)
+        self.window = window
+        self.sources = sources or {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.spanOffsets.nbytes + self.spans.nbytes
+
+    def getIndexesForKeys(self, fqPatchIDs):
+        """ @brief Get the indexes of patches
+
+            @param fqPatchIDs Sequence of objects with patchID, zoneID and hillID attributes,
+            e.g. rhessystypes.FQPatchID or flowtableio.FlowTableEntryReceiver
+
+            @return Array of indexes, -1 for patches not in the index
+        """
+        if not len(fqPatchIDs) or not len(self.keys):
+            return np.zeros(len(fqPatchIDs), dtype=np.int64) - 1
+        ids = np.array([(f.patchID, f.zoneID, f.hillID) for f in fqPatchIDs], dtype=np.int64)
+        keys = flowtablearray.packKeys(ids[:,0], ids[:,1], ids[:,2], self.radix)
+        indexes = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        indexes[(self.keys[indexes] != keys) | (keys < 0)] = -1
+        return indexes
+
+    def getSpans(self, index):
+        """ @brief Get the spans of the patch at an index, an array of SPAN_DTYPE """
+        return self.spans[self.spanOffsets[index]:self.spanOffsets[index+1]]
+
+    def getCells(self, index):
+        """ @brief Get the cells of the patch at an index
+
+            @return Tuple of arrays (rows, cols), in row and column order
+        """
+        spans = self.getSpans(index)
+        lengths = (spans['colEnd'] - spans['colStart']).astype(np.int64)
+        rows = np.repeat(spans['row'].astype(np.int64), lengths)
+        # Column of each cell: the start of its span plus its position in the span
+        starts = np.cumsum(lengths) - lengths
+        cols = np.arange(lengths.sum()) - np.repeat(starts - spans['colStart'], lengths)
+        return (rows, cols)
+
+    def getCoordinates(self, index):
+        """ @brief Get the coordinates of the cells of the patch at an index, in row
+            and column order, computed as G_col_to_easting and G_row_to_northing do
+
+            @return List of rhessystypes.CoordinatePair
+        """
+        (rows, cols) = self.getCells(index)
+        w = self.window
+        eastings = w['west'] + (cols + 0.5) * w['ewRes']
+        northings = w['north'] - (rows + 0.5) * w['nsRes']
+        return [rhessystypes.getCoordinatePair(e, n) for (e, n) in zip(eastings.tolist(), northings.tolist())]
+
+    def toArrays(self):
+        return {'keys': self.keys, 'spanOffsets': self.spanOffsets, 'spans': self.spans}
+
+
+def buildPatchCellIndex(rows, window, sources=None):
+    """ @brief Build a patch cell index in one pass over the rows of the patch, zone
+        and hillslope maps.  Cells with a negative ID in any of the maps, e.g. NULL
+        cells, belong to no patch.
+
+        @param rows Iterable of tuples (patchRow, zoneRow, hillRow) of arrays of
+        numpy.int64, the rows of the maps in order
+        @param window Dict describing the region of the rows, see PatchCellIndex
+        @param sources Dict mapping map name to identity as returned by getRasterIdentity
+
+        @return PatchCellIndex
+    """
+    runs = []
+    for (row, (patchRow, zoneRow, hillRow)) in enumerate(rows):
+        if not len(patchRow):
+            continue
+        # Runs start where any of the IDs changes
+        changed = (patchRow[1:] != patchRow[:-1]) | (zoneRow[1:] != zoneRow[:-1]) | \
+                  (hillRow[1:] != hillRow[:-1])
+        starts = np.concatenate( ([0], np.flatnonzero(changed) + 1) )
+        ends = np.append(starts[1:], len(patchRow))
+        valid = (patchRow[starts] >= 0) & (zoneRow[starts] >= 0) & (hillRow[starts] >= 0)
+        starts = starts[valid]
+        runs.append( (np.repeat(row, len(starts)), starts, ends[valid],
+                      patchRow[starts], zoneRow[starts], hillRow[starts]) )
+    if runs:
+        (runRows, colStarts, colEnds, patchIDs, zoneIDs, hillIDs) = \
+            [np.concatenate([r[i] for r in runs]) for i in xrange(6)]
+    else:
+        (runRows, colStarts, colEnds, patchIDs, zoneIDs, hillIDs) = \
+            [np.zeros(0, dtype=np.int64) for i in xrange(6)]
+    del runs
+
+    radix = flowtablearray.getKeyRadix(zoneIDs, hillIDs)
+    runKeys = flowtablearray.packKeys(patchIDs, zoneIDs, hillIDs, radix)
+    # Stable, so the spans of each patch stay in row and column order
+    order = np.argsort(runKeys, kind='mergesort')
+    runKeys = runKeys[order]
+    spans = np.empty(len(order), dtype=SPAN_DTYPE)
+    spans['row'] = runRows[order]
+    spans['colStart'] = colStarts[order]
+    spans['colEnd'] = colEnds[order]
+
+    isFirst = np.ones(len(runKeys), dtype=bool)
+    isFirst[1:] = runKeys[1:] != runKeys[:-1]
+    firsts = np.flatnonzero(isFirst)
+    spanOffsets = np.append(firsts, len(runKeys)).astype(np.int64)
+    return PatchCellIndex(runKeys[firsts], spanOffsets, spans, radix, window, sources)
+
+
+def writePatchCellIndex(index, path):
+    """ @brief Write a patch cell index
+
+        @param index PatchCellIndex
+        @param path String representing the path of the index to write
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    metadata = {'format': PATCH_INDEX_FORMAT, 'formatVersion': PATCH_INDEX_FORMAT_VERSION,
+                'radix': list(index.radix), 'window': index.window, 'sources': index.sources}
+    arrayfile.writeArrays(path, index.toArrays(), metadata)
+
+def readPatchCellIndex(path):
+    """ @brief Memory map a patch cell index
+
+        @param path String representing the path of the index
+
+        @return PatchCellIndex whose arrays are read-only views of the index file
+    """
+    (arrays, metadata) = arrayfile.readArrays(path)
+    if metadata.get('format') != PATCH_INDEX_FORMAT or \
+            metadata.get('formatVersion') != PATCH_INDEX_FORMAT_VERSION:
+        raise IOError("%s is not a patch cell index" % (path,) )
+    return PatchCellIndex(arrays['keys'], arrays['spanOffsets'], arrays['spans'], metadata['radix'],
+                          metadata['window'], metadata['sources'])
+
+def isPatchCellIndexCurrent(index, window, sources):
+    """ @brief Determine whether a patch cell index matches the current region and
+        the current files of the maps it was built from
+
+        @param index PatchCellIndex
+        @param window Dict describing the current region, see PatchCellIndex
+        @param sources Dict mapping map name to its current identity, as returned by
+        getRasterIdentity
+
+        @return True if the index is current
+    """
+    return index.window == window and index.sources == sources
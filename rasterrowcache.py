@@ -0,0 +1,170 @@
+"""@package rasterrowcache
+
+@brief Process-wide cache of raster rows read through the GRASS library, so
+        that repeated lookups in the same neighborhood of a map do not read and
+        decompress the same rows again.  Rows are keyed by map, mapset, row and
+        version, where the version combines the current region and the identity
+        of the files of the map (see patchcellindex.getRasterIdentity), so rows
+        of a changed map or of another region are never returned.  Rows are
+        evicted least recently used first to stay within a memory budget.
+        Cached rows are shared between callers and are read-only.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor
+      the names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import threading
+from collections import namedtuple
+from collections import OrderedDict
+
+## Constants
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+## Type definitions
+RasterRowCacheStats = namedtuple('RasterRowCacheStats', ['hits', 'misses', 'evictions', 'numRows',
+                                                         'numBytes', 'maxBytes'], verbose=False)
+
+
+def getRasterVersion(window, identity):
+    """ @brief Get the version of a raster map, for use with RasterRowCache.getRow
+
+        @param window Dict describing the current region, e.g. from
+        GrassDataLookup._getWindow
+        @param identity Dict mapping each file of the map to a list [size, mtime], see
+        patchcellindex.getRasterIdentity
+
+        @return Hashable version
+    """
+    return ( tuple(sorted(window.items())),
+             tuple(sorted( (path, tuple(stat)) for (path, stat) in identity.items() )) )
+
+
+class RasterRowCache(object):
+    def __init__(self, maxBytes=DEFAULT_MAX_BYTES):
+        """ @brief Build a RasterRowCache
+
+            @param maxBytes Number of bytes of rows the cache may hold
+        """
+        self.maxBytes = maxBytes
+        self._rows = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.numBytes = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def getRow(self, mapName, mapset, row, version, readFunction):
+        """ @brief Get a row of a raster map, reading it if it is not cached
+
+            @param mapName String representing the name of the map
+            @param mapset String representing the mapset of the map
+            @param row Integer representing the row, in the current region
+            @param version Version of the map, see getRasterVersion
+            @param readFunction Function called with the row to read it when it is not
+            cached, returning a new numpy.ndarray
+
+            @return numpy.ndarray, read-only and shared with other callers
+        """
+        key = (mapName, mapset, row, version)
+        with self._lock:
+            cached = self._rows.pop(key, None)
+            if cached is not None:
+                self._rows[key] = cached
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        values = readFunction(row)
+        values.flags.writeable = False
+        size = values.nbytes
+        with self._lock:
+            if key in self._rows:
+                # Read concurrently by another thread, share its copy
+                return self._rows[key]
+            # Rows of older versions of the map can no longer be requested
+            if self._versions.get( (mapName, mapset), version ) != version:
+                self._evictMap(mapName, mapset)
+            self._versions[ (mapName, mapset) ] = version
+            if size <= self.maxBytes:
+                while self.numBytes + size > self.maxBytes:
+                    self._evict(next(iter(self._rows)))
+                self._rows[key] = values
+                self.numBytes += size
+        return values
+
+    def _evict(self, key):
+        values = self._rows.pop(key)
+        self.numBytes -= values.nbytes
+        self.evictions += 1
+
+    def _evictMap(self, mapName, mapset):
+        for key in [k for k in self._rows if k[0] == mapName and k[1] == mapset]:
+            self._evict(key)
+        self._versions.pop( (mapName, mapset), None )
+
+    def setMaxBytes(self, maxBytes):
+        """ @brief Change the memory budget, evicting rows as needed """
+        with self._lock:
+            self.maxBytes = maxBytes
+            while self._rows and self.numBytes > self.maxBytes:
+                self._evict(next(iter(self._rows)))
+
+    def invalidate(self, mapName, mapset):
+        """ @brief Remove all rows of a map from the cache """
+        with self._lock:
+            self._evictMap(mapName, mapset)
+
+    def clear(self):
+        """ @brief Remove all rows from the cache """
+        with self._lock:
+            for key in list(self._rows):
+                self._evict(key)
+            self._versions.clear()
+
+    def getStats(self):
+        """ @brief Get the counters of this cache
+
+            @return RasterRowCacheStats
+        """
+        with self._lock:
+            return RasterRowCacheStats(self.hits, self.misses, self.evictions, len(self._rows),
+                                       self.numBytes, self.maxBytes)
+
+
+## Process-wide cache
+_cache = RasterRowCache()
+
+def getCache():
+    """ @brief Get the process-wide RasterRowCache, e.g. to configure its memory
+        budget with setMaxBytes or to read its counters with getStats
+    """
+    return _cache
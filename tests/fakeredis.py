@@ -0,0 +1,199 @@
+"""@package tests.fakeredis
+
+@brief In-memory stand-in for the parts of redis.Redis used by the flow table
+        cache, versions and edit overlay, so that their tests run without a
+        Redis server
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+import time
+import threading
+
+
+class FakePipeline(object):
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        def call(*args, **kwargs):
+            self.calls.append( (method, args, kwargs) )
+            return self
+        return call
+
+    def execute(self):
+        (calls, self.calls) = (self.calls, [])
+        return [method(*args, **kwargs) for (method, args, kwargs) in calls]
+
+
+class FakeRedis(object):
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+        self._lock = threading.RLock()
+
+    def _expire(self, key):
+        if key in self.expiry and self.expiry[key] <= time.time():
+            self.data.pop(key, None)
+            del self.expiry[key]
+
+    def _get(self, key, default=None):
+        self._expire(key)
+        return self.data.get(key, default)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def info(self):
+        # Only used for reporting, a rough count will do
+        return {'used_memory': len(self.data)}
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value, px=None, nx=False):
+        with self._lock:
+            if nx and self._get(key) is not None:
+                return None
+            self.data[key] = str(value)
+            self.expiry.pop(key, None)
+            if px is not None:
+                self.expiry[key] = time.time() + px / 1000.0
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            deleted = 0
+            for key in keys:
+                if self._get(key) is not None:
+                    deleted += 1
+                self.data.pop(key, None)
+                self.expiry.pop(key, None)
+            return deleted
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._get(key, 0)) + 1
+            self.data[key] = str(value)
+            return value
+
+    def expire(self, key, seconds):
+        return self.pexpire(key, seconds * 1000)
+
+    def pexpire(self, key, milliseconds):
+        with self._lock:
+            if self._get(key) is None:
+                return 0
+            self.expiry[key] = time.time() + int(milliseconds) / 1000.0
+            return 1
+
+    def eval(self, script, numKeys, key, token, *args):
+        # Only the compare-and-delete and compare-and-expire lock scripts are supported
+        with self._lock:
+            if self._get(key) != token:
+                return 0
+            if 'pexpire' in script:
+                return self.pexpire(key, args[0])
+            return self.delete(key)
+
+    def hset(self, key, field, value):
+        with self._lock:
+            h = self.data.setdefault(key, {})
+            isNew = field not in h
+            h[field] = str(value)
+            return int(isNew)
+
+    def hmset(self, key, mapping):
+        with self._lock:
+            h = self.data.setdefault(key, {})
+            for (field, value) in mapping.items():
+                h[field] = str(value)
+            return True
+
+    def hget(self, key, field):
+        with self._lock:
+            return self._get(key, {}).get(field)
+
+    def hmget(self, key, fields):
+        with self._lock:
+            h = self._get(key, {})
+            return [h.get(field) for field in fields]
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._get(key, {}))
+
+    def hexists(self, key, field):
+        with self._lock:
+            return field in self._get(key, {})
+
+    def hlen(self, key):
+        with self._lock:
+            return len(self._get(key, {}))
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            h = self._get(key, {})
+            return sum(1 for field in fields if h.pop(field, None) is not None)
+
+    def rpush(self, key, *values):
+        with self._lock:
+            l = self.data.setdefault(key, [])
+            l.extend(str(v) for v in values)
+            return len(l)
+
+    def llen(self, key):
+        with self._lock:
+            return len(self._get(key, []))
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            l = self._get(key, [])
+            return l[start:] if end == -1 else l[start:end + 1]
+
+    def sadd(self, key, *values):
+        with self._lock:
+            s = self.data.setdefault(key, set())
+            added = sum(1 for v in values if str(v) not in s)
+            s.update(str(v) for v in values)
+            return added
+
+    def srem(self, key, *values):
+        with self._lock:
+            s = self._get(key, set())
+            removed = sum(1 for v in values if str(v) in s)
+            s.difference_update(str(v) for v in values)
+            return removed
+
+    def smembers(self, key):
+        with self._lock:
+            return set(self._get(key, set()))
@@ -0,0 +1,190 @@
+"""@package tests.test_flowgraph
+
+@brief Test methods for flowgraph
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage:
+@code
+python -m unittest test_flowgraph
+@endcode
+"""
+import os, errno
+import gzip
+from collections import OrderedDict
+from unittest import TestCase
+
+import numpy as np
+
+from flowtableio import readFlowtable
+from flowtableio import FlowTableEntry
+from flowtableio import FlowTableEntryReceiver
+from flowtablearray import readFlowtableColumnar
+from flowgraph import buildFlowGraph
+import rhessystypes
+
+## Constants
+ZERO = 0.001
+
+def _makeFlowtable(patches):
+    """ @brief Build a flow table dict from a list of (patchID, area, accumArea, receivers)
+        where receivers is a list of (patchID, gamma)
+    """
+    flowtable = OrderedDict()
+    for (patchID, area, accumArea, receivers) in patches:
+        key = rhessystypes.FQPatchID(patchID=patchID, zoneID=1, hillID=1)
+        items = [FlowTableEntry(patchID, 1, 1, 0.0, 0.0, 0.0, accumArea, area, 1, 1.0, len(receivers))]
+        items.extend([FlowTableEntryReceiver(r, 1, 1, gamma) for (r, gamma) in receivers])
+        flowtable[key] = items
+    return flowtable
+
+## Unit tests
+class TestFlowGraph(TestCase):
+
+    def testAccumulatedArea(self):
+        # 1 and 2 drain into 3, which splits between 4 and 5; 5 also drains into 4
+        flowtable = _makeFlowtable([ (4, 1, 9.25, []),
+                                     (5, 1, 3.5, [(4, 1.0)]),
+                                     (3, 2, 5.0, [(4, 0.5), (5, 0.5)]),
+                                     (1, 1, 1.0, [(3, 1.0)]),
+                                     (2, 2, 2.0, [(3, 1.0), (99, 0.0)]) ])
+        graph = buildFlowGraph(flowtable)
+        self.assertFalse( graph.hasCycles() )
+        order = list(graph.getTopologicalOrder())
+        self.assertTrue( order.index(2) < order.index(1) < order.index(0) )
+        self.assertTrue( np.allclose(graph.getAccumulatedArea(), [7.0, 3.5, 5.0, 1.0, 2.0]) )
+        mismatches = graph.getAccumulatedAreaMismatches()
+        self.assertTrue( len(mismatches) == 1 )
+        self.assertTrue( mismatches[0].key.patchID == 4 )
+        self.assertTrue( abs(mismatches[0].computed - 7.0) < ZERO )
+
+    def testDownstreamPath(self):
+        flowtable = _makeFlowtable([ (1, 1, 1.0, [(2, 0.3), (3, 0.7)]),
+                                     (2, 1, 1.0, [(4, 1.0)]),
+                                     (3, 1, 1.0, [(4, 1.0)]),
+                                     (4, 1, 1.0, [(4, 1.0)]) ])
+        graph = buildFlowGraph(flowtable)
+        path = graph.getDownstreamPath(rhessystypes.FQPatchID(patchID=1, zoneID=1, hillID=1))
+        self.assertTrue( [p.patchID for p in path] == [1, 3, 4] )
+        self.assertTrue( graph.getOutlet(1) == 3 )
+
+    def testCycles(self):
+        flowtable = _makeFlowtable([ (1, 1, 1.0, [(2, 1.0)]),
+                                     (2, 1, 1.0, [(3, 1.0)]),
+                                     (3, 1, 1.0, [(2, 1.0)]),
+                                     (4, 1, 1.0, [(3, 1.0)]),
+                                     (5, 1, 1.0, []) ])
+        graph = buildFlowGraph(flowtable)
+        self.assertTrue( graph.hasCycles() )
+        self.assertTrue( list(graph.getCycleNodes()) == [1, 2] )
+        self.assertRaises( Exception, graph.getTopologicalOrder )
+        self.assertTrue( np.isnan(graph.getAccumulatedArea()[2]) )
+        self.assertRaises( Exception, graph.getDownstreamPath, 0 )
+        self.assertTrue( graph.getOutlet(4) == 4 )
+
+    def testDownstreamPathBelowCycle(self):
+        # 1 and 2 form a cycle of dominant receivers; 2 also drains a little into 4,
+        # whose own dominant path to 5 has no cycle
+        flowtable = _makeFlowtable([ (1, 1, 1.0, [(2, 1.0)]),
+                                     (2, 1, 1.0, [(1, 0.6), (4, 0.4)]),
+                                     (4, 1, 1.0, [(5, 1.0)]),
+                                     (5, 1, 1.0, []),
+                                     (6, 1, 1.0, [(1, 1.0)]) ])
+        graph = buildFlowGraph(flowtable)
+        self.assertTrue( graph.hasCycles() )
+        path = graph.getDownstreamPath(rhessystypes.FQPatchID(patchID=4, zoneID=1, hillID=1))
+        self.assertTrue( [p.patchID for p in path] == [4, 5] )
+        self.assertTrue( graph.getOutlet(2) == 3 )
+        for index in (0, 1, 4):
+            self.assertTrue( graph.getOutlet(index) == -1 )
+            self.assertRaises( Exception, graph.getDownstreamPath, index )
+
+    def testLongDownstreamPath(self):
+        numPatches = 5000
+        flowtable = _makeFlowtable([ (i, 1, 1.0, [(i + 1, 1.0)] if i < numPatches else []) \
+                                     for i in xrange(1, numPatches + 1) ])
+        graph = buildFlowGraph(flowtable)
+        self.assertTrue( [graph.getOutlet(i) for i in (0, numPatches // 2)] == [numPatches - 1] * 2 )
+        self.assertTrue( len(graph.getDownstreamPath(0)) == numPatches )
+
+
+class TestFlowGraphFlowtable(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # We gzip the flow table to be nice to GitHub, unzip it
+        cls.flowtablePath = os.path.abspath('./tests/data/world5m_dr5.flow')
+        flowtableGz = "%s.gz" % (cls.flowtablePath,)
+        if not os.access(flowtableGz, os.R_OK):
+            raise IOError(errno.EACCES, "Unable to read flow table %s" %
+                      flowtableGz)
+        cls.flowtableDir = os.path.split(flowtableGz)[0]
+        if not os.access(cls.flowtableDir, os.W_OK):
+            raise IOError(errno.EACCES, "Unable to write to flow table dir %s" %
+                          cls.flowtableDir)
+        fIn = gzip.open(flowtableGz, 'rb')
+        fOut = open(cls.flowtablePath, 'wb')
+        fOut.write(fIn.read())
+        fIn.close()
+        fOut.close()
+
+        cls.flowtable = readFlowtable(cls.flowtablePath)
+        cls.graph = buildFlowGraph(cls.flowtable)
+
+    @classmethod
+    def tearDownClass(cls):
+        # Get rid of the un-gzipped flow table
+        os.unlink(cls.flowtablePath)
+
+    def testSameAsColumnar(self):
+        columnarGraph = buildFlowGraph(readFlowtableColumnar(self.flowtablePath))
+        self.assertTrue( np.array_equal(self.graph.patchIDs, columnarGraph.patchIDs) )
+        self.assertTrue( np.array_equal(self.graph.edgeTargets, columnarGraph.edgeTargets) )
+        self.assertTrue( np.allclose(self.graph.getAccumulatedArea(), columnarGraph.getAccumulatedArea(),
+                                     equal_nan=True) )
+
+    def testTopologicalOrder(self):
+        if self.graph.hasCycles():
+            self.assertRaises( Exception, self.graph.getTopologicalOrder )
+            return
+        order = self.graph.getTopologicalOrder()
+        self.assertTrue( sorted(order) == range(len(self.graph)) )
+        position = np.empty(len(order), dtype=np.int64)
+        position[order] = np.arange(len(order))
+        sources = np.repeat(np.arange(len(self.graph)), np.diff(self.graph.edgeOffsets))
+        self.assertTrue( (position[sources] < position[self.graph.edgeTargets]).all() )
+
+    def testDownstreamPath(self):
+        for index in xrange(0, len(self.graph), 997):
+            if self.graph.getOutlet(index) < 0:
+                continue
+            path = self.graph.getDownstreamPath(index)
+            self.assertTrue( path[0] == self.graph.getKey(index) )
+            self.assertTrue( path[-1] == self.graph.getKey(self.graph.getOutlet(index)) )
@@ -0,0 +1,221 @@
+"""@package tests.test_flowtablearray
+
+@brief Test methods for flowtablearray
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage:
+@code
+python -m unittest test_flowtablearray
+@endcode
+"""
+import os, errno
+import gzip
+import shutil
+import filecmp
+from StringIO import StringIO
+from unittest import TestCase
+
+import numpy as np
+
+from flowtableio import readFlowtable
+from flowtableio import writeFlowtable
+from flowtableio import getReceiversForFlowtableEntry
+from flowtableio import buildDonorIndex
+from flowtableio import getDonorsForFlowtableEntry
+from flowtablearray import readFlowtableColumnar
+from flowtablearray import loadFlowtable
+from flowtablearray import writeFlowtableColumnar
+from flowtablearray import getSidecarPath
+from flowtablearray import isSidecarCurrent
+import rhessystypes
+
+## Constants
+ZERO = 0.001
+
+## Unit tests
+class TestReadFlowtableColumnar(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # We gzip the flow table to be nice to GitHub, unzip it
+        cls.flowtablePath = os.path.abspath('./tests/data/world5m_dr5.flow')
+        flowtableGz = "%s.gz" % (cls.flowtablePath,)
+        if not os.access(flowtableGz, os.R_OK):
+            raise IOError(errno.EACCES, "Unable to read flow table %s" %
+                      flowtableGz)
+        cls.flowtableDir = os.path.split(flowtableGz)[0]
+        if not os.access(cls.flowtableDir, os.W_OK):
+            raise IOError(errno.EACCES, "Unable to write to flow table dir %s" %
+                          cls.flowtableDir)
+        fIn = gzip.open(flowtableGz, 'rb')
+        fOut = open(cls.flowtablePath, 'wb')
+        fOut.write(fIn.read())
+        fIn.close()
+        fOut.close()
+
+        cls.flowtable = readFlowtableColumnar(cls.flowtablePath)
+
+    @classmethod
+    def tearDownClass(cls):
+        # Get rid of the un-gzipped flow table
+        os.unlink(cls.flowtablePath)
+
+    def testReadWriteFlowtable(self):
+        testOutpath = os.path.join(self.flowtableDir, "test-flow-columnar.flow")
+        writeFlowtable(self.flowtable, testOutpath)
+        self.assertTrue( filecmp.cmp(self.flowtablePath, testOutpath, shallow=False) )
+        os.unlink(testOutpath)
+
+    def testWriteFlowtableColumnar(self):
+        testOutpath = os.path.join(self.flowtableDir, "test-flow-columnar-fast.flow")
+        writeFlowtableColumnar(self.flowtable, testOutpath)
+        self.assertTrue( filecmp.cmp(self.flowtablePath, testOutpath, shallow=False) )
+        os.unlink(testOutpath)
+        # and to a file object, as writeFlowtable does
+        out = StringIO()
+        writeFlowtableColumnar(self.flowtable, out)
+        f = open(self.flowtablePath, 'rb')
+        self.assertTrue( out.getvalue() == f.read() )
+        f.close()
+
+    def testSameAsReadFlowtable(self):
+        flowDict = readFlowtable(self.flowtablePath)
+        columnarDict = self.flowtable.toFlowtableDict()
+        self.assertTrue( flowDict.keys() == columnarDict.keys() )
+        self.assertTrue( len(self.flowtable) == len(flowDict) )
+
+    def testParallelRead(self):
+        parallel = readFlowtableColumnar(self.flowtablePath, numWorkers=4)
+        serialArrays = self.flowtable.toArrays()
+        parallelArrays = parallel.toArrays()
+        for name in serialArrays.keys():
+            self.assertTrue( np.array_equal(serialArrays[name], parallelArrays[name]) )
+
+    def testReadCompressedFlowtable(self):
+        flowtableGz = "%s.gz" % (self.flowtablePath,)
+        serialArrays = self.flowtable.toArrays()
+        for numWorkers in (1, 4):
+            compressedArrays = readFlowtableColumnar(flowtableGz, numWorkers=numWorkers).toArrays()
+            for name in serialArrays.keys():
+                self.assertTrue( np.array_equal(serialArrays[name], compressedArrays[name]) )
+
+    def testEntryWithRoad(self):
+        testKeyStr = "367400     67     67"
+        values = testKeyStr.split()
+        testEntry = rhessystypes.getFQPatchIDFromArray(values)
+        index = self.flowtable.getIndexForKey(testEntry)
+        self.assertTrue( index >= 0 )
+        self.assertTrue( self.flowtable.getEntry(index).patchID == 367400 )
+        receivers = self.flowtable.getReceivers(index)
+        self.assertTrue( len(receivers) == 8 )
+        self.assertTrue( receivers[0].patchID == 366553 )
+        self.assertTrue( abs(receivers[7].gamma - 0.53678352) < ZERO )
+        self.assertTrue( abs(self.flowtable.getRoad(index).roadWidth - 5.0) < ZERO )
+
+    def testGetReceiversForFlowtableEntryWithoutRoad(self):
+        testKeyStr = "324225     67     67"
+        values = testKeyStr.split()
+        testEntry = rhessystypes.getFQPatchIDFromArray(values)
+        receivers = getReceiversForFlowtableEntry(testEntry, self.flowtable)
+        self.assertTrue( len(receivers) == 8 )
+        self.assertTrue( receivers[0].patchID == 323378 )
+        self.assertIsNone( self.flowtable.getRoad(self.flowtable.getIndexForKey(testEntry)) )
+
+    def testRejectNonIntegerValues(self):
+        # readFlowtable parses integer columns with int(), the columnar reader must
+        # reject the same values rather than truncating them
+        testFlowtable = os.path.join(self.flowtableDir, "test-flow-nonint.flow")
+        entry = "%8d %8d %8d %10.1f %10.1f %10.1f %10.1f %s %3d %10.6f %3d\n"
+        lines = [ "2\n", entry % (1, 1, 1, 0.5, 0.5, 10.0, 1.0, "1", 1, 1.0, 1),
+                  "%8s %8d %8d %10.6f\n" % ("2", 1, 1, 1.0),
+                  entry % (2, 1, 1, 1.5, 0.5, 5.0, 2.0, "1", 1, 1.0, 0) ]
+        try:
+            for (line, value) in ( (1, "1.5"), (1, "1e3"), (2, "2.0") ):
+                values = list(lines)
+                if line == 1:
+                    values[1] = entry % (1, 1, 1, 0.5, 0.5, 10.0, 1.0, value, 1, 1.0, 1)
+                else:
+                    values[2] = "%8s %8d %8d %10.6f\n" % (value, 1, 1, 1.0)
+                f = open(testFlowtable, 'w')
+                f.write(''.join(values))
+                f.close()
+                self.assertRaises( ValueError, readFlowtable, testFlowtable )
+                self.assertRaises( Exception, readFlowtableColumnar, testFlowtable )
+
+            f = open(testFlowtable, 'w')
+            f.write(''.join(lines))
+            f.close()
+            self.assertTrue( readFlowtable(testFlowtable).keys() == \
+                             readFlowtableColumnar(testFlowtable).toFlowtableDict().keys() )
+        finally:
+            os.unlink(testFlowtable)
+
+    def testDonorIndex(self):
+        flowDict = self.flowtable.toFlowtableDict()
+        donorIndex = buildDonorIndex(flowDict)
+        for key in flowDict.keys():
+            self.assertTrue( getDonorsForFlowtableEntry(key, self.flowtable) == \
+                             getDonorsForFlowtableEntry(key, donorIndex) )
+
+    def testMissingKey(self):
+        testEntry = rhessystypes.FQPatchID(patchID=-1, zoneID=67, hillID=67)
+        self.assertTrue( self.flowtable.getIndexForKey(testEntry) == -1 )
+        self.assertFalse( testEntry in self.flowtable )
+
+    def testSidecar(self):
+        testFlowtable = os.path.join(self.flowtableDir, "test-flow-sidecar.flow")
+        testOutpath = os.path.join(self.flowtableDir, "test-flow-sidecar-out.flow")
+        shutil.copy(self.flowtablePath, testFlowtable)
+        sidecar = getSidecarPath(testFlowtable)
+        try:
+            self.assertFalse( isSidecarCurrent(testFlowtable) )
+            loadFlowtable(testFlowtable)
+            self.assertTrue( isSidecarCurrent(testFlowtable) )
+
+            # Second load maps the sidecar
+            mapped = loadFlowtable(testFlowtable)
+            self.assertFalse( mapped.entries.flags.writeable )
+            self.assertTrue( mapped.donorOffsets is not None )
+            self.assertTrue( np.array_equal(mapped.donors, self.flowtable.getDonorArrays()['donors']) )
+            writeFlowtable(mapped, testOutpath)
+            self.assertTrue( filecmp.cmp(self.flowtablePath, testOutpath, shallow=False) )
+
+            # Changing the flow table invalidates the sidecar
+            f = open(testFlowtable, 'a')
+            f.write("\n")
+            f.close()
+            self.assertFalse( isSidecarCurrent(testFlowtable) )
+            self.assertTrue( len(loadFlowtable(testFlowtable)) == len(self.flowtable) )
+            self.assertTrue( isSidecarCurrent(testFlowtable) )
+        finally:
+            for path in (testFlowtable, testOutpath, sidecar):
+                if os.path.exists(path):
+                    os.unlink(path)
@@ -0,0 +1,168 @@
+"""@package tests.test_flowtablecache
+
+@brief Test methods for flowtablecache
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage:
+@code
+python -m unittest test_flowtablecache
+@endcode
+"""
+import os, errno
+import gzip
+import time
+from unittest import TestCase
+
+from flowtableio import readFlowtable
+from flowtableio import buildDonorIndex
+from flowtableio import dumpDonors
+from flowtableio import loadDonors
+from flowtableio import FlowTableEntry
+from flowtableio import FlowTableEntryReceiver
+from flowtableio import FlowTableRecord
+from flowtableio import writeFlowtableRecords
+from flowtablearray import readFlowtableColumnar
+import flowtablecache
+from flowtablecache import packKey
+from flowtablecache import unpackKey
+from flowtablecache import encodeCacheValue
+from flowtablecache import decodeCacheValue
+from flowtablecache import encodeReceivers
+from flowtablecache import decodeReceivers
+import rhessystypes
+from tests.fakeredis import FakeRedis
+
+## Unit tests
+class TestFlowtableCache(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # We gzip the flow table to be nice to GitHub, unzip it
+        cls.flowtablePath = os.path.abspath('./tests/data/world5m_dr5.flow')
+        flowtableGz = "%s.gz" % (cls.flowtablePath,)
+        if not os.access(flowtableGz, os.R_OK):
+            raise IOError(errno.EACCES, "Unable to read flow table %s" %
+                      flowtableGz)
+        cls.flowtableDir = os.path.split(flowtableGz)[0]
+        if not os.access(cls.flowtableDir, os.W_OK):
+            raise IOError(errno.EACCES, "Unable to write to flow table dir %s" %
+                          cls.flowtableDir)
+        fIn = gzip.open(flowtableGz, 'rb')
+        fOut = open(cls.flowtablePath, 'wb')
+        fOut.write(fIn.read())
+        fIn.close()
+        fOut.close()
+
+        cls.flowtable = readFlowtable(cls.flowtablePath)
+
+    @classmethod
+    def tearDownClass(cls):
+        # Get rid of the un-gzipped flow table
+        os.unlink(cls.flowtablePath)
+
+    def testPackKey(self):
+        key = rhessystypes.FQPatchID(patchID=367400, zoneID=67, hillID=67)
+        packed = packKey(key)
+        self.assertTrue( len(packed) == flowtablecache.KEY_STRUCT.size )
+        self.assertTrue( unpackKey(packed) == key )
+
+    def testEncodeCacheValue(self):
+        for items in self.flowtable.itervalues():
+            decoded = decodeCacheValue(encodeCacheValue(items))
+            self.assertTrue( decoded[0] == items[0] )
+            self.assertTrue( len(decoded) == len(items) )
+            for (d, i) in zip(decoded[1:], items[1:]):
+                self.assertTrue( type(d) == type(i) )
+                if isinstance(i, FlowTableEntryReceiver):
+                    self.assertTrue( (d.patchID, d.zoneID, d.hillID, d.gamma) == \
+                                     (i.patchID, i.zoneID, i.hillID, i.gamma) )
+                else:
+                    self.assertTrue( d == i )
+
+    def testColumnarBatchesSameAsDict(self):
+        columnar = readFlowtableColumnar(self.flowtablePath)
+        columnarBatches = list(flowtablecache._iterColumnarBatches(columnar, 1000))
+        dictBatches = list(flowtablecache._iterDictBatches(self.flowtable, 1000))
+        self.assertTrue( columnarBatches == dictBatches )
+
+    def testEncodeDonors(self):
+        donorIndex = buildDonorIndex(self.flowtable)
+        for donors in donorIndex.itervalues():
+            self.assertTrue( loadDonors(dumpDonors(donors)) == donors )
+
+    def testEncodeReceivers(self):
+        for items in self.flowtable.itervalues():
+            receivers = [item for item in items if isinstance(item, FlowTableEntryReceiver)]
+            decoded = decodeReceivers(encodeReceivers(receivers))
+            self.assertTrue( [(r.patchID, r.zoneID, r.hillID, r.gamma) for r in decoded] == \
+                             [(r.patchID, r.zoneID, r.hillID, r.gamma) for r in receivers] )
+
+    def testProgressCountsDistinctPatches(self):
+        # Patch 1 occurs twice, and is loaded once
+        def record(patchID):
+            entry = FlowTableEntry(patchID, 1, 1, 0.0, 0.0, 10.0 - patchID, 1.0, 1, 1, 1.0, 1)
+            return FlowTableRecord(entry, [FlowTableEntryReceiver(patchID + 1, 1, 1, 1.0)], None)
+        dupPath = os.path.join(self.flowtableDir, "test-flow-cache-dup.flow")
+        writeFlowtableRecords([record(1), record(2), record(3), record(1)], dupPath)
+        try:
+            table = readFlowtableColumnar(dupPath)
+        finally:
+            os.unlink(dupPath)
+        redisClient = FakeRedis()
+        calls = []
+        stats = flowtablecache.bulkLoadFlowtable(redisClient, 'dup', table, batchSize=2,
+                                                 progress=lambda *args: calls.append(args))
+        self.assertTrue( calls == [(0, 3), (2, 3), (3, 3)] )
+        self.assertTrue( stats.numPatches == flowtablecache.getCachedNumPatches(redisClient, 'dup') == 3 )
+
+    def testSlowLoaderKeepsLock(self):
+        redisClient = FakeRedis()
+        flowtable = dict(self.flowtable.items()[:500])
+        def slowRead():
+            # Reading takes longer than the lock lasts
+            time.sleep(0.5)
+            return flowtable
+        stats = flowtablecache.ensureFlowtableCached(redisClient, 'slow', slowRead, lockTimeout=0.2)
+        self.assertTrue( stats.numPatches == len(flowtable) )
+        self.assertTrue( flowtablecache.isFlowtableCached(redisClient, 'slow') )
+        self.assertIsNone( flowtablecache.getLoadProgress(redisClient, 'slow') )
+        self.assertIsNone( flowtablecache.ensureFlowtableCached(redisClient, 'slow', slowRead, lockTimeout=0.2) )
+
+    def testLostLock(self):
+        redisClient = FakeRedis()
+        def stolenRead():
+            # Another process takes over the lock while the flow table is read
+            lockKey = flowtablecache._getLockKeys('stolen')[0]
+            redisClient.set(lockKey, 'other')
+            return dict(self.flowtable.items()[:500])
+        with self.assertRaises(Exception):
+            flowtablecache.ensureFlowtableCached(redisClient, 'stolen', stolenRead, lockTimeout=0.2)
+        self.assertFalse( flowtablecache.isFlowtableCached(redisClient, 'stolen') )
@@ -42,14 +42,30 @@ import os, errno
 import sys
 import gzip
 import filecmp
+import cPickle
 from shutil import rmtree
 from zipfile import ZipFile
 from unittest import TestCase
 
 from flowtableio import readFlowtable
+from flowtableio import iterFlowtable
+from flowtableio import iterFlowtableKeys
 from flowtableio import writeFlowtable
+from flowtableio import writeFlowtableRecords
+from flowtableio import iterFlowtableBlocks
+from flowtableio import openFlowtable
+from flowtableio import readFlowtableNumPatches
 from flowtableio import getReceiversForFlowtableEntry
 from flowtableio import getEntryForFlowtableKey
+from flowtableio import FlowTableEntryReceiver
+from flowtableio import FlowTableEntryRoad
+from flowtableio import dumpReceivers
+from flowtableio import loadReceivers
+from flowtableio import FlowTableDonor
+from flowtableio import dumpDonors
+from flowtableio import loadDonors
+from flowtableio import buildDonorIndex
+from flowtableio import getDonorsForFlowtableEntry
 import rhessystypes
 
 from grassdatalookup import GrassDataLookup
@@ -118,6 +134,120 @@ class TestReadFlowtable(TestCase):
         self.assertTrue( filecmp.cmp(self.flowtablePath, testOutpath) )
         os.unlink(testOutpath)
 
+    def testWriteFlowtableRecords(self):
+        testOutpath = os.path.join(self.flowtableDir, "test-flow-records.flow")
+        numWritten = writeFlowtableRecords(iterFlowtable(self.flowtablePath), testOutpath)
+        self.assertTrue( numWritten == len(self.flowtable) )
+        self.assertTrue( readFlowtableNumPatches(testOutpath) == len(self.flowtable) )
+        self.assertTrue( filecmp.cmp(self.flowtablePath, testOutpath, shallow=False) )
+        os.unlink(testOutpath)
+
+    def testReadCompressedFlowtable(self):
+        flowtableGz = "%s.gz" % (self.flowtablePath,)
+        self.assertTrue( readFlowtableNumPatches(flowtableGz) == len(self.flowtable) )
+        flowtable = readFlowtable(flowtableGz)
+        self.assertTrue( flowtable.keys() == self.flowtable.keys() )
+
+    def testWriteCompressedFlowtable(self):
+        testOutpath = os.path.join(self.flowtableDir, "test-flow-compressed.flow.bz2")
+        writeFlowtable(self.flowtable, testOutpath)
+        f = open(self.flowtablePath, 'r')
+        compressed = openFlowtable(testOutpath, 'r')
+        self.assertTrue( compressed.read() == f.read() )
+        compressed.close()
+        f.close()
+        os.unlink(testOutpath)
+
+    def testIterFlowtableBlocks(self):
+        blocks = iterFlowtableBlocks(iterFlowtable(self.flowtablePath), len(self.flowtable))
+        f = open(self.flowtablePath, 'r')
+        self.assertTrue( ''.join(blocks) == f.read() )
+        f.close()
+
+    def testReceiverIsSlotted(self):
+        receiver = FlowTableEntryReceiver("324225", "67", "67", "0.25")
+        self.assertFalse( hasattr(receiver, '__dict__') )
+        receiver.gamma = 0.5
+        copy = cPickle.loads(cPickle.dumps(receiver, cPickle.HIGHEST_PROTOCOL))
+        self.assertTrue( (copy.patchID, copy.zoneID, copy.hillID, copy.gamma) == (324225, 67, 67, 0.5) )
+
+    def testDumpReceivers(self):
+        def itemTuples(items):
+            return [(i.patchID, i.zoneID, i.hillID, i.gamma) if isinstance(i, FlowTableEntryReceiver) else i \
+                    for i in items]
+        for items in self.flowtable.itervalues():
+            decoded = loadReceivers(dumpReceivers(items))
+            self.assertTrue( [type(i) for i in decoded] == [type(i) for i in items] )
+            self.assertTrue( itemTuples(decoded) == itemTuples(items) )
+
+    def testLoadLegacyJSONReceivers(self):
+        # Items stored by the JSON encoding used before the binary one
+        legacy = '[{"patchID": 324225, "zoneID": 67, "hillID": 67, "x": 1.5, "y": 2.5, "z": 100.0, ' \
+                 '"accumArea": 0.0, "area": 25, "landType": 2, "totalGamma": 1.0, "numAdjacent": 1}, ' \
+                 '{"patchID": 324226, "zoneID": 67, "hillID": 67, "gamma": 1.0}, ' \
+                 '{"streamPatchID": 1, "streamZoneID": 2, "streamHillID": 3, "roadWidth": 4.5}]'
+        items = loadReceivers(legacy)
+        self.assertTrue( items[0].patchID == 324225 and items[0].area == 25 )
+        self.assertTrue( (items[1].patchID, items[1].gamma) == (324226, 1.0) )
+        self.assertTrue( items[2] == FlowTableEntryRoad(1, 2, 3, 4.5) )
+        # and are written back in the binary encoding
+        self.assertTrue( loadReceivers(dumpReceivers(items))[::2] == items[::2] )
+
+    def testDumpDonors(self):
+        donors = [FlowTableDonor(324225, 67, 67, 0.5), FlowTableDonor(324226, 67, 68, 0.25)]
+        self.assertTrue( loadDonors(dumpDonors(donors)) == donors )
+        self.assertTrue( loadDonors(dumpDonors([])) == [] )
+        donorIndex = buildDonorIndex(self.flowtable)
+        for donors in donorIndex.itervalues():
+            self.assertTrue( loadDonors(dumpDonors(donors)) == donors )
+
+    def testGetDonorsForFlowtableEntry(self):
+        donorIndex = buildDonorIndex(self.flowtable)
+        numDonors = 0
+        for (key, items) in self.flowtable.iteritems():
+            for receiver in getReceiversForFlowtableEntry(key, self.flowtable):
+                receiverKey = rhessystypes.FQPatchID(patchID=receiver.patchID, zoneID=receiver.zoneID,
+                                                     hillID=receiver.hillID)
+                donors = getDonorsForFlowtableEntry(receiverKey, donorIndex)
+                matches = [d for d in donors if (d.patchID, d.zoneID, d.hillID) == key]
+                self.assertTrue( len(matches) >= 1 )
+                self.assertTrue( matches[0].gamma == receiver.gamma )
+                numDonors += 1
+        self.assertTrue( numDonors == sum(len(d) for d in donorIndex.values()) )
+        missing = rhessystypes.FQPatchID(patchID=-1, zoneID=67, hillID=67)
+        self.assertTrue( getDonorsForFlowtableEntry(missing, donorIndex) == [] )
+
+    def testIterFlowtable(self):
+        keys = self.flowtable.keys()
+        numRecords = 0
+        for (i, record) in enumerate(iterFlowtable(self.flowtablePath)):
+            key = keys[i]
+            self.assertTrue( record.entry.patchID == key.patchID )
+            self.assertTrue( len(record.receivers) == record.entry.numAdjacent )
+            items = self.flowtable[key]
+            self.assertTrue( len(items) == 1 + len(record.receivers) + (record.road is not None) )
+            numRecords += 1
+        self.assertTrue( numRecords == len(self.flowtable) )
+
+    def testIterFlowtableKeys(self):
+        self.assertTrue( list(iterFlowtableKeys(self.flowtablePath)) == self.flowtable.keys() )
+
+    def testIterFlowtableTooFewReceivers(self):
+        testOutpath = os.path.join(self.flowtableDir, "test-flow-short.flow")
+        flowFile = open(testOutpath, 'w')
+        flowFile.write("%8d" % (2,) )
+        flowFile.write("\n %6d %6d %6d %6.1f %6.1f %6.1f %10f %d %4d %f %4d" % \
+                       (1, 1, 1, 0.0, 0.0, 10.0, 1.0, 1, 1, 0.5, 2) )
+        flowFile.write("\n%16d %6d %6d %8.8f  " % (2, 1, 1, 1.0) )
+        flowFile.write("\n %6d %6d %6d %6.1f %6.1f %6.1f %10f %d %4d %f %4d" % \
+                       (2, 1, 1, 5.0, 0.0, 9.0, 2.0, 1, 1, 0.0, 0) )
+        flowFile.close()
+        try:
+            with self.assertRaisesRegexp(Exception, "line 4"):
+                readFlowtable(testOutpath)
+        finally:
+            os.unlink(testOutpath)
+
     def testEntryWithoutRoad(self):
         testKeyStr = "324225     67     67"
         values = testKeyStr.split()
@@ -0,0 +1,149 @@
+"""@package tests.test_flowtablejournal
+
+@brief Test methods for flowtablejournal
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage:
+@code
+python -m unittest test_flowtablejournal
+@endcode
+"""
+import os, errno
+import gzip
+import filecmp
+from unittest import TestCase
+
+from flowtableio import readFlowtable
+from flowtableio import writeFlowtable
+from flowtableio import FlowTableEntryReceiver
+from flowtableio import getReceiversForFlowtableEntry
+from flowtablejournal import FlowtableJournal
+from flowtablejournal import composeJournals
+from flowtablejournal import writeJournal
+from flowtablejournal import readJournal
+from flowtablejournal import appendJournalEdit
+from flowtablejournal import applyJournal
+import rhessystypes
+
+## Unit tests
+class TestFlowtableJournal(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # We gzip the flow table to be nice to GitHub, unzip it
+        cls.flowtablePath = os.path.abspath('./tests/data/world5m_dr5.flow')
+        flowtableGz = "%s.gz" % (cls.flowtablePath,)
+        if not os.access(flowtableGz, os.R_OK):
+            raise IOError(errno.EACCES, "Unable to read flow table %s" %
+                      flowtableGz)
+        cls.flowtableDir = os.path.split(flowtableGz)[0]
+        if not os.access(cls.flowtableDir, os.W_OK):
+            raise IOError(errno.EACCES, "Unable to write to flow table dir %s" %
+                          cls.flowtableDir)
+        fIn = gzip.open(flowtableGz, 'rb')
+        fOut = open(cls.flowtablePath, 'wb')
+        fOut.write(fIn.read())
+        fIn.close()
+        fOut.close()
+
+        cls.flowtable = readFlowtable(cls.flowtablePath)
+
+    @classmethod
+    def tearDownClass(cls):
+        # Get rid of the un-gzipped flow table
+        os.unlink(cls.flowtablePath)
+
+    def _editedKeys(self):
+        keys = self.flowtable.keys()
+        return [keys[0], keys[len(keys) // 2], keys[-1]]
+
+    def testApplyJournal(self):
+        (first, middle, last) = self._editedKeys()
+        session1 = FlowtableJournal()
+        session1.setReceivers(first, [FlowTableEntryReceiver(middle.patchID, middle.zoneID, middle.hillID, 1.0)])
+        session1.setReceivers(middle, [])
+        session2 = FlowtableJournal()
+        session2.setReceivers(first, [FlowTableEntryReceiver(last.patchID, last.zoneID, last.hillID, 0.5),
+                                      FlowTableEntryReceiver(middle.patchID, middle.zoneID, middle.hillID, 0.5)])
+        journal = composeJournals([session1, session2])
+        self.assertTrue( len(journal.compact()) == 2 )
+
+        # Write the expected flow table by editing the whole table in memory
+        expected = readFlowtable(self.flowtablePath)
+        for (key, receivers) in journal.getReplacements().iteritems():
+            items = expected[key]
+            road = [i for i in items[1:] if not isinstance(i, FlowTableEntryReceiver)]
+            expected[key] = [items[0]._replace(numAdjacent=len(receivers))] + receivers + road
+        expectedPath = os.path.join(self.flowtableDir, "test-flow-journal-expected.flow")
+        writeFlowtable(expected, expectedPath)
+
+        testOutpath = os.path.join(self.flowtableDir, "test-flow-journal.flow")
+        journalPath = os.path.join(self.flowtableDir, "test-flow.journal")
+        try:
+            writeJournal(journal, journalPath)
+            numWritten = applyJournal(self.flowtablePath, readJournal(journalPath), testOutpath)
+            self.assertTrue( numWritten == len(self.flowtable) )
+            self.assertTrue( filecmp.cmp(expectedPath, testOutpath, shallow=False) )
+            edited = readFlowtable(testOutpath)
+            self.assertTrue( len(getReceiversForFlowtableEntry(first, edited)) == 2 )
+            self.assertTrue( getReceiversForFlowtableEntry(middle, edited) == [] )
+        finally:
+            for path in (expectedPath, testOutpath, journalPath):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def testJournalFileIsDeterministic(self):
+        (first, middle, last) = self._editedKeys()
+        receivers = [FlowTableEntryReceiver(last.patchID, last.zoneID, last.hillID, 0.1)]
+        journal = FlowtableJournal()
+        journal.setReceivers(first, receivers)
+        journal.setReceivers(middle, receivers)
+        writtenPath = os.path.join(self.flowtableDir, "test-flow-written.journal")
+        appendedPath = os.path.join(self.flowtableDir, "test-flow-appended.journal")
+        try:
+            writeJournal(journal, writtenPath)
+            appendJournalEdit(appendedPath, first, receivers)
+            appendJournalEdit(appendedPath, middle, receivers)
+            self.assertTrue( filecmp.cmp(writtenPath, appendedPath, shallow=False) )
+            replayed = readJournal(appendedPath).getReplacements()
+            self.assertTrue( replayed.keys() == [first, middle] )
+            self.assertTrue( replayed[first][0].gamma == 0.1 )
+        finally:
+            for path in (writtenPath, appendedPath):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def testMissingPatch(self):
+        journal = FlowtableJournal()
+        journal.setReceivers(rhessystypes.FQPatchID(patchID=-1, zoneID=67, hillID=67), [])
+        testOutpath = os.path.join(self.flowtableDir, "test-flow-journal-missing.flow")
+        self.assertRaises( Exception, applyJournal, self.flowtablePath, journal, testOutpath )
+        self.assertFalse( os.path.exists(testOutpath) )
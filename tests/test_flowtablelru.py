@@ -0,0 +1,125 @@
+"""@package tests.test_flowtablelru
+
+@brief Test methods for flowtablelru
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage:
+@code
+python -m unittest test_flowtablelru
+@endcode
+"""
+import os, errno
+import gzip
+import shutil
+from unittest import TestCase
+
+from flowtablearray import readFlowtableColumnar
+from flowtablelru import FlowtableLRUCache
+
+## Unit tests
+class TestFlowtableLRUCache(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # We gzip the flow table to be nice to GitHub, unzip it
+        cls.flowtablePath = os.path.abspath('./tests/data/world5m_dr5.flow')
+        flowtableGz = "%s.gz" % (cls.flowtablePath,)
+        if not os.access(flowtableGz, os.R_OK):
+            raise IOError(errno.EACCES, "Unable to read flow table %s" %
+                      flowtableGz)
+        cls.flowtableDir = os.path.split(flowtableGz)[0]
+        if not os.access(cls.flowtableDir, os.W_OK):
+            raise IOError(errno.EACCES, "Unable to write to flow table dir %s" %
+                          cls.flowtableDir)
+        fIn = gzip.open(flowtableGz, 'rb')
+        fOut = open(cls.flowtablePath, 'wb')
+        fOut.write(fIn.read())
+        fIn.close()
+        fOut.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        # Get rid of the un-gzipped flow table
+        os.unlink(cls.flowtablePath)
+
+    def testHitsAndMisses(self):
+        cache = FlowtableLRUCache(loadFunction=readFlowtableColumnar)
+        table = cache.getFlowtable(self.flowtablePath)
+        self.assertTrue( cache.getFlowtable(self.flowtablePath) is table )
+        self.assertFalse( table.receivers.flags.writeable )
+        stats = cache.getStats()
+        self.assertTrue( (stats.hits, stats.misses, stats.evictions) == (1, 1, 0) )
+        self.assertTrue( stats.numBytes == table.nbytes )
+
+    def testDonorIndexIsCounted(self):
+        cache = FlowtableLRUCache(loadFunction=readFlowtableColumnar)
+        table = cache.getFlowtable(self.flowtablePath)
+        numBytes = table.nbytes
+        table.buildDonorIndex()
+        self.assertTrue( table.nbytes == numBytes + table.donorOffsets.nbytes + table.donors.nbytes )
+        cache.getFlowtable(self.flowtablePath)
+        self.assertTrue( cache.getStats().numBytes == table.nbytes )
+
+    def testChangedFileIsReloaded(self):
+        testFlowtable = os.path.join(self.flowtableDir, "test-flow-lru.flow")
+        shutil.copy(self.flowtablePath, testFlowtable)
+        try:
+            cache = FlowtableLRUCache(loadFunction=readFlowtableColumnar)
+            table = cache.getFlowtable(testFlowtable)
+            f = open(testFlowtable, 'a')
+            f.write("\n")
+            f.close()
+            self.assertFalse( cache.getFlowtable(testFlowtable) is table )
+            self.assertTrue( len(cache) == 1 )
+            self.assertTrue( cache.getStats().evictions == 1 )
+        finally:
+            os.unlink(testFlowtable)
+
+    def testEviction(self):
+        testFlowtable = os.path.join(self.flowtableDir, "test-flow-lru.flow")
+        shutil.copy(self.flowtablePath, testFlowtable)
+        try:
+            cache = FlowtableLRUCache(loadFunction=readFlowtableColumnar)
+            table = cache.getFlowtable(self.flowtablePath)
+            cache.setMaxBytes(table.nbytes)
+            cache.getFlowtable(testFlowtable)
+            self.assertTrue( len(cache) == 1 )
+            cache.getFlowtable(self.flowtablePath)
+            stats = cache.getStats()
+            self.assertTrue( (stats.hits, stats.misses, stats.evictions) == (0, 3, 2) )
+            self.assertTrue( stats.numBytes <= stats.maxBytes )
+
+            # Flow tables larger than the budget are not cached
+            cache.setMaxBytes(0)
+            cache.getFlowtable(testFlowtable)
+            self.assertTrue( len(cache) == 0 )
+        finally:
+            os.unlink(testFlowtable)
@@ -0,0 +1,264 @@
+"""@package tests.test_flowtablemerge
+
+@brief Test methods for flowtablemerge
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage:
+@code
+python -m unittest test_flowtablemerge
+@endcode
+"""
+import os, errno
+import gzip
+from unittest import TestCase
+
+import numpy as np
+
+from flowtableio import FlowTableEntry
+from flowtableio import FlowTableRecord
+from flowtableio import iterFlowtable
+from flowtableio import writeFlowtableRecords
+from flowtablearray import readFlowtableColumnar
+from flowtablearray import writeFlowtableColumnar
+from flowtablesubset import subsetColumnar
+from flowtablesubset import RECEIVER_POLICY_KEEP
+from flowtablemerge import readBoundaryMap
+from flowtablemerge import findCollisions
+from flowtablemerge import rewireRecord
+from flowtablemerge import mergeFlowtables
+from flowtablemerge import COLLISION_KEEP_FIRST
+import flowtablemerge
+import rhessystypes
+
+## Constants
+ZERO = 0.001
+
+def _receiverTuples(receivers):
+    return [(r.patchID, r.zoneID, r.hillID, r.gamma) for r in receivers]
+
+def _makeRecord(patchID, x, z):
+    return FlowTableRecord(FlowTableEntry(patchID, 1, 1, x, 0.0, z, 1.0, 1, 1, 0.0, 0), [], None)
+
+## Unit tests
+class TestFlowtableMerge(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # We gzip the flow table to be nice to GitHub, unzip it
+        cls.flowtablePath = os.path.abspath('./tests/data/world5m_dr5.flow')
+        flowtableGz = "%s.gz" % (cls.flowtablePath,)
+        if not os.access(flowtableGz, os.R_OK):
+            raise IOError(errno.EACCES, "Unable to read flow table %s" %
+                      flowtableGz)
+        cls.flowtableDir = os.path.split(flowtableGz)[0]
+        if not os.access(cls.flowtableDir, os.W_OK):
+            raise IOError(errno.EACCES, "Unable to write to flow table dir %s" %
+                          cls.flowtableDir)
+        fIn = gzip.open(flowtableGz, 'rb')
+        fOut = open(cls.flowtablePath, 'wb')
+        fOut.write(fIn.read())
+        fIn.close()
+        fOut.close()
+
+        # Split the flow table by hillslope, keeping the receivers in other hillslopes
+        cls.flowtable = readFlowtableColumnar(cls.flowtablePath)
+        cls.hillPaths = []
+        for hillID in np.unique(cls.flowtable.entries['hillID']).tolist():
+            path = os.path.join(cls.flowtableDir, "test-flow-merge-hill%d.flow" % (hillID,) )
+            subset = subsetColumnar(cls.flowtable, hillIDs=[hillID], receiverPolicy=RECEIVER_POLICY_KEEP)
+            writeFlowtableColumnar(subset, path)
+            cls.hillPaths.append(path)
+        cls.outPath = os.path.join(cls.flowtableDir, "test-flow-merge-out.flow.gz")
+
+    @classmethod
+    def tearDownClass(cls):
+        # Get rid of the un-gzipped flow table and the hillslopes
+        os.unlink(cls.flowtablePath)
+        for path in cls.hillPaths + [cls.outPath]:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def _assertSameAsFlowtable(self, merged):
+        self.assertTrue( len(merged) == len(self.flowtable) )
+        for i in xrange(len(merged)):
+            original = self.flowtable.getIndexForKey(merged.getKey(i))
+            self.assertTrue( original >= 0 )
+            self.assertTrue( _receiverTuples(merged.getReceivers(i)) == \
+                             _receiverTuples(self.flowtable.getReceivers(original)) )
+
+    def testMergeHills(self):
+        for byElevation in (True, False):
+            stats = mergeFlowtables(self.hillPaths, self.outPath, byElevation=byElevation)
+            self.assertTrue( stats.numPatches == len(self.flowtable) )
+            self.assertTrue( stats.numCollisions == 0 )
+            merged = readFlowtableColumnar(self.outPath)
+            self._assertSameAsFlowtable(merged)
+            # The entries of each input keep their order
+            for path in self.hillPaths:
+                hillID = readFlowtableColumnar(path).entries['hillID'][0]
+                hillKeys = [merged.getKey(i) for i in np.flatnonzero(merged.entries['hillID'] == hillID)]
+                self.assertTrue( hillKeys == [rhessystypes.FQPatchID(r.entry.patchID, r.entry.zoneID, r.entry.hillID) \
+                                              for r in iterFlowtable(path)] )
+            if not byElevation:
+                # Concatenated hillslopes follow each other
+                hillIDs = merged.entries['hillID']
+                self.assertTrue( np.sum(hillIDs[1:] != hillIDs[:-1]) == len(self.hillPaths) - 1 )
+
+    def testMergeByElevation(self):
+        # Inputs ordered by decreasing elevation merge into a flow table so ordered
+        paths = []
+        try:
+            for (i, path) in enumerate(self.hillPaths):
+                table = readFlowtableColumnar(path)
+                order = np.argsort(-table.entries['z'], kind='mergesort')
+                records = [FlowTableRecord(table.getEntry(j), table.getReceivers(j), table.getRoad(j)) \
+                           for j in order.tolist()]
+                sortedPath = os.path.join(self.flowtableDir, "test-flow-merge-sorted%d.flow" % (i,) )
+                writeFlowtableRecords(records, sortedPath)
+                paths.append(sortedPath)
+            mergeFlowtables(paths, self.outPath)
+            merged = readFlowtableColumnar(self.outPath)
+            self._assertSameAsFlowtable(merged)
+            self.assertTrue( np.all(np.diff(merged.entries['z']) <= 0) )
+        finally:
+            for path in paths:
+                os.unlink(path)
+
+    def testCollisions(self):
+        paths = [self.hillPaths[0], self.hillPaths[0]]
+        numPatches = len(readFlowtableColumnar(paths[0]))
+        (collisions, numEntries) = findCollisions(paths)
+        self.assertTrue( len(collisions) == numPatches )
+        self.assertTrue( numEntries == 2 * numPatches )
+        self.assertTrue( collisions[0].inputs == [0, 1] )
+        self.assertRaises( Exception, mergeFlowtables, paths, self.outPath )
+
+        stats = mergeFlowtables(paths, self.outPath, onCollision=COLLISION_KEEP_FIRST)
+        self.assertTrue( stats.numPatches == numPatches )
+        self.assertTrue( stats.numSkipped == numPatches )
+        self.assertTrue( len(readFlowtableColumnar(self.outPath)) == numPatches )
+
+    def _writeInputs(self, inputs):
+        paths = []
+        for (i, records) in enumerate(inputs):
+            path = os.path.join(self.flowtableDir, "test-flow-merge-small%d.flow" % (i,) )
+            writeFlowtableRecords(records, path)
+            paths.append(path)
+        return paths
+
+    def testKeepFirstInInputOrder(self):
+        # The first input has the patch lower down than the second
+        paths = self._writeInputs([ [_makeRecord(1, 1.0, 10.0), _makeRecord(2, 1.0, 5.0)],
+                                    [_makeRecord(3, 2.0, 90.0), _makeRecord(1, 2.0, 50.0)] ])
+        try:
+            (collisions, numEntries) = findCollisions(paths)
+            self.assertTrue( [(c.inputs, c.positions) for c in collisions] == [([0, 1], [0, 1])] )
+            for byElevation in (True, False):
+                stats = mergeFlowtables(paths, self.outPath, onCollision=COLLISION_KEEP_FIRST,
+                                        byElevation=byElevation)
+                self.assertTrue( stats.numSkipped == 1 )
+                entries = [(r.entry.patchID, r.entry.x) for r in iterFlowtable(self.outPath)]
+                self.assertTrue( sorted(entries) == [(1, 1.0), (2, 1.0), (3, 2.0)] )
+        finally:
+            for path in paths:
+                os.unlink(path)
+
+    def testMergeUnsortedInput(self):
+        paths = self._writeInputs([ [_makeRecord(1, 0.0, 10.0), _makeRecord(2, 0.0, 90.0),
+                                     _makeRecord(3, 0.0, 10.0)],
+                                    [_makeRecord(4, 0.0, 50.0)] ])
+        try:
+            mergeFlowtables(paths, self.outPath)
+            entries = [(r.entry.patchID, r.entry.z) for r in iterFlowtable(self.outPath)]
+            self.assertTrue( entries == [(2, 90.0), (4, 50.0), (1, 10.0), (3, 10.0)] )
+        finally:
+            for path in paths:
+                os.unlink(path)
+
+    def testMergeUnsortedInputInRuns(self):
+        elevations = [10.0, 90.0, 10.0, 30.0, 70.0, 30.0, 5.0, 90.0, 20.0]
+        paths = self._writeInputs([ [_makeRecord(i + 1, 0.0, z) for (i, z) in enumerate(elevations)],
+                                    [_makeRecord(100, 0.0, 50.0), _makeRecord(101, 0.0, 30.0)] ])
+        runNumEntries = flowtablemerge.SORT_RUN_NUM_ENTRIES
+        try:
+            # Several sorted runs of the unsorted input are merged
+            flowtablemerge.SORT_RUN_NUM_ENTRIES = 2
+            mergeFlowtables(paths, self.outPath)
+            entries = [r.entry.patchID for r in iterFlowtable(self.outPath)]
+            self.assertTrue( entries == [2, 8, 5, 100, 4, 6, 101, 9, 1, 3, 7] )
+        finally:
+            flowtablemerge.SORT_RUN_NUM_ENTRIES = runNumEntries
+            for path in paths:
+                os.unlink(path)
+
+    def testRewireRecord(self):
+        record = next(r for r in iterFlowtable(self.flowtablePath) if len(r.receivers) >= 2)
+        (first, second) = [rhessystypes.FQPatchID(r.patchID, r.zoneID, r.hillID) for r in record.receivers[:2]]
+        target = rhessystypes.FQPatchID(first.patchID, first.zoneID, first.hillID + 1000)
+        (rewired, numRewired) = rewireRecord(record, {first: target, second: target})
+        self.assertTrue( numRewired == 2 )
+        self.assertTrue( rewired.entry.numAdjacent == len(record.receivers) - 1 )
+        self.assertTrue( len(rewired.receivers) == len(record.receivers) - 1 )
+        r = rewired.receivers[0]
+        self.assertTrue( (r.patchID, r.zoneID, r.hillID) == target )
+        self.assertTrue( abs(r.gamma - record.receivers[0].gamma - record.receivers[1].gamma) < ZERO )
+        self.assertTrue( abs(sum(r.gamma for r in rewired.receivers) - \
+                             sum(r.gamma for r in record.receivers)) < ZERO )
+        self.assertTrue( rewireRecord(record, {})[0] is record )
+
+    def testBoundaryMap(self):
+        mapPath = os.path.join(self.flowtableDir, "test-flow-merge.map")
+        receiver = self.flowtable.getReceivers(0)[0]
+        source = rhessystypes.FQPatchID(receiver.patchID, receiver.zoneID, receiver.hillID)
+        target = rhessystypes.FQPatchID(receiver.patchID, receiver.zoneID, receiver.hillID + 1000)
+        f = open(mapPath, 'w')
+        f.write("# Test boundary map\n\n%d %d %d %d %d %d\n" % (source + target))
+        f.close()
+        try:
+            boundaryMap = readBoundaryMap(mapPath)
+            self.assertTrue( boundaryMap == {source: target} )
+            stats = mergeFlowtables(self.hillPaths, self.outPath, boundaryMap)
+            self.assertTrue( stats.numRewired == \
+                             np.sum((self.flowtable.receivers['patchID'] == source.patchID) & \
+                                    (self.flowtable.receivers['zoneID'] == source.zoneID) & \
+                                    (self.flowtable.receivers['hillID'] == source.hillID)) )
+            merged = readFlowtableColumnar(self.outPath)
+            self.assertTrue( np.sum(merged.receivers['hillID'] == target.hillID) >= stats.numRewired )
+            self.assertTrue( np.sum((merged.receivers['patchID'] == source.patchID) & \
+                                    (merged.receivers['zoneID'] == source.zoneID) & \
+                                    (merged.receivers['hillID'] == source.hillID)) == 0 )
+
+            f = open(mapPath, 'w')
+            f.write("1 2 3\n")
+            f.close()
+            self.assertRaises( Exception, readBoundaryMap, mapPath )
+        finally:
+            os.unlink(mapPath)
@@ -0,0 +1,132 @@
+"""@package tests.test_flowtableoverlay
+
+@brief Test methods for flowtableoverlay
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage:
+@code
+python -m unittest test_flowtableoverlay
+@endcode
+"""
+from unittest import TestCase
+
+from flowtableio import FlowTableEntry
+from flowtableio import FlowTableEntryReceiver
+from flowtableio import FlowTableEntryRoad
+import flowtableoverlay
+from flowtableoverlay import getOverlayKey
+from flowtableoverlay import setEditedReceivers
+from flowtableoverlay import getEditedReceivers
+from flowtableoverlay import getEdits
+from flowtableoverlay import getNumEdits
+from flowtableoverlay import clearEdits
+from flowtableoverlay import getOverlayJournal
+from flowtableoverlay import overlayItems
+from flowtableoverlay import moveEdits
+import rhessystypes
+from tests.fakeredis import FakeRedis
+
+## Constants
+NAME = 'overlay.flow'
+
+def _getKey(patchID):
+    return rhessystypes.FQPatchID(patchID=patchID, zoneID=1, hillID=1)
+
+def _makeReceivers(patchIDs):
+    return [FlowTableEntryReceiver(p, 1, 1, 1.0 / len(patchIDs)) for p in patchIDs]
+
+def _receiverTuples(receivers):
+    return [(r.patchID, r.zoneID, r.hillID, r.gamma) for r in receivers]
+
+## Unit tests
+class TestFlowtableOverlay(TestCase):
+
+    def setUp(self):
+        self.redisClient = FakeRedis()
+
+    def testSetGetEdits(self):
+        self.assertIsNone( getEditedReceivers(self.redisClient, NAME, 'alice', _getKey(1)) )
+        setEditedReceivers(self.redisClient, NAME, 'alice', _getKey(1), _makeReceivers([2, 3]))
+        setEditedReceivers(self.redisClient, NAME, 'alice', _getKey(4), _makeReceivers([5]))
+        setEditedReceivers(self.redisClient, NAME, 'alice', _getKey(1), _makeReceivers([3]))
+        self.assertTrue( _receiverTuples(getEditedReceivers(self.redisClient, NAME, 'alice', _getKey(1))) == \
+                         _receiverTuples(_makeReceivers([3])) )
+        self.assertTrue( getNumEdits(self.redisClient, NAME, 'alice') == 2 )
+        self.assertTrue( sorted(getEdits(self.redisClient, NAME, 'alice').keys()) == [_getKey(1), _getKey(4)] )
+        # Edits are kept per owner and per flow table
+        self.assertTrue( getNumEdits(self.redisClient, NAME, 'bob') == 0 )
+        self.assertTrue( getNumEdits(self.redisClient, 'other.flow', 'alice') == 0 )
+        self.assertTrue( self.redisClient.expiry[getOverlayKey(NAME, 'alice')] > 0 )
+
+    def testOverlayJournal(self):
+        setEditedReceivers(self.redisClient, NAME, 'alice', _getKey(4), _makeReceivers([5]))
+        setEditedReceivers(self.redisClient, NAME, 'alice', _getKey(1), _makeReceivers([2, 3]))
+        journal = getOverlayJournal(self.redisClient, NAME, 'alice')
+        replacements = journal.getReplacements()
+        self.assertTrue( sorted(replacements.keys()) == [_getKey(1), _getKey(4)] )
+        self.assertTrue( _receiverTuples(replacements[_getKey(1)]) == _receiverTuples(_makeReceivers([2, 3])) )
+        self.assertTrue( len(getOverlayJournal(self.redisClient, NAME, 'bob')) == 0 )
+
+    def testOverlayItems(self):
+        entry = FlowTableEntry(1, 1, 1, 0.0, 0.0, 10.0, 1.0, 1, 2, 1.0, 1)
+        road = FlowTableEntryRoad(9, 1, 1, 5.0)
+        items = [entry] + _makeReceivers([2]) + [road]
+        self.assertTrue( overlayItems(self.redisClient, NAME, 'alice', _getKey(1), items) is items )
+
+        setEditedReceivers(self.redisClient, NAME, 'alice', _getKey(1), _makeReceivers([3, 4]))
+        overlaid = overlayItems(self.redisClient, NAME, 'alice', _getKey(1), items)
+        self.assertTrue( overlaid[0] == entry._replace(numAdjacent=2) )
+        self.assertTrue( _receiverTuples(overlaid[1:3]) == _receiverTuples(_makeReceivers([3, 4])) )
+        self.assertTrue( overlaid[3:] == [road] )
+        self.assertTrue( overlayItems(self.redisClient, NAME, 'bob', _getKey(1), items) is items )
+
+    def testClearEdits(self):
+        setEditedReceivers(self.redisClient, NAME, 'alice', _getKey(1), _makeReceivers([2]))
+        setEditedReceivers(self.redisClient, 'other.flow', 'alice', _getKey(1), _makeReceivers([2]))
+        clearEdits(self.redisClient, NAME, 'alice')
+        self.assertTrue( getNumEdits(self.redisClient, NAME, 'alice') == 0 )
+        self.assertTrue( getNumEdits(self.redisClient, 'other.flow', 'alice') == 1 )
+        self.assertTrue( self.redisClient.smembers(flowtableoverlay.getOwnerKey('alice')) == set(['other.flow']) )
+
+    def testMoveEdits(self):
+        setEditedReceivers(self.redisClient, NAME, 'session-1', _getKey(1), _makeReceivers([2]))
+        setEditedReceivers(self.redisClient, 'other.flow', 'session-1', _getKey(7), _makeReceivers([8]))
+        setEditedReceivers(self.redisClient, NAME, 'user-1', _getKey(1), _makeReceivers([3]))
+        setEditedReceivers(self.redisClient, NAME, 'user-1', _getKey(4), _makeReceivers([5]))
+
+        self.assertTrue( moveEdits(self.redisClient, 'session-1', 'user-1') == 2 )
+        self.assertTrue( getNumEdits(self.redisClient, NAME, 'session-1') == 0 )
+        self.assertTrue( getNumEdits(self.redisClient, NAME, 'user-1') == 2 )
+        # The edit moved in wins over the one it replaces
+        self.assertTrue( _receiverTuples(getEditedReceivers(self.redisClient, NAME, 'user-1', _getKey(1))) == \
+                         _receiverTuples(_makeReceivers([2])) )
+        self.assertTrue( getNumEdits(self.redisClient, 'other.flow', 'user-1') == 1 )
+        self.assertTrue( moveEdits(self.redisClient, 'session-1', 'user-1') == 0 )
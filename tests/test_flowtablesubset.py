@@ -0,0 +1,235 @@
+"""@package tests.test_flowtablesubset
+
+@brief Test methods for flowtablesubset
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage:
+@code
+python -m unittest test_flowtablesubset
+@endcode
+"""
+import os, errno
+import gzip
+import filecmp
+import itertools
+from unittest import TestCase
+
+import numpy as np
+
+from flowtableio import FlowTableEntry
+from flowtableio import FlowTableEntryReceiver
+from flowtableio import FlowTableRecord
+from flowtableio import FlowTableEntryRoad
+from flowtableio import LAND_TYPE_LAND
+from flowtableio import LAND_TYPE_ROAD
+from flowtableio import iterFlowtable
+from flowtableio import writeFlowtableRecords
+from flowtablearray import readFlowtableColumnar
+from flowtablearray import writeFlowtableColumnar
+from flowtablesubset import subsetColumnar
+from flowtablesubset import subsetFlowtable
+from flowtablesubset import RECEIVER_POLICY_DROP
+from flowtablesubset import RECEIVER_POLICY_KEEP
+from flowtablevalidator import validateFlowtable
+from flowtablevalidator import CHECK_MISSING_RECEIVER
+from flowtablevalidator import CHECK_MISSING_STREAM
+from flowtablevalidator import CHECK_ROAD_LAND_TYPE
+
+## Constants
+ZERO = 0.001
+
+def _receiverTuples(receivers):
+    return [(r.patchID, r.zoneID, r.hillID, r.gamma) for r in receivers]
+
+## Unit tests
+class TestFlowtableSubset(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # We gzip the flow table to be nice to GitHub, unzip it
+        cls.flowtablePath = os.path.abspath('./tests/data/world5m_dr5.flow')
+        flowtableGz = "%s.gz" % (cls.flowtablePath,)
+        if not os.access(flowtableGz, os.R_OK):
+            raise IOError(errno.EACCES, "Unable to read flow table %s" %
+                      flowtableGz)
+        cls.flowtableDir = os.path.split(flowtableGz)[0]
+        if not os.access(cls.flowtableDir, os.W_OK):
+            raise IOError(errno.EACCES, "Unable to write to flow table dir %s" %
+                          cls.flowtableDir)
+        fIn = gzip.open(flowtableGz, 'rb')
+        fOut = open(cls.flowtablePath, 'wb')
+        fOut.write(fIn.read())
+        fIn.close()
+        fOut.close()
+
+        cls.flowtable = readFlowtableColumnar(cls.flowtablePath)
+        entries = cls.flowtable.entries
+        cls.hillID = int(entries['hillID'][len(entries) // 2])
+        cls.bbox = (float(np.percentile(entries['x'], 25)), float(np.percentile(entries['y'], 25)),
+                    float(np.percentile(entries['x'], 75)), float(np.percentile(entries['y'], 75)))
+
+    @classmethod
+    def tearDownClass(cls):
+        # Get rid of the un-gzipped flow table
+        os.unlink(cls.flowtablePath)
+
+    def testSelectHill(self):
+        subset = subsetColumnar(self.flowtable, hillIDs=[self.hillID])
+        self.assertTrue( len(subset) == np.sum(self.flowtable.entries['hillID'] == self.hillID) )
+        self.assertTrue( np.all(subset.entries['hillID'] == self.hillID) )
+
+    def testDropReceivers(self):
+        subset = subsetColumnar(self.flowtable, bbox=self.bbox, receiverPolicy=RECEIVER_POLICY_DROP)
+        counts = validateFlowtable(subset).getCounts()
+        for check in (CHECK_MISSING_RECEIVER, CHECK_MISSING_STREAM, CHECK_ROAD_LAND_TYPE):
+            self.assertTrue( counts[check] == 0 )
+        # Gammas still sum to the same total
+        for i in xrange(len(subset)):
+            receivers = subset.getReceivers(i)
+            if receivers:
+                original = self.flowtable.getReceivers(self.flowtable.getIndexForKey(subset.getKey(i)))
+                self.assertTrue( abs(sum(r.gamma for r in receivers) - sum(r.gamma for r in original)) < ZERO )
+
+    def testKeepReceivers(self):
+        subset = subsetColumnar(self.flowtable, bbox=self.bbox, receiverPolicy=RECEIVER_POLICY_KEEP)
+        for i in xrange(len(subset)):
+            original = self.flowtable.getIndexForKey(subset.getKey(i))
+            self.assertTrue( _receiverTuples(subset.getReceivers(i)) == \
+                             _receiverTuples(self.flowtable.getReceivers(original)) )
+
+    def testStreamingSameAsColumnar(self):
+        columnarPath = os.path.join(self.flowtableDir, "test-flow-subset-columnar.flow")
+        streamedPath = os.path.join(self.flowtableDir, "test-flow-subset-streamed.flow")
+        try:
+            for policy in (RECEIVER_POLICY_DROP, RECEIVER_POLICY_KEEP):
+                for selection in (dict(hillIDs=[self.hillID]), dict(bbox=self.bbox)):
+                    subset = subsetColumnar(self.flowtable, receiverPolicy=policy, **selection)
+                    writeFlowtableColumnar(subset, columnarPath)
+                    numWritten = subsetFlowtable(self.flowtablePath, streamedPath, receiverPolicy=policy,
+                                                 **selection)
+                    self.assertTrue( numWritten == len(subset) )
+                    self.assertTrue( filecmp.cmp(columnarPath, streamedPath, shallow=False) )
+        finally:
+            for path in (columnarPath, streamedPath):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def testStreamingDuplicates(self):
+        # Patch 1 occurs twice; the second occurrence is the one kept, at the first position
+        def record(patchID, hillID, receivers):
+            entry = FlowTableEntry(patchID, hillID, hillID, 0.0, 0.0, 10.0 - patchID, 1.0, 1, 1, 1.0,
+                                   len(receivers))
+            return FlowTableRecord(entry, [FlowTableEntryReceiver(r, h, h, g) for (r, h, g) in receivers], None)
+        dupPath = os.path.join(self.flowtableDir, "test-flow-subset-dup.flow")
+        columnarPath = os.path.join(self.flowtableDir, "test-flow-subset-columnar.flow")
+        streamedPaths = [os.path.join(self.flowtableDir, "test-flow-subset-streamed.flow" + suffix)
+                         for suffix in ('', '.gz')]
+        writeFlowtableRecords([record(1, 1, [(2, 1, 1.0)]),
+                               record(2, 1, [(3, 2, 1.0)]),
+                               record(3, 2, []),
+                               record(1, 1, [(2, 1, 0.25), (3, 2, 0.75)])], dupPath)
+        try:
+            for (policy, streamedPath) in itertools.product((RECEIVER_POLICY_DROP, RECEIVER_POLICY_KEEP),
+                                                            streamedPaths):
+                subset = subsetColumnar(readFlowtableColumnar(dupPath), hillIDs=[1], receiverPolicy=policy)
+                writeFlowtableColumnar(subset, columnarPath)
+                numWritten = subsetFlowtable(dupPath, streamedPath, hillIDs=[1], receiverPolicy=policy)
+                self.assertTrue( numWritten == len(subset) == 2 )
+                streamed = list(iterFlowtable(streamedPath))
+                self.assertTrue( [r.entry.patchID for r in streamed] == [1, 2] )
+                self.assertTrue( len(streamed[0].receivers) == (1 if policy == RECEIVER_POLICY_DROP else 2) )
+                columnar = list(iterFlowtable(columnarPath))
+                self.assertTrue( [(r.entry, _receiverTuples(r.receivers)) for r in streamed] == \
+                                 [(r.entry, _receiverTuples(r.receivers)) for r in columnar] )
+        finally:
+            for path in [dupPath, columnarPath] + streamedPaths:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def testStreamingDuplicatesMoved(self):
+        # Patch 1 moves out of the bounding box and patch 3 into it at their second occurrence
+        def record(patchID, x):
+            entry = FlowTableEntry(patchID, 1, 1, x, 0.0, 10.0 - patchID, 1.0, 1, 1, 1.0, 1)
+            return FlowTableRecord(entry, [FlowTableEntryReceiver(patchID + 1, 1, 1, 1.0)], None)
+        dupPath = os.path.join(self.flowtableDir, "test-flow-subset-dup.flow")
+        columnarPath = os.path.join(self.flowtableDir, "test-flow-subset-columnar.flow")
+        streamedPath = os.path.join(self.flowtableDir, "test-flow-subset-streamed.flow")
+        writeFlowtableRecords([record(1, 0.0), record(2, 0.0), record(3, 5.0), record(1, 5.0),
+                               record(3, 0.5)], dupPath)
+        bbox = (-1.0, -1.0, 1.0, 1.0)
+        try:
+            subset = subsetColumnar(readFlowtableColumnar(dupPath), bbox=bbox, receiverPolicy=RECEIVER_POLICY_KEEP)
+            writeFlowtableColumnar(subset, columnarPath)
+            numWritten = subsetFlowtable(dupPath, streamedPath, bbox=bbox, receiverPolicy=RECEIVER_POLICY_KEEP)
+            streamed = list(iterFlowtable(streamedPath))
+            self.assertTrue( numWritten == len(streamed) == 2 )
+            self.assertTrue( [(r.entry.patchID, r.entry.x) for r in streamed] == [(2, 0.0), (3, 0.5)] )
+            self.assertTrue( [(r.entry, _receiverTuples(r.receivers)) for r in streamed] == \
+                             [(r.entry, _receiverTuples(r.receivers)) for r in iterFlowtable(columnarPath)] )
+            self.assertTrue( [f for f in os.listdir(self.flowtableDir) if f.startswith('.subset')] == [] )
+        finally:
+            for path in (dupPath, columnarPath, streamedPath):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def testDropRule(self):
+        # Patch 9 is a receiver in the selected hillslope but not an entry, and the road
+        # of patch 1 drains to a stream patch outside the selection
+        def record(patchID, hillID, receivers, road=None):
+            entry = FlowTableEntry(patchID, hillID, hillID, 0.0, 0.0, 10.0 - patchID, 1.0, 1,
+                                   LAND_TYPE_ROAD if road else 1, 1.0, len(receivers))
+            return FlowTableRecord(entry, [FlowTableEntryReceiver(r, h, h, g) for (r, h, g) in receivers],
+                                   FlowTableEntryRoad(road, road, road, 2.0) if road else None)
+        inputPath = os.path.join(self.flowtableDir, "test-flow-subset-rule.flow")
+        columnarPath = os.path.join(self.flowtableDir, "test-flow-subset-columnar.flow")
+        streamedPath = os.path.join(self.flowtableDir, "test-flow-subset-streamed.flow")
+        writeFlowtableRecords([record(1, 1, [(2, 1, 0.5), (9, 1, 0.5)], road=3),
+                               record(2, 1, [(3, 3, 1.0)], road=1),
+                               record(3, 3, [])], inputPath)
+        try:
+            subset = subsetColumnar(readFlowtableColumnar(inputPath), hillIDs=[1])
+            writeFlowtableColumnar(subset, columnarPath)
+            self.assertTrue( subsetFlowtable(inputPath, streamedPath, hillIDs=[1]) == 2 )
+            self.assertTrue( filecmp.cmp(columnarPath, streamedPath, shallow=False) )
+            streamed = list(iterFlowtable(streamedPath))
+            self.assertTrue( _receiverTuples(streamed[0].receivers) == [(2, 1, 1, 1.0)] )
+            self.assertTrue( streamed[0].road is None and streamed[0].entry.landType == LAND_TYPE_LAND )
+            self.assertTrue( streamed[1].receivers == [] and streamed[1].road.streamPatchID == 1 )
+            counts = validateFlowtable(readFlowtableColumnar(streamedPath)).getCounts()
+            for check in (CHECK_MISSING_RECEIVER, CHECK_MISSING_STREAM, CHECK_ROAD_LAND_TYPE):
+                self.assertTrue( counts[check] == 0 )
+        finally:
+            for path in (inputPath, columnarPath, streamedPath):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+    def testNoSelection(self):
+        self.assertRaises( Exception, subsetColumnar, self.flowtable )
@@ -0,0 +1,152 @@
+"""@package tests.test_flowtablevalidator
+
+@brief Test methods for flowtablevalidator
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage:
+@code
+python -m unittest test_flowtablevalidator
+@endcode
+"""
+import os, errno
+import gzip
+from collections import OrderedDict
+from unittest import TestCase
+
+import numpy as np
+
+from flowtableio import readFlowtable
+from flowtableio import FlowTableEntry
+from flowtableio import FlowTableEntryReceiver
+from flowtableio import FlowTableEntryRoad
+from flowtableio import LAND_TYPE_ROAD
+from flowtablearray import readFlowtableColumnar
+from flowtablearray import flowtableDictToColumnar
+import flowtablevalidator
+from flowtablevalidator import validateFlowtable
+import rhessystypes
+
+def _makeFlowtable(patches):
+    """ @brief Build a flow table dict from a list of (patchID, landType, numAdjacent,
+        receivers, road) where receivers is a list of (patchID, gamma) and road is
+        the stream patch ID or None
+    """
+    flowtable = OrderedDict()
+    for (patchID, landType, numAdjacent, receivers, road) in patches:
+        key = rhessystypes.FQPatchID(patchID=patchID, zoneID=1, hillID=1)
+        items = [FlowTableEntry(patchID, 1, 1, 0.0, 0.0, 0.0, 1.0, 1, landType, 1.0, numAdjacent)]
+        items.extend([FlowTableEntryReceiver(r, 1, 1, gamma) for (r, gamma) in receivers])
+        if road is not None:
+            items.append(FlowTableEntryRoad(road, 1, 1, 5.0))
+        flowtable[key] = items
+    return flowtable
+
+## Unit tests
+class TestValidateFlowtable(TestCase):
+
+    def testValid(self):
+        flowtable = _makeFlowtable([ (1, 1, 2, [(2, 0.25), (3, 0.75)], None),
+                                     (2, LAND_TYPE_ROAD, 1, [(3, 1.0)], 3),
+                                     (3, 1, 0, [], None) ])
+        report = validateFlowtable(flowtable)
+        self.assertTrue( report.isValid() )
+        self.assertTrue( report.getProblems() == [] )
+
+    def testProblems(self):
+        flowtable = _makeFlowtable([ (1, 1, 3, [(2, 0.25), (3, 0.5)], None),
+                                     (2, LAND_TYPE_ROAD, 1, [(2, 1.0)], 9),
+                                     (3, 1, 2, [(4, 1.5), (1, -0.5)], None),
+                                     (5, LAND_TYPE_ROAD, 0, [], None),
+                                     (6, 1, 0, [], 3) ])
+        report = validateFlowtable(flowtable)
+        self.assertFalse( report.isValid() )
+        counts = report.getCounts()
+        self.assertTrue( counts[flowtablevalidator.CHECK_DUPLICATE_KEY] == 0 )
+        self.assertTrue( counts[flowtablevalidator.CHECK_NUM_ADJACENT] == 1 )
+        self.assertTrue( counts[flowtablevalidator.CHECK_GAMMA_SUM] == 1 )
+        self.assertTrue( counts[flowtablevalidator.CHECK_NEGATIVE_GAMMA] == 1 )
+        self.assertTrue( counts[flowtablevalidator.CHECK_MISSING_RECEIVER] == 1 )
+        self.assertTrue( counts[flowtablevalidator.CHECK_SELF_RECEIVER] == 1 )
+        self.assertTrue( counts[flowtablevalidator.CHECK_ROAD_LAND_TYPE] == 2 )
+        self.assertTrue( counts[flowtablevalidator.CHECK_MISSING_STREAM] == 1 )
+
+        problems = report.getProblems(flowtablevalidator.CHECK_MISSING_RECEIVER)
+        self.assertTrue( problems[0].key.patchID == 3 )
+        self.assertTrue( "(4, 1, 1)" in problems[0].message )
+        problems = report.getProblems(flowtablevalidator.CHECK_GAMMA_SUM)
+        self.assertTrue( problems[0].key.patchID == 1 )
+        self.assertTrue( len(report.getProblems(limit=1)) == 7 )
+
+    def testDuplicateKey(self):
+        table = flowtableDictToColumnar(_makeFlowtable([ (1, 1, 1, [(2, 1.0)], None),
+                                                         (2, 1, 0, [], None) ]))
+        arrays = table.toArrays()
+        arrays['entries'] = np.concatenate([arrays['entries'], arrays['entries'][:1]])
+        arrays['receiverOffsets'] = np.append(arrays['receiverOffsets'], arrays['receiverOffsets'][-1])
+        arrays['entries']['numAdjacent'][-1] = 0
+        arrays['roadIndex'] = np.append(arrays['roadIndex'], -1)
+        table = type(table)(**arrays)
+        report = validateFlowtable(table)
+        self.assertTrue( list(report.entryRows[flowtablevalidator.CHECK_DUPLICATE_KEY]) == [0, 2] )
+
+
+class TestValidateFlowtableData(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # We gzip the flow table to be nice to GitHub, unzip it
+        cls.flowtablePath = os.path.abspath('./tests/data/world5m_dr5.flow')
+        flowtableGz = "%s.gz" % (cls.flowtablePath,)
+        if not os.access(flowtableGz, os.R_OK):
+            raise IOError(errno.EACCES, "Unable to read flow table %s" %
+                      flowtableGz)
+        cls.flowtableDir = os.path.split(flowtableGz)[0]
+        if not os.access(cls.flowtableDir, os.W_OK):
+            raise IOError(errno.EACCES, "Unable to write to flow table dir %s" %
+                          cls.flowtableDir)
+        fIn = gzip.open(flowtableGz, 'rb')
+        fOut = open(cls.flowtablePath, 'wb')
+        fOut.write(fIn.read())
+        fIn.close()
+        fOut.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        # Get rid of the un-gzipped flow table
+        os.unlink(cls.flowtablePath)
+
+    def testSameForDictAndColumnar(self):
+        columnarReport = validateFlowtable(readFlowtableColumnar(self.flowtablePath))
+        dictReport = validateFlowtable(readFlowtable(self.flowtablePath))
+        self.assertTrue( columnarReport.getCounts() == dictReport.getCounts() )
+        counts = columnarReport.getCounts()
+        self.assertTrue( counts[flowtablevalidator.CHECK_DUPLICATE_KEY] == 0 )
+        self.assertTrue( counts[flowtablevalidator.CHECK_NUM_ADJACENT] == 0 )
@@ -0,0 +1,175 @@
+"""@package tests.test_flowtableversions
+
+@brief Test methods for flowtableversions
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage:
+@code
+python -m unittest test_flowtableversions
+@endcode
+"""
+from collections import OrderedDict
+from unittest import TestCase
+
+from flowtableio import FlowTableEntry
+from flowtableio import FlowTableEntryReceiver
+import flowtablecache
+import flowtableversions
+from flowtableversions import BASE_VERSION
+from flowtableversions import createVersion
+from flowtableversions import getParentVersion
+from flowtableversions import isVersionFrozen
+from flowtableversions import getVersionRecord
+from flowtableversions import setVersionReceivers
+from flowtableversions import getVersionChanges
+from flowtableversions import iterVersionRecords
+from flowtableversions import compactVersion
+from flowtableversions import deleteVersions
+import rhessystypes
+from tests.fakeredis import FakeRedis
+
+## Constants
+NAME = 'versions.flow'
+
+def _getKey(patchID):
+    return rhessystypes.FQPatchID(patchID=patchID, zoneID=1, hillID=1)
+
+def _makeFlowtable(numPatches):
+    """ @brief Build a flow table dict in which each patch drains into the next """
+    flowtable = OrderedDict()
+    for patchID in xrange(1, numPatches + 1):
+        receivers = [FlowTableEntryReceiver(patchID + 1, 1, 1, 1.0)] if patchID < numPatches else []
+        flowtable[_getKey(patchID)] = [FlowTableEntry(patchID, 1, 1, 0.0, 0.0, float(numPatches - patchID),
+                                                      1.0, 1, 1, 1.0, len(receivers))] + receivers
+    return flowtable
+
+def _getReceiverIDs(record):
+    return [r.patchID for r in record.receivers]
+
+## Unit tests
+class TestFlowtableVersions(TestCase):
+
+    def setUp(self):
+        self.redisClient = FakeRedis()
+        self.flowtable = _makeFlowtable(10)
+        flowtablecache.bulkLoadFlowtable(self.redisClient, NAME, self.flowtable)
+
+    def _setReceivers(self, version, patchID, receiverIDs):
+        setVersionReceivers(self.redisClient, NAME, version, _getKey(patchID),
+                            [FlowTableEntryReceiver(r, 1, 1, 1.0 / len(receiverIDs)) for r in receiverIDs])
+
+    def _getReceivers(self, version, patchID):
+        return _getReceiverIDs(getVersionRecord(self.redisClient, NAME, version, _getKey(patchID)))
+
+    def testCreateVersion(self):
+        v1 = createVersion(self.redisClient, NAME)
+        self.assertTrue( getParentVersion(self.redisClient, NAME, v1) == BASE_VERSION )
+        self.assertIsNone( getParentVersion(self.redisClient, NAME, BASE_VERSION) )
+        self.assertFalse( isVersionFrozen(self.redisClient, NAME, v1) )
+        v2 = createVersion(self.redisClient, NAME, v1)
+        self.assertTrue( getParentVersion(self.redisClient, NAME, v2) == v1 )
+        self.assertTrue( isVersionFrozen(self.redisClient, NAME, v1) )
+        self.assertRaises( Exception, createVersion, self.redisClient, NAME, 99 )
+        self.assertRaises( Exception, createVersion, self.redisClient, 'uncached.flow' )
+
+    def testSetAndGetAcrossChain(self):
+        v1 = createVersion(self.redisClient, NAME)
+        self._setReceivers(v1, 3, [5])
+        v2 = createVersion(self.redisClient, NAME, v1)
+        self._setReceivers(v2, 4, [6, 7])
+        v3 = createVersion(self.redisClient, NAME, v2)
+        self._setReceivers(v3, 3, [8])
+
+        self.assertTrue( self._getReceivers(BASE_VERSION, 3) == [4] )
+        self.assertTrue( self._getReceivers(v1, 3) == [5] )
+        self.assertTrue( self._getReceivers(v2, 3) == [5] )
+        self.assertTrue( self._getReceivers(v2, 4) == [6, 7] )
+        self.assertTrue( self._getReceivers(v3, 3) == [8] )
+        self.assertTrue( self._getReceivers(v3, 4) == [6, 7] )
+        self.assertTrue( self._getReceivers(v3, 5) == [6] )
+        record = getVersionRecord(self.redisClient, NAME, v2, _getKey(4))
+        self.assertTrue( record.entry.numAdjacent == 2 )
+        self.assertIsNone( getVersionRecord(self.redisClient, NAME, v3, _getKey(99)) )
+
+        # Frozen versions and patches outside the flow table can't be changed
+        self.assertRaises( Exception, self._setReceivers, v1, 5, [7] )
+        self.assertRaises( Exception, self._setReceivers, v3, 99, [7] )
+
+        changes = getVersionChanges(self.redisClient, NAME, v3)
+        self.assertTrue( sorted(k.patchID for k in changes) == [3, 4] )
+        records = list(iterVersionRecords(self.redisClient, NAME, v3, batchSize=3))
+        self.assertTrue( [r.entry.patchID for r in records] == range(1, 11) )
+        self.assertTrue( _getReceiverIDs(records[2]) == [8] )
+        self.assertTrue( _getReceiverIDs(records[3]) == [6, 7] )
+
+    def testCompactVersion(self):
+        version = createVersion(self.redisClient, NAME)
+        for patchID in xrange(1, flowtableversions.MAX_CHAIN_LENGTH):
+            self._setReceivers(version, patchID, [10])
+            version = createVersion(self.redisClient, NAME, version)
+        self.assertRaises( Exception, createVersion, self.redisClient, NAME, version )
+
+        compacted = compactVersion(self.redisClient, NAME, version)
+        self.assertTrue( getParentVersion(self.redisClient, NAME, compacted) == BASE_VERSION )
+        self.assertTrue( isVersionFrozen(self.redisClient, NAME, version) )
+        changes = getVersionChanges(self.redisClient, NAME, compacted)
+        self.assertTrue( sorted(k.patchID for k in changes) == range(1, flowtableversions.MAX_CHAIN_LENGTH) )
+        self.assertTrue( sorted(changes) == sorted(getVersionChanges(self.redisClient, NAME, version)) )
+        self.assertTrue( self._getReceivers(compacted, 1) == [10] )
+        self.assertTrue( self._getReceivers(compacted, flowtableversions.MAX_CHAIN_LENGTH - 1) == [10] )
+        createVersion(self.redisClient, NAME, compacted)
+
+    def testDeleteVersions(self):
+        v1 = createVersion(self.redisClient, NAME)
+        self._setReceivers(v1, 3, [5])
+        createVersion(self.redisClient, NAME, v1)
+        deleteVersions(self.redisClient, NAME)
+        self.assertRaises( Exception, getVersionRecord, self.redisClient, NAME, v1, _getKey(3) )
+        self.assertTrue( [k for k in self.redisClient.data if '.version' in k] == [] )
+        self.assertTrue( self._getReceivers(BASE_VERSION, 3) == [4] )
+
+    def testReloadMakesVersionsStale(self):
+        v1 = createVersion(self.redisClient, NAME)
+        self._setReceivers(v1, 3, [5])
+        flowtablecache.bulkLoadFlowtable(self.redisClient, NAME, _makeFlowtable(5))
+        self.assertRaises( Exception, getVersionRecord, self.redisClient, NAME, v1, _getKey(3) )
+        self.assertRaises( Exception, self._setReceivers, v1, 3, [5] )
+        self.assertRaises( Exception, createVersion, self.redisClient, NAME, v1 )
+        self.assertRaises( Exception, compactVersion, self.redisClient, NAME, v1 )
+
+        flowtablecache.clearFlowtable(self.redisClient, NAME)
+        self.assertRaises( Exception, getVersionChanges, self.redisClient, NAME, v1 )
+
+        # Versions made from the new load are fine
+        flowtablecache.bulkLoadFlowtable(self.redisClient, NAME, self.flowtable)
+        v2 = createVersion(self.redisClient, NAME)
+        self._setReceivers(v2, 3, [5])
+        self.assertTrue( self._getReceivers(v2, 3) == [5] )
@@ -38,16 +38,25 @@ Usage:
 python -m unittest test_grassdatalookup
 @endcode
 
-@note Must have GRASS installed and have GISBASE environmental variable set.
+@note Must have GRASS installed and have GISBASE environmental variable set, except
+for TestGRASSDataLookupNative and TestPatchCellIndexStaleness.
 """ 
 import os, errno
+import time
+import tempfile
 from shutil import rmtree
 from zipfile import ZipFile
 from unittest import TestCase
 
+import numpy as np
+
 import rhessystypes
+import grassraster
 from grassdatalookup import GrassDataLookup
 from grassdatalookup import GRASSConfig
+from rasterrowcache import RasterRowCache
+from tests.test_grassraster import writeIntegerMap
+from tests.test_grassraster import _writeHeader
 
 ## Constants
 ZERO = 4.999
@@ -55,6 +64,8 @@ ZERO = 4.999
 ## Unit tests
 class TestGRASSDataLookup(TestCase):
     
+    useNativeReader = False
+    
     @classmethod
     def setUpClass(cls):
         # We zip the GRASSData folder to be nice to GitHub, unzip it
@@ -71,9 +82,9 @@ class TestGRASSDataLookup(TestCase):
         extractDir = os.path.split(cls.grassDBasePath)[0]
         zip.extractall(path=extractDir)
         
-        gisbase = os.environ['GISBASE']
+        gisbase = os.environ.get('GISBASE') if cls.useNativeReader else os.environ['GISBASE']
         grassConfig = GRASSConfig(gisbase=gisbase, dbase=cls.grassDBasePath, location='DR5_5m', mapset='taehee')
-        cls.grassdatalookup = GrassDataLookup(grass_config=grassConfig)
+        cls.grassdatalookup = GrassDataLookup(grass_config=grassConfig, use_native_reader=cls.useNativeReader)
         
         cls.inPatchID = 309999
         cls.inZoneID = 73
@@ -101,6 +112,17 @@ class TestGRASSDataLookup(TestCase):
         self.assertTrue( abs(coordPair.northing - self.northing) < ZERO )
         
     
+    def testCoordinatesMapBackToPatch(self):
+        fqPatchID = rhessystypes.FQPatchID(patchID=self.inPatchID, zoneID=self.inZoneID, hillID=self.inHillID)
+        coords = self.grassdatalookup.getCoordinatesForFQPatchIDs([fqPatchID, fqPatchID], self.patchMap,
+                                                                  self.zoneMap, self.hillslopeMap)
+        self.assertTrue( coords.keys() == [fqPatchID] )
+        self.assertTrue( len(coords[fqPatchID]) > 0 )
+        for coordPair in coords[fqPatchID]:
+            self.assertTrue( self.grassdatalookup.getFQPatchIDForCoordinates(coordPair, \
+                                 self.patchMap, self.zoneMap, self.hillslopeMap) == fqPatchID )
+        
+    
     def testGetFQPatchIDForCoordinates(self):
         fqPatchIDs = [ (rhessystypes.FQPatchID(patchID=self.inPatchID, \
                                                    zoneID=self.inZoneID, hillID=self.inHillID)) ]
@@ -119,3 +141,103 @@ class TestGRASSDataLookup(TestCase):
         self.assertTrue( self.inZoneID == zoneID )
         self.assertTrue( self.inHillID == hillID )
         
+    
+    def testGetFQPatchIDsForCoordinates(self):
+        fqPatchID = rhessystypes.FQPatchID(patchID=self.inPatchID, zoneID=self.inZoneID, hillID=self.inHillID)
+        coords = self.grassdatalookup.getCoordinatesForFQPatchIDs([fqPatchID], self.patchMap,
+                                                                  self.zoneMap, self.hillslopeMap)
+        # Points in input order, one far outside the region
+        outside = rhessystypes.getCoordinatePair(0.0, 0.0)
+        points = [outside] + list(reversed(coords[fqPatchID])) + [outside]
+        fqPatchIDs = self.grassdatalookup.getFQPatchIDsForCoordinates(points, self.patchMap,
+                                                                      self.zoneMap, self.hillslopeMap)
+        self.assertTrue( len(fqPatchIDs) == len(points) )
+        self.assertIsNone( fqPatchIDs[0] )
+        self.assertIsNone( fqPatchIDs[-1] )
+        self.assertTrue( all(f == fqPatchID for f in fqPatchIDs[1:-1]) )
+        self.assertTrue( self.grassdatalookup.getFQPatchIDsForCoordinates([], self.patchMap,
+                                                                          self.zoneMap, self.hillslopeMap) == [] )
+
+
+class TestGRASSDataLookupNative(TestGRASSDataLookup):
+    # The same tests, reading the maps with grassraster rather than the GRASS library
+    useNativeReader = True
+
+
+class TestPatchCellIndexStaleness(TestCase):
+    # Maps written with the GRASS 6 format in a temporary location, read natively
+    
+    def setUp(self):
+        self.locationPath = tempfile.mkdtemp()
+        self.mapsetPath = os.path.join(self.locationPath, 'PERMANENT')
+        for element in ('cell', 'cellhd', 'cell_misc'):
+            os.makedirs(os.path.join(self.mapsetPath, element))
+        (self.numRows, self.numCols) = (30, 40)
+        _writeHeader(os.path.join(self.mapsetPath, 'WIND'), self.numRows, self.numCols)
+        rows = np.arange(self.numRows)[:,None]
+        cols = np.arange(self.numCols)[None,:]
+        # Patches of 3 x 2 cells in a single zone and hillslope
+        self.patch = (rows // 3 * (self.numCols // 2) + cols // 2 + 1).astype(np.int32)
+        self._writeMap('patch', self.patch)
+        ones = np.ones((self.numRows, self.numCols), dtype=np.int32)
+        self._writeMap('hill', ones)
+        self.maps = ('patch@PERMANENT', 'hill@PERMANENT', 'hill@PERMANENT')
+        self.key = rhessystypes.FQPatchID(patchID=1, zoneID=1, hillID=1)
+    
+    def tearDown(self):
+        rmtree(self.locationPath)
+    
+    def _writeMap(self, name, array, nulls=None):
+        if nulls is None:
+            nulls = np.zeros(array.shape, dtype=bool)
+        writeIntegerMap(self.mapsetPath, name, array, grassraster.COMPRESSION_RLE, nulls)
+    
+    def _getLookup(self):
+        grassConfig = GRASSConfig(gisbase=None, dbase=self.locationPath, location='', mapset='PERMANENT')
+        return GrassDataLookup(grass_config=grassConfig, row_cache=RasterRowCache(), use_native_reader=True)
+    
+    def _getNumCells(self, lookup, useIndex):
+        return len(lookup.getCoordinatesForFQPatchIDs([self.key], *self.maps, useIndex=useIndex)[self.key])
+    
+    def testIndexKeptWithMap(self):
+        lookup = self._getLookup()
+        self.assertTrue( self._getNumCells(lookup, True) == 6 )
+        self.assertFalse( 'patch@PERMANENT' in os.listdir(os.path.join(self.mapsetPath, 'cell_misc')) )
+        
+        # Make sure the rewritten map has a different modification time
+        time.sleep(1.1)
+        self.patch[0, 0:2] = 99
+        self._writeMap('patch', self.patch)
+        self.assertTrue( self._getNumCells(lookup, True) == 4 )
+        self.assertTrue( self._getNumCells(self._getLookup(), True) == 4 )
+    
+    def testIndexBypassesRowCache(self):
+        lookup = self._getLookup()
+        lookup.getPatchCellIndex(*self.maps)
+        self.assertTrue( len(lookup.rowCache) == 0 )
+    
+    def testCellOutsideRegion(self):
+        lookup = self._getLookup()
+        (window, numRows, numCols) = lookup._getWindow()
+        inside = rhessystypes.getCoordinatePair(window['west'] + 0.5 * window['ewRes'],
+                                                window['north'] - 0.5 * window['nsRes'])
+        self.assertTrue( lookup.getFQPatchIDForCoordinates(inside, *self.maps) == self.key )
+        # West of the region, within a cell of its edge, and beyond the last column
+        for (easting, northing) in ((window['west'] - 0.5 * window['ewRes'], inside.northing),
+                                    (window['west'] - 1.5 * window['ewRes'], inside.northing),
+                                    (window['west'] + (numCols + 0.5) * window['ewRes'], inside.northing),
+                                    (inside.easting, window['north'] + 0.5 * window['nsRes'])):
+            coordinate = rhessystypes.getCoordinatePair(easting, northing)
+            self.assertIsNone( lookup.getFQPatchIDForCoordinates(coordinate, *self.maps) )
+    
+    def testIndexFollowsMask(self):
+        lookup = self._getLookup()
+        self.assertTrue( self._getNumCells(lookup, True) == 6 )
+        
+        nulls = np.zeros((self.numRows, self.numCols), dtype=bool)
+        nulls[:3] = True
+        self._writeMap(grassraster.MASK_NAME, np.ones((self.numRows, self.numCols), dtype=np.int32), nulls)
+        for l in (lookup, self._getLookup()):
+            for useIndex in (True, False):
+                with self.assertRaises(KeyError):
+                    self._getNumCells(l, useIndex)
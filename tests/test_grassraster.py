@@ -0,0 +1,316 @@
+"""@package tests.test_grassraster
+
+@brief Test methods for grassraster
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage:
+@code
+python -m unittest test_grassraster
+@endcode
+"""
+import os
+import zlib
+import struct
+import tempfile
+from shutil import rmtree
+from unittest import TestCase
+
+import numpy as np
+
+from grassraster import CELL_NULL
+from grassraster import COMPRESSION_NONE
+from grassraster import COMPRESSION_RLE
+from grassraster import COMPRESSION_ZLIB
+from grassraster import GrassRaster
+from grassraster import UnsupportedRasterError
+from grassraster import readCellHeader
+from grassraster import readRegion
+from grassraster import findRaster
+from grassraster import listRasters
+from grassraster import openMask
+from grassraster import getValuesForCoordinates
+
+## Constants
+NORTH = 4350000.0
+WEST = 349000.0
+RES = 5.0
+ROWS = 12
+COLS = 21
+
+## Writing GRASS 6 raster maps, as the GRASS library does
+def _writeHeader(path, rows, cols, north=NORTH, west=WEST, res=RES, format=None, compressed=None):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    f = open(path, 'w')
+    f.write("proj:       1\nzone:       17\nnorth:      %r\nsouth:      %r\neast:       %r\nwest:       %r\n" % \
+            (north, north - rows * res, west + cols * res, west) )
+    f.write("cols:       %d\nrows:       %d\ne-w resol:  %r\nn-s resol:  %r\n" % (cols, rows, res, res) )
+    if format is not None:
+        f.write("format:     %d\ncompressed: %d\n" % (format, compressed) )
+    f.close()
+
+def _encodeCells(values, nbytes):
+    data = []
+    for v in values:
+        cell = struct.pack('>I', abs(int(v)))[4 - nbytes:]
+        if v < 0:
+            cell = chr(ord(cell[0]) | 0x80) + cell[1:]
+        data.append(cell)
+    return ''.join(data)
+
+def _encodeRuns(values, nbytes):
+    runs = []
+    (start, n) = (0, len(values))
+    while start < n:
+        end = start + 1
+        while end < n and end - start < 255 and values[end] == values[start]:
+            end += 1
+        runs.append(chr(end - start) + _encodeCells(values[start:start + 1], nbytes))
+        start = end
+    return ''.join(runs)
+
+def _writeRows(path, rows, compressed):
+    f = open(path, 'wb')
+    if compressed:
+        offsets = [1 + 4 * (len(rows) + 1)]
+        for row in rows:
+            offsets.append(offsets[-1] + len(row))
+        f.write(chr(4) + ''.join(struct.pack('>I', o) for o in offsets))
+    f.write(''.join(rows))
+    f.close()
+
+def _writeNulls(mapsetPath, name, nulls):
+    if nulls is None:
+        return
+    path = os.path.join(mapsetPath, 'cell_misc', name, 'null')
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    f = open(path, 'wb')
+    f.write(''.join(np.packbits(row).tostring() for row in nulls))
+    f.close()
+
+def writeIntegerMap(mapsetPath, name, array, compression, nulls=None, nbytes=4):
+    rows = []
+    for values in array.tolist():
+        if compression == COMPRESSION_NONE:
+            rows.append(_encodeCells(values, nbytes))
+            continue
+        raw = _encodeCells(values, nbytes)
+        if compression == COMPRESSION_ZLIB:
+            packed = zlib.compress(raw)
+        else:
+            packed = _encodeRuns(values, nbytes)
+        rows.append(chr(nbytes) + (packed if len(packed) < len(raw) else raw))
+    _writeHeader(os.path.join(mapsetPath, 'cellhd', name), array.shape[0], array.shape[1],
+                 format=nbytes - 1, compressed=compression)
+    _writeRows(os.path.join(mapsetPath, 'cell', name), rows, compression)
+    _writeNulls(mapsetPath, name, nulls)
+
+def writeFloatingPointMap(mapsetPath, name, array, compressed, nulls=None):
+    fileDtype = array.dtype.newbyteorder('>')
+    rows = []
+    for values in array:
+        raw = values.astype(fileDtype).tostring()
+        if compressed:
+            packed = zlib.compress(raw)
+            rows.append('1' + packed if len(packed) < len(raw) else '0' + raw)
+        else:
+            rows.append(raw)
+    _writeHeader(os.path.join(mapsetPath, 'cellhd', name), array.shape[0], array.shape[1],
+                 format=-1, compressed=int(compressed))
+    _writeRows(os.path.join(mapsetPath, 'fcell', name), rows, compressed)
+    open(os.path.join(mapsetPath, 'cell', name), 'wb').close()
+    if not os.path.isdir(os.path.join(mapsetPath, 'cell_misc', name)):
+        os.makedirs(os.path.join(mapsetPath, 'cell_misc', name))
+    f = open(os.path.join(mapsetPath, 'cell_misc', name, 'f_format'), 'w')
+    f.write("type: %s\nbyte_order: xdr\nlzw_compression_bits: -1\n" % \
+            ('double' if array.dtype == np.float64 else 'float',) )
+    f.close()
+    _writeNulls(mapsetPath, name, nulls)
+
+def writeReclassMap(mapsetPath, name, baseName, baseMapset, first, table):
+    f = open(os.path.join(mapsetPath, 'cellhd', name), 'w')
+    f.write("reclass\nname: %s\nmapset: %s\n#%d\n" % (baseName, baseMapset, first) )
+    f.write(''.join("%s\n" % ('*' if value is None else value,) for value in table))
+    f.close()
+
+
+## Unit tests
+class TestGrassRaster(TestCase):
+
+    def setUp(self):
+        self.locationPath = tempfile.mkdtemp()
+        self.mapsetPath = os.path.join(self.locationPath, 'PERMANENT')
+        for element in ('cell', 'fcell', 'cellhd', 'cell_misc'):
+            os.makedirs(os.path.join(self.mapsetPath, element))
+        _writeHeader(os.path.join(self.mapsetPath, 'WIND'), ROWS, COLS)
+
+        # Patch-like runs of IDs, including negative values and values needing 4 bytes
+        rows = np.arange(ROWS)[:, None]
+        cols = np.arange(COLS)[None, :]
+        self.cells = ( (rows // 3) * 100000 + cols // 4 + 1 ).astype(np.int32)
+        self.cells[1, :] = -(self.cells[1, :] + 0x1000000)
+        self.nulls = np.zeros( (ROWS, COLS), dtype=bool )
+        self.nulls[2, 3:9] = True
+        self.nulls[7, -1] = True
+
+    def tearDown(self):
+        rmtree(self.locationPath)
+
+    def _expected(self, values, nulls, null):
+        expected = values.copy()
+        expected[nulls] = null
+        return expected
+
+    def testReadIntegerMaps(self):
+        expected = self._expected(self.cells, self.nulls, CELL_NULL)
+        for compression in (COMPRESSION_NONE, COMPRESSION_RLE, COMPRESSION_ZLIB):
+            writeIntegerMap(self.mapsetPath, 'patch', self.cells, compression, self.nulls)
+            with GrassRaster(self.mapsetPath, 'patch') as raster:
+                self.assertTrue( raster.compressed == compression )
+                array = raster.readArray()
+                self.assertTrue( array.dtype == np.int32 )
+                self.assertTrue( np.array_equal(array, expected) )
+                self.assertTrue( np.array_equal(raster.readRow(ROWS - 1), expected[-1]) )
+
+    def testReadSmallCells(self):
+        # Cells of fewer than 4 bytes are unsigned, and without a null file zero is NULL
+        values = (np.arange(ROWS * COLS).reshape(ROWS, COLS) % 300).astype(np.int32)
+        for compression in (COMPRESSION_NONE, COMPRESSION_RLE):
+            writeIntegerMap(self.mapsetPath, 'small', values, compression, nbytes=2)
+            with GrassRaster(self.mapsetPath, 'small') as raster:
+                self.assertTrue( np.array_equal(raster.readArray(), self._expected(values, values == 0, CELL_NULL)) )
+
+    def testReadFloatingPointMaps(self):
+        for dtype in (np.float32, np.float64):
+            values = (self.cells / 7.0).astype(dtype)
+            expected = self._expected(values, self.nulls, np.nan)
+            for compressed in (False, True):
+                writeFloatingPointMap(self.mapsetPath, 'elevation', values, compressed, self.nulls)
+                with GrassRaster(self.mapsetPath, 'elevation') as raster:
+                    self.assertTrue( raster.isFloatingPoint )
+                    array = raster.readArray()
+                    self.assertTrue( array.dtype == dtype )
+                    self.assertTrue( np.array_equal(np.isnan(array), self.nulls) )
+                    self.assertTrue( np.array_equal(array[~self.nulls], expected[~self.nulls]) )
+
+    def testReadRegion(self):
+        writeIntegerMap(self.mapsetPath, 'patch', self.cells, COMPRESSION_RLE, self.nulls)
+        expected = self._expected(self.cells, self.nulls, CELL_NULL)
+        regions = [ {'north': NORTH + 7.5, 'west': WEST - 12.5, 'nsRes': 2.5, 'ewRes': 2.5, 'rows': 20, 'cols': 30},
+                    {'north': NORTH - 10.0, 'west': WEST + 20.0, 'nsRes': 10.0, 'ewRes': 7.5, 'rows': 8, 'cols': 16},
+                    {'north': NORTH, 'west': WEST, 'nsRes': RES, 'ewRes': RES, 'rows': ROWS, 'cols': COLS} ]
+        with GrassRaster(self.mapsetPath, 'patch') as raster:
+            for region in regions:
+                # Nearest neighbor: the map cell holding the center of each region cell
+                northings = region['north'] - (np.arange(region['rows']) + 0.5) * region['nsRes']
+                eastings = region['west'] + (np.arange(region['cols']) + 0.5) * region['ewRes']
+                rows = np.floor( (NORTH - northings) / RES ).astype(int)
+                cols = np.floor( (eastings - WEST) / RES ).astype(int)
+                for (row, mapRow) in enumerate(rows):
+                    values = raster.getRow(row, region)
+                    for (col, mapCol) in enumerate(cols):
+                        if 0 <= mapRow < ROWS and 0 <= mapCol < COLS:
+                            self.assertTrue( values[col] == expected[mapRow, mapCol] )
+                        else:
+                            self.assertTrue( values[col] == CELL_NULL )
+                self.assertTrue( np.array_equal(raster.readArray(region),
+                                                np.array([raster.getRow(r, region) for r in range(region['rows'])])) )
+
+    def testMaskAndValuesForCoordinates(self):
+        writeIntegerMap(self.mapsetPath, 'patch', self.cells, COMPRESSION_RLE, self.nulls)
+        writeFloatingPointMap(self.mapsetPath, 'elevation', (self.cells / 2.0).astype(np.float32), True)
+        self.assertTrue( readRegion(self.mapsetPath)['cols'] == COLS )
+        self.assertTrue( findRaster(self.locationPath, 'user', 'patch') == (self.mapsetPath, 'patch') )
+        self.assertTrue( findRaster(self.locationPath, 'user', 'patch@PERMANENT') == (self.mapsetPath, 'patch') )
+        self.assertIsNone( findRaster(self.locationPath, 'PERMANENT', 'missing') )
+        self.assertTrue( listRasters(self.locationPath, 'PERMANENT') == ['elevation@PERMANENT', 'patch@PERMANENT'] )
+
+        (easting, northing) = (WEST + 5 * RES + 1.0, NORTH - 4 * RES - 1.0)
+        values = getValuesForCoordinates(self.locationPath, 'PERMANENT', easting, northing)
+        self.assertTrue( values['patch@PERMANENT'] == self.cells[4, 5] )
+        self.assertTrue( values['elevation@PERMANENT'] == self.cells[4, 5] / 2.0 )
+        values = getValuesForCoordinates(self.locationPath, 'PERMANENT', WEST - 1.0, northing, ['patch'])
+        self.assertIsNone( values['patch'] )
+
+        # Cells where the mask is zero or NULL are NULL
+        mask = np.ones( (ROWS, COLS), dtype=np.int32 )
+        mask[4, 5] = 0
+        writeIntegerMap(self.mapsetPath, 'MASK', mask, COMPRESSION_RLE)
+        with openMask(self.mapsetPath) as maskRaster:
+            with GrassRaster(self.mapsetPath, 'patch') as raster:
+                self.assertTrue( raster.getRow(4, mask=maskRaster)[5] == CELL_NULL )
+                self.assertTrue( raster.getRow(4, mask=maskRaster)[6] == self.cells[4, 6] )
+        values = getValuesForCoordinates(self.locationPath, 'PERMANENT', easting, northing, ['patch'])
+        self.assertIsNone( values['patch'] )
+
+    def testUnsupportedMaps(self):
+        writeIntegerMap(self.mapsetPath, 'patch', self.cells, COMPRESSION_ZLIB, self.nulls)
+        open(os.path.join(self.mapsetPath, 'cell_misc', 'patch', 'nullcmpr'), 'wb').close()
+        self.assertRaises( UnsupportedRasterError, GrassRaster, self.mapsetPath, 'patch' )
+        
+        writeIntegerMap(self.mapsetPath, 'zstd', self.cells, COMPRESSION_RLE)
+        _writeHeader(os.path.join(self.mapsetPath, 'cellhd', 'zstd'), ROWS, COLS, format=3, compressed=5)
+        self.assertRaises( UnsupportedRasterError, GrassRaster, self.mapsetPath, 'zstd' )
+
+    def testReclassMap(self):
+        soils = (np.arange(ROWS * COLS).reshape(ROWS, COLS) % 5 + 1).astype(np.int32)
+        writeIntegerMap(self.mapsetPath, 'soils', soils, COMPRESSION_RLE)
+        writeIntegerMap(self.mapsetPath, 'patch', self.cells, COMPRESSION_RLE, self.nulls)
+        # Categories 2 to 5; 1 is below the table and 3 is reclassified to NULL
+        writeReclassMap(self.mapsetPath, 'soilclass', 'soils', 'PERMANENT', 2, [20, None, 40, 50])
+        expected = np.array([CELL_NULL, CELL_NULL, 20, CELL_NULL, 40, 50], dtype=np.int32)[soils]
+        with GrassRaster(self.mapsetPath, 'soilclass') as raster:
+            self.assertTrue( np.array_equal(raster.readArray(), expected) )
+        
+        # Maps that cannot be read do not fail the lookup of the others
+        writeIntegerMap(self.mapsetPath, 'zstd', self.cells, COMPRESSION_RLE)
+        _writeHeader(os.path.join(self.mapsetPath, 'cellhd', 'zstd'), ROWS, COLS, format=3, compressed=5)
+        (easting, northing) = (WEST + 5 * RES + 1.0, NORTH - 4 * RES - 1.0)
+        values = getValuesForCoordinates(self.locationPath, 'PERMANENT', easting, northing)
+        self.assertTrue( values.keys() == ['patch@PERMANENT', 'soilclass@PERMANENT', 'soils@PERMANENT',
+                                           'zstd@PERMANENT'] )
+        self.assertTrue( values['patch@PERMANENT'] == self.cells[4, 5] )
+        self.assertTrue( values['soilclass@PERMANENT'] == expected[4, 5] == 50 )
+        self.assertTrue( values['soils@PERMANENT'] == soils[4, 5] )
+        self.assertIsNone( values['zstd@PERMANENT'] )
+
+    def testReadLatLongHeader(self):
+        path = os.path.join(self.mapsetPath, 'cellhd', 'latlong')
+        f = open(path, 'w')
+        f.write("proj:       3\nzone:       0\nnorth:      36:00:00N\nsouth:      35:30:00N\n" \
+                "east:       78:30:00W\nwest:       79:00:00W\ne-w resol:  0:00:30\nn-s resol:  0:00:30\n" \
+                "format:     3\ncompressed: 1\n")
+        f.close()
+        header = readCellHeader(path)
+        self.assertTrue( header['north'] == 36.0 and header['west'] == -79.0 )
+        self.assertTrue( (header['rows'], header['cols']) == (60, 60) )
+        self.assertTrue( abs(header['nsRes'] - 1 / 120.0) < 1e-12 )
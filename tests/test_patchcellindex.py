@@ -0,0 +1,123 @@
+"""@package tests.test_patchcellindex
+
+@brief Test methods for patchcellindex
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage:
+@code
+python -m unittest test_patchcellindex
+@endcode
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+import rhessystypes
+from patchcellindex import buildPatchCellIndex
+from patchcellindex import writePatchCellIndex
+from patchcellindex import readPatchCellIndex
+from patchcellindex import isPatchCellIndexCurrent
+from patchcellindex import getPatchCellIndexPath
+
+## Constants
+NULL = -2147483648
+
+## Unit tests
+class TestPatchCellIndex(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Patches of 3 x 2 cells in 4 hillslopes, one patch split in two, and some NULL cells
+        numRows = 60
+        numCols = 80
+        rows = np.arange(numRows)[:,None]
+        cols = np.arange(numCols)[None,:]
+        cls.patch = (rows // 3 * (numCols // 2) + cols // 2 + 1).astype(np.int64)
+        cls.patch[5, 7] = cls.patch[40, 40]
+        cls.patch[0, :5] = NULL
+        cls.hill = (cols * 4 // numCols + 1 + np.zeros_like(rows)).astype(np.int64)
+        cls.window = {'north': 4350000.0, 'west': 349000.0, 'nsRes': 5.0, 'ewRes': 5.0,
+                      'rows': numRows, 'cols': numCols}
+        cls.sources = {'patch': {'cell/patch': [100, 1371234567.25]}}
+        cls.index = buildPatchCellIndex(cls._iterRows(), cls.window, cls.sources)
+
+    @classmethod
+    def _iterRows(cls):
+        for row in xrange(cls.patch.shape[0]):
+            yield (cls.patch[row], cls.hill[row], cls.hill[row])
+
+    def _getKey(self, row, col):
+        return rhessystypes.FQPatchID(int(self.patch[row, col]), int(self.hill[row, col]), int(self.hill[row, col]))
+
+    def testCellsMatchRaster(self):
+        valid = self.patch >= 0
+        keys = set( (p, h) for (p, h) in zip(self.patch[valid].tolist(), self.hill[valid].tolist()) )
+        self.assertTrue( len(self.index) == len(keys) )
+        for (row, col) in ((1, 0), (5, 7), (40, 40), (59, 79)):
+            key = self._getKey(row, col)
+            index = self.index.getIndexesForKeys([key])[0]
+            self.assertTrue( index >= 0 )
+            (rows, cols) = self.index.getCells(index)
+            mask = (self.patch == key.patchID) & (self.hill == key.hillID)
+            (expectedRows, expectedCols) = np.nonzero(mask)
+            self.assertTrue( np.array_equal(rows, expectedRows) )
+            self.assertTrue( np.array_equal(cols, expectedCols) )
+        coords = self.index.getCoordinates(self.index.getIndexesForKeys([self._getKey(1, 0)])[0])
+        self.assertTrue( coords[0] == rhessystypes.getCoordinatePair(349002.5, 4349992.5) )
+
+    def testMissingKeys(self):
+        missing = [rhessystypes.FQPatchID(NULL, 1, 1), rhessystypes.FQPatchID(1, 99, 1),
+                   rhessystypes.FQPatchID(10**6, 1, 1)]
+        self.assertTrue( self.index.getIndexesForKeys(missing).tolist() == [-1, -1, -1] )
+
+    def testWriteReadIndex(self):
+        mapsetPath = tempfile.mkdtemp()
+        try:
+            path = getPatchCellIndexPath(mapsetPath, 'patch', 'hill', 'hill')
+            writePatchCellIndex(self.index, path)
+            mapped = readPatchCellIndex(path)
+            self.assertFalse( mapped.spans.flags.writeable )
+            for name in ('keys', 'spanOffsets', 'spans'):
+                self.assertTrue( np.array_equal(getattr(mapped, name), getattr(self.index, name)) )
+            key = self._getKey(40, 40)
+            self.assertTrue( mapped.getCoordinates(mapped.getIndexesForKeys([key])[0]) == \
+                             self.index.getCoordinates(self.index.getIndexesForKeys([key])[0]) )
+
+            self.assertTrue( isPatchCellIndexCurrent(mapped, self.window, self.sources) )
+            window = dict(self.window, nsRes=10.0)
+            self.assertFalse( isPatchCellIndexCurrent(mapped, window, self.sources) )
+            sources = {'patch': {'cell/patch': [100, 1371234568.25]}}
+            self.assertFalse( isPatchCellIndexCurrent(mapped, self.window, sources) )
+        finally:
+            shutil.rmtree(mapsetPath)
@@ -0,0 +1,115 @@
+"""@package tests.test_rasterrowcache
+
+@brief Test methods for rasterrowcache
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2013, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Usage:
+@code
+python -m unittest test_rasterrowcache
+@endcode
+"""
+from unittest import TestCase
+
+import numpy as np
+
+from rasterrowcache import RasterRowCache
+from rasterrowcache import getRasterVersion
+
+## Constants
+NUM_COLS = 100
+
+## Unit tests
+class TestRasterRowCache(TestCase):
+
+    def setUp(self):
+        self.window = {'north': 4350000.0, 'west': 349000.0, 'nsRes': 5.0, 'ewRes': 5.0,
+                       'rows': 10, 'cols': NUM_COLS}
+        self.identity = {'cell/patch': [4096, 1370000000.0], 'cellhd/patch': [256, 1370000000.0]}
+        self.reads = []
+
+    def _readRow(self, row):
+        self.reads.append(row)
+        return np.arange(NUM_COLS, dtype=np.int32) + row * NUM_COLS
+
+    def testHitsAndMisses(self):
+        cache = RasterRowCache()
+        version = getRasterVersion(self.window, self.identity)
+        row = cache.getRow('patch', 'PERMANENT', 3, version, self._readRow)
+        self.assertTrue( cache.getRow('patch', 'PERMANENT', 3, version, self._readRow) is row )
+        self.assertFalse( row.flags.writeable )
+        self.assertTrue( row[0] == 300 )
+        self.assertTrue( self.reads == [3] )
+        stats = cache.getStats()
+        self.assertTrue( (stats.hits, stats.misses, stats.evictions) == (1, 1, 0) )
+        self.assertTrue( stats.numBytes == row.nbytes )
+
+    def testChangedVersionIsReread(self):
+        cache = RasterRowCache()
+        version = getRasterVersion(self.window, self.identity)
+        for row in range(3):
+            cache.getRow('patch', 'PERMANENT', row, version, self._readRow)
+        cache.getRow('zone', 'PERMANENT', 0, version, self._readRow)
+
+        # A changed map replaces the rows of its older version
+        self.identity['cell/patch'] = [4100, 1370000060.0]
+        changed = getRasterVersion(self.window, self.identity)
+        self.assertTrue( changed != version )
+        cache.getRow('patch', 'PERMANENT', 0, changed, self._readRow)
+        self.assertTrue( len(cache) == 2 )
+        self.assertTrue( cache.getStats().evictions == 3 )
+
+        # So does a changed region
+        self.window['north'] += 5.0
+        moved = getRasterVersion(self.window, self.identity)
+        cache.getRow('patch', 'PERMANENT', 0, moved, self._readRow)
+        self.assertTrue( self.reads == [0, 1, 2, 0, 0, 0] )
+        self.assertTrue( len(cache) == 2 )
+
+        cache.invalidate('zone', 'PERMANENT')
+        self.assertTrue( len(cache) == 1 )
+
+    def testEviction(self):
+        cache = RasterRowCache(maxBytes=2 * NUM_COLS * 4)
+        version = getRasterVersion(self.window, self.identity)
+        for row in (0, 1, 0, 2, 0):
+            cache.getRow('patch', 'PERMANENT', row, version, self._readRow)
+        # Row 1 was the least recently used when row 2 was read
+        self.assertTrue( self.reads == [0, 1, 2] )
+        stats = cache.getStats()
+        self.assertTrue( (stats.hits, stats.misses, stats.evictions, stats.numRows) == (2, 3, 1, 2) )
+        self.assertTrue( stats.numBytes <= stats.maxBytes )
+
+        # Rows larger than the budget are not cached
+        cache.setMaxBytes(0)
+        cache.getRow('patch', 'PERMANENT', 0, version, self._readRow)
+        self.assertTrue( len(cache) == 0 )
+        cache.clear()
+        self.assertTrue( cache.getStats().numBytes == 0 )
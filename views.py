@@ -1,13 +1,40 @@
+import os
 import json
-from uuid import uuid4
+import zlib
+import uuid
+import redis
 from rhessystypes import FQPatchID
 import flowtableio
-import redis
-from collections import OrderedDict
-from django.http import HttpResponse
-import cPickle
+import flowtablejournal
+import flowtablecache
+import flowtableoverlay
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from mezzanine.pages.models import Page
 
+EDITS_OWNER_SESSION_KEY = 'rhessysweb_edits_owner'
+
+def _edits_owner(request):
+    # Edits belong to the user when logged in, otherwise to the session.  Only
+    # an owner ID is kept in the session, the edits live in flowtableoverlay.  The
+    # ID is not the session key, which changes when the user logs in.
+    if request.user.is_authenticated():
+        return "user-%d" % (request.user.pk,)
+    owner = request.session.get(EDITS_OWNER_SESSION_KEY)
+    if owner is None:
+        owner = "session-" + uuid.uuid4().hex
+        request.session[EDITS_OWNER_SESSION_KEY] = owner
+    return owner
+
+@receiver(user_logged_in)
+def move_session_edits(sender, request, user, **kwargs):
+    # Keep the edits made before logging in
+    owner = request.session.pop(EDITS_OWNER_SESSION_KEY, None)
+    if owner is not None:
+        flowtableoverlay.moveEdits(redis.Redis(db=15), owner, _edits_owner(request))
+
 def cache_patches_in_session(request, *args, **kwargs):
     flowtable = request.POST['flowtable']
     patch_id = int(request.POST['patch'])
@@ -15,46 +42,98 @@ def cache_patches_in_session(request, *args, **kwargs):
     hill_id = int(request.POST['hill'])
     receivers = json.loads(request.POST['receivers'])
 
-    print flowtable
-    print patch_id
-    print zone_id
-    print hill_id
-    print json.dumps(receivers, indent=4)
+    fqpatch = FQPatchID(patch_id, zone_id, hill_id)
+    flowtableoverlay.setEditedReceivers(redis.Redis(db=15), flowtable, _edits_owner(request), fqpatch,
+                                        _receivers_from_json(receivers))
+    return HttpResponse()
 
 
-    fqpatch = FQPatchID(patch_id, zone_id, hill_id)
+def _receivers_from_json(items):
+    # Receivers are posted either as dumped by flowtableio.dumpReceiversJSON (possibly
+    # along with the entry and road record) or with the property names of the
+    # features returned by the flow table driver
+    return [flowtableio.FlowTableEntryReceiver(
+                item['patchID'] if 'patchID' in item else item['patchId'],
+                item['zoneID'] if 'zoneID' in item else item['zoneId'],
+                item['hillID'] if 'hillID' in item else item['hillId'],
+                item['gamma'])
+            for item in items if item.get('gamma') is not None]
 
-    if flowtable not in request.session:
-        request.session[flowtable] = {}
-    request.session[flowtable][fqpatch] = receivers
-    return HttpResponse()
+def _gzip_blocks(blocks):
+    # Compress on the fly into a single gzip member
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
 
+def _media_path(name):
+    # Resolve a file named in a request, refusing anything outside MEDIA_ROOT
+    root = os.path.realpath(settings.MEDIA_ROOT)
+    path = os.path.realpath(os.path.join(root, name))
+    if not path.startswith(root + os.sep):
+        return None
+    return path
 
 def save_flowtable(request, *args, **kwargs):
-    flowtable = redis.Redis(db=15)
     flowtable_name = request.GET['flowtable']
-    flowtable_new = "/tmp/" + uuid4().hex # request.POST['new_table']
-    hashtable = flowtable_name + ".hash"
-    N = flowtable.llen(flowtable_name)
-    outflow = OrderedDict()
-    for entry in flowtable.lrange(flowtable_name, 0, N):
-        fqpatch = cPickle.loads(entry)
-
-        if flowtable_name in request.session and fqpatch in request.session[flowtable_name]:
-            outflow[fqpatch] = flowtableio.loadReceivers(request.session[flowtable_name])
-        else:
-            outflow[fqpatch] = flowtableio.loadReceivers(flowtable.hget(hashtable, entry))
-
-    flowtableio.writeFlowtable(outflow, flowtable_new)
-    rsp = HttpResponse(open(flowtable_new), mimetype='application/octet-stream')
-    rsp['Content-Disposition'] = 'filename="flowtable.txt"'
+    compress = request.GET.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    # Only the edited patches are spliced into the original flow table
+    flowtable = redis.Redis(db=15)
+    journal = flowtableoverlay.getOverlayJournal(flowtable, flowtable_name, _edits_owner(request))
+
+    # Stream from the cache when it is loaded, otherwise from the flow table file
+    if flowtablecache.isFlowtableCached(flowtable, flowtable_name):
+        missing = flowtablecache.getUncachedKeys(flowtable, flowtable_name, journal.getReplacements().keys())
+        if missing:
+            return HttpResponseBadRequest("Edited patches not in flow table %s, e.g. %s" % \
+                                          (flowtable_name, missing[0]) )
+        num_patches = flowtablecache.getCachedNumPatches(flowtable, flowtable_name)
+        records = flowtablecache.iterCachedRecords(flowtable, flowtable_name)
+    else:
+        path = _media_path(flowtable_name)
+        if path is None:
+            return HttpResponseBadRequest("Flow table %s is not in the media directory" % (flowtable_name,))
+        # Check the edits up front, the journal only finds a missing patch at the end of the stream
+        missing = set(journal.getReplacements().keys())
+        if missing:
+            missing.difference_update(flowtableio.iterFlowtableKeys(path))
+        if missing:
+            return HttpResponseBadRequest("Edited patches not in flow table %s, e.g. %s" % \
+                                          (flowtable_name, sorted(missing)[0]) )
+        num_patches = flowtableio.readFlowtableNumPatches(path)
+        records = flowtableio.iterFlowtable(path)
+    blocks = flowtableio.iterFlowtableBlocks(flowtablejournal.iterJournaledFlowtable(records, journal),
+                                             num_patches)
+
+    if compress:
+        rsp = StreamingHttpResponse(_gzip_blocks(blocks), mimetype='application/x-gzip')
+        rsp['Content-Disposition'] = 'filename="flowtable.txt.gz"'
+    else:
+        rsp = StreamingHttpResponse(blocks, mimetype='application/octet-stream')
+        rsp['Content-Disposition'] = 'filename="flowtable.txt"'
     return rsp
 
 def revert_flowtable(request, *args, **kwargs):
     flowtable = request.POST['flowtable']
-    del request.session[flowtable]
+    flowtableoverlay.clearEdits(redis.Redis(db=15), flowtable, _edits_owner(request))
     return HttpResponse()
 
+def get_feature_info(request, *args, **kwargs):
+    # WMS GetFeatureInfo on the flow table layer, answered here rather than by
+    # ga_resources so that the receivers shown include the user's edits
+    (west, south, east, north) = [float(v) for v in request.GET['BBOX'].split(',')]
+    wherex = west + (int(request.GET['X']) + 0.5) * (east - west) / int(request.GET['WIDTH'])
+    wherey = north - (int(request.GET['Y']) + 0.5) * (north - south) / int(request.GET['HEIGHT'])
+    srs = request.GET['SRS']
+    p = Page.objects.get(slug=request.GET['slug'])
+    data = p.dataresource.driver_instance.get_data_for_point(wherex, wherey, srs,
+                                                             edits_owner=_edits_owner(request))
+    layers = request.GET['QUERY_LAYERS'].split(',')
+    return HttpResponse(json.dumps(dict((layer, data) for layer in layers)), mimetype='application/json')
+
 def get_patch(request, *args, **kwargs):
     wherex = float(request.GET['x'])
     wherey = float(request.GET['y'])